@@ -155,16 +155,20 @@ def set_param(space, __args__):
         except ValueError:
             raise oefmt(space.w_ValueError, "error in JIT parameters string")
     for key, w_value in kwds_w.items():
-        if key == 'enable_opts':
-            jit.set_param(None, 'enable_opts', space.text_w(w_value))
+        for name, _ in unroll_parameters:
+            if name == key:
+                if name in jit.STRING_PARAMETERS:
+                    try:
+                        jit.set_param(None, name, space.text_w(w_value))
+                    except ValueError:
+                        raise oefmt(space.w_ValueError,
+                                    "invalid value for JIT parameter '%s'",
+                                    key)
+                else:
+                    jit.set_param(None, name, space.int_w(w_value))
+                break
         else:
-            intval = space.int_w(w_value)
-            for name, _ in unroll_parameters:
-                if name == key and name != 'enable_opts':
-                    jit.set_param(None, name, intval)
-                    break
-            else:
-                raise oefmt(space.w_TypeError, "no JIT parameter '%s'", key)
+            raise oefmt(space.w_TypeError, "no JIT parameter '%s'", key)
 
 @dont_look_inside
 def residual_call(space, w_callable, __args__):
@@ -348,10 +348,12 @@ W_JitLoopInfo.typedef.acceptable_as_base_class = False
 
 
 class W_JitInfoSnapshot(W_Root):
-    def __init__(self, space, w_times, w_counters, w_counter_times):
+    def __init__(self, space, w_times, w_counters, w_counter_times,
+                 w_histograms):
         self.w_loop_run_times = w_times
         self.w_counters = w_counters
         self.w_counter_times = w_counter_times
+        self.w_histograms = w_histograms
 
 W_JitInfoSnapshot.typedef = TypeDef(
     "JitInfoSnapshot",
@@ -362,10 +364,18 @@ W_JitInfoSnapshot.typedef = TypeDef(
                                        doc="various JIT counters"),
     counter_times = interp_attrproperty_w("w_counter_times",
                                             cls=W_JitInfoSnapshot,
-                                            doc="various JIT timers")
+                                            doc="various JIT timers"),
+    histograms = interp_attrproperty_w("w_histograms",
+                                         cls=W_JitInfoSnapshot,
+                                         doc="per trace compile times (us) "
+                                         "and code sizes of the LLVM "
+                                         "backend, counts by power of two")
 )
 W_JitInfoSnapshot.typedef.acceptable_as_base_class = False
 
+COMPILE_PHASES = (Counters.LLVM_BUILD_IR, Counters.LLVM_OPTIMISE,
+                  Counters.LLVM_CODEGEN)
+
 def get_stats_snapshot(space):
     """ Get the jit status in the specific moment in time. Note that this
     is eager - the attribute access is not lazy, if you need new stats
@@ -388,7 +398,18 @@ def get_stats_snapshot(space):
     space.setitem_str(w_counter_times, 'TRACING', space.newfloat(tr_time))
     b_time = jit_hooks.stats_get_times_value(None, Counters.BACKEND)
     space.setitem_str(w_counter_times, 'BACKEND', space.newfloat(b_time))
-    return W_JitInfoSnapshot(space, w_times, w_counters, w_counter_times)
+    w_histograms = space.newdict()
+    for i, counter_name in enumerate(Counters.counter_names):
+        if i in COMPILE_PHASES:
+            t = jit_hooks.stats_get_times_value(None, i)
+            space.setitem_str(w_counter_times, counter_name, space.newfloat(t))
+        if i in COMPILE_PHASES or i == Counters.LLVM_CODE_SIZE:
+            ll_buckets = jit_hooks.stats_get_histogram(None, i)
+            w_buckets = space.newlist([space.newint(ll_buckets[j])
+                                       for j in range(len(ll_buckets))])
+            space.setitem_str(w_histograms, counter_name, w_buckets)
+    return W_JitInfoSnapshot(space, w_times, w_counters, w_counter_times,
+                             w_histograms)
 
 def get_stats_asmmemmgr(space):
     """Returns the raw memory currently used by the JIT backend,
@@ -1,6 +1,21 @@
+from rpython.rlib import jit
+
+
 class AppTestPyPyJIT:
     spaceconfig = dict(usemodules=('pypyjit',))
 
+    def setup_method(self, meth):
+        # untranslated, set_param() does nothing; the LLVM backend raises
+        # ValueError for a pass pipeline it can't parse
+        def set_param(driver, name, value):
+            if name == 'llvm_passes' and value == 'bogus':
+                raise ValueError("Unknown LLVM pass bogus")
+        self.orig_set_param = jit.set_param
+        jit.set_param = set_param
+
+    def teardown_method(self, meth):
+        jit.set_param = self.orig_set_param
+
     def test_setup(self):
         # this just checks that the module is setting up things correctly, and
         # the resulting code makes sense on top of CPython.
@@ -41,6 +56,12 @@ class AppTestPyPyJIT:
             pypyjit.set_compile_hook(None)
             pypyjit.set_param('default')
 
+    def test_set_param_invalid_string_value(self):
+        import pypyjit
+        raises(ValueError, pypyjit.set_param, llvm_passes="bogus")
+        raises(ValueError, pypyjit.set_param, "llvm_passes=bogus")
+        raises(TypeError, pypyjit.set_param, bogus=5)
+
     def test_doc(self):
         import pypyjit
         d = pypyjit.PARAMETER_DOCS
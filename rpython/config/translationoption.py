@@ -122,10 +122,10 @@ translation_optiondescription = OptionDescription(
                          ("translation.gcrootfinder", DEFL_ROOTFINDER_WITHJIT),
                          ("translation.list_comprehension_operations", True)]),
     ChoiceOption("jit_backend", "choose the backend for the JIT",
-                 ["auto", "x86", "x86-without-sse2", 'arm'],
+                 ["auto", "x86", "x86-without-sse2", 'arm', 'x86-64-llvm'],
                  default="auto", cmdline="--jit-backend"),
     ChoiceOption("jit_profiler", "integrate profiler support into the JIT",
-                 ["off", "oprofile"],
+                 ["off", "oprofile", "perf"],
                  default="off"),
     ChoiceOption("jit_opencoder_model", "the model limits the maximal length"
                  " of traces. Use big if you want to go bigger than "
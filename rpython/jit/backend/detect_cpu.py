@@ -13,6 +13,7 @@ class ProcessorAutodetectError(Exception):
 MODEL_X86         = 'x86'
 MODEL_X86_NO_SSE2 = 'x86-without-sse2'
 MODEL_X86_64      = 'x86-64'
+MODEL_X86_64_LLVM = 'x86-64-llvm'
 MODEL_ARM         = 'arm'
 MODEL_ARM64       = 'aarch64'
 MODEL_PPC_64      = 'ppc-64'
@@ -120,6 +121,8 @@ def getcpuclassname(backend_name="auto"):
         return "rpython.jit.backend.x86.runner", "CPU386_NO_SSE2"
     elif backend_name == MODEL_X86_64:
         return "rpython.jit.backend.x86.runner", "CPU_X86_64"
+    elif backend_name == MODEL_X86_64_LLVM:
+        return "rpython.jit.backend.llvm.tiered", "TieredCPU"
     elif backend_name == MODEL_ARM:
         return "rpython.jit.backend.arm.runner", "CPU_ARM"
     elif backend_name == MODEL_ARM64:
@@ -145,6 +148,7 @@ def getcpufeatures(backend_name="auto"):
         MODEL_X86: ['floats', 'singlefloats', 'longlong'],
         MODEL_X86_NO_SSE2: ['longlong'],
         MODEL_X86_64: ['floats', 'singlefloats'],
+        MODEL_X86_64_LLVM: ['floats', 'singlefloats'],
         MODEL_ARM: ['floats', 'singlefloats', 'longlong'],
         MODEL_ARM64: ['floats'],
         MODEL_PPC_64: ['floats'],
@@ -26,6 +26,8 @@ from rpython.rlib.objectmodel import Symbolic, compute_hash
 class LLAsmInfo(object):
     def __init__(self, lltrace):
         self.ops_offset = None
+        self.asmaddr = 0
+        self.asmlen = len(lltrace.operations) # a stand-in for the code size
         self.lltrace = lltrace
 
 class LLTrace(object):
@@ -356,6 +358,7 @@ class LLGraphCPU(model.AbstractCPU):
         clt._llgraph_loop = lltrace
         clt._llgraph_alltraces = [lltrace]
         self._record_labels(lltrace)
+        return LLAsmInfo(lltrace)
 
     def compile_bridge(self, faildescr, inputargs, operations,
                        original_loop_token, log=True, logger=None):
@@ -24,6 +24,10 @@ class AsmMemoryManager(object):
         self.free_blocks = {}      # map {start: stop}
         self.free_blocks_end = {}  # map {stop: start}
         self.blocks_by_size = [[] for i in range(self.num_indices)]
+        self.chunks = {}           # map {start: stop} of the mmap()ed memory
+        # free chunks are given back to the OS, as long as this much
+        # memory stays allocated, to not mmap() it again right away
+        self.min_retained = large_alloc_size
 
     def get_stats(self):
         """Returns stats for rlib.jit.jit_hooks.stats_asmmemmgr_*()."""
@@ -45,10 +49,16 @@ class AsmMemoryManager(object):
         return result   # pair (start, stop)
 
     def free(self, start, stop):
-        """Free a block (start, stop) returned by a previous malloc()."""
+        """Free a block (start, stop) returned by a previous malloc().
+        The chunks of memory that are completely free afterwards are
+        returned to the OS.
+        """
         if r_uint is not None:
             self.total_mallocs -= r_uint(stop - start)
-        self._add_free_block(start, stop)
+        start = self._add_free_block(start, stop)
+        stop = self.free_blocks[start]
+        if stop - start >= self.large_alloc_size:
+            self._release_chunks(start, stop)
 
     def open_malloc(self, minsize):
         """Allocate at least minsize bytes.  Returns (start, stop)."""
@@ -79,6 +89,16 @@ class AsmMemoryManager(object):
                 rmmap.hint.pos += 0x80000000 - size
         return data
 
+    def _mmap_free(self, start, size):
+        # overridden by a test
+        data = rffi.cast(rmmap.PTR, start)
+        if not we_are_translated():
+            for i in range(len(self._allocated)):
+                if rffi.cast(lltype.Signed, self._allocated[i][0]) == start:
+                    data, _ = self._allocated.pop(i)
+                    break
+        rmmap.free(data, size)
+
     def _allocate_large_block(self, minsize):
         # Compute 'size' from 'minsize': it must be rounded up to
         # 'large_alloc_size'.  Additionally, we use the following line
@@ -89,8 +109,35 @@ class AsmMemoryManager(object):
         data = self._mmap_alloc(size)
         self.total_memory_allocated += r_uint(size)
         data = rffi.cast(lltype.Signed, data)
+        self.chunks[data] = data + size
         return self._add_free_block(data, data + size)
 
+    def _release_chunks(self, start, stop):
+        # The free block (start, stop) can span several chunks, as the
+        # ones next to each other in memory were coalesced
+        inside = []
+        for chunk_start, chunk_stop in self.chunks.items():
+            if start <= chunk_start and chunk_stop <= stop:
+                inside.append(chunk_start)
+        if not inside:
+            return
+        inside.sort()
+        self._del_free_block(start, stop)
+        freed_start = start
+        for chunk_start in inside:
+            chunk_stop = self.chunks[chunk_start]
+            size = r_uint(chunk_stop - chunk_start)
+            if self.total_memory_allocated - size < r_uint(self.min_retained):
+                continue   # kept as part of the free block
+            if freed_start < chunk_start:
+                self._add_free_block(freed_start, chunk_start)
+            del self.chunks[chunk_start]
+            self._mmap_free(chunk_start, chunk_stop - chunk_start)
+            self.total_memory_allocated -= size
+            freed_start = chunk_stop
+        if freed_start < stop:
+            self._add_free_block(freed_start, stop)
+
     def _get_index(self, length):
         i = 0
         while length > self.min_fragment:
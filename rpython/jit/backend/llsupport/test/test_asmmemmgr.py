@@ -158,6 +158,21 @@ class TestAsmMemoryManager:
                     assert new_total <= 147456
                     prev_total = new_total
 
+    def test_release_free_chunks(self):
+        got = []
+        while self.asmmemmgr.total_memory_allocated < 4 * 8192:
+            got.append(self.asmmemmgr.malloc(1000, 1000))
+        for start, stop in got:
+            self.asmmemmgr.free(start, stop)
+        # one chunk is kept for the next mallocs
+        assert self.asmmemmgr.total_memory_allocated == 8192
+        assert self.asmmemmgr.total_mallocs == 0
+        [(chunk_start, chunk_stop)] = self.asmmemmgr.chunks.items()
+        assert self.asmmemmgr.free_blocks == {chunk_start: chunk_stop}
+        start, stop = self.asmmemmgr.malloc(1000, 1000)
+        assert chunk_start <= start < stop <= chunk_stop
+        assert self.asmmemmgr.total_memory_allocated == 8192
+
     def test_insert_gcroot_marker(self):
         if self.AMMClass is not AsmMemoryManager:
             py.test.skip("not for TestFakeAsmMemoryManager")
@@ -206,6 +221,9 @@ class TestFakeAsmMemoryManager(TestAsmMemoryManager):
         def _mmap_alloc(self, size):
             assert size == 8192
             return self._pool.pop()
+        def _mmap_free(self, start, size):
+            assert size == 8192
+            self._pool.append(start)
         def _delete(self):
             pass
 
@@ -1,9 +1,28 @@
 from rpython.jit.backend.model import CompiledLoopToken
 from rpython.jit.backend.llsupport.assembler import BaseAssembler
-from rpython.rtyper.lltypesystem import lltype
+from rpython.rtyper.lltypesystem import lltype, rffi
 from rpython.jit.backend.llvm.llvm_api import CString
+from rpython.jit.backend.llvm.optimiser import LLVMOptimiser
 from rpython.jit.backend.llsupport import jitframe
 from rpython.rtyper.lltypesystem.rffi import constcharp2str
+from rpython.rlib.jit import Counters
+import time
+
+class LoopResources(object):
+    """
+    What the LLVM_CPU holds on behalf of a loop and its bridges, kept on
+    the compiled loop token and released by free_loop_and_bridges.
+    """
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher #the loop's, its module is kept for dump_looptoken
+        self.trackers = [] #ORC resource trackers owning the code of the loop and its bridges
+        self.gc_tables = [] #raw tables from allocate_gc_table
+        self.guard_descrs = [] #descrs of the guards that got a bridge slot
+        self.raw_words = [] #invalidation flags and the redirect slot, from allocate_raw_word
+        self.redirect_slot = 0 #word the loop's entry function checks, see redirect_call_assembler
+        self.code_ranges = [] #(symbol, address, size) of the functions of the loop and its bridges
+        self.jd_id = 0 #portal frame the loop's code is attributed to in the codemap
+        self.unique_id = 0
 
 class LLVMAssembler(BaseAssembler):
     def __init__(self, cpu):
@@ -12,27 +31,43 @@ class LLVMAssembler(BaseAssembler):
         self.debug = cpu.debug
         self.llvm.InitializeNativeTarget(None)
         self.llvm.InitializeNativeAsmPrinter(None)
-        self.pass_manager = self.llvm.CreatePassManager(None)
-        self.add_opt_passes()
+        self.optimiser = LLVMOptimiser(cpu)
+        self.modules_added = 0
+        self.symbol_sizes = self.llvm.CreateSymbolSizes() #filled in by every JIT this makes, see code_ranges
         self.initialise_jit()
 
-    def initialise_jit(self):
-        jit_builder = self.llvm.CreateLLJITBuilder(None)
-        if self.debug and jit_builder._cast_to_int() == 0:
-            raise Exception("JIT Builder is Null")
+    def setup_once(self):
+        gc_ll_descr = self.cpu.gc_ll_descr
+        gc_ll_descr.initialize()
+        if hasattr(gc_ll_descr, 'gcheaderbuilder'):
+            self.gc_size_of_header = gc_ll_descr.gcheaderbuilder.size_gc_header
+        else:
+            self.gc_size_of_header = self.cpu.WORD # for tests
+        self._build_release_gil(gc_ll_descr.gcrootmap)
+
+    def create_target_machine(self, opt_level):
         cpu_name = self.llvm.GetHostCPUName(None)
         cpu_features = self.llvm.GetHostCPUFeatures(None)
         triple = self.llvm.GetTargetTriple(None)
         target = self.llvm.GetTarget(triple)
         enums = lltype.malloc(self.llvm.JITEnums, flavor='raw')
         self.llvm.SetJITEnums(enums)
-        opt_level = enums.codegenlevel
         reloc_mode = enums.reloc
         code_model = enums.codemodel
         target_machine = self.llvm.CreateTargetMachine(target, triple, cpu_name,
                                                        cpu_features, opt_level,
                                                        reloc_mode, code_model)
         lltype.free(enums, flavor='raw')
+        return target_machine
+
+    def initialise_jit(self):
+        jit_builder = self.llvm.CreateLLJITBuilder(None)
+        if self.debug and jit_builder._cast_to_int() == 0:
+            raise Exception("JIT Builder is Null")
+        self.codegen_level = self.optimiser.pipeline.codegen_level
+        target_machine = self.create_target_machine(self.codegen_level) #owned by the JIT from here on
+        self.optimiser.target_machine = self.create_target_machine(
+                                            self.codegen_level)
         self.data_layout = self.llvm.CreateTargetDataLayout(target_machine)
         jit_target_machine_builder = self.llvm.JITTargetMachineBuilderCreateFromTargetMachine(
                                             target_machine)
@@ -45,55 +80,203 @@ class LLVMAssembler(BaseAssembler):
         self.DyLib = self.llvm.LLJITGetMainJITDylib(self.LLJIT)
         if self.debug and self.DyLib._cast_to_int() == 0:
             raise Exception("DyLib is Null")
+        self.llvm.RecordSymbolSizes(self.LLJIT, self.symbol_sizes)
         #exec_session = self.llvm.GetExecutionSession(self.LLJIT)
         #self.object_layer = self.llvm.CreateObjectLinkingLayer(exec_session)
 
 
-    def jit_compile(self, module, looptoken, inputargs, dispatcher, is_bridge=False):
+    def setup_compiled_loop_token(self, looptoken, inputargs):
+        """
+        Made before the loop is rewritten, since call_assemblers of the
+        loop to itself need its frame info and initial locations.
+        """
         clt = CompiledLoopToken(self.cpu, looptoken.number)
-        if is_bridge:
-            clt.compiling_a_bridge()
-            self.cpu.tracker.total_compiled_loops -= 1 #hack to undo clt init function
         looptoken.compiled_loop_token = clt
-        clt._debug_nbargs = dispatcher.args_size/self.cpu.WORD
+        clt._debug_nbargs = len(inputargs)
         locs = [self.cpu.WORD*i for i in range(len(inputargs))]
         clt._ll_initial_locs = locs
-        frame_info = lltype.malloc(jitframe.JITFRAMEINFO, flavor='raw')
-        frame_info.jfi_frame_depth = len(inputargs)
-        frame_size = dispatcher.args_size + self.cpu.WORD
-        + dispatcher.local_vars_size #args+ret addr+vars
-        frame_info.jfi_frame_size = frame_size
+        frame_info = lltype.malloc(jitframe.JITFRAMEINFO, flavor='raw',
+                                   track_allocation=False) #lives as long as the loop
+        frame_info.clear()
         clt.frame_info = frame_info
 
-        module_copy = self.llvm.CloneModule(module) #if we want to mutate module later to patch in a bridge we have to pass a copy to be owned by LLVM's JIT
-        self.llvm.RunPassManager(self.pass_manager, module_copy)
-        if self.debug:
-            self.cpu.write_ir(module_copy, "opt")
+    def jit_compile(self, module, looptoken, inputargs, dispatcher):
+        clt = looptoken.compiled_loop_token
+        self.update_frame_info(clt, dispatcher)
+        clt.llvm_resources = LoopResources(dispatcher)
+        looptoken._ll_function_addr = self.add_module(module, dispatcher,
+                                                      clt.llvm_resources)
+
+    def jit_compile_bridge(self, module, faildescr, looptoken, dispatcher):
+        """
+        Bridges are compiled on their own, so the cost only depends on the
+        bridge's size. The loop's code is left untouched, we only fill in
+        the guard's bridge slot.
+        """
+        clt = looptoken.compiled_loop_token
+        clt.compiling_a_bridge()
+        self.update_frame_info(clt, dispatcher)
+        addr = self.add_module(module, dispatcher, clt.llvm_resources)
+        self.patch_bridge_slot(faildescr, addr)
+
+    def update_frame_info(self, clt, dispatcher):
+        base_ofs = self.cpu.get_baseofs_of_frame_field()
+        clt.frame_info.update_frame_depth(base_ofs, dispatcher.frame_depth)
+
+    def patch_bridge_slot(self, faildescr, addr):
+        slot = rffi.cast(rffi.SIGNEDP, self.cpu.get_bridge_slot(faildescr))
+        slot[0] = addr
+
+    def patch_gcref_table(self, looptoken, table_addr, allgcrefs):
+        if table_addr == 0:
+            return
+        tracer = self.cpu.gc_ll_descr.make_gcref_tracer(table_addr, allgcrefs)
+        gcreftracers = self.get_asmmemmgr_gcreftracers(looptoken)
+        gcreftracers.append(tracer) #keepalive
+
+    def set_llvm_passes(self, text):
+        """
+        The codegen level is baked into the JIT's target machine, so a
+        preset asking for a different one only gets it if nothing has been
+        compiled yet, otherwise only the IR pipeline changes.
+        """
+        self.optimiser.set_pipeline(text)
+        if (self.optimiser.pipeline.codegen_level != self.codegen_level and
+                self.modules_added == 0):
+            self.llvm.DisposeLLJIT(self.LLJIT)
+            self.initialise_jit()
+
+    def add_module(self, module, dispatcher, resources):
+        """
+        Each module gets its own resource tracker, so its code can be
+        removed from the JIT along with the loop it belongs to.
+        """
+        start = time.time()
+        tracker = self.llvm.CreateResourceTracker(self.DyLib)
+        resources.trackers.append(tracker)
+        if self.cpu.object_cache is not None:
+            optimise_time = self.add_cached_module(module, dispatcher, tracker)
+        else:
+            optimise_time = self.add_ir_module(module, tracker)
+        self.modules_added += 1
+        cstring = CString(dispatcher.entry_name)
+        addr = self.llvm.LLJITLookup(self.LLJIT,
+                                     cstring.ptr)._cast_to_int() #compiles the module if it's IR
+        if self.debug and addr == 0:
+            raise Exception("trace Function is Null")
+        dispatcher.code_ranges = self.code_ranges(dispatcher)
+        resources.code_ranges.extend(dispatcher.code_ranges)
+        stats = self.cpu.tracker.compile_stats
+        stats.phase_done(Counters.LLVM_CODEGEN,
+                         time.time() - start - optimise_time)
+        code_size = 0
+        for symbol, code_addr, size in dispatcher.code_ranges:
+            code_size += size
+        stats.record(Counters.LLVM_CODE_SIZE, code_size)
+        return addr
+
+    def code_ranges(self, dispatcher):
+        """
+        (symbol, address, size) of the functions the module just added
+        defines, for profilers. ORC only gives out addresses, the sizes
+        come from the module's object on its way into the JIT.
+        """
+        names = [dispatcher.func_name]
+        if dispatcher.entry_name != dispatcher.func_name:
+            names.append(dispatcher.entry_name)
+        ranges = []
+        for name in names:
+            cstring = CString(name)
+            size = self.llvm.TakeSymbolSize(self.symbol_sizes, cstring.ptr)
+            if size == 0: #not emitted
+                continue
+            addr = self.llvm.LLJITLookup(self.LLJIT,
+                                         cstring.ptr)._cast_to_int()
+            ranges.append((name, addr, size))
+        self.llvm.ClearSymbolSizes(self.symbol_sizes)
+        return ranges
+
+    def add_cached_module(self, module, dispatcher, tracker):
+        """
+        Add the module's object code to the JIT, from the object cache if
+        another process (or an earlier one) already compiled the same IR,
+        otherwise compiling it ourselves and storing the result. Returns
+        the time spent optimising it.
+        """
+        cache = self.cpu.object_cache
+        config = "%s %d" % (self.optimiser.pipeline.text, self.codegen_level)
+        key = cache.make_key(self.module_text(module), config)
+        table_name = dispatcher.name_reloc_table(key)
+        obj = cache.lookup(key)
+        optimise_time = 0.0
+        if obj is None:
+            module_copy = self.llvm.CloneModule(module)
+            optimise_time = self.optimiser.run(module_copy)
+            self.llvm.SetTarget(module_copy, self.llvm.GetTargetTriple(None))
+            buf = self.llvm.EmitObject(self.optimiser.target_machine,
+                                       module_copy)
+            self.llvm.DisposeModule(module_copy)
+            if not buf:
+                raise Exception("Failed To Emit Object Code")
+            size = rffi.cast(lltype.Signed, self.llvm.GetBufferSize(buf))
+            obj = rffi.charpsize2str(self.llvm.GetBufferStart(buf), size)
+            self.llvm.DisposeMemoryBuffer(buf)
+            cache.store(key, obj)
+        if table_name is not None:
+            self.define_reloc_table(table_name, dispatcher.relocations)
+        data = rffi.str2charp(obj)
+        cstring = CString(dispatcher.func_name)
+        buf = self.llvm.CreateMemoryBufferWithMemoryRangeCopy(data, len(obj),
+                                                              cstring.ptr)
+        rffi.free_charp(data)
+        failure = self.llvm.LLJITAddObjectFileWithRT(self.LLJIT, tracker, buf) #the JIT owns buf from here on
+        if self.debug and failure._cast_to_int():
+            print(constcharp2str(self.llvm.GetErrorMessage(failure)))
+            raise Exception("Failed To Add Object To JIT")
+        return optimise_time
+
+    def define_reloc_table(self, name, relocations):
+        table = lltype.malloc(rffi.SIGNEDP.TO, len(relocations), flavor='raw',
+                              track_allocation=False) #lives as long as the code using it
+        for i in range(len(relocations)):
+            table[i] = relocations[i]
+        cstring = CString(name)
+        failure = self.llvm.DefineAbsoluteSymbol(self.LLJIT, self.DyLib,
+                                                 cstring.ptr,
+                                                 rffi.cast(lltype.Signed, table))
+        if self.debug and failure._cast_to_int():
+            print(constcharp2str(self.llvm.GetErrorMessage(failure)))
+            raise Exception("Failed To Define Relocation Table")
+
+    def module_text(self, module):
+        text_ptr = self.llvm.PrintModuleToString(module)
+        text = constcharp2str(text_ptr)
+        self.llvm.DisposeMessage(text_ptr)
+        return text
+
+    def add_ir_module(self, module, tracker):
+        module_copy = self.llvm.CloneModule(module) #dispatcher keeps the original around for dumping, LLVM's JIT owns the copy
+        optimise_time = self.optimiser.run(module_copy)
         ctx = self.cpu.thread_safe_context
         thread_safe_module = self.llvm.CreateThreadSafeModule(module_copy, ctx)
         if self.debug and thread_safe_module._cast_to_int() == 0:
             raise Exception("TSM is Null")
-        failure = self.llvm.LLJITAddModule(self.LLJIT,
-                                           self.DyLib,
-                                           thread_safe_module) #looking up a symbol in a module added to the LLVM Orc JIT invokes JIT compilation of the whole module
+        failure = self.llvm.LLJITAddModuleWithRT(self.LLJIT,
+                                                 tracker,
+                                                 thread_safe_module) #looking up a symbol in a module added to the LLVM Orc JIT invokes JIT compilation of the whole module
         if self.debug and failure._cast_to_int():
             print(constcharp2str(self.llvm.GetErrorMessage(failure)))
             raise Exception("Failed To Add Module To JIT")
-        cstring = CString("trace")
-        addr = self.llvm.LLJITLookup(self.LLJIT,
-                                     cstring.ptr)._cast_to_int()
-        if self.debug and addr == 0:
-            raise Exception("trace Function is Null")
-        looptoken._ll_function_addr = addr
-
-    def refresh_jit(self):
-        self.llvm.DisposeLLJIT(self.LLJIT)
-        self.initialise_jit()
+        return optimise_time
 
-    def add_opt_passes(self):
-        self.llvm.AddInstructionCombiningPass(self.pass_manager)
-        self.llvm.AddReassociatePass(self.pass_manager)
-        self.llvm.AddGVNPass(self.pass_manager)
-        self.llvm.AddScalarReplAggregatesPass(self.pass_manager)
-        self.llvm.AddIndVarSimplifyPass(self.pass_manager)
-        self.llvm.AddCFGSimplificationPass(self.pass_manager)
+    def free_code(self, resources):
+        """Remove the code and symbols of a loop and its bridges from the JIT"""
+        for tracker in resources.trackers:
+            failure = self.llvm.ResourceTrackerRemove(tracker)
+            if failure._cast_to_int():
+                if self.debug:
+                    print(constcharp2str(self.llvm.GetErrorMessage(failure)))
+                    raise Exception("Failed To Remove Code From JIT")
+                self.llvm.ConsumeError(failure)
+            self.llvm.ReleaseResourceTracker(tracker)
+        resources.trackers = []
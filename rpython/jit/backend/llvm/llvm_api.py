@@ -1,6 +1,27 @@
 from rpython.rtyper.lltypesystem import rffi, lltype
 from rpython.translator.tool.cbuild import ExternalCompilationInfo
-from rpython.rtyper.lltypesystem.rffi import str2constcharp, constcharp2str
+from rpython.rtyper.lltypesystem.rffi import constcharp2str
+import py
+import os
+
+WRAPPER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "llvm_wrapper")
+
+def llvm_config():
+    """Path of llvm-config, $LLVM_CONFIG picks one other than the first on $PATH"""
+    tool = os.environ.get("LLVM_CONFIG", "llvm-config")
+    path = py.path.local.sysfind(tool)
+    if not path:
+        raise ImportError("cannot find %r" % (tool,))
+    return str(path)
+
+def build_wrapper(config):
+    """
+    Builds libwrapper.so from the sources in llvm_wrapper against the
+    LLVM config points to. make leaves it alone when it's up to date.
+    """
+    py.process.cmdexec('make -s -C "%s" LLVM_CONFIG="%s"' % (WRAPPER_DIR,
+                                                              config))
 
 class LLVMAPI:
     def __init__(self, debug=False):
@@ -37,6 +58,7 @@ class LLVMAPI:
         self.IntPredicate = self.Enum
         self.TargetDataRef = self.VoidPtr
         self.JITDylibRef = self.VoidPtr
+        self.ResourceTrackerRef = self.VoidPtr
         self.ThreadSafeModuleRef = self.VoidPtr
         self.ThreadSafeContextRef = self.VoidPtr
         self.LLJITBuilderRef = self.VoidPtr
@@ -51,10 +73,12 @@ class LLVMAPI:
         self.TargetRef = self.VoidPtr
         self.PassManagerRef = self.VoidPtr
         self.MetadataRef = self.VoidPtr
+        self.MemoryBufferRef = self.VoidPtr
         self.ExecutionSessionRef = self.VoidPtr
         self.ObjectLayerRef = self.VoidPtr
         self.MemoryManagerFactoryFunction = self.VoidPtr
         self.ObjectLinkingLayerCreatorFunction = self.VoidPtr
+        self.SymbolSizesRef = self.VoidPtr
         self.JITEnums = lltype.Struct('JITEnums', ('codegenlevel', lltype.Signed), ('reloc', lltype.Signed), ('codemodel', lltype.Signed))
         self.CmpEnums = lltype.Struct('CmpEnums', ('inteq', lltype.Signed), ('intne', lltype.Signed), ('intugt', lltype.Signed), ('intuge', lltype.Signed), ('intult', lltype.Signed), ('intule', lltype.Signed), ('intsgt', lltype.Signed), ('intsge', lltype.Signed), ('intslt', lltype.Signed), ('intsle', lltype.Signed), ('realeq', lltype.Signed), ('realne', lltype.Signed), ('realgt', lltype.Signed), ('realge', lltype.Signed), ('reallt', lltype.Signed), ('realle', lltype.Signed),('realord', lltype.Signed))
 
@@ -62,19 +86,21 @@ class LLVMAPI:
         header_files = ["Core","Target","Analysis","DataTypes",
                         "Error","ErrorHandling","ExternC",
                         "Initialization","Orc","TargetMachine","Types",
-                        "LLJIT","OrcEE"]
+                        "LLJIT","OrcEE","Transforms/Scalar","Transforms/IPO",
+                        "Transforms/Vectorize","Transforms/InstCombine",
+                        "Transforms/Utils","DebugInfo","Object"]
         llvm_c = ["llvm-c/"+f+".h" for f in header_files]
-        cflags = ["""-I/usr/lib/llvm/12/include -D_GNU_SOURCE
-                    -D__STDC_CONSTANT_MACROS -D__STDC_FORMAT_MACROS
-                    -D__STDC_LIMIT_MACROS"""] #know this should be in the includes arg, but llvm is weird and only works this way
-        path = "/home/muke/Programming/Project/pypy/rpython/jit/backend/llvm/llvm_wrapper/" #TODO: get real path
-        path2 = "/home/muke/Programming/Project/pypy/rpython/jit/backend/llvm/" #wrapper libs need to be in the same directory as the python file, don't ask why
-        info = ExternalCompilationInfo(includes=llvm_c+[path2+"wrapper.h"],
-                                       libraries=["LLVM-12","wrapper"],
-                                       include_dirs=["/usr/lib/llvm/12/lib64",
-                                                     "/usr/lib/llvm/12/include",path],
-                                       library_dirs=["/usr/lib/llvm/12/lib64",path],
-                                       compile_extra=cflags, link_extra=cflags) #TODO: make this platform independant (rather than hardcoding the output of llvm-config for my system)
+        config = llvm_config()
+        build_wrapper(config)
+        cflags = [py.process.cmdexec('"%s" --cflags' % config)] #know this should be in the includes arg, but llvm is weird and only works this way
+        ldflags = py.process.cmdexec('"%s" --ldflags --libs' % config)
+        info = ExternalCompilationInfo(includes=llvm_c+["wrapper.h"],
+                                       libraries=["wrapper"],
+                                       include_dirs=[WRAPPER_DIR],
+                                       library_dirs=[WRAPPER_DIR],
+                                       compile_extra=cflags,
+                                       link_extra=cflags+["-Wl,-rpath,"+WRAPPER_DIR]) #so the loader finds libwrapper.so where it was built
+        info = info.merge(ExternalCompilationInfo.from_linker_flags(ldflags))
 
         self.CreateModule = rffi.llexternal("LLVMModuleCreateWithNameInContext",
                                             [self.Str, self.ContextRef], self.ModuleRef,
@@ -352,6 +378,58 @@ class LLVMAPI:
                                             self.Str],
                                            self.ValueRef,
                                            compilation_info=info)
+        self.LoadFrameArgs = rffi.llexternal("LoadFrameArgs", #batched builders, one call per op rather than per instruction
+                                             [self.BuilderRef, self.TypeRef,
+                                              self.ValueRef, lltype.Unsigned,
+                                              lltype.Unsigned, self.TypeRefPtr,
+                                              self.ValueRefPtr, lltype.Unsigned],
+                                             self.Void,
+                                             compilation_info=info)
+        self.StoreFrameArgs = rffi.llexternal("StoreFrameArgs",
+                                              [self.BuilderRef, self.TypeRef,
+                                               self.ValueRef, lltype.Unsigned,
+                                               lltype.Unsigned,
+                                               self.ValueRefPtr,
+                                               lltype.Unsigned],
+                                              self.Void,
+                                              compilation_info=info)
+        self.BuildGuardBranch = rffi.llexternal("BuildGuardBranch",
+                                                [self.BuilderRef, self.ValueRef,
+                                                 self.BasicBlockRef,
+                                                 self.BasicBlockRef,
+                                                 lltype.Unsigned,
+                                                 self.MetadataRef,
+                                                 self.BasicBlockRef],
+                                                self.ValueRef,
+                                                compilation_info=info)
+        self.BuildOverflowOp = rffi.llexternal("BuildOverflowOp",
+                                               [self.BuilderRef, self.ValueRef,
+                                                self.ValueRef, self.ValueRef,
+                                                self.ValueRefPtr],
+                                               self.ValueRef,
+                                               compilation_info=info)
+        self.BuildCallAddress = rffi.llexternal("BuildCallAddress",
+                                                [self.BuilderRef, self.ValueRef,
+                                                 self.TypeRef, self.TypeRefPtr,
+                                                 self.ValueRefPtr,
+                                                 lltype.Unsigned, self.Str],
+                                                self.ValueRef,
+                                                compilation_info=info)
+        self.BuildReleaseStore = rffi.llexternal("BuildReleaseStore",
+                                                 [self.BuilderRef, self.ValueRef,
+                                                  self.ValueRef],
+                                                 self.ValueRef,
+                                                 compilation_info=info)
+        self.BuildCompareAndSwap = rffi.llexternal("BuildCompareAndSwap",
+                                                   [self.BuilderRef,
+                                                    self.ValueRef, self.ValueRef,
+                                                    self.ValueRef, self.Str],
+                                                   self.ValueRef,
+                                                   compilation_info=info)
+        self.LinkForInlining = rffi.llexternal("LinkForInlining",
+                                               [self.ModuleRef, self.ModuleRef],
+                                               self.Bool,
+                                               compilation_info=info)
         self.BuildLoad = rffi.llexternal("LLVMBuildLoad2",
                                           [self.BuilderRef, self.TypeRef,
                                            self.ValueRef, self.Str],
@@ -400,6 +478,12 @@ class LLVMAPI:
                                              lltype.Unsigned, self.ValueRef],
                                             self.ValueRef,
                                             compilation_info=info)
+        self.BuildMemSet = rffi.llexternal("LLVMBuildMemSet",
+                                            [self.BuilderRef, self.ValueRef,
+                                             self.ValueRef, self.ValueRef,
+                                             lltype.Unsigned],
+                                            self.ValueRef,
+                                            compilation_info=info)
         self.CreatePassManager = rffi.llexternal("LLVMCreatePassManager",
                                                   [self.Void],
                                                   self.PassManagerRef,
@@ -445,6 +529,87 @@ class LLVMAPI:
                                                             [self.PassManagerRef],
                                                             self.Void,
                                                             compilation_info=info)
+        self.AddBasicAliasAnalysisPass = rffi.llexternal("LLVMAddBasicAliasAnalysisPass",
+                                                         [self.PassManagerRef],
+                                                         self.Void,
+                                                         compilation_info=info)
+        self.AddTypeBasedAliasAnalysisPass = rffi.llexternal("LLVMAddTypeBasedAliasAnalysisPass",
+                                                             [self.PassManagerRef],
+                                                             self.Void,
+                                                             compilation_info=info)
+        self.AddEarlyCSEPass = rffi.llexternal("LLVMAddEarlyCSEPass",
+                                               [self.PassManagerRef],
+                                               self.Void,
+                                               compilation_info=info)
+        self.AddDeadStoreEliminationPass = rffi.llexternal("LLVMAddDeadStoreEliminationPass",
+                                                           [self.PassManagerRef],
+                                                           self.Void,
+                                                           compilation_info=info)
+        self.AddSCCPPass = rffi.llexternal("LLVMAddSCCPPass",
+                                           [self.PassManagerRef],
+                                           self.Void,
+                                           compilation_info=info)
+        self.AddAggressiveDCEPass = rffi.llexternal("LLVMAddAggressiveDCEPass",
+                                                    [self.PassManagerRef],
+                                                    self.Void,
+                                                    compilation_info=info)
+        self.AddLICMPass = rffi.llexternal("LLVMAddLICMPass",
+                                           [self.PassManagerRef],
+                                           self.Void,
+                                           compilation_info=info)
+        self.AddLoopRotatePass = rffi.llexternal("LLVMAddLoopRotatePass",
+                                                 [self.PassManagerRef],
+                                                 self.Void,
+                                                 compilation_info=info)
+        self.AddLoopUnrollPass = rffi.llexternal("LLVMAddLoopUnrollPass",
+                                                 [self.PassManagerRef],
+                                                 self.Void,
+                                                 compilation_info=info)
+        self.AddLoopDeletionPass = rffi.llexternal("LLVMAddLoopDeletionPass",
+                                                   [self.PassManagerRef],
+                                                   self.Void,
+                                                   compilation_info=info)
+        self.AddJumpThreadingPass = rffi.llexternal("LLVMAddJumpThreadingPass",
+                                                    [self.PassManagerRef],
+                                                    self.Void,
+                                                    compilation_info=info)
+        self.AddCorrelatedValuePropagationPass = rffi.llexternal("LLVMAddCorrelatedValuePropagationPass",
+                                                                 [self.PassManagerRef],
+                                                                 self.Void,
+                                                                 compilation_info=info)
+        self.AddMemCpyOptPass = rffi.llexternal("LLVMAddMemCpyOptPass",
+                                                [self.PassManagerRef],
+                                                self.Void,
+                                                compilation_info=info)
+        self.AddTailCallEliminationPass = rffi.llexternal("LLVMAddTailCallEliminationPass",
+                                                          [self.PassManagerRef],
+                                                          self.Void,
+                                                          compilation_info=info)
+        self.AddFunctionInliningPass = rffi.llexternal("LLVMAddFunctionInliningPass",
+                                                       [self.PassManagerRef],
+                                                       self.Void,
+                                                       compilation_info=info)
+        self.AddSLPVectorizePass = rffi.llexternal("LLVMAddSLPVectorizePass",
+                                                   [self.PassManagerRef],
+                                                   self.Void,
+                                                   compilation_info=info)
+        self.AddLoopVectorizePass = rffi.llexternal("LLVMAddLoopVectorizePass",
+                                                    [self.PassManagerRef],
+                                                    self.Void,
+                                                    compilation_info=info)
+        self.DisposePassManager = rffi.llexternal("LLVMDisposePassManager",
+                                                   [self.PassManagerRef],
+                                                   self.Void,
+                                                   compilation_info=info)
+        self.RunPasses = rffi.llexternal("RunPasses",
+                                          [self.ModuleRef, self.TargetMachineRef,
+                                           self.Str],
+                                          lltype.Signed,
+                                          compilation_info=info)
+        self.GetInstructionCount = rffi.llexternal("GetInstructionCount",
+                                                    [self.ModuleRef],
+                                                    lltype.Unsigned,
+                                                    compilation_info=info)
         self.GetSubtypes = rffi.llexternal("LLVMGetSubtypes",
                                             [self.TypeRef, self.TypeRefPtr],
                                             self.Void,
@@ -470,6 +635,9 @@ class LLVMAPI:
                                        [self.LLJITRef],
                                        self.ErrorRef,
                                        compilation_info=info)
+        self.ConsumeError = rffi.llexternal("LLVMConsumeError",
+                                            [self.ErrorRef], self.Void,
+                                            compilation_info=info)
         self.GetErrorMessage = rffi.llexternal("LLVMGetErrorMessage",
                                                 [self.ErrorRef],
                                                 self.Str,
@@ -651,11 +819,32 @@ class LLVMAPI:
                                             lltype.Unsigned],
                                            lltype.Unsigned,
                                            compilation_info=info)
+        self.MDNode = rffi.llexternal("LLVMMDNodeInContext2",
+                                      [self.ContextRef, self.VoidPtrPtr,
+                                       lltype.Unsigned],
+                                      self.MetadataRef,
+                                      compilation_info=info)
+        self.ValueAsMetadata = rffi.llexternal("LLVMValueAsMetadata",
+                                               [self.ValueRef],
+                                               self.MetadataRef,
+                                               compilation_info=info)
         self.SetMetadata = rffi.llexternal("LLVMSetMetadata",
                                            [self.ValueRef, lltype.Unsigned,
                                             self.ValueRef],
                                            self.Void,
                                            compilation_info=info)
+        self.TemporaryMDNode = rffi.llexternal("LLVMTemporaryMDNode",
+                                               [self.ContextRef,
+                                                self.VoidPtrPtr,
+                                                lltype.Unsigned],
+                                               self.MetadataRef,
+                                               compilation_info=info)
+        self.MetadataReplaceAllUsesWith = rffi.llexternal(
+                                            "LLVMMetadataReplaceAllUsesWith",
+                                            [self.MetadataRef,
+                                             self.MetadataRef],
+                                            self.Void,
+                                            compilation_info=info)
         self.BuildNeg = rffi.llexternal("LLVMBuildNeg",
                                         [self.BuilderRef, self.ValueRef,
                                          self.Str],
@@ -691,6 +880,12 @@ class LLVMAPI:
                                            self.TypeRef, self.Str],
                                           self.ValueRef,
                                           compilation_info=info)
+        self.BuildExtractValue = rffi.llexternal("LLVMBuildExtractValue",
+                                                 [self.BuilderRef,
+                                                  self.ValueRef,
+                                                  lltype.Unsigned, self.Str],
+                                                 self.ValueRef,
+                                                 compilation_info=info)
         self.BuildCall = rffi.llexternal("LLVMBuildCall",
                                          [self.BuilderRef, self.ValueRef,
                                           self.ValueRefPtr, lltype.Unsigned,
@@ -715,6 +910,204 @@ class LLVMAPI:
             "LLVMOrcLLJITBuilderSetObjectLinkingLayerCreator",
             [self.LLJITBuilderRef, self.ObjectLinkingLayerCreatorFunction,
              self.VoidPtr], self.Void, compilation_info=info)
+        self.GetNamedFunction = rffi.llexternal("LLVMGetNamedFunction",
+                                                [self.ModuleRef, self.Str],
+                                                self.ValueRef,
+                                                compilation_info=info)
+        self.SetValueName = rffi.llexternal("LLVMSetValueName2",
+                                            [self.ValueRef, self.Str,
+                                             lltype.Signed],
+                                            self.Void,
+                                            compilation_info=info)
+        self.BuildSwitch = rffi.llexternal("LLVMBuildSwitch",
+                                           [self.BuilderRef, self.ValueRef,
+                                            self.BasicBlockRef, lltype.Unsigned],
+                                           self.ValueRef,
+                                           compilation_info=info)
+        self.AddCase = rffi.llexternal("LLVMAddCase",
+                                       [self.ValueRef, self.ValueRef,
+                                        self.BasicBlockRef],
+                                       self.Void,
+                                       compilation_info=info)
+        self.SetMustTailCall = rffi.llexternal("SetMustTailCall",
+                                               [self.ValueRef],
+                                               self.Void,
+                                               compilation_info=info)
+        self.AddGlobal = rffi.llexternal("LLVMAddGlobal",
+                                         [self.ModuleRef, self.TypeRef,
+                                          self.Str],
+                                         self.ValueRef,
+                                         compilation_info=info)
+        self.GetNamedGlobal = rffi.llexternal("LLVMGetNamedGlobal",
+                                              [self.ModuleRef, self.Str],
+                                              self.ValueRef,
+                                              compilation_info=info)
+        self.PrintModuleToString = rffi.llexternal("LLVMPrintModuleToString",
+                                                   [self.ModuleRef],
+                                                   self.Str,
+                                                   compilation_info=info)
+        self.SetTarget = rffi.llexternal("LLVMSetTarget",
+                                         [self.ModuleRef, self.Str],
+                                         self.Void,
+                                         compilation_info=info)
+        self.EmitObject = rffi.llexternal("EmitObject",
+                                          [self.TargetMachineRef,
+                                           self.ModuleRef],
+                                          self.MemoryBufferRef,
+                                          compilation_info=info)
+        self.GetBufferStart = rffi.llexternal("LLVMGetBufferStart",
+                                              [self.MemoryBufferRef],
+                                              rffi.CCHARP,
+                                              compilation_info=info)
+        self.GetBufferSize = rffi.llexternal("LLVMGetBufferSize",
+                                             [self.MemoryBufferRef],
+                                             rffi.SIZE_T,
+                                             compilation_info=info)
+        self.CreateMemoryBufferWithMemoryRangeCopy = rffi.llexternal(
+                                        "LLVMCreateMemoryBufferWithMemoryRangeCopy",
+                                        [rffi.CCHARP, rffi.SIZE_T, self.Str],
+                                        self.MemoryBufferRef,
+                                        compilation_info=info)
+        self.DisposeMemoryBuffer = rffi.llexternal("LLVMDisposeMemoryBuffer",
+                                                   [self.MemoryBufferRef],
+                                                   self.Void,
+                                                   compilation_info=info)
+        self.CreateResourceTracker = rffi.llexternal(
+            "LLVMOrcJITDylibCreateResourceTracker", [self.JITDylibRef],
+            self.ResourceTrackerRef, compilation_info=info)
+        self.ResourceTrackerRemove = rffi.llexternal(
+            "LLVMOrcResourceTrackerRemove", [self.ResourceTrackerRef],
+            self.ErrorRef, compilation_info=info)
+        self.ReleaseResourceTracker = rffi.llexternal(
+            "LLVMOrcReleaseResourceTracker", [self.ResourceTrackerRef],
+            self.Void, compilation_info=info)
+        self.LLJITAddModuleWithRT = rffi.llexternal(
+            "LLVMOrcLLJITAddLLVMIRModuleWithRT",
+            [self.LLJITRef, self.ResourceTrackerRef,
+             self.ThreadSafeModuleRef],
+            self.ErrorRef, compilation_info=info)
+        self.LLJITAddObjectFileWithRT = rffi.llexternal(
+            "LLVMOrcLLJITAddObjectFileWithRT",
+            [self.LLJITRef, self.ResourceTrackerRef, self.MemoryBufferRef],
+            self.ErrorRef, compilation_info=info)
+        self.LLJITAddObjectFile = rffi.llexternal("LLVMOrcLLJITAddObjectFile",
+                                                  [self.LLJITRef,
+                                                   self.JITDylibRef,
+                                                   self.MemoryBufferRef],
+                                                  self.ErrorRef,
+                                                  compilation_info=info)
+        self.DefineAbsoluteSymbol = rffi.llexternal("DefineAbsoluteSymbol",
+                                                    [self.LLJITRef,
+                                                     self.JITDylibRef,
+                                                     self.Str, lltype.Signed],
+                                                    self.ErrorRef,
+                                                    compilation_info=info)
+        self.CreateSymbolSizes = rffi.llexternal("CreateSymbolSizes", [],
+                                                 self.SymbolSizesRef,
+                                                 compilation_info=info)
+        self.RecordSymbolSizes = rffi.llexternal("RecordSymbolSizes",
+                                                 [self.LLJITRef,
+                                                  self.SymbolSizesRef],
+                                                 self.Void,
+                                                 compilation_info=info)
+        self.TakeSymbolSize = rffi.llexternal("TakeSymbolSize",
+                                              [self.SymbolSizesRef, self.Str],
+                                              lltype.Signed,
+                                              compilation_info=info)
+        self.ClearSymbolSizes = rffi.llexternal("ClearSymbolSizes",
+                                                [self.SymbolSizesRef],
+                                                self.Void,
+                                                compilation_info=info)
+        self.VectorType = rffi.llexternal("LLVMVectorType",
+                                          [self.TypeRef, lltype.Unsigned],
+                                          self.TypeRef,
+                                          compilation_info=info)
+        self.GetVectorSize = rffi.llexternal("LLVMGetVectorSize",
+                                             [self.TypeRef],
+                                             lltype.Unsigned,
+                                             compilation_info=info)
+        self.GetElementType = rffi.llexternal("LLVMGetElementType",
+                                              [self.TypeRef],
+                                              self.TypeRef,
+                                              compilation_info=info)
+        self.ConstNull = rffi.llexternal("LLVMConstNull",
+                                         [self.TypeRef],
+                                         self.ValueRef,
+                                         compilation_info=info)
+        self.ConstVector = rffi.llexternal("LLVMConstVector",
+                                           [self.ValueRefPtr, lltype.Unsigned],
+                                           self.ValueRef,
+                                           compilation_info=info)
+        self.BuildInsertElement = rffi.llexternal("LLVMBuildInsertElement",
+                                                  [self.BuilderRef,
+                                                   self.ValueRef, self.ValueRef,
+                                                   self.ValueRef, self.Str],
+                                                  self.ValueRef,
+                                                  compilation_info=info)
+        self.BuildExtractElement = rffi.llexternal("LLVMBuildExtractElement",
+                                                   [self.BuilderRef,
+                                                    self.ValueRef,
+                                                    self.ValueRef, self.Str],
+                                                   self.ValueRef,
+                                                   compilation_info=info)
+        self.BuildShuffleVector = rffi.llexternal("LLVMBuildShuffleVector",
+                                                  [self.BuilderRef,
+                                                   self.ValueRef, self.ValueRef,
+                                                   self.ValueRef, self.Str],
+                                                  self.ValueRef,
+                                                  compilation_info=info)
+        self.SetAlignment = rffi.llexternal("LLVMSetAlignment",
+                                            [self.ValueRef, lltype.Unsigned],
+                                            self.Void,
+                                            compilation_info=info)
+        self.BuildFPToSI = rffi.llexternal("LLVMBuildFPToSI",
+                                           [self.BuilderRef, self.ValueRef,
+                                            self.TypeRef, self.Str],
+                                           self.ValueRef,
+                                           compilation_info=info)
+        self.BuildSIToFP = rffi.llexternal("LLVMBuildSIToFP",
+                                           [self.BuilderRef, self.ValueRef,
+                                            self.TypeRef, self.Str],
+                                           self.ValueRef,
+                                           compilation_info=info)
+        self.BuildFPTrunc = rffi.llexternal("LLVMBuildFPTrunc",
+                                            [self.BuilderRef, self.ValueRef,
+                                             self.TypeRef, self.Str],
+                                            self.ValueRef,
+                                            compilation_info=info)
+        self.BuildFPExt = rffi.llexternal("LLVMBuildFPExt",
+                                          [self.BuilderRef, self.ValueRef,
+                                           self.TypeRef, self.Str],
+                                          self.ValueRef,
+                                          compilation_info=info)
+
+class ScratchArray:
+    """
+    Raw array for passing LLVM refs to LLVM-C, reused across calls rather
+    than malloced and freed around each one. Only valid until the next fill.
+    """
+    def __init__(self, size=16):
+        self.size = size
+        self.array = lltype.malloc(rffi.VOIDPP.TO, size, flavor='raw',
+                                   track_allocation=False) #lives as long as the cpu
+
+    def reserve(self, count):
+        """The array, with room for at least count refs"""
+        if count > self.size:
+            lltype.free(self.array, flavor='raw', track_allocation=False)
+            self.size = max(count, self.size*2)
+            self.array = lltype.malloc(rffi.VOIDPP.TO, self.size,
+                                       flavor='raw', track_allocation=False)
+        return self.array
+
+    def fill(self, refs):
+        array = self.reserve(len(refs))
+        for c, ref in enumerate(refs):
+            array[c] = ref
+        return array
+
+    def __del__(self):
+        lltype.free(self.array, flavor='raw', track_allocation=False)
 
 class CString:
     """
@@ -723,6 +1116,7 @@ class CString:
     (without ugly explicit calls to free everywhere)
     """
     def __init__(self, string):
-        self.ptr = str2constcharp(string)
+        self.ptr = rffi.cast(rffi.CONST_CCHARP,
+                             rffi.str2charp(string, track_allocation=False)) #the cpu caches some, see value_name
     def __del__(self):
-        lltype.free(self.ptr, flavor='raw')
+        lltype.free(self.ptr, flavor='raw', track_allocation=False)
@@ -1,59 +1,90 @@
 import ctypes
 from rpython.jit.metainterp.history import ConstInt
+from rpython.jit.metainterp.resoperation import rop, VectorOp
+from rpython.jit.metainterp.resume import AccumInfo
 from rpython.jit.metainterp.support import ptr2int
 from rpython.rlib.objectmodel import compute_unique_id
+from rpython.jit.backend.llvm.objcache import RELOC_TABLE
 from rpython.rlib.jit_libffi import types
 from rpython.rtyper.lltypesystem import rffi, lltype, llmemory
 from rpython.rtyper.annlowlevel import llhelper
-from rpython.jit.backend.llsupport import gc
+from rpython.jit.backend.llsupport import gc, symbolic, llerrno, lltls
+from rpython.jit.backend.llsupport.rewrite import FLAG_ARRAY, FLAG_STR
+from rpython.rtyper.lltypesystem import rstr
+from rpython.rtyper import rclass
+from rpython.rlib import rgil
 from rpython.jit.backend.llvm.llvm_api import CString
 
+NULL_VALUE = lltype.nullptr(rffi.VOIDP.TO)
+GUARD_HOT_WEIGHT = 2000 #branch weight of a guard not failing, what __builtin_expect gives
+EXCEPTION_GUARDS = (rop.GUARD_EXCEPTION, rop.GUARD_NO_EXCEPTION,
+                    rop.GUARD_NOT_FORCED) #exit with the pending exception in jf_guard_exc
+
 class LLVMOpDispatcher:
-    def __init__(self, cpu, builder, module, entry, func, jitframe_type, jitframe_subtypes):
+    def __init__(self, cpu, builder, module, entry, func, func_name,
+                 func_type, jitframe_type, jitframe_subtypes):
         self.cpu = cpu
         self.builder = builder
         self.module = module
         self.func = func
+        self.func_name = func_name
+        self.func_type = func_type #every trace function shares this signature so they can tail call each other
+        self.entry_name = func_name #symbol execute_token enters through, loops override this
         self.entry = entry
         self.llvm = self.cpu.llvm
         self.jitframe_type = jitframe_type
         self.jitframe_subtypes = jitframe_subtypes
         self.args_size = 0
         self.local_vars_size = 0
+        self.frame_depth = 0 #max number of jitframe slots this function reads or writes
         self.ssa_vars = {} #map pypy ssa vars to llvm objects
         self.descr_phis = {} #map label descrs to phi values
-        self.descr_blocks = {} #map label and guard descrs to their blocks
-        self.descr_guards = {} #map guard descrs to llvm instructions
+        self.descr_blocks = {} #map label descrs to their blocks
         self.llvm_failargs = {} #map guards to llvm values their failargs map to at point of parsing
+        self.declared_funcs = {} #map names of trace functions in other modules to their declarations in this one
         self.guards = set() #keep track of seen guards for later
-        self.max_failargs = 0 #track max number of failargs seen
+        self.guard_exit = None #exit stub of the guard being parsed, see setup_guard
+        self.guard_descr = None #descr of the guard being parsed
+        self.loop_vectorized = False #vector ops seen since the last label, see parse_jump
+        self.intrinsics = {} #map names of intrinsics to their declarations in this module
+        self.label_entries = 0 #number of labels that can be entered from other functions
+        self.looptoken = None #token of the loop being compiled, None for bridges
+        self.operations = [] #ops being dispatched, forcing calls look ahead at their guard
+        self.invalidation_flag = 0 #raw word guard_not_invalidated checks, see LLVM_CPU.invalidate_loop
+        self.redirect_slot = 0 #raw word the entry function checks, see LLVM_CPU.redirect_call_assembler
+        self.finish_gcmap = [] #jitframe slots of the refs a guard_not_forced_2 left for the finish after it
+        self.inlined_callees = {} #map entry names of call_assembler targets to modules to link in, see link_callees
+        self.code_ranges = [] #(symbol, address, size) of this module's functions once in the JIT, see LLVMAssembler.code_ranges
+        gcrootmap = self.cpu.gc_ll_descr.gcrootmap
+        self.gc_roots = gcrootmap is not None and gcrootmap.is_shadow_stack #refs must be in the jitframe whenever the gc can run
+        self.live_refs = [] #ref boxes defined so far that may still be used, only tracked with gc_roots
+        self.last_uses = {} #map boxes to the index of the last op using them
+        self.op_index = 0
+        self.gc_table_addr = 0
+        self.propagate_block = None
+        self.relocate = self.cpu.object_cache is not None #see address()
+        self.relocations = [] #addresses the relocation table gets filled with
+        self.reloc_indices = {} #map addresses to their index in relocations
+        self.reloc_table = None
         self.llvm.PositionBuilderAtEnd(builder, self.entry)
         self.jitframe = self.llvm.GetParam(self.func, 0)
+        self.thread_local = self.llvm.GetParam(self.func, 1)
+        self.entry_index = self.llvm.GetParam(self.func, 2)
         cstring = CString("bailout")
         self.bailout = self.llvm.AppendBasicBlock(self.cpu.context,
                                                   self.func, cstring.ptr)
         self.define_constants()
 
     def define_constants(self):
-        self.zero = self.llvm.ConstInt(self.cpu.llvm_int_type, 0, 1)
-        self.true = self.llvm.ConstInt(self.cpu.llvm_bool_type, 1, 0)
-        self.false = self.llvm.ConstInt(self.cpu.llvm_bool_type, 0, 0)
-        self.max_int = self.llvm.ConstInt(self.cpu.llvm_wide_int,
-                                          2**(self.cpu.WORD*8-1)-1, 1)
-        self.min_int = self.llvm.ConstInt(self.cpu.llvm_wide_int,
-                                          -2**(self.cpu.WORD*8-1), 1)
-        self.fabs_intrinsic = self.define_function([self.cpu.llvm_float_type],
-                                                   self.cpu.llvm_float_type,
-                                                   "llvm.fabs.f64")
-        self.stackmap_intrinsic = self.define_function(
-            [self.cpu.llvm_int_type, self.cpu.llvm_indx_type],
-            self.cpu.llvm_void_type, "llvm.experimental.stackmap", variadic=True
-            )
+        self.zero = self.cpu.const_zero
+        self.true = self.cpu.const_true
+        self.false = self.cpu.const_false
+        self.max_int = self.cpu.const_max_int
+        self.min_int = self.cpu.const_min_int
         self.set_pred_enums()
 
     def set_pred_enums(self):
-        enums = lltype.malloc(self.llvm.CmpEnums, flavor='raw')
-        self.llvm.SetCmpEnums(enums)
+        enums = self.cpu.cmp_enums
         self.inteq = enums.inteq
         self.intne = enums.intne
         self.intugt = enums.intugt
@@ -71,7 +102,6 @@ class LLVMOpDispatcher:
         self.reallt = enums.reallt
         self.realle = enums.realle
         self.realord = enums.realord
-        lltype.free(enums, flavor='raw')
 
     def get_func_ptr(self, func, arg_types, ret_type):
         #takes rpython types
@@ -83,68 +113,65 @@ class LLVMOpDispatcher:
         func_ptr = llhelper(FPTR, func)
         return ConstInt(ptr2int(func_ptr))
 
+    def intrinsic(self, name, param_types, ret_type):
+        """Declaration of an intrinsic, added to the module on first use"""
+        try:
+            return self.intrinsics[name]
+        except KeyError:
+            func_type = self.cpu.function_type(name, param_types, ret_type)
+            cstring = CString(name)
+            func = self.llvm.AddFunction(self.module, cstring.ptr, func_type)
+            self.intrinsics[name] = func
+            return func
+
     def define_function(self, param_types, ret_type, name, variadic=False):
         #takes llvm types
-        parameters = self.rpython_array(param_types, self.llvm.TypeRef)
+        parameters = self.cpu.type_scratch.fill(param_types)
         signature = self.llvm.FunctionType(ret_type, parameters,
                                            len(param_types),
                                            1 if variadic else 0)
-        lltype.free(parameters, flavor='raw')
         cstring = CString(name)
         return self.llvm.AddFunction(self.module, cstring.ptr, signature)
 
     def call_function(self, func_int_ptr, ret_type, arg_types, args, res_name):
-        # takes llvm types
+        # takes llvm types, int args are fitted to the width of their type
         # pass res_name = "" when returning void
-        arg_num = len(args)
-        arg_types = self.rpython_array(arg_types, self.llvm.TypeRef)
-        func_type = self.llvm.FunctionType(ret_type, arg_types,
-                                           arg_num, 0)
-
-        func_ptr_type = self.llvm.PointerType(func_type, 0)
-        cstring = CString("func_ptr")
-        func = self.llvm.BuildIntToPtr(self.builder, func_int_ptr,
-                                       func_ptr_type, cstring.ptr)
-        arg_array = self.rpython_array(args, self.llvm.ValueRef)
-
-        cstring = CString(res_name)
-        res =  self.llvm.BuildCall(self.builder, func, arg_array, arg_num,
-                                   cstring.ptr)
-
-        lltype.free(arg_array, flavor='raw')
-        lltype.free(arg_types, flavor='raw')
-        return res
-
+        param_types = self.cpu.type_scratch.fill(arg_types)
+        arg_array = self.cpu.value_scratch.fill(args)
+        cstring = self.cpu.value_name(res_name)
+        return self.llvm.BuildCallAddress(self.builder, func_int_ptr, ret_type,
+                                          param_types, arg_array, len(args),
+                                          cstring.ptr)
 
     def create_metadata(self, string):
         cstring = CString(string)
         mdstr = self.llvm.MDString(self.cpu.context, cstring.ptr, len(string))
         return self.llvm.MetadataAsValue(self.cpu.context, mdstr)
 
-    def rpython_array(self, args, elem_type):
-        arg_array_type = rffi.CArray(elem_type)
-        arg_array = lltype.malloc(arg_array_type, n=len(args), flavor='raw')
-        for c, arg in enumerate(args):
-            arg_array.__setitem__(c, arg)
-        return arg_array
+    def gep_indices(self, indices):
+        """Raw GEP index array of 0 then indices, for aggregates behind a pointer"""
+        index_consts = [self.llvm.ConstInt(self.cpu.llvm_indx_type, 0, 1)]
+        for index in indices:
+            index_consts.append(self.llvm.ConstInt(self.cpu.llvm_indx_type,
+                                                   index, 1))
+        return self.cpu.value_scratch.fill(index_consts)
 
-    def parse_args(self, args):
+    def _parse_args(self, args):
         llvm_args = []
         for arg in args:
             if arg.is_constant():
                 if arg.type == 'i':
                     typ = self.cpu.llvm_int_type
-                    val = self.llvm.ConstInt(typ, arg.getvalue(), 1)
+                    val = self.cpu.const_word(arg.getvalue())
                     llvm_args.append([val, typ])
                 elif arg.type == 'f':
                     typ = self.cpu.llvm_float_type
-                    val = self.llvm.ConstFloat(typ, float(arg.getvalue()))
+                    val = self.cpu.const_float(float(arg.getvalue()))
                     llvm_args.append([val, typ])
                 elif arg.type == 'r':
-                    int_typ = self.cpu.llvm_int_type
-                    int_val = self.llvm.ConstInt(int_typ, arg.getvalue(), 1)
+                    int_val = self.cpu.const_word(arg.getvalue())
                     typ = self.cpu.llvm_void_ptr
-                    cstring = CString("ptr_arg")
+                    cstring = self.cpu.value_name("ptr_arg")
                     val = self.llvm.BuildIntToPtr(self.builder, int_val,
                                                   typ, cstring.ptr)
                     llvm_args.append([val, typ])
@@ -157,569 +184,785 @@ class LLVMOpDispatcher:
         if arg.type == 'i':
             return llvm_val #already int
         if arg.type == 'f':
-            cstring = CString("arg")
+            cstring = self.cpu.value_name("arg")
             return self.llvm.BuildBitCast(self.builder, llvm_val,
                                           self.cpu.llvm_float_type, cstring.ptr)
         if arg.type == 'r':
-            cstring = CString("arg")
+            cstring = self.cpu.value_name("arg")
             return self.llvm.BuildIntToPtr(self.builder, llvm_val,
                                            self.cpu.llvm_void_ptr, cstring.ptr)
 
     def uncast(self, arg, llvm_val):
     #need to put signed ints back in the jitframe
         if arg.type == 'i':
-            cstring = CString("uncast_res")
-            return self.llvm.BuildSExt(self.builder, llvm_val, #TODO: look into what happens when val is i1
-                                       self.cpu.llvm_int_type, cstring.ptr)
+            return self.fit_to_type(llvm_val, self.cpu.llvm_int_type)
         elif arg.type == 'f':
-            cstring = CString("uncast_res")
+            cstring = self.cpu.value_name("uncast_res")
             return self.llvm.BuildBitCast(self.builder, llvm_val,
                                           self.cpu.llvm_int_type, cstring.ptr)
         else: #arg.type == 'r'
-            cstring = CString("uncast_res")
+            cstring = self.cpu.value_name("uncast_res")
             return self.llvm.BuildPtrToInt(self.builder, llvm_val,
                                            self.cpu.llvm_int_type, cstring.ptr)
 
+    def is_bool(self, llvm_val):
+        return (rffi.cast(lltype.Signed, self.llvm.TypeOf(llvm_val)) ==
+                rffi.cast(lltype.Signed, self.cpu.llvm_bool_type))
+
+    def fit_to_type(self, llvm_val, typ):
+        """
+        Convert an int between the i1 comparisons leave and the word
+        everything else uses, for the few places that need one or the
+        other: the jitframe, loop headers, guards and addresses. Bools
+        are 0 or 1 as words, never -1.
+        """
+        if (rffi.cast(lltype.Signed, self.llvm.TypeOf(llvm_val)) ==
+                rffi.cast(lltype.Signed, typ)):
+            return llvm_val
+        if self.is_bool(llvm_val):
+            cstring = self.cpu.value_name("word")
+            return self.llvm.BuildZExt(self.builder, llvm_val, typ,
+                                       cstring.ptr)
+        if (rffi.cast(lltype.Signed, typ) ==
+                rffi.cast(lltype.Signed, self.cpu.llvm_bool_type)):
+            cstring = self.cpu.value_name("bool")
+            return self.llvm.BuildICmp(self.builder, self.intne, llvm_val,
+                                       self.zero, cstring.ptr)
+        return llvm_val
+
     def exit_trace(self, args, descr):
         self.jitframe.set_elem(descr, 1)
-        for i in range(len(args)):
-            self.jitframe.set_elem(args[i], 7, i+1)
-        self.llvm.BuildRet(self.builder, self.jitframe.struct)
+        self.store_frame_args(args)
+        self.llvm.BuildRet(self.builder, self.jitframe.get_struct())
+
+    def arg_type(self, arg):
+        if arg.type == 'f':
+            return self.cpu.llvm_float_type
+        if arg.type == 'r':
+            return self.cpu.llvm_void_ptr
+        return self.cpu.llvm_int_type
+
+    def load_frame_args(self, args):
+        """Values of args read from the jitframe's slots 1 to len(args)"""
+        types = self.cpu.type_scratch.fill([self.arg_type(arg)
+                                            for arg in args])
+        values = self.cpu.value_scratch.reserve(len(args))
+        self.llvm.LoadFrameArgs(self.builder, self.jitframe_type,
+                                self.jitframe.get_struct(), 7, 1, types,
+                                values, len(args))
+        return [values[c] for c in range(len(args))]
+
+    def store_frame_args(self, values, first_slot=1):
+        """
+        Write values to the jitframe's slots from first_slot, as words.
+        Null values are holes left unwritten.
+        """
+        value_array = self.cpu.value_scratch.fill(values)
+        self.llvm.StoreFrameArgs(self.builder, self.jitframe_type,
+                                 self.jitframe.get_struct(), 7, first_slot,
+                                 value_array, len(values))
 
     def init_bailout(self):
+        current_block = self.llvm.GetInsertBlock(self.builder)
         self.llvm.PositionBuilderAtEnd(self.builder, self.bailout)
-        self.bailout_phis = []
-        cstring = CString("descr_phi")
-        descr_phi = self.llvm.BuildPhi(self.builder, self.cpu.llvm_int_type,
-                                       cstring.ptr)
-        self.bailout_phis.append(descr_phi)
-        self.llvm.PositionBuilderAtEnd(self.builder, self.entry)
+        cstring = self.cpu.value_name("bridge_slot_phi")
+        self.slot_phi = self.llvm.BuildPhi(self.builder, self.cpu.llvm_int_type,
+                                           cstring.ptr)
+        self.llvm.PositionBuilderAtEnd(self.builder, current_block)
 
     def populate_bailout(self):
         if len(self.guards) == 0: #is linear loop
             self.llvm.DeleteBasicBlock(self.bailout)
             return
         self.llvm.PositionBuilderAtEnd(self.builder, self.bailout)
-        for guard in self.guards:
-            failargs = guard.getfailargs()
-            num_failargs = len(failargs)
-            descr = guard.getdescr()
-            block = self.descr_blocks[descr]
-            for i in range(self.max_failargs-num_failargs):
-                #how far we got + extra phi node we're currently at + 1 for descr phi + 1 for 0 indexing
-                indx = num_failargs+i+2
-                dummy_value = self.llvm.ConstInt(self.cpu.context,
-                                                 0, 0)
-                self.llvm.AddIncoming(self.bailout_phis[indx], dummy_value, block)
-            #arg_array_type = rffi.CArray(self.llvm.ValueRef)
-            #arg_array = lltype.malloc(arg_array_type, n=(2+len(failargs)), flavor='raw')
-            #ID = self.llvm.ConstInt(self.cpu.llvm_int_type, 0, 0)
-            #shadow_bytes = self.llvm.ConstInt(self.cpu.llvm_indx_type, 0, 0)
-            #arg_array.__setitem__(0, ID)
-            #arg_array.__setitem__(1, shadow_bytes)
-            #for c, failarg in enumerate(failargs, 2):
-                #arg_array.__setitem__(c, self.ssa_vars[failarg])
-            #cstring = CString("")
-            #self.llvm.BuildCall(self.builder, self.stackmap_intrinsic,
-                                #arg_array, 2+len(failargs), cstring.ptr)
-            #lltype.free(arg_array, flavor='raw')
-
-        if self.max_failargs > 0:
-            descr = self.bailout_phis[0]
-            self.exit_trace(self.bailout_phis[1:], descr)
-        else:
-            descr = self.bailout_phis[0]
-            self.jitframe.set_elem(descr, 1)
-            self.llvm.BuildRet(self.builder, self.jitframe.struct)
-
-    def patch_guard(self, faildescr, inputargs):
-        branch, op, cnd, resume = self.descr_guards[faildescr]
-        self.guards.remove(op)
-        cstring = CString("bridge")
-        bridge = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
-                                            cstring.ptr)
-        self.llvm.PositionBuilderBefore(self.builder, branch)
-        current_block = self.llvm.GetInsertBlock(self.builder)
-        self.llvm.EraseInstruction(branch)
-        failargs = op.getfailargs()
-        num_failargs = len(failargs)
-        self.llvm.PositionBuilderAtEnd(self.builder, current_block)
-        self.llvm.BuildCondBr(self.builder, cnd, resume, bridge)
-        self.llvm.PositionBuilderAtEnd(self.builder, bridge)
-        for c, arg in enumerate(inputargs,1):
-            phi = self.bailout_phis[c]
-            value = self.llvm.getIncomingValueForBlock(phi, current_block)
-            self.ssa_vars[arg] = value
-        if num_failargs == self.max_failargs:
-            self.max_failargs = 0
-            for guard in self.guards:
-                self.max_failargs = max(len(guard.getfailargs()), self.max_failargs)
-            if self.max_failargs < num_failargs:
-                for i in range(self.max_failargs, num_failargs):
-                    phi = self.bailout_phis[-1]
-                    self.bailout_phis.pop()
-                    self.llvm.EraseInstruction(phi)
-        self.llvm.removePredecessor(self.bailout, current_block)
-        block = self.llvm.splitBasicBlockAtPhi(self.bailout)
-        terminator = self.llvm.getTerminator(self.bailout)
-        self.llvm.EraseInstruction(terminator)
-        self.llvm.DeleteBasicBlock(block)
+        self.jump_to_bridge(self.bailout_value(self.slot_phi))
 
-    def init_inputargs(self, inputargs):
-        cstring = CString("overflow_flag")
-        self.overflow = self.llvm.BuildAlloca(self.builder,
-                                              self.cpu.llvm_bool_type,
+    def jump_to_bridge(self, slot_addr):
+        """
+        Every guard owns a word of raw memory holding the address of the
+        bridge attached to it (or 0). Bridges are separate functions, so
+        attaching one only means writing that word, the function containing
+        the guard never gets recompiled.
+        """
+        cstring = self.cpu.value_name("bridge_slot")
+        slot = self.llvm.BuildIntToPtr(self.builder, slot_addr,
+                                       self.cpu.llvm_int_ptr, cstring.ptr)
+        cstring = self.cpu.value_name("bridge_addr")
+        bridge_addr = self.llvm.BuildLoad(self.builder, self.cpu.llvm_int_type,
+                                          slot, cstring.ptr)
+        cstring = self.cpu.value_name("has_bridge")
+        has_bridge = self.llvm.BuildICmp(self.builder, self.intne, bridge_addr,
+                                         self.zero, cstring.ptr)
+        cstring = CString("call_bridge")
+        call_block = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                                cstring.ptr)
+        cstring = CString("exit_trace")
+        exit_block = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                                cstring.ptr)
+        self.llvm.BuildCondBr(self.builder, has_bridge, call_block, exit_block)
+
+        self.llvm.PositionBuilderAtEnd(self.builder, call_block)
+        func_ptr_type = self.llvm.PointerType(self.func_type, 0)
+        cstring = self.cpu.value_name("bridge")
+        bridge = self.llvm.BuildIntToPtr(self.builder, bridge_addr,
+                                         func_ptr_type, cstring.ptr)
+        self.tail_call_trace(bridge, self.zero)
+
+        self.llvm.PositionBuilderAtEnd(self.builder, exit_block)
+        self.llvm.BuildRet(self.builder, self.jitframe.get_struct())
+
+    def tail_call_trace(self, func, entry_index):
+        args = [self.jitframe.get_struct(), self.thread_local, entry_index]
+        arg_array = self.cpu.value_scratch.fill(args)
+        cstring = self.cpu.value_name("trace_res")
+        res = self.llvm.BuildCall(self.builder, func, arg_array, len(args),
+                                  cstring.ptr)
+        self.llvm.SetMustTailCall(res) #loop -> bridge -> loop cycles mustn't grow the stack
+        self.llvm.BuildRet(self.builder, res)
+
+    def declare_trace_func(self, name):
+        try:
+            return self.declared_funcs[name]
+        except KeyError:
+            cstring = CString(name)
+            func = self.llvm.AddFunction(self.module, cstring.ptr,
+                                         self.func_type)
+            self.declared_funcs[name] = func
+            return func
+
+    def define_entry_function(self, name, redirect_slot=0):
+        """
+        execute_token calls loops with only (jitframe, threadlocal_addr),
+        so they get a thin wrapper entering the body at its first block.
+        LLVM inlines the body into it. With a shadowstack the wrapper also
+        pushes the jitframe, like the other backends' call header, so a
+        moving gc can find and update it.
+
+        Call_assemblers call the wrapper directly, so instead of patching
+        its code, redirect_call_assembler writes the address of the new
+        entry function to redirect_slot, which the wrapper checks first.
+        """
+        jitframe_ptr = self.llvm.PointerType(self.jitframe_type, 0)
+        entry_func = self.declared_funcs.get(name, None) #recursive call_assemblers already declared it
+        if entry_func is None:
+            entry_func = self.define_function([jitframe_ptr,
+                                               self.cpu.llvm_void_ptr],
+                                              jitframe_ptr, name)
+        cstring = CString("entry")
+        block = self.llvm.AppendBasicBlock(self.cpu.context, entry_func,
+                                           cstring.ptr)
+        self.llvm.PositionBuilderAtEnd(self.builder, block)
+        frame = self.llvm.GetParam(entry_func, 0)
+        if redirect_slot != 0:
+            self.check_redirect(entry_func, redirect_slot)
+            self.redirect_slot = redirect_slot
+        if self.gc_roots:
+            self.push_frame(frame)
+        args = [frame, self.llvm.GetParam(entry_func, 1), self.zero]
+        arg_array = self.cpu.value_scratch.fill(args)
+        cstring = self.cpu.value_name("trace_res")
+        res = self.llvm.BuildCall(self.builder, self.func, arg_array,
+                                  len(args), cstring.ptr)
+        if self.gc_roots:
+            self.pop_frame()
+        self.llvm.BuildRet(self.builder, res)
+        self.entry_name = name
+
+    def check_redirect(self, entry_func, redirect_slot):
+        cstring = self.cpu.value_name("redirect_slot")
+        slot = self.llvm.BuildIntToPtr(self.builder,
+                                       self.address(redirect_slot),
+                                       self.cpu.llvm_int_ptr, cstring.ptr)
+        cstring = self.cpu.value_name("redirect_addr")
+        target_addr = self.llvm.BuildLoad(self.builder, self.cpu.llvm_int_type,
+                                          slot, cstring.ptr)
+        cstring = self.cpu.value_name("redirected")
+        redirected = self.llvm.BuildICmp(self.builder, self.intne, target_addr,
+                                         self.zero, cstring.ptr)
+        cstring = CString("redirect")
+        redirect = self.llvm.AppendBasicBlock(self.cpu.context, entry_func,
                                               cstring.ptr)
-        self.local_vars_size += 1
-        self.llvm.BuildStore(self.builder, self.false, self.overflow)
+        cstring = CString("enter")
+        enter = self.llvm.AppendBasicBlock(self.cpu.context, entry_func,
+                                           cstring.ptr)
+        weights = self.cpu.get_branch_weights(1, GUARD_HOT_WEIGHT)
+        self.llvm.BuildGuardBranch(self.builder, redirected, redirect, enter,
+                                   self.cpu.prof_kind_id, weights, redirect)
+        cstring = self.cpu.value_name("redirect")
+        target = self.llvm.BuildIntToPtr(self.builder, target_addr,
+                                         self.llvm.TypeOf(entry_func),
+                                         cstring.ptr) #TypeOf a function is already a pointer to it
+        args = [self.llvm.GetParam(entry_func, 0),
+                self.llvm.GetParam(entry_func, 1)]
+        arg_array = self.cpu.value_scratch.fill(args)
+        cstring = self.cpu.value_name("redirect_res")
+        res = self.llvm.BuildCall(self.builder, target, arg_array, len(args),
+                                  cstring.ptr)
+        self.llvm.BuildRet(self.builder, res)
+        self.llvm.PositionBuilderAtEnd(self.builder, enter)
+
+    def init_inputargs(self, inputargs):
+        self.overflow_flag = self.false #overflow bit of the last *_ovf op, branched on by the guard after it
+        cstring = self.cpu.value_name("jitframe_slot")
+        frame_slot = self.llvm.BuildAlloca(self.builder,
+                                           self.llvm.TypeOf(self.jitframe),
+                                           cstring.ptr) #the gc may move the frame, see reload_frame
+        self.local_vars_size += self.cpu.WORD
         self.jitframe = LLVMStruct(self, self.jitframe_subtypes, 2,
                                    self.entry, self.jitframe,
-                                   self.jitframe_type)
+                                   self.jitframe_type, frame_slot)
+        #other trace functions enter us at a label by passing its index
+        cstring = CString("start")
+        start = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                           cstring.ptr)
+        self.entry_switch = self.llvm.BuildSwitch(self.builder,
+                                                  self.entry_index, start, 0)
+        self.llvm.PositionBuilderAtEnd(self.builder, start)
 
-        indecies_array = rffi.CArray(self.llvm.ValueRef)
-        indecies = lltype.malloc(indecies_array, n=3, flavor='raw')
-        for c, arg in enumerate(inputargs,1):
-            arg_uncast = self.jitframe.get_elem(7,c)
-            self.ssa_vars[arg] = self.cast_arg(arg, arg_uncast)
+        values = self.load_frame_args(inputargs)
+        for c, arg in enumerate(inputargs):
+            self.ssa_vars[arg] = values[c]
             self.args_size += self.cpu.WORD
-        lltype.free(indecies, flavor='raw')
-
-    def dispatch_ops(self, inputargs, ops, faildescr=None):
-        if faildescr is None:
-            self.init_inputargs(inputargs)
-            self.init_bailout()
-        else: #is bridge
-            self.patch_guard(faildescr, inputargs)
-
-        for op in ops:
-            if op.opnum == 1:
-                self.parse_jump(op)
-
-            elif op.opnum == 2:
-                self.parse_finish(op)
-
-            elif op.opnum == 4:
-                self.parse_label(op)
-
-            elif op.opnum == 7:
-                resume_block = self.setup_guard(op)
-                self.parse_guard_true(op, resume_block)
-
-            elif op.opnum == 8:
-                resume_block = self.setup_guard(op)
-                self.parse_guard_false(op, resume_block)
-
-            elif op.opnum == 11: #9 and 10 are vect ops
-                resume_block = self.setup_guard(op)
-                self.parse_guard_value(op, resume_block)
-
-            elif op.opnum == 13:
-                resume_block = self.setup_guard(op)
-                self.parse_guard_nonnull(op, resume_block)
-
-            elif op.opnum == 14:
-                resume_block = self.setup_guard(op)
-                self.parse_guard_isnull(op, resume_block)
-
-            elif op.opnum == 22:
-                resume_block = self.setup_guard(op)
-                self.parse_guard_no_overflow(op, resume_block)
-
-            elif op.opnum == 23:
+            if self.gc_roots and arg.type == 'r':
+                self.live_refs.append(arg)
+        self.frame_depth = max(self.frame_depth, len(inputargs))
+
+    def dispatch_ops(self, inputargs, ops, gc_table_addr=0):
+        self.gc_table_addr = gc_table_addr
+        self.operations = ops
+        if self.gc_roots:
+            self.find_last_uses(ops)
+        self.init_inputargs(inputargs)
+        self.init_bailout()
+
+        for index, op in enumerate(ops):
+            self.op_index = index
+            opnum = op.getopnum()
+            if op.is_vector():
+                self.loop_vectorized = True
+            if op.is_guard():
                 resume_block = self.setup_guard(op)
-                self.parse_guard_overflow(op, resume_block)
-
-            elif op.opnum == 31:
-                self.parse_int_add(op)
-
-            elif op.opnum == 32:
-                self.parse_int_sub(op)
-
-            elif op.opnum == 33:
-                self.parse_int_mul(op)
-
-            elif op.opnum == 34:
-                self.parse_uint_mul_high(op)
-
-            elif op.opnum == 35:
-                self.parse_int_and(op)
-
-            elif op.opnum == 36:
-                self.parse_int_or(op)
-
-            elif op.opnum == 37:
-                self.parse_int_xor(op)
-
-            elif op.opnum == 38:
-                self.parse_int_rshift(op)
-
-            elif op.opnum == 39:
-                self.parse_int_lshift(op)
-
-            elif op.opnum == 40:
-                self.parse_uint_rshift(op)
-
-            elif op.opnum == 41:
-                self.parse_int_sext(op)
-
-            elif op.opnum == 42:
-                self.parse_float_add(op)
-
-            elif op.opnum == 43:
-                self.parse_float_sub(op)
-
-            elif op.opnum == 44:
-                self.parse_float_mul(op)
-
-            elif op.opnum == 45:
-                self.parse_float_div(op)
-
-            elif op.opnum == 46:
-                self.parse_float_neg(op)
-
-            elif op.opnum == 47:
-                self.parse_float_abs(op)
-
-            elif op.opnum == 48:
-                self.parse_float_to_int(op)
-
-            elif op.opnum == 49:
-                self.parse_int_to_float(op)
-
-            elif op.opnum == 50:
-                self.parse_float_to_single_float(op)
-
-            elif op.opnum == 51:
-                self.parse_single_float_to_float(op)
-
-            elif op.opnum == 52: #float_to_longlong - int is already word len
-                self.parse_float_to_int(op)
-
-            elif op.opnum == 53:
-                self.parse_int_to_float(op)
-
-            elif op.opnum == 91:
-                self.parse_int_cmp(op, self.intslt)
-
-            elif op.opnum == 92:
-                self.parse_int_cmp(op, self.intsle)
-
-            elif op.opnum == 93:
-                self.parse_int_cmp(op, self.inteq)
-
-            elif op.opnum == 94:
-                self.parse_int_cmp(op, self.intne)
-
-            elif op.opnum == 95:
-                self.parse_int_cmp(op, self.intsgt)
-
-            elif op.opnum == 96:
-                self.parse_int_cmp(op, self.intsge)
-
-            elif op.opnum == 97:
-                self.parse_int_cmp(op, self.intult)
-
-            elif op.opnum == 98:
-                self.parse_int_cmp(op, self.intule)
-
-            elif op.opnum == 99:
-                self.parse_int_cmp(op, self.intugt)
-
-            elif op.opnum == 100:
-                self.parse_int_cmp(op, self.intuge)
-
-            elif op.opnum == 101:
-                self.parse_float_cmp(op, self.reallt)
-
-            elif op.opnum == 102:
-                self.parse_float_cmp(op, self.realle)
-
-            elif op.opnum == 103:
-                self.parse_float_cmp(op, self.realeq)
-
-            elif op.opnum == 104:
-                self.parse_float_cmp(op, self.realne)
-
-            elif op.opnum == 105:
-                self.parse_float_cmp(op, self.realgt)
-
-            elif op.opnum == 106:
-                self.parse_float_cmp(op, self.realge)
-
-            elif op.opnum == 107:
-                self.parse_int_is_zero(op)
-
-            elif op.opnum == 108:
-                self.parse_int_is_true(op)
-
-            elif op.opnum == 109:
-                self.parse_int_neg(op)
-
-            elif op.opnum == 110:
-                self.parse_int_invert(op)
-
-            elif op.opnum == 111:
-                self.parse_int_force_ge_zero(op)
-
-            elif op.opnum == 113:
-                self.parse_ptr_to_int(op)
-
-            elif op.opnum == 114:
-                self.parse_int_to_ptr(op)
-
-            elif op.opnum == 117:
-                self.parse_ptr_eq(op)
-
-            elif op.opnum == 116:
-                self.parse_ptr_ne(op)
-
-            elif op.opnum == 160:
-                self.parse_new(op)
-
-            elif op.opnum == 161:
-                self.parse_new_with_vtable(op)
-
-            elif op.opnum == 162:
-                self.parse_new_array(op)
-
-            elif op.opnum == 163:
-                self.parse_new_array(op) #TODO: boehm zero inits by default, other gc might not
-
-            elif op.opnum == 164:
-                self.parse_newstr(op)
-
-            elif op.opnum == 165:
-                self.parse_newunicode(op)
-
-            elif op.opnum == 166:
-                self.parse_force_token(op)
-
-            elif op.opnum == 168: #167 doesn't reach backend
-                self.parse_strhash(op)
-
-            elif op.opnum == 169:
-                self.parse_unicodehash(op)
-
-            elif op.opnum == 213:
-                self.parse_call(op, 'r')
-
-            elif op.opnum == 214:
-                self.parse_call(op, 'f')
-
-            elif op.opnum == 215:
-                self.parse_call(op, 'i')
-
-            elif op.opnum == 216:
-                self.parse_call(op, 'n')
-
-            elif op.opnum == 217:
-                self.parse_cond_call(op)
-
-            elif op.opnum == 218:
-                self.parse_cond_call_value(op, "r")
-
-            elif op.opnum == 219:
-                self.parse_cond_call_value(op, "i")
-
-            elif op.opnum == 246:
-                self.parse_int_ovf(op, '+')
-
-            elif op.opnum == 247:
-                self.parse_int_ovf(op, '-')
-
-            elif op.opnum == 248:
-                self.parse_int_ovf(op, '*')
-
-
-            else: #TODO: take out as this may prevent jump table optimisation
-                raise Exception("Unimplemented opcode: "+str(op)+"\n Opnum: "+str(op.opnum))
+                guard_list[opnum](self, op, resume_block)
+            else:
+                op_list[opnum](self, op)
+            if self.gc_roots and op.type == 'r':
+                self.live_refs.append(op)
 
         self.populate_bailout()
+        self.link_callees()
         if self.cpu.debug:
             self.llvm.DumpModule(self.module)
 
     def parse_jump(self, op):
-        current_block = self.llvm.GetInsertBlock(self.builder)
         descr = op.getdescr()
+        if descr not in self.descr_phis: #label lives in another trace function
+            self.jump_to_label_entry(op)
+            return
+        current_block = self.llvm.GetInsertBlock(self.builder)
         target_block = self.descr_blocks[descr]
         phis = self.descr_phis[descr]
 
         c = 0
-        for arg, _, in self.parse_args(op.getarglist()):
+        for arg, _, in self._parse_args(op.getarglist()):
             phi = phis[c]
+            arg = self.fit_to_type(arg, self.llvm.TypeOf(phi))
             self.llvm.AddIncoming(phi, arg, current_block)
             c += 1
 
-        self.llvm.BuildBr(self.builder, target_block)
+        branch = self.llvm.BuildBr(self.builder, target_block)
+        self.set_loop_metadata(branch)
+
+    def set_loop_metadata(self, back_edge):
+        """
+        Give the loop its !llvm.loop id, so LLVM's loop passes can tell it
+        apart and take hints. Not llvm.loop.mustprogress: a trace loop
+        without side effects is an infinite loop in the program itself.
+        """
+        hints = []
+        if self.loop_vectorized:
+            hints.append(self.cpu.loop_vectorized_hint)
+        loop_id = self.llvm.MetadataAsValue(self.cpu.context,
+                                            self.cpu.loop_id(hints))
+        self.llvm.SetMetadata(back_edge, self.cpu.loop_kind_id, loop_id)
+
+    def jump_to_label_entry(self, op):
+        descr = op.getdescr()
+        args = op.getarglist()
+        llvm_args = self._parse_args(args)
+        slots, num_slots = self.frame_slots(args)
+        for c in range(len(args)):
+            if args[c].is_vector():
+                self.store_frame_vector(llvm_args[c][0], slots[c])
+                continue
+            uncast = self.uncast(args[c], llvm_args[c][0])
+            self.jitframe.set_elem(uncast, 7, slots[c])
+        self.frame_depth = max(self.frame_depth, num_slots)
+        func = self.declare_trace_func(descr._llvm_entry_func)
+        index = self.cpu.const_word(descr._llvm_label_index)
+        self.tail_call_trace(func, index)
 
     def parse_finish(self, op):
-        uncast_args = []
-        for arg in op.getarglist():
-            uncast = self.uncast(arg, self.ssa_vars[arg])
-            uncast_args.append(uncast)
-        descr = compute_unique_id(op.getdescr())
-        descr = self.llvm.ConstInt(self.cpu.llvm_int_type, descr, 0)
-        self.exit_trace(uncast_args, descr)
+        args = [self.ssa_vars[arg] for arg in op.getarglist()]
+        self.frame_depth = max(self.frame_depth, len(args))
+        if self.gc_roots:
+            self.push_gcmap([c for c, arg in enumerate(op.getarglist())
+                             if arg.type == 'r'] + self.finish_gcmap)
+        descr = self.address(compute_unique_id(op.getdescr()))
+        self.exit_trace(args, descr)
 
     def parse_label(self, op):
+        """
+        Labels become canonical loop headers: falling through and entering
+        from other functions both go through one preheader, so the only
+        other predecessors of the header are the loop's own back edges.
+        The header's phis have the values' own types, floats stay doubles
+        and comparisons stay i1s (see stays_bool), only entering from the
+        jitframe converts.
+        """
         descr = op.getdescr()
+        arg_list = op.getarglist()
+        values = []
+        for c, (arg, typ) in enumerate(self._parse_args(arg_list)):
+            if self.is_bool(arg) and not self.stays_bool(descr, arg_list, c):
+                arg = self.fit_to_type(arg, self.cpu.llvm_int_type)
+            values.append(arg)
         current_block = self.llvm.GetInsertBlock(self.builder)
+        cstring = CString("loop_preheader")
+        preheader = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                               cstring.ptr)
         cstring = CString("loop_header")
         loop_header = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
                                                  cstring.ptr)
-        self.llvm.BuildBr(self.builder, loop_header) #llvm requires explicit branching even for fall through
+        self.llvm.BuildBr(self.builder, preheader) #llvm requires explicit branching even for fall through
+        self.llvm.PositionBuilderAtEnd(self.builder, preheader)
+        entry_phis = []
+        for c, arg in enumerate(values):
+            cstring = self.cpu.value_name("entry_phi_"+str(c))
+            phi = self.llvm.BuildPhi(self.builder, self.llvm.TypeOf(arg),
+                                     cstring.ptr)
+            self.llvm.AddIncoming(phi, arg, current_block)
+            entry_phis.append(phi)
+        self.llvm.BuildBr(self.builder, loop_header)
         self.llvm.PositionBuilderAtEnd(self.builder, loop_header)
         phis = []
-        arg_list = op.getarglist()
-        c = 0
-        for arg, typ in self.parse_args(arg_list):
-            cstring = CString("phi_"+str(c))
-            phi = self.llvm.BuildPhi(self.builder, typ, cstring.ptr)
-            self.llvm.AddIncoming(phi, arg, current_block)
+        for c in range(len(arg_list)):
+            entry_phi = entry_phis[c]
+            cstring = self.cpu.value_name("phi_"+str(c))
+            phi = self.llvm.BuildPhi(self.builder,
+                                     self.llvm.TypeOf(entry_phi), cstring.ptr)
+            self.llvm.AddIncoming(phi, entry_phi, preheader)
             rpy_val = arg_list[c] #want to replace referances to this value with the phi instead of whatever was there beofre
             self.ssa_vars[rpy_val] = phi
             phis.append(phi)
-            c += 1
         self.descr_phis[descr] = phis
         self.descr_blocks[descr] = loop_header
+        self.add_label_entry(descr, arg_list, entry_phis, preheader)
+        self.llvm.PositionBuilderAtEnd(self.builder, loop_header)
+        self.loop_vectorized = False
+
+    def stays_bool(self, descr, arg_list, index):
+        """
+        Whether the index'th argument of the label can stay an i1 across
+        the loop header: every jump back to it in this trace passes a
+        comparison result, a 0 or 1 constant or the argument itself.
+        Otherwise the phi is a word, and comparisons get widened once
+        on the back edge instead.
+        """
+        label_arg = arg_list[index]
+        for op in self.operations[self.op_index+1:]:
+            if op.getopnum() != rop.JUMP or op.getdescr() is not descr:
+                continue
+            arg = op.getarg(index)
+            if arg is label_arg:
+                continue
+            if arg.is_constant():
+                if arg.getint() not in (0, 1):
+                    return False
+            elif not rop.returns_bool_result(arg.getopnum()):
+                return False
+        return True
+
+    def add_label_entry(self, descr, arg_list, phis, preheader):
+        """
+        Bridges and other loops jumping here are separate functions, they
+        leave the label's arguments in the jitframe and tail call us with
+        this label's index.
+        """
+        self.label_entries += 1
+        index = self.cpu.const_word(self.label_entries)
+        cstring = CString("label_entry")
+        block = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                           cstring.ptr)
+        self.llvm.AddCase(self.entry_switch, index, block)
+        self.llvm.PositionBuilderAtEnd(self.builder, block)
+        slots, num_slots = self.frame_slots(arg_list)
+        for c, arg in enumerate(arg_list):
+            if arg.is_vector():
+                value = self.load_frame_vector(slots[c],
+                                               self.llvm.TypeOf(phis[c]))
+            else:
+                value = self.cast_arg(arg, self.jitframe.get_elem(7, slots[c]))
+                value = self.fit_to_type(value, self.llvm.TypeOf(phis[c]))
+            self.llvm.AddIncoming(phis[c], value, block)
+        self.llvm.BuildBr(self.builder, preheader)
+        self.frame_depth = max(self.frame_depth, num_slots)
+        descr._llvm_entry_func = self.func_name
+        descr._llvm_label_index = self.label_entries
 
     def setup_guard(self, op):
+        """
+        Every guard gets its own exit stub, writing just its descr, failargs
+        and gcmap to the jitframe before branching to the bailout block the
+        guards share, which only has to find the bridge to run. The stubs
+        are cold, guard_branch weights the branches to them accordingly.
+        """
         self.guards.add(op)
+        self.guard_descr = op.getdescr()
         current_block = self.llvm.GetInsertBlock(self.builder)
-        failargs = op.getfailargs()
-        self.llvm.PositionBuilderAtEnd(self.builder, self.bailout)
-        num_failargs = len(failargs)
-        if num_failargs > self.max_failargs:
-            for i in range(num_failargs - self.max_failargs):
-                cstring = CString("bailout_phi")
-                phi = self.llvm.BuildPhi(self.builder, self.cpu.llvm_int_type,
-                                         cstring.ptr)
-                self.bailout_phis.append(phi)
-            self.max_failargs = num_failargs
+        cstring = CString("guard_exit")
+        self.guard_exit = self.llvm.AppendBasicBlock(self.cpu.context,
+                                                     self.func, cstring.ptr)
+        self.llvm.PositionBuilderAtEnd(self.builder, self.guard_exit)
         descr = op.getdescr()
+        num_slots = self.cpu.set_failarg_locs(descr, op.getfailargs())
+        self.frame_depth = max(self.frame_depth, num_slots)
         descr_addr = compute_unique_id(descr) #TODO: look into making more efficient
-        descr_addr_llvm = self.llvm.ConstInt(self.cpu.llvm_int_type,
-                                             descr_addr, 1)
-        self.llvm.AddIncoming(self.bailout_phis[0], descr_addr_llvm, current_block)
-        for i in range(1,num_failargs+1):
-            arg = failargs[i-1]
-            uncast_arg = self.uncast(arg, self.ssa_vars[arg])
-            self.llvm.AddIncoming(self.bailout_phis[i], uncast_arg, current_block)
+        self.jitframe.set_elem(self.address(descr_addr), 1)
+        self.store_frame_args(self.failarg_values(op))
+        if self.gc_roots:
+            self.push_gcmap([c for c, arg in enumerate(self.live_failargs(op))
+                             if arg.type == 'r'])
+        if op.getopnum() in EXCEPTION_GUARDS:
+            self.store_and_reset_exception()
+        slot_addr = self.cpu.allocate_bridge_slot(descr)
+        self.llvm.AddIncoming(self.slot_phi, self.bailout_address(slot_addr),
+                              self.guard_exit)
+        self.llvm.BuildBr(self.builder, self.bailout)
         self.llvm.PositionBuilderAtEnd(self.builder, current_block)
         cstring = CString("resume")
         resume = self.llvm.AppendBasicBlock(self.cpu.context,
                                             self.func, cstring.ptr)
-        self.descr_blocks[descr] = current_block
         return resume
 
+    def live_failargs(self, op):
+        """A guard's failargs without the holes, see set_failarg_locs"""
+        return [arg for arg in op.getfailargs() if arg is not None]
+
+    def failarg_values(self, op):
+        """
+        Llvm values of a guard's failargs, leaving out the holes. Results
+        of the call a guard_not_forced follows while the call's still being
+        prepared are null values, which store_frame_args skips.
+        """
+        accums = self.accumulated_failargs(op.getdescr())
+        values = []
+        for c, arg in enumerate(op.getfailargs()):
+            if arg is None: #hole in the failargs, has no slot
+                continue
+            elif arg not in self.ssa_vars: #written by the call itself
+                values.append(NULL_VALUE)
+            elif arg.is_vector(): #only accumulators leave loops as vectors
+                values.append(self.reduce_accumulator(arg, accums[c]))
+            else:
+                values.append(self.ssa_vars[arg])
+        return values
+
+    def guard_branch(self, cnd, resume, exit_on=False):
+        """
+        Continue at resume unless cnd is exit_on, in which case leave
+        through the current guard's exit stub. The exit is weighted as
+        cold unless the guard has been seen failing, see guard_fail_weight.
+        """
+        fail_weight = self.cpu.guard_fail_weight(self.guard_descr)
+        if exit_on:
+            weights = self.cpu.get_branch_weights(fail_weight,
+                                                  GUARD_HOT_WEIGHT)
+            self.llvm.BuildGuardBranch(self.builder, cnd, self.guard_exit,
+                                       resume, self.cpu.prof_kind_id,
+                                       weights, resume)
+        else:
+            weights = self.cpu.get_branch_weights(GUARD_HOT_WEIGHT,
+                                                  fail_weight)
+            self.llvm.BuildGuardBranch(self.builder, cnd, resume,
+                                       self.guard_exit, self.cpu.prof_kind_id,
+                                       weights, resume)
+
     def parse_guard_true(self, op, resume):
-        cnd = self.ssa_vars[op.getarglist()[0]]
-        branch = self.llvm.BuildCondBr(self.builder, cnd, resume, self.bailout)
-        self.descr_guards[op.getdescr()] = (branch, op, cnd, resume)
-        self.llvm.PositionBuilderAtEnd(self.builder, resume)
+        cnd = self.fit_to_type(self.ssa_vars[op.getarglist()[0]],
+                               self.cpu.llvm_bool_type)
+        self.guard_branch(cnd, resume)
 
     def parse_guard_false(self, op, resume):
-        cnd = self.ssa_vars[op.getarglist()[0]]
-        cstring = CString("cnd_flipped")
-        cnd_flipped = self.llvm.BuildXor(self.builder, cnd, self.true,
-                                         cstring.ptr)
-        branch = self.llvm.BuildCondBr(self.builder, cnd_flipped, resume, self.bailout)
-        self.descr_guards[op.getdescr()] = (branch, op, cnd_flipped, resume)
-        self.llvm.PositionBuilderAtEnd(self.builder, resume)
+        cnd = self.fit_to_type(self.ssa_vars[op.getarglist()[0]],
+                               self.cpu.llvm_bool_type)
+        self.guard_branch(cnd, resume, exit_on=True)
 
     def parse_guard_value(self, op, resume):
         args = op.getarglist()
         val = self.ssa_vars[args[0]]
         typ = args[1].type
         const_val = args[1].getvalue()
-        cstring = CString("guard_value_cmp")
+        cstring = self.cpu.value_name("guard_value_cmp")
         if typ == 'i':
-            const = self.llvm.ConstInt(self.cpu.llvm_int_type, const_val, 1)
+            const = self.cpu.const_word(const_val)
             cnd = self.llvm.BuildICmp(self.builder, self.inteq, val, const,
                                       cstring.ptr)
         elif typ == 'f':
-            const = self.llvm.ConstFloat(self.cpu.llvm_float_type,
-                                         float(const_val))
+            const = self.cpu.const_float(float(const_val))
             cnd = self.llvm.BuildFCmp(self.builder, self.realeq, val, const,
                                       cstring.ptr)
         elif typ == 'r':
-            const = self.llvm.ConstInt(self.cpu.llvm_int_type, const_val, 0)
+            const = self.cpu.const_word(const_val)
             int_ptr = self.llvm.BuildPtrToInt(self.builder, val,
                                               self.cpu.llvm_int_type,
                                               cstring.ptr)
             cnd = self.llvm.BuildICmp(self.builder, self.inteq, int_ptr, const,
                                       cstring.ptr)
-        branch = self.llvm.BuildCondBr(self.builder, cnd, resume, self.bailout)
-        self.descr_guards[op.getdescr()] = (branch, op, cnd, resume)
-        self.llvm.PositionBuilderAtEnd(self.builder, resume)
+        self.guard_branch(cnd, resume)
 
     def parse_guard_nonnull(self, op, resume):
-        arg, typ = self.parse_args(op.getarglist())[0]
-        cstring = CString("guard_nonnull_res")
+        arg, typ = self._parse_args(op.getarglist())[0]
+        cstring = self.cpu.value_name("guard_nonnull_res")
         if typ != 'f': #IsNotNull is generic on int and ptr but not float
             cnd = self.llvm.BuildIsNotNull(self.builder, arg, cstring.ptr)
         else:
-            zero = self.llvm.ConstFloat(self.cpu.llvm_float_type, float(0))
+            zero = self.cpu.const_float(0.0)
             cnd = self.llvm.BuildFCmp(self.builder, self.realne, arg, zero,
                                       cstring.ptr)
-        branch = self.llvm.BuildCondBr(self.builder, cnd, resume, self.bailout)
-        self.descr_guards[op.getdescr()] = (branch, op, cnd, resume)
-        self.llvm.PositionBuilderAtEnd(self.builder, resume)
+        self.guard_branch(cnd, resume)
 
     def parse_guard_isnull(self, op, resume):
-        arg, typ = self.parse_args(op.getarglist())[0]
-        cstring = CString("guard_isnull_res")
+        arg, typ = self._parse_args(op.getarglist())[0]
+        cstring = self.cpu.value_name("guard_isnull_res")
         if typ != 'f':
             cnd = self.llvm.BuildIsNull(self.builder, arg, cstring.ptr)
         else:
-            zero = self.llvm.ConstFloat(self.cpu.llvm_float_type, float(0))
+            zero = self.cpu.const_float(0.0)
             cnd = self.llvm.BuildFCmp(self.builder, self.realeq, arg, zero,
                                       cstring.ptr)
-        branch = self.llvm.BuildCondBr(self.builder, cnd, resume, self.bailout)
-        self.descr_guards[op.getdescr()] = (branch, op, cnd, resume)
-        self.llvm.PositionBuilderAtEnd(self.builder, resume)
+        self.guard_branch(cnd, resume)
 
     def parse_guard_no_overflow(self, op, resume):
-        cstring = CString("overflow_flag")
-        cnd = self.llvm.BuildLoad(self.builder, self.cpu.llvm_bool_type,
-                                  self.overflow, cstring.ptr)
-        cstring = CString("overflow_flag_flipped")
-        cnd_flipped = self.llvm.BuildXor(self.builder, cnd, self.true,
-                                         cstring.ptr)
-        branch = self.llvm.BuildCondBr(self.builder, cnd_flipped, resume,
-                                       self.bailout)
-        self.descr_guards[op.getdescr()] = (branch, op, cnd_flipped, resume)
-        self.llvm.PositionBuilderAtEnd(self.builder, resume)
+        self.guard_branch(self.overflow_flag, resume, exit_on=True)
 
     def parse_guard_overflow(self, op, resume):
-        cstring = CString("overflow_flag")
-        cnd = self.llvm.BuildLoad(self.builder, self.cpu.llvm_bool_type,
-                                  self.overflow, cstring.ptr)
-        branch = self.llvm.BuildCondBr(self.builder, cnd, resume, self.bailout)
-        self.descr_guards[op.getdescr()] = (branch, op, cnd, resume)
+        self.guard_branch(self.overflow_flag, resume)
+
+    def load_word_at(self, addr, offset, llvm_type, name):
+        """Load of llvm_type at offset from addr, an i8* or a word"""
+        if (rffi.cast(lltype.Signed, self.llvm.TypeOf(addr)) ==
+                rffi.cast(lltype.Signed, self.cpu.llvm_int_type)):
+            cstring = self.cpu.value_name("addr")
+            addr = self.llvm.BuildIntToPtr(self.builder, addr,
+                                           self.cpu.llvm_void_ptr, cstring.ptr)
+        cstring = self.cpu.value_name(name+"_addr")
+        ptr = self.llvm.BuildGEP1D(self.builder, self.cpu.llvm_char_type,
+                                   addr, self.cpu.const_word(offset),
+                                   cstring.ptr)
+        ptr_type = self.llvm.PointerType(llvm_type, 0)
+        cstring = self.cpu.value_name(name+"_ptr")
+        ptr = self.llvm.BuildBitCast(self.builder, ptr, ptr_type, cstring.ptr)
+        cstring = self.cpu.value_name(name)
+        return self.llvm.BuildLoad(self.builder, llvm_type, ptr, cstring.ptr)
+
+    def load_typeid(self, obj):
+        """
+        Typeid of a gc object, the half word of its header at offset 0 on
+        little endian machines, as a word.
+        """
+        typeid = self.load_word_at(obj, 0, self.cpu.llvm_indx_type, "typeid")
+        cstring = self.cpu.value_name("typeid_word")
+        return self.llvm.BuildZExt(self.builder, typeid,
+                                   self.cpu.llvm_int_type, cstring.ptr)
+
+    def typeinfo_addr(self, typeid):
+        """Address of the entry of the gc's typeinfo table for typeid"""
+        base_type_info, shift_by, sizeof_ti = (
+            self.cpu.gc_ll_descr.get_translated_info_for_typeinfo())
+        cstring = self.cpu.value_name("typeinfo_ofs")
+        offset = self.llvm.BuildLShl(self.builder, typeid,
+                                     self.cpu.const_word(shift_by),
+                                     cstring.ptr)
+        cstring = self.cpu.value_name("typeinfo")
+        return self.llvm.BuildAdd(self.builder, self.address(base_type_info),
+                                  offset, cstring.ptr)
+
+    def class_check(self, obj, classptr):
+        """
+        I1 of whether obj is an instance of exactly classptr. Without a
+        vtable field in objects, classes are told apart by typeid.
+        """
+        offset = self.cpu.vtable_offset
+        cstring = self.cpu.value_name("is_class")
+        if offset is not None:
+            vtable = self.load_word_at(obj, offset, self.cpu.llvm_int_type,
+                                       "vtable")
+            return self.llvm.BuildICmp(self.builder, self.inteq, vtable,
+                                       self.address(classptr), cstring.ptr)
+        expected_typeid = (self.cpu.gc_ll_descr.
+                           get_typeid_from_classptr_if_gcremovetypeptr(classptr))
+        return self.typeid_check(obj, expected_typeid)
+
+    def typeid_check(self, obj, expected_typeid):
+        assert self.cpu.supports_guard_gc_type
+        typeid = self.load_word_at(obj, 0, self.cpu.llvm_indx_type, "typeid")
+        expected = self.llvm.ConstInt(self.cpu.llvm_indx_type,
+                                      expected_typeid, 0)
+        cstring = self.cpu.value_name("is_type")
+        return self.llvm.BuildICmp(self.builder, self.inteq, typeid, expected,
+                                   cstring.ptr)
+
+    def parse_guard_class(self, op, resume):
+        obj = self._parse_args([op.getarg(0)])[0][0]
+        cnd = self.class_check(obj, op.getarg(1).getint())
+        self.guard_branch(cnd, resume)
+
+    def parse_guard_nonnull_class(self, op, resume):
+        obj = self._parse_args([op.getarg(0)])[0][0]
+        cstring = self.cpu.value_name("nonnull")
+        nonnull = self.llvm.BuildIsNotNull(self.builder, obj, cstring.ptr)
+        cstring = CString("check_class")
+        check_class = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                                 cstring.ptr)
+        self.guard_branch(nonnull, check_class)
+        cnd = self.class_check(obj, op.getarg(1).getint())
+        self.guard_branch(cnd, resume)
+
+    def parse_guard_gc_type(self, op, resume):
+        obj = self._parse_args([op.getarg(0)])[0][0]
+        cnd = self.typeid_check(obj, op.getarg(1).getint())
+        self.guard_branch(cnd, resume)
+
+    def parse_guard_is_object(self, op, resume):
+        assert self.cpu.supports_guard_gc_type
+        obj = self._parse_args([op.getarg(0)])[0][0]
+        infobits_offset, is_object_flag = (
+            self.cpu.gc_ll_descr.get_translated_info_for_guard_is_object())
+        typeinfo = self.typeinfo_addr(self.load_typeid(obj))
+        infobits = self.load_word_at(typeinfo, infobits_offset,
+                                     self.cpu.llvm_char_type, "infobits")
+        flag = self.llvm.ConstInt(self.cpu.llvm_char_type, is_object_flag, 0)
+        cstring = self.cpu.value_name("is_object")
+        is_object = self.llvm.BuildAnd(self.builder, infobits, flag,
+                                       cstring.ptr)
+        cnd = self.llvm.BuildIsNotNull(self.builder, is_object, cstring.ptr)
+        self.guard_branch(cnd, resume)
+
+    def parse_guard_subclass(self, op, resume):
+        """
+        Classes are numbered so that the subclasses of a class are those
+        whose subclassrange_min falls in its [min, max) range.
+        """
+        assert self.cpu.supports_guard_gc_type
+        obj = self._parse_args([op.getarg(0)])[0][0]
+        offset = self.cpu.vtable_offset
+        offset2 = self.cpu.subclassrange_min_offset
+        if offset is not None:
+            vtable = self.load_word_at(obj, offset, self.cpu.llvm_int_type,
+                                       "vtable")
+            subclass_min = self.load_word_at(vtable, offset2,
+                                             self.cpu.llvm_int_type,
+                                             "subclassrange_min")
+        else:
+            _, _, sizeof_ti = (
+                self.cpu.gc_ll_descr.get_translated_info_for_typeinfo())
+            typeinfo = self.typeinfo_addr(self.load_typeid(obj))
+            subclass_min = self.load_word_at(typeinfo, sizeof_ti + offset2,
+                                             self.cpu.llvm_int_type,
+                                             "subclassrange_min")
+        vtable_ptr = rffi.cast(rclass.CLASSTYPE, op.getarg(1).getint())
+        check_min = vtable_ptr.subclassrange_min
+        check_max = vtable_ptr.subclassrange_max
+        cstring = self.cpu.value_name("subclass_ofs")
+        diff = self.llvm.BuildSub(self.builder, subclass_min,
+                                  self.cpu.const_word(check_min), cstring.ptr)
+        cstring = self.cpu.value_name("is_subclass")
+        cnd = self.llvm.BuildICmp(self.builder, self.intult, diff,
+                                  self.cpu.const_word(check_max - check_min),
+                                  cstring.ptr)
+        self.guard_branch(cnd, resume)
+
+    def parse_guard_no_exception(self, op, resume):
+        exc_class = self.load_exception_class()
+        cstring = self.cpu.value_name("no_exception")
+        cnd = self.llvm.BuildICmp(self.builder, self.inteq, exc_class,
+                                  self.zero, cstring.ptr)
+        self.guard_branch(cnd, resume)
+
+    def parse_guard_exception(self, op, resume):
+        exc_class = self.load_exception_class()
+        cstring = self.cpu.value_name("exception_matches")
+        cnd = self.llvm.BuildICmp(self.builder, self.inteq, exc_class,
+                                  self._get_word(op.getarg(0)), cstring.ptr)
+        self.guard_branch(cnd, resume)
+        exc_value = self.take_exception()
+        cstring = self.cpu.value_name("exc_value")
+        self.ssa_vars[op] = self.llvm.BuildIntToPtr(self.builder, exc_value,
+                                                    self.cpu.llvm_void_ptr,
+                                                    cstring.ptr)
+
+    def parse_guard_not_invalidated(self, op, resume):
+        """
+        Rather than patching code, invalidate_loop sets a word every guard
+        of the trace checks, so the check is one load LICM can hoist out of
+        loops with no calls, which can't invalidate anything.
+        """
+        if self.invalidation_flag == 0:
+            self.invalidation_flag = self.cpu.allocate_raw_word()
+        cstring = self.cpu.value_name("invalidated")
+        flag = self.llvm.BuildLoad(self.builder, self.cpu.llvm_int_type,
+                                   self._raw_ptr(self.invalidation_flag),
+                                   cstring.ptr)
+        cstring = self.cpu.value_name("valid")
+        cnd = self.llvm.BuildICmp(self.builder, self.inteq, flag, self.zero,
+                                  cstring.ptr)
+        self.guard_branch(cnd, resume)
+
+    def parse_guard_not_forced(self, op, resume):
+        """The frame was forced during the call if jf_descr got set"""
+        cstring = self.cpu.value_name("not_forced")
+        cnd = self.llvm.BuildICmp(self.builder, self.inteq,
+                                  self.jitframe.get_elem(1), self.zero,
+                                  cstring.ptr)
+        self.guard_branch(cnd, resume)
+
+    def parse_guard_not_forced_2(self, op, resume):
+        """
+        Comes right before a finish, which leaves the frame to be forced
+        later, so it never fails itself, only its failargs and descr are
+        stored. They go above slot 0, which the finish writes.
+        """
+        self.llvm.BuildBr(self.builder, resume)
         self.llvm.PositionBuilderAtEnd(self.builder, resume)
+        descr = op.getdescr()
+        num_slots = self.cpu.set_failarg_locs(descr, op.getfailargs(), 1)
+        self.store_force_descr(descr)
+        self.store_frame_args(self.failarg_values(op), 2)
+        self.frame_depth = max(self.frame_depth, 1+num_slots)
+        self.finish_gcmap = [1+c for c, arg in enumerate(self.live_failargs(op))
+                             if arg.type == 'r']
 
     def parse_int_add(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("int_add_res")
+        cstring = self.cpu.value_name("int_add_res")
         self.ssa_vars[op] = self.llvm.BuildAdd(self.builder, lhs, rhs,
                                                cstring.ptr)
 
     def parse_int_sub(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("int_sub_res")
+        cstring = self.cpu.value_name("int_sub_res")
         self.ssa_vars[op] = self.llvm.BuildSub(self.builder, lhs, rhs,
                                                cstring.ptr)
 
     def parse_int_mul(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("int_mul_res")
+        cstring = self.cpu.value_name("int_mul_res")
         self.ssa_vars[op] = self.llvm.BuildMul(self.builder, lhs, rhs,
                                                cstring.ptr)
 
@@ -729,369 +972,1173 @@ class LLVMOpDispatcher:
         of this, but note that it differs slightly as this version was changed
         to match the output of clang at O3
         """
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        shift = self.llvm.ConstInt(self.cpu.llvm_int_type,
-                                   self.cpu.WORD/2, 0)
+        shift = self.cpu.const_word(self.cpu.WORD/2)
         mask_tmp = (1 << self.cpu.WORD/2) - 1
-        mask = self.llvm.ConstInt(self.cpu.llvm_int_type,
-                                  mask_tmp, 0)
+        mask = self.cpu.const_word(mask_tmp)
 
-        cstring = CString("a_high")
+        cstring = self.cpu.value_name("a_high")
         a_high = self.llvm.BuildURShl(self.builder, lhs, shift, cstring.ptr)
-        cstring = CString("a_low")
+        cstring = self.cpu.value_name("a_low")
         a_low = self.llvm.BuildAnd(self.builder, lhs, mask, cstring.ptr)
-        cstring = CString("b_high")
+        cstring = self.cpu.value_name("b_high")
         b_high = self.llvm.BuildURShl(self.builder, rhs, shift, cstring.ptr)
-        cstring = CString("b_low")
+        cstring = self.cpu.value_name("b_low")
         b_low = self.llvm.BuildAnd(self.builder, rhs, mask, cstring.ptr)
 
-        cstring = CString("res_low_low")
+        cstring = self.cpu.value_name("res_low_low")
         res_low_low = self.llvm.BuildNUWMul(self.builder, a_low, b_low,
                                             cstring.ptr)
-        cstring = CString("res_low_high")
+        cstring = self.cpu.value_name("res_low_high")
         res_low_high = self.llvm.BuildNUWMul(self.builder, a_low, b_high,
                                              cstring.ptr)
-        cstring = CString("res_high_low")
+        cstring = self.cpu.value_name("res_high_low")
         res_high_low = self.llvm.BuildNUWMul(self.builder, a_high, b_low,
                                           cstring.ptr)
-        cstring = CString("res_high_high")
+        cstring = self.cpu.value_name("res_high_high")
         res_high_high = self.llvm.BuildMul(self.builder, a_high, b_high,
                                            cstring.ptr)
 
-        cstring = CString("res")
+        cstring = self.cpu.value_name("res")
         res_1 = self.llvm.BuildURShl(self.builder, res_low_low, shift,
                                      cstring.ptr)
         res_2 = self.llvm.BuildAdd(self.builder, res_low_high, res_high_low,
                                    cstring.ptr)
         res_3 = self.llvm.BuildAdd(self.builder, res_2, res_1, cstring.ptr)
 
-        cstring = CString("cmp")
+        cstring = self.cpu.value_name("cmp")
         cnd = self.llvm.BuildICmp(self.builder, self.intugt, res_3, res_1,
                                   cstring.ptr)
-        sixteen = self.llvm.ConstInt(self.cpu.llvm_int_type, 16, 0)
-        cstring = CString("borrow")
+        sixteen = self.cpu.const_word(16)
+        cstring = self.cpu.value_name("borrow")
         borrow = self.llvm.BuildSelect(self.builder, cnd, self.zero, sixteen,
                                          cstring.ptr)
-        cstring = CString("res")
+        cstring = self.cpu.value_name("res")
         res_4 = self.llvm.BuildURShl(self.builder, res_3, shift, cstring.ptr)
         res_5 = self.llvm.BuildAdd(self.builder, res_4, res_high_high, cstring.ptr)
-        cstring = CString("uint_mul_high_res")
+        cstring = self.cpu.value_name("uint_mul_high_res")
         self.ssa_vars[op] = self.llvm.BuildAdd(self.builder, res_5,
                                                 borrow, cstring.ptr)
 
     def parse_int_and(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("int_and_res")
+        cstring = self.cpu.value_name("int_and_res")
         self.ssa_vars[op] = self.llvm.BuildAnd(self.builder, lhs, rhs,
                                                cstring.ptr)
 
     def parse_int_or(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("int_or_res")
+        cstring = self.cpu.value_name("int_or_res")
         self.ssa_vars[op] = self.llvm.BuildOr(self.builder, lhs, rhs,
                                               cstring.ptr)
 
     def parse_int_xor(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("int_xor_res")
+        cstring = self.cpu.value_name("int_xor_res")
         self.ssa_vars[op] = self.llvm.BuildXor(self.builder, lhs, rhs,
                                                cstring.ptr)
 
     def parse_int_rshift(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("int_rshift_res")
+        cstring = self.cpu.value_name("int_rshift_res")
         self.ssa_vars[op] = self.llvm.BuildRShl(self.builder, lhs, rhs,
                                                 cstring.ptr)
 
     def parse_int_lshift(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("int_lshift_res")
+        cstring = self.cpu.value_name("int_lshift_res")
         self.ssa_vars[op] = self.llvm.BuildLShl(self.builder, lhs, rhs,
                                                 cstring.ptr)
 
     def parse_uint_rshift(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("uint_rshift_res")
+        cstring = self.cpu.value_name("uint_rshift_res")
         self.ssa_vars[op] = self.llvm.BuildURShl(self.builder, lhs, rhs,
                                                  cstring.ptr)
 
-    def parse_int_sext(self, op): #TODO: look into what pypy is passing, likely not a type
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+    def parse_int_signext(self, op): #TODO: look into what pypy is passing, likely not a type
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("int_sext_res")
+        cstring = self.cpu.value_name("int_sext_res")
         self.ssa_vars[op] = self.llvm.BuildSExt(self.builder, lhs, rhs,
                                                 cstring.ptr)
 
     def parse_float_add(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("float_add_res")
+        cstring = self.cpu.value_name("float_add_res")
         self.ssa_vars[op] = self.llvm.BuildFAdd(self.builder, lhs, rhs,
                                                 cstring.ptr)
 
     def parse_float_sub(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("float_sub_res")
+        cstring = self.cpu.value_name("float_sub_res")
         self.ssa_vars[op] = self.llvm.BuildFSub(self.builder, lhs, rhs,
                                                 cstring.ptr)
 
     def parse_float_mul(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("float_mul_res")
+        cstring = self.cpu.value_name("float_mul_res")
         self.ssa_vars[op] = self.llvm.BuildFMul(self.builder, lhs, rhs,
                                                 cstring.ptr)
 
-    def parse_float_div(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+    def parse_float_truediv(self, op):
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("float_div_res")
+        cstring = self.cpu.value_name("float_div_res")
         self.ssa_vars[op] = self.llvm.BuildFDiv(self.builder, lhs, rhs,
                                                 cstring.ptr)
 
     def parse_float_neg(self, op):
-        arg = self.parse_args(op.getarglist())[0][0]
-        cstring = CString("float_neg_res")
+        arg = self._parse_args(op.getarglist())[0][0]
+        cstring = self.cpu.value_name("float_neg_res")
         self.ssa_vars[op] = self.llvm.BuildFNeg(self.builder, arg, cstring.ptr)
 
     def parse_float_abs(self, op):
-        arg = self.parse_args(op.getarglist())[0][0]
-        arg_array_type = rffi.CArray(self.llvm.ValueRef)
-        arg_array = lltype.malloc(arg_array_type, n=1, flavor='raw')
-        arg_array.__setitem__(0, arg)
-        cstring = CString("float_abs_res")
-        self.ssa_vars[op] = self.llvm.BuildCall(self.builder,
-                                                self.fabs_intrinsic,
+        arg = self._parse_args(op.getarglist())[0][0]
+        arg_array = self.cpu.value_scratch.fill([arg])
+        cstring = self.cpu.value_name("float_abs_res")
+        fabs = self.intrinsic("llvm.fabs.f64", [self.cpu.llvm_float_type],
+                              self.cpu.llvm_float_type)
+        self.ssa_vars[op] = self.llvm.BuildCall(self.builder, fabs,
                                                 arg_array, 1, cstring.ptr)
-        lltype.free(arg_array, flavor='raw')
 
-    def parse_float_to_int(self, op):
-        arg = self.parse_args(op.getarglist())[0][0]
-        cstring = CString("float_to_int_res")
+    def parse_cast_float_to_int(self, op):
+        arg = self._parse_args(op.getarglist())[0][0]
+        cstring = self.cpu.value_name("float_to_int_res")
         self.ssa_vars[op] = self.llvm.BuildBitCast(self.builder, arg,
                                                    self.cpu.llvm_int_type,
                                                    cstring.ptr)
 
-    def parse_int_to_float(self, op):
-        arg = self.parse_args(op.getarglist())[0]
-        cstring = CString("int_to_float_res")
+    def parse_cast_int_to_float(self, op):
+        arg = self._parse_args(op.getarglist())[0]
+        cstring = self.cpu.value_name("int_to_float_res")
         self.ssa_vars[op] = self.llvm.BuildBitCast(self.builder, arg,
                                                    self.cpu.llvm_float_type,
                                                    cstring.ptr)
 
-    def parse_float_to_single_float(self, op):
-        arg = self.parse_args(op.getarglist())[0]
-        cstring = CString("float_to_single_float_res")
+    def parse_cast_float_to_singlefloat(self, op):
+        arg = self._parse_args(op.getarglist())[0]
+        cstring = self.cpu.value_name("float_to_single_float_res")
         self.ssa_vars[op] = self.llvm.BuildBitCast(self.builder, arg,
                                                    self.cpu.llvm_single_float_type,
                                                    cstring.ptr)
 
-    def parse_single_float_to_float(self, op):
-        arg = self.parse_args(op.getarglist())[0]
-        cstring = CString("single_float_to_res")
+    def parse_cast_singlefloat_to_float(self, op):
+        arg = self._parse_args(op.getarglist())[0]
+        cstring = self.cpu.value_name("single_float_to_res")
         self.ssa_vars[op] = self.llvm.BuildBitCast(self.builder, arg,
                                                    self.cpu.llvm_float_type,
                                                    cstring.ptr)
 
-    def parse_int_cmp(self, op, pred):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+    def _parse_int_cmp(self, op, pred):
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("int_cmp_res")
+        cstring = self.cpu.value_name("int_cmp_res")
         self.ssa_vars[op] = self.llvm.BuildICmp(self.builder, pred, lhs, rhs,
                                                 cstring.ptr)
 
 
-    def parse_float_cmp(self, op, pred):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+    def _parse_float_cmp(self, op, pred):
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("float_cmp_res")
+        cstring = self.cpu.value_name("float_cmp_res")
         self.ssa_vars[op] = self.llvm.BuildFCmp(self.builder, pred, lhs, rhs,
                                                 cstring.ptr)
 
+    def _int_cmpop(pred_name):
+        def parse_cmp(self, op):
+            self._parse_int_cmp(op, getattr(self, pred_name))
+        return parse_cmp
+
+    def _float_cmpop(pred_name):
+        def parse_cmp(self, op):
+            self._parse_float_cmp(op, getattr(self, pred_name))
+        return parse_cmp
+
+    parse_int_lt = _int_cmpop('intslt')
+    parse_int_le = _int_cmpop('intsle')
+    parse_int_eq = _int_cmpop('inteq')
+    parse_int_ne = _int_cmpop('intne')
+    parse_int_gt = _int_cmpop('intsgt')
+    parse_int_ge = _int_cmpop('intsge')
+    parse_uint_lt = _int_cmpop('intult')
+    parse_uint_le = _int_cmpop('intule')
+    parse_uint_gt = _int_cmpop('intugt')
+    parse_uint_ge = _int_cmpop('intuge')
+    parse_float_lt = _float_cmpop('reallt')
+    parse_float_le = _float_cmpop('realle')
+    parse_float_eq = _float_cmpop('realeq')
+    parse_float_ne = _float_cmpop('realne')
+    parse_float_gt = _float_cmpop('realgt')
+    parse_float_ge = _float_cmpop('realge')
+
     def parse_int_is_zero(self, op):
-        arg = self.parse_args(op.getarglist())[0][0]
-        cstring = CString("int_is_zero_res")
+        arg = self._parse_args(op.getarglist())[0][0]
+        cstring = self.cpu.value_name("int_is_zero_res")
         pred = self.inteq
         self.ssa_vars[op] = self.llvm.BuildICmp(self.builder, pred, arg,
                                                 self.zero, cstring.ptr)
 
     def parse_int_is_true(self, op):
-        arg = self.parse_args(op.getarglist())[0][0]
-        cstring = CString("int_is_true_res")
+        arg = self._parse_args(op.getarglist())[0][0]
+        cstring = self.cpu.value_name("int_is_true_res")
         pred = self.intne
         self.ssa_vars[op] = self.llvm.BuildICmp(self.builder, pred, arg,
                                                 self.zero, cstring.ptr)
 
     def parse_int_neg(self, op):
-        arg = self.parse_args(op.getarglist())[0][0]
-        cstring = CString("int_neg_res")
+        arg = self._parse_args(op.getarglist())[0][0]
+        cstring = self.cpu.value_name("int_neg_res")
         self.ssa_vars[op] = self.llvm.BuildNeg(self.builder, arg, cstring.ptr)
 
     def parse_int_invert(self, op):
-        arg = self.parse_args(op.getarglist())[0][0]
-        negative_one = self.llvm.ConstInt(self.cpu.llvm_int_type, -1, 1)
-        cstring = CString("int_invert_res")
+        arg = self._parse_args(op.getarglist())[0][0]
+        negative_one = self.cpu.const_word(-1)
+        cstring = self.cpu.value_name("int_invert_res")
         self.ssa_vars[op] = self.llvm.BuildXor(self.builder, arg, negative_one,
                                                cstring.ptr)
 
     def parse_int_force_ge_zero(self, op):
-        arg = self.parse_args(op.getarglist())[0][0]
-        cstring = CString("int_force_ge_zero_cmp")
+        arg = self._parse_args(op.getarglist())[0][0]
+        cstring = self.cpu.value_name("int_force_ge_zero_cmp")
         cmp = self.llvm.BuildICmp(self.builder, self.intsle, arg, self.zero,
                                   cstring.ptr)
-        cstring = CString("int_force_ge_zero_res")
+        cstring = self.cpu.value_name("int_force_ge_zero_res")
         self.ssa_vars[op] = self.llvm.BuildSelect(self.builder, cmp,
                                                   self.zero, arg, cstring.ptr)
 
-    def parse_ptr_to_int(self, op):
+    def parse_cast_ptr_to_int(self, op):
         arg = op.getarglist()[0]
         if arg.is_constant():
-            self.ssa_vars[op] = self.llvm.ConstInt(self.cpu.llvm_int_type,
-                                                   arg.getvalue(), 0)
+            self.ssa_vars[op] = self.cpu.const_word(arg.getvalue())
         else:
-            cstring = CString("pre_to_int_res")
+            cstring = self.cpu.value_name("pre_to_int_res")
             self.ssa_vars[op] = self.llvm.BuildPtrToInt(self.builder,
                                                         self.ssa_vars[arg],
                                                         self.cpu.llvm_int_type,
                                                         cstring.ptr)
 
-    def parse_int_to_ptr(self, op):
-        arg = self.parse_args(op.getarglist())[0][0]
-        cstring = CString("int_to_ptr_res")
+    def parse_cast_int_to_ptr(self, op):
+        arg = self._parse_args(op.getarglist())[0][0]
+        cstring = self.cpu.value_name("int_to_ptr_res")
         self.ssa_vars[op] = self.llvm.BuildIntToPtr(self.builder, arg,
                                                     self.cpu.llvm_void_ptr,
                                                     cstring.ptr)
 
     def parse_ptr_eq(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("ptr_eq_res_diff")
+        cstring = self.cpu.value_name("ptr_eq_res_diff")
         res = self.llvm.BuildPtrDiff(self.builder, lhs, rhs, cstring.ptr)
-        cstring = CString("ptr_eq_res")
+        cstring = self.cpu.value_name("ptr_eq_res")
         self.ssa_vars[op] = self.llvm.BuildICmp(self.builder, self.inteq,
                                                 res, self.zero, cstring.ptr)
 
     def parse_ptr_ne(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
-        cstring = CString("ptr_ne_res_diff")
+        cstring = self.cpu.value_name("ptr_ne_res_diff")
         res = self.llvm.BuildPtrDiff(self.builder, lhs, rhs, cstring.ptr)
-        cstring = CString("ptr_ne_res")
+        cstring = self.cpu.value_name("ptr_ne_res")
         self.ssa_vars[op] = self.llvm.BuildICmp(self.builder, self.intne,
                                                 res, self.zero, cstring.ptr)
 
-    def parse_new(self, op):
-        descr = op.getdescr()
-        ptr = self.cpu.bh_new(descr)._cast_to_int()
-        llvm_ptr = self.llvm.ConstInt(self.cpu.llvm_int_type, ptr, 0)
-        cstring = CString("new_res")
-        self.ssa_vars[op] = self.llvm.BuildIntToPtr(self.builder, llvm_ptr,
-                                                    self.cpu.llvm_void_ptr,
-                                                    cstring.ptr)
+    parse_instance_ptr_eq = parse_ptr_eq
+    parse_instance_ptr_ne = parse_ptr_ne
 
-    def parse_new_with_vtable(self, op):
-        descr = op.getdescr()
-        ptr = self.cpu.bh_new_with_vtable(descr)._cast_to_int()
-        llvm_ptr = self.llvm.ConstInt(self.cpu.llvm_int_type, ptr, 0)
-        cstring = CString("new_res")
-        self.ssa_vars[op] = self.llvm.BuildIntToPtr(self.builder, llvm_ptr,
+    def find_last_uses(self, ops):
+        for index, op in enumerate(ops):
+            for arg in op.getarglist():
+                if not arg.is_constant():
+                    self.last_uses[arg] = index
+            if op.is_guard():
+                for arg in op.getfailargs():
+                    if arg is not None:
+                        self.last_uses[arg] = index
+
+    def address(self, addr):
+        """
+        i64 llvm value for an address only valid in this process. With the
+        object cache on it's loaded from the module's relocation table,
+        rather than baked into the code, so the object code can be reused
+        by processes where the address is different.
+        """
+        if not self.relocate:
+            return self.cpu.const_word(addr)
+        return self.load_relocation(self.reloc_index(addr))
+
+    def bailout_address(self, addr):
+        """
+        Value for a bailout phi, the bailout block turns it into the address
+        with bailout_value, so guards don't pay for the relocation table load.
+        """
+        if not self.relocate:
+            return self.cpu.const_word(addr)
+        return self.reloc_index(addr)
+
+    def bailout_value(self, phi):
+        if not self.relocate:
+            return phi
+        return self.load_relocation(phi)
+
+    def reloc_index(self, addr):
+        try:
+            index = self.reloc_indices[addr]
+        except KeyError:
+            index = len(self.relocations)
+            self.relocations.append(addr)
+            self.reloc_indices[addr] = index
+        return self.cpu.const_word(index)
+
+    def load_relocation(self, index):
+        if self.reloc_table is None:
+            cstring = CString(RELOC_TABLE)
+            self.reloc_table = self.llvm.AddGlobal(self.module,
+                                                   self.cpu.llvm_int_type,
+                                                   cstring.ptr) #external, defined when the module is loaded
+        cstring = self.cpu.value_name("reloc_ptr")
+        ptr = self.llvm.BuildGEP1D(self.builder, self.cpu.llvm_int_type,
+                                   self.reloc_table, index, cstring.ptr)
+        cstring = self.cpu.value_name("reloc")
+        return self.llvm.BuildLoad(self.builder, self.cpu.llvm_int_type, ptr,
+                                   cstring.ptr)
+
+    def name_reloc_table(self, key):
+        """
+        Called once the module's been hashed, gives the relocation table a
+        symbol unique to this module's code. Returns the symbol, or None
+        if the module doesn't use one.
+        """
+        if self.reloc_table is None:
+            return None
+        name = "reloc_" + key
+        cstring = CString(name)
+        self.llvm.SetValueName(self.reloc_table, cstring.ptr, len(name))
+        return name
+
+    def _raw_ptr(self, addr):
+        """i64* to a fixed raw address, e.g. the nursery's free pointer"""
+        addr_llvm = self.address(addr)
+        cstring = self.cpu.value_name("raw_ptr")
+        return self.llvm.BuildIntToPtr(self.builder, addr_llvm,
+                                       self.cpu.llvm_int_ptr, cstring.ptr)
+
+    def _word_ptr(self, addr):
+        """i64* to an address held in an llvm value"""
+        cstring = self.cpu.value_name("word_ptr")
+        return self.llvm.BuildIntToPtr(self.builder, addr,
+                                       self.cpu.llvm_int_ptr, cstring.ptr)
+
+    def _shadowstack_top(self):
+        gcrootmap = self.cpu.gc_ll_descr.gcrootmap
+        rst_ptr = self._raw_ptr(gcrootmap.get_root_stack_top_addr())
+        cstring = self.cpu.value_name("shadowstack_top")
+        rst = self.llvm.BuildLoad(self.builder, self.cpu.llvm_int_type,
+                                  rst_ptr, cstring.ptr)
+        return rst_ptr, rst
+
+    def push_frame(self, frame):
+        rst_ptr, rst = self._shadowstack_top()
+        one = self.cpu.const_word(1) #for the shadowstack's is_minor optimisation
+        self.llvm.BuildStore(self.builder, one, self._word_ptr(rst))
+        word = self.cpu.const_word(self.cpu.WORD)
+        cstring = self.cpu.value_name("frame_entry")
+        frame_entry = self.llvm.BuildAdd(self.builder, rst, word, cstring.ptr)
+        cstring = self.cpu.value_name("frame_addr")
+        frame_addr = self.llvm.BuildPtrToInt(self.builder, frame,
+                                             self.cpu.llvm_int_type,
+                                             cstring.ptr)
+        self.llvm.BuildStore(self.builder, frame_addr,
+                             self._word_ptr(frame_entry))
+        two_words = self.cpu.const_word(2*self.cpu.WORD)
+        cstring = self.cpu.value_name("new_shadowstack_top")
+        new_rst = self.llvm.BuildAdd(self.builder, rst, two_words, cstring.ptr)
+        self.llvm.BuildStore(self.builder, new_rst, rst_ptr)
+
+    def pop_frame(self):
+        rst_ptr, rst = self._shadowstack_top()
+        two_words = self.cpu.const_word(2*self.cpu.WORD)
+        cstring = self.cpu.value_name("new_shadowstack_top")
+        new_rst = self.llvm.BuildSub(self.builder, rst, two_words, cstring.ptr)
+        self.llvm.BuildStore(self.builder, new_rst, rst_ptr)
+
+    def reload_frame(self):
+        """
+        After anything that can collect the jitframe may have moved, the
+        shadowstack entry pushed by define_entry_function has its new address.
+        """
+        rst_ptr, rst = self._shadowstack_top()
+        word = self.cpu.const_word(self.cpu.WORD)
+        cstring = self.cpu.value_name("frame_entry")
+        frame_entry = self.llvm.BuildSub(self.builder, rst, word, cstring.ptr)
+        cstring = self.cpu.value_name("frame_addr")
+        frame_addr = self.llvm.BuildLoad(self.builder, self.cpu.llvm_int_type,
+                                         self._word_ptr(frame_entry),
+                                         cstring.ptr)
+        jitframe_ptr = self.llvm.PointerType(self.jitframe_type, 0)
+        cstring = self.cpu.value_name("frame")
+        frame = self.llvm.BuildIntToPtr(self.builder, frame_addr, jitframe_ptr,
+                                        cstring.ptr)
+        self.jitframe.set_struct(frame)
+        wbdescr = self.cpu.gc_ll_descr.write_barrier_descr
+        if wbdescr is not None: #we're about to write refs into it again
+            cstring = self.cpu.value_name("frame_obj")
+            obj = self.llvm.BuildBitCast(self.builder, frame,
+                                         self.cpu.llvm_void_ptr, cstring.ptr)
+            self.write_barrier(obj, wbdescr)
+
+    def store_gcmap(self, gcmap):
+        cstring = self.cpu.value_name("gcmap")
+        gcmap_ptr = self.llvm.BuildIntToPtr(self.builder, gcmap,
+                                            self.cpu.llvm_void_ptr, cstring.ptr)
+        self.jitframe.set_elem(gcmap_ptr, 3)
+
+    def push_gcmap(self, positions):
+        gcmap = self.cpu.get_gcmap(positions)
+        self.store_gcmap(self.address(gcmap))
+
+    def pop_gcmap(self):
+        self.store_gcmap(self.zero)
+
+    def spill_live_refs(self, base=0):
+        """
+        LLVM keeps refs in registers the gc knows nothing about, so before
+        anything that can collect, the ones still needed afterwards go to
+        the lowest jitframe slots from base, where the gcmap tells the gc
+        to look. Returns the spilled boxes to pass to reload_live_refs.
+        """
+        if not self.gc_roots:
+            return []
+        self.live_refs = [box for box in self.live_refs
+                          if self.last_uses.get(box, -1) > self.op_index]
+        for c, box in enumerate(self.live_refs, base+1):
+            uncast = self.uncast(box, self.ssa_vars[box])
+            self.jitframe.set_elem(uncast, 7, c)
+        self.frame_depth = max(self.frame_depth, base+len(self.live_refs))
+        return self.live_refs
+
+    def reload_live_refs(self, spilled, base=0):
+        for c, box in enumerate(spilled, base+1):
+            arg_uncast = self.jitframe.get_elem(7, c)
+            self.ssa_vars[box] = self.cast_arg(box, arg_uncast)
+
+    def enter_collecting_call(self, spilled):
+        if self.gc_roots:
+            self.push_gcmap(range(len(spilled)))
+
+    def leave_collecting_call(self):
+        if self.gc_roots:
+            self.reload_frame()
+            self.pop_gcmap()
+
+    def can_collect(self, calldescr):
+        if not self.gc_roots:
+            return False
+        effectinfo = calldescr.get_extra_info()
+        return effectinfo is None or effectinfo.check_can_collect()
+
+    def get_propagate_exception_block(self):
+        """
+        Shared exit for allocations that failed with a MemoryError, the
+        equivalent of the other backends' propagate exception path.
+        """
+        if self.propagate_block is not None:
+            return self.propagate_block
+        current_block = self.llvm.GetInsertBlock(self.builder)
+        cstring = CString("propagate_exception")
+        self.propagate_block = self.llvm.AppendBasicBlock(self.cpu.context,
+                                                          self.func,
+                                                          cstring.ptr)
+        self.llvm.PositionBuilderAtEnd(self.builder, self.propagate_block)
+        self.store_and_reset_exception()
+        descr = self.address(
+                    compute_unique_id(self.cpu.propagate_exception_descr))
+        self.jitframe.set_elem(descr, 1)
+        self.llvm.BuildRet(self.builder, self.jitframe.get_struct())
+        self.llvm.PositionBuilderAtEnd(self.builder, current_block)
+        return self.propagate_block
+
+    def take_exception(self):
+        """Value of the pending exception, as a word, leaving none pending"""
+        exc_value_ptr = self._raw_ptr(self.cpu.pos_exc_value())
+        cstring = self.cpu.value_name("exc_value")
+        exc_value = self.llvm.BuildLoad(self.builder, self.cpu.llvm_int_type,
+                                        exc_value_ptr, cstring.ptr)
+        self.llvm.BuildStore(self.builder, self.zero, exc_value_ptr)
+        self.llvm.BuildStore(self.builder, self.zero,
+                             self._raw_ptr(self.cpu.pos_exception()))
+        return exc_value
+
+    def store_and_reset_exception(self):
+        """
+        Move the pending exception to jf_guard_exc, where the metainterp
+        looks for it when the guard being exited from was about exceptions.
+        """
+        exc_value = self.take_exception()
+        cstring = self.cpu.value_name("guard_exc")
+        guard_exc = self.llvm.BuildIntToPtr(self.builder, exc_value,
+                                            self.cpu.llvm_void_ptr, cstring.ptr)
+        self.jitframe.set_elem(guard_exc, 5)
+
+    def load_exception_class(self):
+        cstring = self.cpu.value_name("exc_class")
+        return self.llvm.BuildLoad(self.builder, self.cpu.llvm_int_type,
+                                   self._raw_ptr(self.cpu.pos_exception()),
+                                   cstring.ptr)
+
+    def parse_save_exc_class(self, op):
+        self.ssa_vars[op] = self.load_exception_class()
+
+    def parse_save_exception(self, op):
+        exc_value = self.take_exception()
+        cstring = self.cpu.value_name("exc_value")
+        self.ssa_vars[op] = self.llvm.BuildIntToPtr(self.builder, exc_value,
                                                     self.cpu.llvm_void_ptr,
                                                     cstring.ptr)
 
-    def parse_new_array(self, op): #FIXME
-        num_elem = self.parse_args(op.getarglist())[0][0]
-        func = self.cpu.gc_ll_descr.malloc_array
-        FPTR = self.cpu.gc_ll_descr.malloc_array_FUNCPTR
-        func_int = self.func_ptr_to_int(func, FPTR)
-        func_int_llvm = self.llvm.ConstInt(self.cpu.llvm_int_type, func_int, 0)
-        array_descr = op.getdescr()
-
-        basesize = array_descr.basesize
-        itemsize = array_descr.itemsize
-        ofs_length = 0 # assuming this is fine
-        basesize_llvm = self.llvm.ConstInt(self.cpu.llvm_int_type, basesize, 0)
-        itemsize_llvm = self.llvm.ConstInt(self.cpu.llvm_int_type, itemsize, 0)
-        ofs_length_llvm = self.llvm.ConstInt(self.cpu.llvm_int_type, ofs_length, 0)
-
-        # presumberly if we give more type information to llvm the optimiser
-        # works better
-        if array_descr.is_array_of_structs():
-            # can't represent structs specifically
-            ret_type = self.cpu.llvm_void_ptr
+    def parse_restore_exception(self, op):
+        exc_class = self._get_word(op.getarg(0))
+        exc_value_ref = self._parse_args([op.getarg(1)])[0][0]
+        cstring = self.cpu.value_name("exc_value")
+        exc_value = self.llvm.BuildPtrToInt(self.builder, exc_value_ref,
+                                            self.cpu.llvm_int_type, cstring.ptr)
+        self.llvm.BuildStore(self.builder, exc_value,
+                             self._raw_ptr(self.cpu.pos_exc_value()))
+        self.llvm.BuildStore(self.builder, exc_class,
+                             self._raw_ptr(self.cpu.pos_exception()))
+
+    def parse_check_memory_error(self, op):
+        res = self._parse_args(op.getarglist())[0][0]
+        cstring = self.cpu.value_name("memory_error")
+        failed = self.llvm.BuildIsNull(self.builder, res, cstring.ptr)
+        cstring = CString("allocated")
+        resume = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                            cstring.ptr)
+        self.llvm.BuildCondBr(self.builder, failed,
+                              self.get_propagate_exception_block(), resume)
+        self.llvm.PositionBuilderAtEnd(self.builder, resume)
+
+    def parse_load_from_gc_table(self, op):
+        index = op.getarg(0).getint()
+        table = self.address(self.gc_table_addr)
+        offset = self.cpu.const_word(index*self.cpu.WORD)
+        cstring = self.cpu.value_name("gc_table_entry")
+        entry = self.llvm.BuildAdd(self.builder, table, offset, cstring.ptr)
+        ptr = self._word_ptr(entry)
+        ptr_type = self.llvm.PointerType(self.cpu.llvm_void_ptr, 0)
+        cstring = self.cpu.value_name("gc_table_entry")
+        ptr = self.llvm.BuildBitCast(self.builder, ptr, ptr_type, cstring.ptr)
+        cstring = self.cpu.value_name("gcref")
+        self.ssa_vars[op] = self.llvm.BuildLoad(self.builder,
+                                                self.cpu.llvm_void_ptr, ptr,
+                                                cstring.ptr)
+
+    def _malloc_nursery(self, op, size, slowpath_addr, slowpath_args,
+                        tid=None, too_big=None):
+        """
+        Inline bump pointer allocation in the nursery. The slow path is a
+        call into the gc when the nursery is full (or the object is
+        too_big for it), which can collect.
+        """
+        gc_ll_descr = self.cpu.gc_ll_descr
+        spilled = self.spill_live_refs()
+        free_ptr = self._raw_ptr(gc_ll_descr.get_nursery_free_addr())
+        top_ptr = self._raw_ptr(gc_ll_descr.get_nursery_top_addr())
+        cstring = self.cpu.value_name("nursery_free")
+        free = self.llvm.BuildLoad(self.builder, self.cpu.llvm_int_type,
+                                   free_ptr, cstring.ptr)
+        cstring = self.cpu.value_name("new_nursery_free")
+        new_free = self.llvm.BuildAdd(self.builder, free, size, cstring.ptr)
+        cstring = self.cpu.value_name("nursery_top")
+        top = self.llvm.BuildLoad(self.builder, self.cpu.llvm_int_type,
+                                  top_ptr, cstring.ptr)
+        cstring = self.cpu.value_name("nursery_full")
+        full = self.llvm.BuildICmp(self.builder, self.intugt, new_free, top,
+                                   cstring.ptr)
+        if too_big is not None:
+            full = self.llvm.BuildOr(self.builder, full, too_big, cstring.ptr)
+        cstring = CString("malloc_fast")
+        fast_block = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                                cstring.ptr)
+        cstring = CString("malloc_slow")
+        slow_block = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                                cstring.ptr)
+        cstring = CString("malloc_done")
+        done_block = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                                cstring.ptr)
+        self.llvm.BuildCondBr(self.builder, full, slow_block, fast_block)
+
+        self.llvm.PositionBuilderAtEnd(self.builder, fast_block)
+        self.llvm.BuildStore(self.builder, new_free, free_ptr)
+        cstring = self.cpu.value_name("nursery_obj")
+        fast_res = self.llvm.BuildIntToPtr(self.builder, free,
+                                           self.cpu.llvm_void_ptr, cstring.ptr)
+        if tid is not None:
+            tid_llvm = self.cpu.const_word(tid)
+            self.llvm.BuildStore(self.builder, tid_llvm, self._word_ptr(free))
+        self.llvm.BuildBr(self.builder, done_block)
+
+        self.llvm.PositionBuilderAtEnd(self.builder, slow_block)
+        self.enter_collecting_call(spilled)
+        func = self.address(slowpath_addr)
+        arg_types = [self.cpu.llvm_int_type] * len(slowpath_args)
+        slow_res = self.call_function(func, self.cpu.llvm_void_ptr, arg_types,
+                                      slowpath_args, "malloc_res")
+        self.leave_collecting_call()
+        cstring = self.cpu.value_name("memory_error")
+        failed = self.llvm.BuildIsNull(self.builder, slow_res, cstring.ptr)
+        self.llvm.BuildCondBr(self.builder, failed,
+                              self.get_propagate_exception_block(), done_block)
+        slow_block = self.llvm.GetInsertBlock(self.builder)
+
+        self.llvm.PositionBuilderAtEnd(self.builder, done_block)
+        cstring = self.cpu.value_name("malloc_res")
+        res = self.llvm.BuildPhi(self.builder, self.cpu.llvm_void_ptr,
+                                 cstring.ptr)
+        self.llvm.AddIncoming(res, fast_res, fast_block)
+        self.llvm.AddIncoming(res, slow_res, slow_block)
+        self.reload_live_refs(spilled)
+        self.ssa_vars[op] = res
+
+    def parse_call_malloc_nursery(self, op):
+        size = op.getarg(0).getint()
+        size_llvm = self.cpu.const_word(size)
+        self._malloc_nursery(op, size_llvm,
+                             self.cpu.gc_ll_descr.get_malloc_slowpath_addr(),
+                             [size_llvm])
+
+    def parse_call_malloc_nursery_varsize_frame(self, op):
+        size = self._get_word(op.getarg(0))
+        self._malloc_nursery(op, size,
+                             self.cpu.gc_ll_descr.get_malloc_slowpath_addr(),
+                             [size])
+
+    def parse_call_malloc_nursery_varsize(self, op):
+        gc_ll_descr = self.cpu.gc_ll_descr
+        kind = op.getarg(0).getint()
+        itemsize = op.getarg(1).getint()
+        arraydescr = op.getdescr()
+        length = self._get_word(op.getarg(2))
+        maxlength = gc_ll_descr.max_size_of_young_obj - 2*self.cpu.WORD
+        maxlength_llvm = self.cpu.const_word(maxlength)
+        cstring = self.cpu.value_name("too_big")
+        too_big = self.llvm.BuildICmp(self.builder, self.intugt, length,
+                                      maxlength_llvm, cstring.ptr) #unsigned, so negative lengths go to the gc too
+        constsize = arraydescr.basesize + self.cpu.assembler.gc_size_of_header
+        force_realignment = (itemsize % self.cpu.WORD) != 0
+        if force_realignment:
+            constsize += self.cpu.WORD - 1
+        size = self._heap_offset(op.getarg(2), itemsize, constsize)
+        if force_realignment:
+            mask = self.cpu.const_word(~(self.cpu.WORD - 1))
+            cstring = self.cpu.value_name("aligned_size")
+            size = self.llvm.BuildAnd(self.builder, size, mask, cstring.ptr)
+        if kind == FLAG_ARRAY:
+            addr = gc_ll_descr.get_malloc_slowpath_array_addr()
+            args = [self.cpu.const_word(itemsize),
+                    self.cpu.const_word(arraydescr.tid),
+                    length]
+        elif kind == FLAG_STR:
+            addr = gc_ll_descr.get_malloc_fn_addr('malloc_str')
+            args = [length]
         else:
-            if array_descr.is_array_of_primitives():
-                if array_descr.is_array_of_floats():
-                    if itemsize == 8: elem_type = self.cpu.llvm_float_type
-                    elif itemsize == 4: elem_type = self.cpu.llvm_single_float_type
-                else:
-                    elem_type = self.llvm.IntType(self.cpu.context, itemsize*8)
-            else:
-                elem_type = self.cpu.llvm_void_ptr
-            ret_type = self.llvm.ArrayType(elem_type, num_elem)
-        arg_types = [self.cpu.llvm_int_type] * 4
-        args = [basesize_llvm, itemsize_llvm, num_elem, ofs_length_llvm]
-
-        self.ssa_vars[op] = self.call_function(func_int_llvm, ret_type,
-                                               arg_types, args, "new_array_res")
-
-
-    def parse_newstr(self, op):
-        length = self.parse_args(op.getarglist())[0][0]
-        arg_types = [lltype.Signed]
-        ret_type = llmemory.GCREF
-
-        func_int_ptr = self.get_func_ptr(self.cpu.bh_newstr, arg_types,
-                                         ret_type)
-        func_int_ptr_llvm = self.llvm.ConstInt(self.cpu.llvm_int_type,
-                                               func_int_ptr, 0)
-
-        str_type = self.llvm.ArrayType(self.cpu.llvm_char_type, length)
-        arg_types_llvm = [str_type]
-        ret_type_llvm = self.cpu.llvm_void_ptr
-        args = [length]
-        self.ssa_vars[op] = self.call_function(func_int_ptr_llvm, ret_type_llvm,
-                                               arg_types_llvm, args,
-                                               "newstr_res")
-
-    def parse_newunicode(self, op):
-        pass
+            addr = gc_ll_descr.get_malloc_fn_addr('malloc_unicode')
+            args = [length]
+        self._malloc_nursery(op, size, addr, args, tid=arraydescr.tid,
+                             too_big=too_big)
+
+    def parse_nursery_ptr_increment(self, op):
+        args = self._parse_args(op.getarglist())
+        cstring = self.cpu.value_name("nursery_ptr")
+        self.ssa_vars[op] = self.llvm.BuildGEP1D(self.builder,
+                                                 self.cpu.llvm_char_type,
+                                                 args[0][0], args[1][0],
+                                                 cstring.ptr)
+
+    def parse_zero_array(self, op):
+        _, baseofs, _ = self.cpu.unpack_arraydescr_size(op.getdescr())
+        start_scale = op.getarg(3).getint()
+        length_scale = op.getarg(4).getint()
+        offset = self._heap_offset(op.getarg(1), start_scale, baseofs)
+        dst = self._heap_addr(op.getarg(0), offset, self.cpu.llvm_char_type)
+        length = self._heap_offset(op.getarg(2), length_scale, 0)
+        zero = self.llvm.ConstInt(self.cpu.llvm_char_type, 0, 0)
+        self.llvm.BuildMemSet(self.builder, dst, zero, length, 1)
+
+    def _wb_flag(self, obj, descr):
+        ofs = self.cpu.const_word(descr.jit_wb_if_flag_byteofs)
+        cstring = self.cpu.value_name("wb_flag_addr")
+        addr = self.llvm.BuildGEP1D(self.builder, self.cpu.llvm_char_type,
+                                    obj, ofs, cstring.ptr)
+        cstring = self.cpu.value_name("wb_flag")
+        return self.llvm.BuildLoad(self.builder, self.cpu.llvm_char_type,
+                                   addr, cstring.ptr)
+
+    def write_barrier(self, obj, descr):
+        flag = self._wb_flag(obj, descr)
+        mask = self.llvm.ConstInt(self.cpu.llvm_char_type,
+                                  descr.jit_wb_if_flag_singlebyte, 1)
+        cstring = self.cpu.value_name("wb_needed")
+        needed = self.llvm.BuildAnd(self.builder, flag, mask, cstring.ptr)
+        zero = self.llvm.ConstInt(self.cpu.llvm_char_type, 0, 0)
+        needed = self.llvm.BuildICmp(self.builder, self.intne, needed, zero,
+                                     cstring.ptr)
+        cstring = CString("wb_call")
+        call_block = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                                cstring.ptr)
+        cstring = CString("wb_done")
+        resume = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                            cstring.ptr)
+        self.llvm.BuildCondBr(self.builder, needed, call_block, resume)
+
+        self.llvm.PositionBuilderAtEnd(self.builder, call_block)
+        func = self.address(descr.get_write_barrier_fn(self.cpu))
+        self.call_function(func, self.cpu.llvm_void_type,
+                           [self.cpu.llvm_void_ptr], [obj], "")
+        self.llvm.BuildBr(self.builder, resume)
+        self.llvm.PositionBuilderAtEnd(self.builder, resume)
+
+    def parse_cond_call_gc_wb(self, op):
+        obj = self._parse_args([op.getarg(0)])[0][0]
+        self.write_barrier(obj, op.getdescr())
+
+    def parse_cond_call_gc_wb_array(self, op):
+        """
+        Like the x86 backend: if the array already has GCFLAG_CARDS_SET
+        (the sign bit of the flag byte) we only need to mark the card
+        of the index being written, otherwise call into the gc and check
+        again, as it may have started card marking the array.
+        """
+        descr = op.getdescr()
+        if descr.jit_wb_cards_set == 0:
+            self.parse_cond_call_gc_wb(op)
+            return
+        obj = self._parse_args([op.getarg(0)])[0][0]
+        index = self._get_word(op.getarg(1))
+        zero = self.llvm.ConstInt(self.cpu.llvm_char_type, 0, 0)
+        flag = self._wb_flag(obj, descr)
+        mask = self.llvm.ConstInt(self.cpu.llvm_char_type,
+                                  descr.jit_wb_if_flag_singlebyte | -0x80, 1)
+        cstring = self.cpu.value_name("wb_needed")
+        needed = self.llvm.BuildAnd(self.builder, flag, mask, cstring.ptr)
+        needed = self.llvm.BuildICmp(self.builder, self.intne, needed, zero,
+                                     cstring.ptr)
+        cstring = CString("wb_slow")
+        slow_block = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                                cstring.ptr)
+        cstring = CString("wb_call")
+        call_block = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                                cstring.ptr)
+        cstring = CString("wb_card")
+        card_block = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                                cstring.ptr)
+        cstring = CString("wb_done")
+        resume = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                            cstring.ptr)
+        self.llvm.BuildCondBr(self.builder, needed, slow_block, resume)
+
+        self.llvm.PositionBuilderAtEnd(self.builder, slow_block)
+        cstring = self.cpu.value_name("cards_set")
+        cards_set = self.llvm.BuildICmp(self.builder, self.intslt, flag, zero,
+                                        cstring.ptr)
+        self.llvm.BuildCondBr(self.builder, cards_set, card_block, call_block)
+
+        self.llvm.PositionBuilderAtEnd(self.builder, call_block)
+        func = self.address(descr.get_write_barrier_from_array_fn(self.cpu))
+        self.call_function(func, self.cpu.llvm_void_type,
+                           [self.cpu.llvm_void_ptr], [obj], "")
+        flag = self._wb_flag(obj, descr)
+        cstring = self.cpu.value_name("cards_set")
+        cards_set = self.llvm.BuildICmp(self.builder, self.intslt, flag, zero,
+                                        cstring.ptr)
+        self.llvm.BuildCondBr(self.builder, cards_set, card_block, resume)
+
+        self.llvm.PositionBuilderAtEnd(self.builder, card_block)
+        shift = self.cpu.const_word(descr.jit_wb_card_page_shift)
+        cstring = self.cpu.value_name("card_index")
+        card = self.llvm.BuildURShl(self.builder, index, shift, cstring.ptr)
+        three = self.cpu.const_word(3)
+        cstring = self.cpu.value_name("card_byte")
+        byte_ofs = self.llvm.BuildURShl(self.builder, card, three, cstring.ptr)
+        negative_one = self.cpu.const_word(-1)
+        byte_ofs = self.llvm.BuildXor(self.builder, byte_ofs, negative_one,
+                                      cstring.ptr) #card bytes go backwards from the header
+        seven = self.cpu.const_word(7)
+        cstring = self.cpu.value_name("card_bit")
+        bit_index = self.llvm.BuildAnd(self.builder, card, seven, cstring.ptr)
+        one = self.cpu.const_word(1)
+        bit = self.llvm.BuildLShl(self.builder, one, bit_index, cstring.ptr)
+        bit = self.llvm.BuildTrunc(self.builder, bit, self.cpu.llvm_char_type,
+                                   cstring.ptr)
+        cstring = self.cpu.value_name("card_addr")
+        addr = self.llvm.BuildGEP1D(self.builder, self.cpu.llvm_char_type,
+                                    obj, byte_ofs, cstring.ptr)
+        cstring = self.cpu.value_name("cards")
+        cards = self.llvm.BuildLoad(self.builder, self.cpu.llvm_char_type,
+                                    addr, cstring.ptr)
+        cards = self.llvm.BuildOr(self.builder, cards, bit, cstring.ptr)
+        self.llvm.BuildStore(self.builder, cards, addr)
+        self.llvm.BuildBr(self.builder, resume)
+        self.llvm.PositionBuilderAtEnd(self.builder, resume)
 
     def parse_force_token(self, op):
-        self.ssa_vars[op] = self.jitframe.struct
+        self.ssa_vars[op] = self.jitframe.get_struct()
+
+    def _get_word(self, arg):
+        val = self._parse_args([arg])[0][0]
+        return self.fit_to_type(val, self.cpu.llvm_int_type) #cmp results are still i1s
+
+    def _heap_offset(self, index, scale, base_ofs):
+        """llvm value for base_ofs + index*scale"""
+        if index.is_constant():
+            return self.cpu.const_word(base_ofs + index.getint()*scale)
+        offset = self._get_word(index)
+        if scale != 1:
+            scale_llvm = self.cpu.const_word(scale)
+            cstring = self.cpu.value_name("scaled_index")
+            offset = self.llvm.BuildMul(self.builder, offset, scale_llvm,
+                                        cstring.ptr)
+        if base_ofs != 0:
+            base_ofs_llvm = self.cpu.const_word(base_ofs)
+            cstring = self.cpu.value_name("offset")
+            offset = self.llvm.BuildAdd(self.builder, offset, base_ofs_llvm,
+                                        cstring.ptr)
+        return offset
+
+    def _heap_addr(self, base, offset, llvm_type):
+        """
+        Typed pointer to base+offset. Base is either a gcref or, for raw
+        accesses, an integer address.
+        """
+        base_llvm = self._parse_args([base])[0][0]
+        cstring = self.cpu.value_name("base")
+        if base.type == 'i':
+            base_llvm = self.llvm.BuildIntToPtr(self.builder, base_llvm,
+                                                self.cpu.llvm_void_ptr,
+                                                cstring.ptr)
+        cstring = self.cpu.value_name("addr")
+        addr = self.llvm.BuildGEP1D(self.builder, self.cpu.llvm_char_type,
+                                    base_llvm, offset, cstring.ptr)
+        ptr_type = self.llvm.PointerType(llvm_type, 0)
+        cstring = self.cpu.value_name("typed_addr")
+        return self.llvm.BuildBitCast(self.builder, addr, ptr_type,
+                                      cstring.ptr)
+
+    def _memory_type(self, typ, size):
+        if typ == 'f':
+            return self.cpu.llvm_float_type
+        if typ == 'r':
+            return self.cpu.llvm_void_ptr
+        return self.llvm.IntType(self.cpu.context, size*8)
+
+    def set_tbaa(self, instr, tag):
+        tag_llvm = self.llvm.MetadataAsValue(self.cpu.context, tag)
+        self.llvm.SetMetadata(instr, self.cpu.tbaa_kind_id, tag_llvm)
+
+    def _load(self, op, base, offset, size, sign, tag):
+        llvm_type = self._memory_type(op.type, size)
+        ptr = self._heap_addr(base, offset, llvm_type)
+        cstring = self.cpu.value_name("load_res")
+        res = self.llvm.BuildLoad(self.builder, llvm_type, ptr, cstring.ptr)
+        self.set_tbaa(res, tag)
+        if op.type == 'i' and size < self.cpu.WORD:
+            cstring = self.cpu.value_name("load_res_ext")
+            if sign:
+                res = self.llvm.BuildSExt(self.builder, res,
+                                          self.cpu.llvm_int_type, cstring.ptr)
+            else:
+                res = self.llvm.BuildZExt(self.builder, res,
+                                          self.cpu.llvm_int_type, cstring.ptr)
+        self.ssa_vars[op] = res
+
+    def _store(self, base, offset, value, size, tag):
+        llvm_type = self._memory_type(value.type, size)
+        if value.type == 'i':
+            value_llvm = self._get_word(value)
+            if size < self.cpu.WORD:
+                cstring = self.cpu.value_name("store_val")
+                value_llvm = self.llvm.BuildTrunc(self.builder, value_llvm,
+                                                  llvm_type, cstring.ptr)
+        else:
+            value_llvm = self._parse_args([value])[0][0]
+        ptr = self._heap_addr(base, offset, llvm_type)
+        store = self.llvm.BuildStore(self.builder, value_llvm, ptr)
+        self.set_tbaa(store, tag)
+
+    def _parse_getfield(self, op, tag):
+        ofs, size, sign = self.cpu.unpack_fielddescr_size(op.getdescr())
+        offset = self.cpu.const_word(ofs)
+        self._load(op, op.getarg(0), offset, size, sign, tag)
+
+    def _parse_setfield(self, op, tag):
+        ofs, size, _ = self.cpu.unpack_fielddescr_size(op.getdescr())
+        offset = self.cpu.const_word(ofs)
+        self._store(op.getarg(0), offset, op.getarg(1), size, tag)
+
+    def _parse_getarrayitem(self, op, tag):
+        ofs, size, sign = self.cpu.unpack_arraydescr_size(op.getdescr())
+        offset = self._heap_offset(op.getarg(1), size, ofs)
+        self._load(op, op.getarg(0), offset, size, sign, tag)
+
+    def _parse_setarrayitem(self, op, tag):
+        ofs, size, _ = self.cpu.unpack_arraydescr_size(op.getdescr())
+        offset = self._heap_offset(op.getarg(1), size, ofs)
+        self._store(op.getarg(0), offset, op.getarg(2), size, tag)
+
+    def parse_getfield_gc_i(self, op):
+        self._parse_getfield(op, self.cpu.get_tbaa_tag(op.getdescr()))
+
+    parse_getfield_gc_r = parse_getfield_gc_i
+    parse_getfield_gc_f = parse_getfield_gc_i
+
+    def parse_getfield_raw_i(self, op):
+        self._parse_getfield(op, self.cpu.tbaa_any_tag)
+
+    parse_getfield_raw_r = parse_getfield_raw_i
+    parse_getfield_raw_f = parse_getfield_raw_i
+
+    def parse_setfield_gc(self, op):
+        self._parse_setfield(op, self.cpu.get_tbaa_tag(op.getdescr()))
+
+    def parse_setfield_raw(self, op):
+        self._parse_setfield(op, self.cpu.tbaa_any_tag)
+
+    def parse_getarrayitem_gc_i(self, op):
+        self._parse_getarrayitem(op, self.cpu.get_tbaa_tag(op.getdescr()))
+
+    parse_getarrayitem_gc_r = parse_getarrayitem_gc_i
+    parse_getarrayitem_gc_f = parse_getarrayitem_gc_i
+    parse_getarrayitem_gc_pure_i = parse_getarrayitem_gc_i
+    parse_getarrayitem_gc_pure_r = parse_getarrayitem_gc_i
+    parse_getarrayitem_gc_pure_f = parse_getarrayitem_gc_i
+
+    def parse_getarrayitem_raw_i(self, op):
+        self._parse_getarrayitem(op, self.cpu.tbaa_any_tag)
+
+    parse_getarrayitem_raw_f = parse_getarrayitem_raw_i
+
+    def parse_setarrayitem_gc(self, op):
+        self._parse_setarrayitem(op, self.cpu.get_tbaa_tag(op.getdescr()))
+
+    def parse_setarrayitem_raw(self, op):
+        self._parse_setarrayitem(op, self.cpu.tbaa_any_tag)
+
+    def _unpack_interiorfielddescr(self, descr):
+        ofs, itemsize, _ = self.cpu.unpack_arraydescr_size(descr.arraydescr)
+        fldofs, fldsize, sign = self.cpu.unpack_fielddescr_size(
+            descr.fielddescr)
+        return ofs + fldofs, itemsize, fldsize, sign
+
+    def parse_getinteriorfield_gc_i(self, op):
+        descr = op.getdescr()
+        ofs, itemsize, fldsize, sign = self._unpack_interiorfielddescr(descr)
+        offset = self._heap_offset(op.getarg(1), itemsize, ofs)
+        self._load(op, op.getarg(0), offset, fldsize, sign,
+                   self.cpu.get_tbaa_tag(descr))
+
+    parse_getinteriorfield_gc_r = parse_getinteriorfield_gc_i
+    parse_getinteriorfield_gc_f = parse_getinteriorfield_gc_i
+
+    def _parse_setinteriorfield(self, op, tag):
+        descr = op.getdescr()
+        ofs, itemsize, fldsize, _ = self._unpack_interiorfielddescr(descr)
+        offset = self._heap_offset(op.getarg(1), itemsize, ofs)
+        self._store(op.getarg(0), offset, op.getarg(2), fldsize, tag)
+
+    def parse_setinteriorfield_gc(self, op):
+        self._parse_setinteriorfield(op, self.cpu.get_tbaa_tag(op.getdescr()))
+
+    def parse_setinteriorfield_raw(self, op):
+        self._parse_setinteriorfield(op, self.cpu.tbaa_any_tag)
+
+    def parse_raw_load_i(self, op):
+        ofs, size, sign = self.cpu.unpack_arraydescr_size(op.getdescr())
+        offset = self._heap_offset(op.getarg(1), 1, ofs)
+        self._load(op, op.getarg(0), offset, size, sign,
+                   self.cpu.tbaa_any_tag)
+
+    parse_raw_load_f = parse_raw_load_i
+
+    def parse_raw_store(self, op):
+        ofs, size, _ = self.cpu.unpack_arraydescr_size(op.getdescr())
+        offset = self._heap_offset(op.getarg(1), 1, ofs)
+        self._store(op.getarg(0), offset, op.getarg(2), size,
+                    self.cpu.tbaa_any_tag)
+
+    def parse_gc_load_i(self, op):
+        size = op.getarg(2).getint() #negative if signed
+        offset = self._heap_offset(op.getarg(1), 1, 0)
+        self._load(op, op.getarg(0), offset, abs(size), size < 0,
+                   self.cpu.tbaa_any_tag)
+
+    parse_gc_load_r = parse_gc_load_i
+    parse_gc_load_f = parse_gc_load_i
+
+    def parse_gc_load_indexed_i(self, op):
+        scale = op.getarg(2).getint()
+        base_ofs = op.getarg(3).getint()
+        size = op.getarg(4).getint()
+        offset = self._heap_offset(op.getarg(1), scale, base_ofs)
+        self._load(op, op.getarg(0), offset, abs(size), size < 0,
+                   self.cpu.tbaa_any_tag)
+
+    parse_gc_load_indexed_r = parse_gc_load_indexed_i
+    parse_gc_load_indexed_f = parse_gc_load_indexed_i
+
+    def parse_gc_store(self, op):
+        size = op.getarg(3).getint()
+        offset = self._heap_offset(op.getarg(1), 1, 0)
+        self._store(op.getarg(0), offset, op.getarg(2), size,
+                    self.cpu.tbaa_any_tag)
+
+    def parse_gc_store_indexed(self, op):
+        scale = op.getarg(3).getint()
+        base_ofs = op.getarg(4).getint()
+        size = op.getarg(5).getint()
+        offset = self._heap_offset(op.getarg(1), scale, base_ofs)
+        self._store(op.getarg(0), offset, op.getarg(2), size,
+                    self.cpu.tbaa_any_tag)
+
+    def parse_arraylen_gc(self, op):
+        lendescr = op.getdescr().lendescr
+        offset = self.cpu.const_word(lendescr.offset)
+        self._load(op, op.getarg(0), offset, self.cpu.WORD, False,
+                   self.cpu.get_tbaa_tag(lendescr))
+
+    def _parse_strlen(self, op, STR, descr):
+        _, _, ofs_length = symbolic.get_array_token(
+            STR, self.cpu.translate_support_code)
+        offset = self.cpu.const_word(ofs_length)
+        self._load(op, op.getarg(0), offset, self.cpu.WORD, False,
+                   self.cpu.get_tbaa_tag(descr.lendescr))
+
+    def _str_items(self, STR):
+        basesize, itemsize, _ = symbolic.get_array_token(
+            STR, self.cpu.translate_support_code)
+        if STR is rstr.STR:
+            basesize -= 1 #for the extra null character
+        return basesize, itemsize
+
+    def _parse_strgetitem(self, op, STR, descr):
+        basesize, itemsize = self._str_items(STR)
+        offset = self._heap_offset(op.getarg(1), itemsize, basesize)
+        self._load(op, op.getarg(0), offset, itemsize, False,
+                   self.cpu.get_tbaa_tag(descr))
+
+    def _parse_strsetitem(self, op, STR, descr):
+        basesize, itemsize = self._str_items(STR)
+        offset = self._heap_offset(op.getarg(1), itemsize, basesize)
+        self._store(op.getarg(0), offset, op.getarg(2), itemsize,
+                    self.cpu.get_tbaa_tag(descr))
+
+    def _parse_copystrcontent(self, op, STR):
+        basesize, itemsize = self._str_items(STR)
+        src_ofs = self._heap_offset(op.getarg(2), itemsize, basesize)
+        dst_ofs = self._heap_offset(op.getarg(3), itemsize, basesize)
+        src = self._heap_addr(op.getarg(0), src_ofs, self.cpu.llvm_char_type)
+        dst = self._heap_addr(op.getarg(1), dst_ofs, self.cpu.llvm_char_type)
+        length = self._heap_offset(op.getarg(4), itemsize, 0)
+        self.llvm.BuildMemCpy(self.builder, dst, 1, src, 1, length)
+
+    def _parse_strhash(self, op, descr):
+        ofs, size, _ = self.cpu.unpack_fielddescr_size(descr)
+        offset = self.cpu.const_word(ofs)
+        self._load(op, op.getarg(0), offset, size, True,
+                   self.cpu.get_tbaa_tag(descr))
+
+    def parse_strlen(self, op):
+        self._parse_strlen(op, rstr.STR, self.cpu.gc_ll_descr.str_descr)
+
+    def parse_unicodelen(self, op):
+        self._parse_strlen(op, rstr.UNICODE,
+                           self.cpu.gc_ll_descr.unicode_descr)
+
+    def parse_strgetitem(self, op):
+        self._parse_strgetitem(op, rstr.STR, self.cpu.gc_ll_descr.str_descr)
+
+    def parse_unicodegetitem(self, op):
+        self._parse_strgetitem(op, rstr.UNICODE,
+                               self.cpu.gc_ll_descr.unicode_descr)
+
+    def parse_strsetitem(self, op):
+        self._parse_strsetitem(op, rstr.STR, self.cpu.gc_ll_descr.str_descr)
+
+    def parse_unicodesetitem(self, op):
+        self._parse_strsetitem(op, rstr.UNICODE,
+                               self.cpu.gc_ll_descr.unicode_descr)
+
+    def parse_copystrcontent(self, op):
+        self._parse_copystrcontent(op, rstr.STR)
+
+    def parse_copyunicodecontent(self, op):
+        self._parse_copystrcontent(op, rstr.UNICODE)
 
     def parse_strhash(self, op):
-        func_ptr = compute_unique_id(self.cpu.bh_strhash)
+        self._parse_strhash(op, self.cpu.gc_ll_descr.str_hash_descr)
 
     def parse_unicodehash(self, op):
+        self._parse_strhash(op, self.cpu.gc_ll_descr.unicode_hash_descr)
+
+    def parse_increment_debug_counter(self, op):
+        offset = self.zero
+        ptr = self._heap_addr(op.getarg(0), offset, self.cpu.llvm_int_type)
+        cstring = self.cpu.value_name("debug_counter")
+        counter = self.llvm.BuildLoad(self.builder, self.cpu.llvm_int_type,
+                                      ptr, cstring.ptr)
+        self.set_tbaa(counter, self.cpu.tbaa_any_tag)
+        one = self.cpu.const_word(1)
+        cstring = self.cpu.value_name("debug_counter_inc")
+        counter = self.llvm.BuildAdd(self.builder, counter, one, cstring.ptr)
+        store = self.llvm.BuildStore(self.builder, counter, ptr)
+        self.set_tbaa(store, self.cpu.tbaa_any_tag)
+
+    def parse_same_as_i(self, op):
+        self.ssa_vars[op] = self._parse_args([op.getarg(0)])[0][0]
+
+    parse_same_as_r = parse_same_as_i
+    parse_same_as_f = parse_same_as_i
+
+    def parse_debug_merge_point(self, op):
         pass
 
+    parse_enter_portal_frame = parse_debug_merge_point
+    parse_leave_portal_frame = parse_debug_merge_point
+    parse_jit_debug = parse_debug_merge_point
+    parse_keepalive = parse_debug_merge_point
+
 
     # Won't work when call descr is dynamic and args are any int type
-    def get_arg_types(self, call_descr, params):
+    def get_arg_types(self, call_descr):
+        """
+        C types of a call's arguments, call_function truncates the words
+        passed for narrower ints.
+        """
         arg_types = []
         for c, typ in enumerate(call_descr.arg_classes):
             if typ == 'i':
@@ -1099,23 +2146,11 @@ class LLVMOpDispatcher:
                 if arg_type is lltype.Signed:
                     arg_types.append(self.cpu.llvm_int_type)
                 elif arg_type is rffi.INT:
-                    llvm_type = self.cpu.llvm_indx_type #indx_type = 32bits
-                    arg_types.append(llvm_type)
-                    cstring = CString("trunced_arg")
-                    params[c] = self.llvm.BuildTrunc(self.builder, params[c],
-                                                     llvm_type, cstring.ptr)
+                    arg_types.append(self.cpu.llvm_indx_type) #indx_type = 32bits
                 elif arg_type is rffi.SHORT:
-                    llvm_type = self.cpu.llvm_short_type
-                    arg_types.append(llvm_type)
-                    cstring = CString("trunced_arg")
-                    params[c] = self.llvm.BuildTrunc(self.builder, params[c],
-                                                     llvm_type, cstring.ptr)
+                    arg_types.append(self.cpu.llvm_short_type)
                 elif arg_type is rffi.CHAR:
-                    llvm_type = self.cpu.llvm_char_type
-                    arg_types.append(llvm_type)
-                    cstring = CString("trunced_arg")
-                    params[c] = self.llvm.BuildTrunc(self.builder, params[c],
-                                                     llvm_type, cstring.ptr)
+                    arg_types.append(self.cpu.llvm_char_type)
             elif typ == 'f': arg_types.append(self.cpu.llvm_float_type)
             elif typ == 'r': arg_types.append(self.cpu.llvm_void_ptr)
             elif typ == 'L': arg_types.append(self.cpu.llvm_float_type)
@@ -1123,18 +2158,27 @@ class LLVMOpDispatcher:
         return arg_types
 
 
-    def parse_call(self, op, ret):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+    def call_ret_type(self, call_descr, ret):
+        if ret == 'r': return self.cpu.llvm_void_ptr
+        if ret == 'f': return self.cpu.llvm_float_type
+        if ret == 'n': return self.cpu.llvm_void_type
+        return self.llvm.IntType(self.cpu.context,
+                                 self.cpu.WORD*call_descr.result_size)
+
+    def _parse_call(self, op, ret, forcing=False):
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         func_int_ptr = args[0]
         params = args[1:]
         call_descr = op.getdescr()
-        if ret == 'r': ret_type = self.cpu.llvm_void_ptr
-        elif ret == 'f': ret_type = self.cpu.llvm_float_type
-        elif ret == 'n': ret_type = self.cpu.llvm_void_type
-        elif ret == 'i': ret_type = self.llvm.IntType(self.cpu.context,
-                                                      self.cpu.WORD*call_descr.
-                                                      result_size)
-        arg_types = self.get_arg_types(call_descr, params)
+        ret_type = self.call_ret_type(call_descr, ret)
+        arg_types = self.get_arg_types(call_descr)
+        can_collect = forcing or self.can_collect(call_descr)
+        base = 0
+        if forcing:
+            spilled, base = self.prepare_forcing_call()
+        elif can_collect:
+            spilled = self.spill_live_refs()
+            self.enter_collecting_call(spilled)
 
         if ret != 'n':
             self.ssa_vars[op] = self.call_function(func_int_ptr, ret_type,
@@ -1143,17 +2187,361 @@ class LLVMOpDispatcher:
         else:
             self.call_function(func_int_ptr, ret_type,
                                 arg_types, params, "")
+        if can_collect:
+            self.leave_collecting_call()
+            self.reload_live_refs(spilled, base)
+
+    def _callop(ret, forcing=False):
+        def parse_call(self, op):
+            self._parse_call(op, ret, forcing)
+        return parse_call
+
+    parse_call_r = _callop('r')
+    parse_call_f = _callop('f')
+    parse_call_i = _callop('i')
+    parse_call_n = _callop('n')
+    parse_call_loopinvariant_r = parse_call_r #the optimiser already removed the repeated ones
+    parse_call_loopinvariant_f = parse_call_f
+    parse_call_loopinvariant_i = parse_call_i
+    parse_call_loopinvariant_n = parse_call_n
+    parse_call_may_force_r = _callop('r', forcing=True)
+    parse_call_may_force_f = _callop('f', forcing=True)
+    parse_call_may_force_i = _callop('i', forcing=True)
+    parse_call_may_force_n = _callop('n', forcing=True)
+
+    def store_force_descr(self, descr):
+        descr_addr = self.address(compute_unique_id(descr))
+        cstring = self.cpu.value_name("force_descr")
+        force_descr = self.llvm.BuildIntToPtr(self.builder, descr_addr,
+                                              self.cpu.llvm_void_ptr,
+                                              cstring.ptr)
+        self.jitframe.set_elem(force_descr, 2)
+
+    def prepare_forcing_call(self):
+        """
+        Calls that can force the jitframe are followed by a guard_not_forced.
+        Forcing (see llmodel.force) sets jf_descr to jf_force_descr and
+        leaves the guard's failargs to be read from the jitframe, so they're
+        written before the call, with the refs still needed after it
+        spilled above them. Returns the spilled refs and the slot they
+        start at, for reload_live_refs.
+        """
+        guard_op = self.operations[self.op_index+1]
+        assert guard_op.getopnum() == rop.GUARD_NOT_FORCED
+        descr = guard_op.getdescr()
+        num_slots = self.cpu.set_failarg_locs(descr, guard_op.getfailargs())
+        self.store_force_descr(descr)
+        self.jitframe.set_elem(self.zero, 1)
+        self.store_frame_args(self.failarg_values(guard_op))
+        self.frame_depth = max(self.frame_depth, num_slots)
+        spilled = self.spill_live_refs(num_slots)
+        if self.gc_roots:
+            positions = [c for c, arg in
+                         enumerate(self.live_failargs(guard_op))
+                         if arg in self.ssa_vars and arg.type == 'r']
+            self.push_gcmap(positions + range(num_slots,
+                                              num_slots+len(spilled)))
+        return spilled, num_slots
+
+    def tls_ptr(self, offset, llvm_type):
+        """Typed pointer to a field of the thread local struct"""
+        cstring = self.cpu.value_name("tls_field")
+        addr = self.llvm.BuildGEP1D(self.builder, self.cpu.llvm_char_type,
+                                    self.thread_local,
+                                    self.cpu.const_word(offset), cstring.ptr)
+        ptr_type = self.llvm.PointerType(llvm_type, 0)
+        cstring = self.cpu.value_name("tls_ptr")
+        return self.llvm.BuildBitCast(self.builder, addr, ptr_type,
+                                      cstring.ptr)
+
+    def real_errno_ptr(self):
+        p_errno = llerrno.get_p_errno_offset(self.cpu)
+        errno_ptr_type = self.llvm.PointerType(self.cpu.llvm_indx_type, 0)
+        cstring = self.cpu.value_name("p_errno")
+        return self.llvm.BuildLoad(self.builder, errno_ptr_type,
+                                   self.tls_ptr(p_errno, errno_ptr_type),
+                                   cstring.ptr)
+
+    def rpy_errno_ptr(self, save_err):
+        if save_err & rffi.RFFI_ALT_ERRNO:
+            rpy_errno = llerrno.get_alt_errno_offset(self.cpu)
+        else:
+            rpy_errno = llerrno.get_rpy_errno_offset(self.cpu)
+        return self.tls_ptr(rpy_errno, self.cpu.llvm_indx_type)
+
+    def write_real_errno(self, save_err):
+        """Errno is an int, so 32 bits wide, set before the call"""
+        if save_err & rffi.RFFI_READSAVED_ERRNO:
+            cstring = self.cpu.value_name("saved_errno")
+            saved_errno = self.llvm.BuildLoad(self.builder,
+                                              self.cpu.llvm_indx_type,
+                                              self.rpy_errno_ptr(save_err),
+                                              cstring.ptr)
+            self.llvm.BuildStore(self.builder, saved_errno,
+                                 self.real_errno_ptr())
+        elif save_err & rffi.RFFI_ZERO_ERRNO_BEFORE:
+            zero = self.llvm.ConstInt(self.cpu.llvm_indx_type, 0, 0)
+            self.llvm.BuildStore(self.builder, zero, self.real_errno_ptr())
+
+    def read_real_errno(self, save_err):
+        if save_err & rffi.RFFI_SAVE_ERRNO:
+            cstring = self.cpu.value_name("errno")
+            errno = self.llvm.BuildLoad(self.builder, self.cpu.llvm_indx_type,
+                                        self.real_errno_ptr(), cstring.ptr)
+            self.llvm.BuildStore(self.builder, errno,
+                                 self.rpy_errno_ptr(save_err))
+
+    def reacquire_gil(self, fastgil, saved_rst):
+        """
+        Take back the gil by swapping our thread ident into rpy_fastgil
+        while it's 0. If it isn't, or with a shadowstack another thread
+        got to run in between and changed the current shadowstack, the
+        general reacqgil function sorts it out.
+        """
+        thread_ident_ofs = lltls.get_thread_ident_offset(self.cpu)
+        cstring = self.cpu.value_name("thread_ident")
+        thread_ident = self.llvm.BuildLoad(self.builder, self.cpu.llvm_int_type,
+                                           self.tls_ptr(thread_ident_ofs,
+                                                        self.cpu.llvm_int_type),
+                                           cstring.ptr)
+        cstring = self.cpu.value_name("acquired")
+        acquired = self.llvm.BuildCompareAndSwap(self.builder, fastgil,
+                                                 self.zero, thread_ident,
+                                                 cstring.ptr)
+        cstring = CString("reacquire_gil")
+        reacquire = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                               cstring.ptr)
+        cstring = CString("gil_acquired")
+        done = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                          cstring.ptr)
+        weights = self.cpu.get_branch_weights(GUARD_HOT_WEIGHT, 1)
+        if saved_rst is None:
+            self.llvm.BuildGuardBranch(self.builder, acquired, done, reacquire,
+                                       self.cpu.prof_kind_id, weights,
+                                       reacquire)
+        else:
+            cstring = CString("check_shadowstack")
+            check = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                               cstring.ptr)
+            cstring = CString("release_gil_again")
+            release = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                                 cstring.ptr)
+            self.llvm.BuildGuardBranch(self.builder, acquired, check,
+                                       reacquire, self.cpu.prof_kind_id,
+                                       weights, check)
+            _, rst = self._shadowstack_top()
+            cstring = self.cpu.value_name("same_shadowstack")
+            same = self.llvm.BuildICmp(self.builder, self.inteq, rst,
+                                       saved_rst, cstring.ptr)
+            self.llvm.BuildGuardBranch(self.builder, same, done, release,
+                                       self.cpu.prof_kind_id, weights,
+                                       release)
+            self.llvm.BuildReleaseStore(self.builder, self.zero, fastgil)
+            self.llvm.BuildBr(self.builder, reacquire)
+            self.llvm.PositionBuilderAtEnd(self.builder, reacquire)
+        reacqgil_addr = self.address(self.cpu.assembler.reacqgil_addr)
+        self.call_function(reacqgil_addr, self.cpu.llvm_void_type, [], [], "")
+        self.llvm.BuildBr(self.builder, done)
+        self.llvm.PositionBuilderAtEnd(self.builder, done)
+
+    def _parse_call_release_gil(self, op, ret):
+        """
+        Call to C code that runs without the gil, which is released by
+        zeroing rpy_fastgil like the other backends do, see rgil.py.
+        """
+        save_err = op.getarg(0).getint()
+        args = [arg for arg, _ in self._parse_args(op.getarglist()[1:])]
+        func_int_ptr = args[0]
+        params = args[1:]
+        call_descr = op.getdescr()
+        ret_type = self.call_ret_type(call_descr, ret)
+        arg_types = self.get_arg_types(call_descr)
+        spilled, base = self.prepare_forcing_call()
+        saved_rst = None
+        if self.gc_roots:
+            _, saved_rst = self._shadowstack_top()
+        fastgil = self._raw_ptr(rffi.cast(lltype.Signed,
+                                          rgil.gil_fetch_fastgil()))
+        self.llvm.BuildReleaseStore(self.builder, self.zero, fastgil)
+        self.write_real_errno(save_err)
+        if ret != 'n':
+            self.ssa_vars[op] = self.call_function(func_int_ptr, ret_type,
+                                                   arg_types, params,
+                                                   "call_res")
+        else:
+            self.call_function(func_int_ptr, ret_type, arg_types, params, "")
+        self.read_real_errno(save_err)
+        self.reacquire_gil(fastgil, saved_rst)
+        self.leave_collecting_call()
+        self.reload_live_refs(spilled, base)
+
+    def _release_gil_callop(ret):
+        def parse_call_release_gil(self, op):
+            self._parse_call_release_gil(op, ret)
+        return parse_call_release_gil
+
+    parse_call_release_gil_f = _release_gil_callop('f')
+    parse_call_release_gil_i = _release_gil_callop('i')
+    parse_call_release_gil_n = _release_gil_callop('n')
+
+    def call_assembler_target(self, looptoken, frame):
+        """
+        Call the entry function of looptoken's loop, returning the jitframe
+        it exits with. Loops this CPU compiled are called by symbol, and
+        their module gets linked into ours so LLVM's inliner can inline
+        them (see link_callees). Anything else only has an address.
+        """
+        clt = looptoken.compiled_loop_token
+        resources = clt.llvm_resources
+        if resources is None and looptoken is not self.looptoken:
+            func_addr = self.address(looptoken._ll_function_addr)
+            return self.call_function(func_addr, self.cpu.llvm_void_ptr,
+                                      [self.cpu.llvm_void_ptr,
+                                       self.cpu.llvm_void_ptr],
+                                      [frame, self.thread_local],
+                                      "call_assembler_frame")
+        if resources is None: #recursion into the loop being compiled
+            name = "trace_" + str(looptoken.number)
+            jitframe_type = self.jitframe_type
+        else:
+            name = resources.dispatcher.entry_name
+            jitframe_type = resources.dispatcher.jitframe_type
+            if (self.cpu.inline_call_assembler and not self.relocate and
+                    name not in self.inlined_callees):
+                self.inlined_callees[name] = resources.dispatcher.module
+        jitframe_ptr = self.llvm.PointerType(jitframe_type, 0)
+        try:
+            entry_func = self.declared_funcs[name]
+        except KeyError:
+            entry_func = self.define_function([jitframe_ptr,
+                                               self.cpu.llvm_void_ptr],
+                                              jitframe_ptr, name)
+            self.declared_funcs[name] = entry_func
+        cstring = self.cpu.value_name("callee_frame")
+        callee_frame = self.llvm.BuildBitCast(self.builder, frame,
+                                              jitframe_ptr, cstring.ptr)
+        args = [callee_frame, self.thread_local]
+        arg_array = self.cpu.value_scratch.fill(args)
+        cstring = self.cpu.value_name("call_assembler_res")
+        res = self.llvm.BuildCall(self.builder, entry_func, arg_array,
+                                  len(args), cstring.ptr)
+        cstring = self.cpu.value_name("call_assembler_frame")
+        return self.llvm.BuildBitCast(self.builder, res,
+                                      self.cpu.llvm_void_ptr, cstring.ptr)
+
+    def link_callees(self):
+        """
+        Link copies of the modules of the loops we call_assemble into ours,
+        with their functions made available_externally: the inliner can
+        inline them, and whatever's left is dropped rather than compiled
+        again, calls to it go to the code the JIT already has.
+        """
+        for name, module in self.inlined_callees.items():
+            module_copy = self.llvm.CloneModule(module)
+            if self.llvm.LinkForInlining(self.module, module_copy): #consumes module_copy
+                raise Exception("Failed to link " + name)
+
+    def done_with_this_frame_descr(self, ret):
+        if ret == 'i': return self.cpu.done_with_this_frame_descr_int
+        if ret == 'r': return self.cpu.done_with_this_frame_descr_ref
+        if ret == 'f': return self.cpu.done_with_this_frame_descr_float
+        return self.cpu.done_with_this_frame_descr_void
+
+    def _parse_call_assembler(self, op, ret):
+        """
+        The llsupport rewriter already allocated the callee's frame and
+        wrote its inputargs, so all that's left is the call and reading
+        the result. If the callee exited with anything but the usual
+        finish of its portal, the jitdriver's assembler helper deals with
+        its frame, like in the other backends.
+        """
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
+        frame = args[0]
+        if len(args) > 1:
+            vable = args[1]
+        else:
+            vable = self.llvm.ConstNull(self.cpu.llvm_void_ptr)
+        looptoken = op.getdescr()
+        spilled, base = self.prepare_forcing_call()
+        res_frame = self.call_assembler_target(looptoken, frame)
+        jf_descr_ofs = self.cpu.get_ofs_of_frame_field('jf_descr')
+        jf_descr = self.load_word_at(res_frame, jf_descr_ofs,
+                                     self.cpu.llvm_int_type, "callee_descr")
+        done_descr = self.done_with_this_frame_descr(ret)
+        if done_descr is None:
+            expected = self.zero
+        else:
+            expected = self.address(compute_unique_id(done_descr))
+        cstring = self.cpu.value_name("callee_done")
+        done = self.llvm.BuildICmp(self.builder, self.inteq, jf_descr,
+                                   expected, cstring.ptr)
+        cstring = CString("call_assembler_done")
+        fast_path = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                               cstring.ptr)
+        cstring = CString("call_assembler_helper")
+        slow_path = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                               cstring.ptr)
+        cstring = CString("call_assembler_resume")
+        resume = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
+                                            cstring.ptr)
+        weights = self.cpu.get_branch_weights(GUARD_HOT_WEIGHT, 1)
+        self.llvm.BuildGuardBranch(self.builder, done, fast_path, slow_path,
+                                   self.cpu.prof_kind_id, weights, fast_path)
+        if ret == 'i':
+            ret_type = self.cpu.llvm_int_type #results come back as words
+        else:
+            ret_type = self.call_ret_type(None, ret)
+        if ret != 'n':
+            base_ofs = self.cpu.get_baseofs_of_frame_field()
+            fast_res = self.load_word_at(res_frame, base_ofs, ret_type,
+                                         "call_assembler_res")
+        self.llvm.BuildBr(self.builder, resume)
+
+        self.llvm.PositionBuilderAtEnd(self.builder, slow_path)
+        jd = looptoken.outermost_jitdriver_sd
+        assert jd is not None
+        helper_addr = self.address(
+            self.cpu.cast_adr_to_int(jd.assembler_helper_adr))
+        slow_res = self.call_function(helper_addr, ret_type,
+                                      [self.cpu.llvm_void_ptr,
+                                       self.cpu.llvm_void_ptr],
+                                      [res_frame, vable],
+                                      "helper_res" if ret != 'n' else "")
+        self.llvm.BuildBr(self.builder, resume)
+
+        self.llvm.PositionBuilderAtEnd(self.builder, resume)
+        if ret != 'n':
+            cstring = self.cpu.value_name("call_assembler_res")
+            phi = self.llvm.BuildPhi(self.builder, ret_type, cstring.ptr)
+            self.llvm.AddIncoming(phi, fast_res, fast_path)
+            self.llvm.AddIncoming(phi, slow_res, slow_path)
+            self.ssa_vars[op] = phi
+        self.leave_collecting_call()
+        self.reload_live_refs(spilled, base)
+
+    def _call_assemblerop(ret):
+        def parse_call_assembler(self, op):
+            self._parse_call_assembler(op, ret)
+        return parse_call_assembler
+
+    parse_call_assembler_r = _call_assemblerop('r')
+    parse_call_assembler_f = _call_assemblerop('f')
+    parse_call_assembler_i = _call_assemblerop('i')
+    parse_call_assembler_n = _call_assemblerop('n')
 
     def parse_cond_call(self, op):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         cnd = args[0]
         func_int_ptr = args[1]
         params = args[2:]
         call_descr = op.getdescr()
-        arg_types = self.get_arg_types(call_descr, params)
+        arg_types = self.get_arg_types(call_descr)
         ret_type = self.cpu.llvm_void_type
+        can_collect = self.can_collect(call_descr)
+        if can_collect:
+            spilled = self.spill_live_refs()
 
-        cstring = CString("cond_call_cmp")
+        cstring = self.cpu.value_name("cond_call_cmp")
         cmp = self.llvm.BuildICmp(self.builder, self.intne, cnd, self.zero,
                                   cstring.ptr)
         cstring = CString("call_block")
@@ -1165,23 +2553,33 @@ class LLVMOpDispatcher:
         self.llvm.BuildCondBr(self.builder, cmp, call_block, resume_block)
 
         self.llvm.PositionBuilderAtEnd(self.builder, call_block)
+        if can_collect:
+            self.enter_collecting_call(spilled)
         self.call_function(func_int_ptr, ret_type, arg_types, params, "")
+        if can_collect:
+            self.leave_collecting_call()
         self.llvm.BuildBr(self.builder, resume_block)
 
         self.llvm.PositionBuilderAtEnd(self.builder, resume_block)
+        if can_collect:
+            self.reload_live_refs(spilled)
 
-    def parse_cond_call_value(self, op, ret):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+    def _parse_cond_call_value(self, op, ret):
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         cnd = args[0]
         func_int_ptr = args[1]
         params = args[2:]
         call_descr = op.getdescr()
-        arg_types = self.get_arg_types(call_descr, params)
+        arg_types = self.get_arg_types(call_descr)
         if ret == 'i': ret_type = self.cpu.llvm_int_type
         if ret == 'r': ret_type = self.cpu.llvm_void_ptr
+        can_collect = self.can_collect(call_descr)
+        if can_collect:
+            spilled = self.spill_live_refs()
 
-        cstring = CString("cmp")
+        cstring = self.cpu.value_name("cmp")
         cmp = self.llvm.BuildIsNull(self.builder, cnd, cstring.ptr)
+        current_block = self.llvm.GetInsertBlock(self.builder)
 
         cstring = CString("call_block")
         call_block = self.llvm.AppendBasicBlock(self.cpu.context, self.func,
@@ -1192,59 +2590,581 @@ class LLVMOpDispatcher:
         self.llvm.BuildCondBr(self.builder, cmp, call_block, resume_block)
 
         self.llvm.PositionBuilderAtEnd(self.builder, call_block)
+        if can_collect:
+            self.enter_collecting_call(spilled)
         call_res = self.call_function(func_int_ptr, ret_type, arg_types, params,
                                       "call_res")
+        if can_collect:
+            self.leave_collecting_call()
+            call_block = self.llvm.GetInsertBlock(self.builder) #the frame's write barrier adds blocks
         self.llvm.BuildBr(self.builder, resume_block)
 
         self.llvm.PositionBuilderAtEnd(self.builder, resume_block)
         phi_type = ret_type
-        cstring = CString("cond_phi")
+        cstring = self.cpu.value_name("cond_phi")
         phi = self.llvm.BuildPhi(self.builder, phi_type, cstring.ptr)
         self.llvm.AddIncoming(phi, call_res, call_block)
-        self.llvm.AddIncoming(phi, cnd, self.entry)
+        self.llvm.AddIncoming(phi, cnd, current_block)
         self.ssa_vars[op] = phi
+        if can_collect:
+            self.reload_live_refs(spilled)
+
+    def parse_cond_call_value_r(self, op):
+        self._parse_cond_call_value(op, 'r')
+
+    def parse_cond_call_value_i(self, op):
+        self._parse_cond_call_value(op, 'i')
 
-    def parse_int_ovf(self, op, binop):
-        args = [arg for arg, _ in self.parse_args(op.getarglist())]
+    def _parse_int_ovf(self, op, binop):
+        """
+        Sets self.overflow_flag to an i1 the following guard_(no_)overflow
+        branches on directly, so instruction selection can fuse it with the
+        arithmetic into e.g. add+jo.
+        """
+        args = [arg for arg, _ in self._parse_args(op.getarglist())]
         lhs = args[0]
         rhs = args[1]
+        if not self.cpu.overflow_intrinsics:
+            self._parse_int_ovf_widened(op, binop, lhs, rhs)
+            return
 
-        cstring = CString("lhs_wide")
+        if binop == "+":
+            name = "llvm.sadd"
+        elif binop == "-":
+            name = "llvm.ssub"
+        else:
+            name = "llvm.smul"
+        name += ".with.overflow.i%d" % (self.cpu.WORD*8)
+        intrinsic = self.intrinsic(name, [self.cpu.llvm_int_type,
+                                          self.cpu.llvm_int_type],
+                                   self.cpu.llvm_ovf_res_type)
+        flag = self.cpu.value_scratch.reserve(1)
+        self.ssa_vars[op] = self.llvm.BuildOverflowOp(self.builder, intrinsic,
+                                                      lhs, rhs, flag)
+        self.overflow_flag = flag[0]
+
+    def _parse_int_ovf_widened(self, op, binop, lhs, rhs):
+        """The arithmetic done in i128 and range checked, for comparison"""
+        cstring = self.cpu.value_name("lhs_wide")
         lhs_wide = self.llvm.BuildSExt(self.builder, lhs,
                                        self.cpu.llvm_wide_int, cstring.ptr)
-        cstring = CString("rhs_wide")
+        cstring = self.cpu.value_name("rhs_wide")
         rhs_wide = self.llvm.BuildSExt(self.builder, rhs,
                                        self.cpu.llvm_wide_int, cstring.ptr)
 
         if binop == "+":
-            cstring = CString("overflow_add")
+            cstring = self.cpu.value_name("overflow_add")
             res = self.llvm.BuildAdd(self.builder, lhs_wide, rhs_wide,
                                      cstring.ptr)
         elif binop == "-":
-            cstring = CString("overflow_sub")
+            cstring = self.cpu.value_name("overflow_sub")
             res = self.llvm.BuildSub(self.builder, lhs_wide, rhs_wide,
                                      cstring.ptr)
-        elif binop == "*":
-            cstring = CString("overflow_mul")
+        else:
+            cstring = self.cpu.value_name("overflow_mul")
             res = self.llvm.BuildMul(self.builder, lhs_wide, rhs_wide,
                                      cstring.ptr)
 
-        cstring = CString("max_flag")
+        cstring = self.cpu.value_name("max_flag")
         max_flag = self.llvm.BuildICmp(self.builder, self.intsgt, res,
                                        self.max_int, cstring.ptr)
-        cstring = CString("min_flag")
+        cstring = self.cpu.value_name("min_flag")
         min_flag = self.llvm.BuildICmp(self.builder, self.intslt, res,
                                        self.min_int, cstring.ptr)
 
-        cstring = CString("overflow_check")
-        check = self.llvm.BuildOr(self.builder, max_flag, min_flag, cstring.ptr)
-        self.llvm.BuildStore(self.builder, check, self.overflow)
+        cstring = self.cpu.value_name("overflow_flag")
+        self.overflow_flag = self.llvm.BuildOr(self.builder, max_flag,
+                                               min_flag, cstring.ptr)
 
-        cstring = CString("int_add_ovf_res")
+        cstring = self.cpu.value_name("int_ovf_res")
         self.ssa_vars[op] = self.llvm.BuildTrunc(self.builder, res,
                                                  self.cpu.llvm_int_type,
                                                  cstring.ptr)
 
+    def parse_int_add_ovf(self, op):
+        self._parse_int_ovf(op, '+')
+
+    def parse_int_sub_ovf(self, op):
+        self._parse_int_ovf(op, '-')
+
+    def parse_int_mul_ovf(self, op):
+        self._parse_int_ovf(op, '*')
+
+    def vector_type(self, op):
+        """LLVM vector type of the shape the vectoriser gave op"""
+        assert isinstance(op, VectorOp)
+        if op.datatype == 'f':
+            if op.bytesize == 4:
+                elem_type = self.cpu.llvm_single_float_type
+            else:
+                elem_type = self.cpu.llvm_float_type
+        else:
+            elem_type = self.llvm.IntType(self.cpu.context, op.bytesize*8)
+        return self.llvm.VectorType(elem_type, op.count)
+
+    def vector_lanes(self, vec):
+        return rffi.cast(lltype.Signed,
+                         self.llvm.GetVectorSize(self.llvm.TypeOf(vec)))
+
+    def int_vector_type(self, vec, bytesize):
+        lanes = self.vector_lanes(vec)
+        elem_type = self.llvm.IntType(self.cpu.context, bytesize*8)
+        return self.llvm.VectorType(elem_type, lanes)
+
+    def lane_index(self, lane):
+        return self.llvm.ConstInt(self.cpu.llvm_indx_type, lane, 0)
+
+    def shuffle_lanes(self, vec, lanes):
+        """
+        Vector of vec's lanes at the given indices, indices past the end of
+        vec give zeroed lanes.
+        """
+        count = self.vector_lanes(vec)
+        mask_array = self.cpu.value_scratch.fill(
+            [self.lane_index(lane if lane < count else count)
+             for lane in lanes])
+        mask = self.llvm.ConstVector(mask_array, len(lanes))
+        zeros = self.llvm.ConstNull(self.llvm.TypeOf(vec))
+        cstring = self.cpu.value_name("vec_shuffle")
+        return self.llvm.BuildShuffleVector(self.builder, vec, zeros, mask,
+                                            cstring.ptr)
+
+    def resize_vector(self, vec, count):
+        """
+        Casts pack as many lanes as the result has, taking the low ones of
+        their argument.
+        """
+        if self.vector_lanes(vec) == count:
+            return vec
+        return self.shuffle_lanes(vec, range(count))
+
+    def scalar_to_lane(self, arg, vec_type, bytesize):
+        value = self._parse_args([arg])[0][0]
+        cstring = self.cpu.value_name("vec_lane")
+        if arg.type == 'f':
+            if bytesize == 4:
+                elem_type = self.llvm.GetElementType(vec_type)
+                value = self.llvm.BuildFPTrunc(self.builder, value, elem_type,
+                                               cstring.ptr)
+        elif bytesize < self.cpu.WORD:
+            elem_type = self.llvm.GetElementType(vec_type)
+            value = self.llvm.BuildTrunc(self.builder, value, elem_type,
+                                         cstring.ptr)
+        return value
+
+    def lane_to_scalar(self, vec_arg, lane):
+        assert isinstance(vec_arg, VectorOp)
+        vec = self.ssa_vars[vec_arg]
+        cstring = self.cpu.value_name("vec_elem")
+        value = self.llvm.BuildExtractElement(self.builder, vec,
+                                              self.lane_index(lane),
+                                              cstring.ptr)
+        cstring = self.cpu.value_name("vec_scalar")
+        if vec_arg.datatype == 'f':
+            if vec_arg.bytesize == 4:
+                value = self.llvm.BuildFPExt(self.builder, value,
+                                             self.cpu.llvm_float_type,
+                                             cstring.ptr)
+        elif vec_arg.bytesize < self.cpu.WORD:
+            if vec_arg.signed:
+                value = self.llvm.BuildSExt(self.builder, value,
+                                            self.cpu.llvm_int_type,
+                                            cstring.ptr)
+            else:
+                value = self.llvm.BuildZExt(self.builder, value,
+                                            self.cpu.llvm_int_type,
+                                            cstring.ptr)
+        return value
+
+    def reduce_accumulator(self, arg, operation):
+        """
+        Scalar a guard exit hands back for an accumulating vector, all of
+        its lanes summed or multiplied.
+        """
+        assert isinstance(arg, VectorOp)
+        vec = self.ssa_vars[arg]
+        res = self.lane_to_scalar(arg, 0)
+        for lane in range(1, self.vector_lanes(vec)):
+            value = self.lane_to_scalar(arg, lane)
+            cstring = self.cpu.value_name("accum")
+            if arg.type == 'f':
+                if operation == '+':
+                    res = self.llvm.BuildFAdd(self.builder, res, value,
+                                              cstring.ptr)
+                else:
+                    res = self.llvm.BuildFMul(self.builder, res, value,
+                                              cstring.ptr)
+            else:
+                if operation == '+':
+                    res = self.llvm.BuildAdd(self.builder, res, value,
+                                             cstring.ptr)
+                else:
+                    res = self.llvm.BuildMul(self.builder, res, value,
+                                             cstring.ptr)
+        return res
+
+    def accumulated_failargs(self, descr):
+        """Map failarg positions of accumulating vectors to their operation"""
+        accums = {}
+        info = descr.rd_vector_info
+        while info is not None:
+            assert isinstance(info, AccumInfo)
+            accums[info.getpos_in_failargs()] = info.accum_operation
+            info = info.next()
+        return accums
+
+    def frame_slots(self, args):
+        """
+        Jitframe slots args are passed to a label through, vectors take as
+        many consecutive words as they need. Also returns the slots used.
+        """
+        slots = []
+        slot = 1
+        for arg in args:
+            slots.append(slot)
+            if arg.is_vector():
+                assert isinstance(arg, VectorOp)
+                size = arg.bytesize * arg.count
+                slot += (size + self.cpu.WORD - 1) // self.cpu.WORD
+            else:
+                slot += 1
+        return slots, slot - 1
+
+    def frame_vector_ptr(self, slot, vec_type):
+        ptr = self.jitframe.get_ptr(7, slot)
+        cstring = self.cpu.value_name("frame_vec_ptr")
+        return self.llvm.BuildBitCast(self.builder, ptr,
+                                      self.llvm.PointerType(vec_type, 0),
+                                      cstring.ptr)
+
+    def load_frame_vector(self, slot, vec_type):
+        ptr = self.frame_vector_ptr(slot, vec_type)
+        cstring = self.cpu.value_name("frame_vec")
+        load = self.llvm.BuildLoad(self.builder, vec_type, ptr, cstring.ptr)
+        self.llvm.SetAlignment(load, self.cpu.WORD)
+        return load
+
+    def store_frame_vector(self, vec, slot):
+        ptr = self.frame_vector_ptr(slot, self.llvm.TypeOf(vec))
+        store = self.llvm.BuildStore(self.builder, vec, ptr)
+        self.llvm.SetAlignment(store, self.cpu.WORD)
+
+    def vector_intrinsic(self, name, vec_type):
+        """Overloaded intrinsic taking and returning vec_type, e.g. llvm.fabs"""
+        elem_type = self.llvm.GetElementType(vec_type)
+        if elem_type == self.cpu.llvm_single_float_type:
+            suffix = "f32"
+        else:
+            suffix = "f64"
+        lanes = rffi.cast(lltype.Signed, self.llvm.GetVectorSize(vec_type))
+        name = "%s.v%d%s" % (name, lanes, suffix)
+        return self.intrinsic(name, [vec_type], vec_type)
+
+    def parse_vec_load_i(self, op):
+        scale = op.getarg(2).getint()
+        base_ofs = op.getarg(3).getint()
+        offset = self._heap_offset(op.getarg(1), scale, base_ofs)
+        vec_type = self.vector_type(op)
+        ptr = self._heap_addr(op.getarg(0), offset, vec_type)
+        cstring = self.cpu.value_name("vec_load_res")
+        res = self.llvm.BuildLoad(self.builder, vec_type, ptr, cstring.ptr)
+        _, itemsize, _ = self.cpu.unpack_arraydescr_size(op.getdescr())
+        self.llvm.SetAlignment(res, itemsize) #arrays are only aligned to their items
+        self.set_tbaa(res, self.cpu.tbaa_any_tag)
+        self.ssa_vars[op] = res
+
+    parse_vec_load_f = parse_vec_load_i
+
+    def parse_vec_store(self, op):
+        value = self.ssa_vars[op.getarg(2)]
+        scale = op.getarg(3).getint()
+        base_ofs = op.getarg(4).getint()
+        offset = self._heap_offset(op.getarg(1), scale, base_ofs)
+        ptr = self._heap_addr(op.getarg(0), offset, self.llvm.TypeOf(value))
+        store = self.llvm.BuildStore(self.builder, value, ptr)
+        _, itemsize, _ = self.cpu.unpack_arraydescr_size(op.getdescr())
+        self.llvm.SetAlignment(store, itemsize)
+        self.set_tbaa(store, self.cpu.tbaa_any_tag)
+
+    def _parse_vec_binop(self, op, binop):
+        lhs = self.ssa_vars[op.getarg(0)]
+        rhs = self.ssa_vars[op.getarg(1)]
+        cstring = self.cpu.value_name("vec_res")
+        if binop == 'add':
+            res = self.llvm.BuildAdd(self.builder, lhs, rhs, cstring.ptr)
+        elif binop == 'sub':
+            res = self.llvm.BuildSub(self.builder, lhs, rhs, cstring.ptr)
+        elif binop == 'mul':
+            res = self.llvm.BuildMul(self.builder, lhs, rhs, cstring.ptr)
+        elif binop == 'and':
+            res = self.llvm.BuildAnd(self.builder, lhs, rhs, cstring.ptr)
+        elif binop == 'or':
+            res = self.llvm.BuildOr(self.builder, lhs, rhs, cstring.ptr)
+        elif binop == 'xor':
+            res = self.llvm.BuildXor(self.builder, lhs, rhs, cstring.ptr)
+        elif binop == 'fadd':
+            res = self.llvm.BuildFAdd(self.builder, lhs, rhs, cstring.ptr)
+        elif binop == 'fsub':
+            res = self.llvm.BuildFSub(self.builder, lhs, rhs, cstring.ptr)
+        elif binop == 'fmul':
+            res = self.llvm.BuildFMul(self.builder, lhs, rhs, cstring.ptr)
+        else: #binop == 'fdiv'
+            res = self.llvm.BuildFDiv(self.builder, lhs, rhs, cstring.ptr)
+        self.ssa_vars[op] = res
+
+    def parse_vec_int_add(self, op):
+        self._parse_vec_binop(op, 'add')
+
+    def parse_vec_int_sub(self, op):
+        self._parse_vec_binop(op, 'sub')
+
+    def parse_vec_int_mul(self, op):
+        self._parse_vec_binop(op, 'mul')
+
+    def parse_vec_int_and(self, op):
+        self._parse_vec_binop(op, 'and')
+
+    def parse_vec_int_or(self, op):
+        self._parse_vec_binop(op, 'or')
+
+    def parse_vec_int_xor(self, op):
+        self._parse_vec_binop(op, 'xor')
+
+    def parse_vec_float_add(self, op):
+        self._parse_vec_binop(op, 'fadd')
+
+    def parse_vec_float_sub(self, op):
+        self._parse_vec_binop(op, 'fsub')
+
+    def parse_vec_float_mul(self, op):
+        self._parse_vec_binop(op, 'fmul')
+
+    def parse_vec_float_truediv(self, op):
+        self._parse_vec_binop(op, 'fdiv')
+
+    def parse_vec_float_neg(self, op):
+        arg = self.ssa_vars[op.getarg(0)]
+        cstring = self.cpu.value_name("vec_neg_res")
+        self.ssa_vars[op] = self.llvm.BuildFNeg(self.builder, arg, cstring.ptr)
+
+    def parse_vec_float_abs(self, op):
+        arg = self.ssa_vars[op.getarg(0)]
+        func = self.vector_intrinsic("llvm.fabs", self.llvm.TypeOf(arg))
+        arg_array = self.cpu.value_scratch.fill([arg])
+        cstring = self.cpu.value_name("vec_abs_res")
+        self.ssa_vars[op] = self.llvm.BuildCall(self.builder, func, arg_array,
+                                                1, cstring.ptr)
+
+    def parse_vec_float_xor(self, op):
+        lhs = self.ssa_vars[op.getarg(0)]
+        rhs = self.ssa_vars[op.getarg(1)]
+        vec_type = self.llvm.TypeOf(lhs)
+        assert isinstance(op, VectorOp)
+        int_type = self.int_vector_type(lhs, op.bytesize)
+        cstring = self.cpu.value_name("vec_bits")
+        lhs = self.llvm.BuildBitCast(self.builder, lhs, int_type, cstring.ptr)
+        rhs = self.llvm.BuildBitCast(self.builder, rhs, int_type, cstring.ptr)
+        res = self.llvm.BuildXor(self.builder, lhs, rhs, cstring.ptr)
+        cstring = self.cpu.value_name("vec_xor_res")
+        self.ssa_vars[op] = self.llvm.BuildBitCast(self.builder, res, vec_type,
+                                                   cstring.ptr)
+
+    def _mask_to_vector(self, op, mask, arg):
+        """Lanes of all ones or zeros, as wide as arg's, like SIMD compares"""
+        assert isinstance(arg, VectorOp)
+        int_type = self.int_vector_type(mask, arg.bytesize)
+        cstring = self.cpu.value_name("vec_cmp_res")
+        self.ssa_vars[op] = self.llvm.BuildSExt(self.builder, mask, int_type,
+                                                cstring.ptr)
+
+    def _parse_vec_cmp(self, op, pred, is_float):
+        lhs = self.ssa_vars[op.getarg(0)]
+        rhs = self.ssa_vars[op.getarg(1)]
+        cstring = self.cpu.value_name("vec_mask")
+        if is_float:
+            mask = self.llvm.BuildFCmp(self.builder, pred, lhs, rhs,
+                                       cstring.ptr)
+        else:
+            mask = self.llvm.BuildICmp(self.builder, pred, lhs, rhs,
+                                       cstring.ptr)
+        self._mask_to_vector(op, mask, op.getarg(0))
+
+    def parse_vec_int_eq(self, op):
+        self._parse_vec_cmp(op, self.inteq, False)
+
+    def parse_vec_int_ne(self, op):
+        self._parse_vec_cmp(op, self.intne, False)
+
+    def parse_vec_float_eq(self, op):
+        self._parse_vec_cmp(op, self.realeq, True)
+
+    def parse_vec_float_ne(self, op):
+        self._parse_vec_cmp(op, self.realne, True)
+
+    def parse_vec_int_is_true(self, op):
+        arg = self.ssa_vars[op.getarg(0)]
+        zeros = self.llvm.ConstNull(self.llvm.TypeOf(arg))
+        cstring = self.cpu.value_name("vec_mask")
+        mask = self.llvm.BuildICmp(self.builder, self.intne, arg, zeros,
+                                   cstring.ptr)
+        self._mask_to_vector(op, mask, op.getarg(0))
+
+    def parse_vec_int_signext(self, op):
+        arg = op.getarg(0)
+        assert isinstance(arg, VectorOp)
+        assert isinstance(op, VectorOp)
+        vec = self.resize_vector(self.ssa_vars[arg], op.count)
+        vec_type = self.vector_type(op)
+        cstring = self.cpu.value_name("vec_signext_res")
+        if op.bytesize > arg.bytesize:
+            vec = self.llvm.BuildSExt(self.builder, vec, vec_type, cstring.ptr)
+        elif op.bytesize < arg.bytesize:
+            vec = self.llvm.BuildTrunc(self.builder, vec, vec_type, cstring.ptr)
+        self.ssa_vars[op] = vec
+
+    def parse_vec_cast_float_to_int(self, op):
+        assert isinstance(op, VectorOp)
+        vec = self.resize_vector(self.ssa_vars[op.getarg(0)], op.count)
+        cstring = self.cpu.value_name("vec_float_to_int_res")
+        self.ssa_vars[op] = self.llvm.BuildFPToSI(self.builder, vec,
+                                                  self.vector_type(op),
+                                                  cstring.ptr)
+
+    def parse_vec_cast_int_to_float(self, op):
+        assert isinstance(op, VectorOp)
+        vec = self.resize_vector(self.ssa_vars[op.getarg(0)], op.count)
+        cstring = self.cpu.value_name("vec_int_to_float_res")
+        self.ssa_vars[op] = self.llvm.BuildSIToFP(self.builder, vec,
+                                                  self.vector_type(op),
+                                                  cstring.ptr)
+
+    def parse_vec_cast_float_to_singlefloat(self, op):
+        assert isinstance(op, VectorOp)
+        vec = self.resize_vector(self.ssa_vars[op.getarg(0)], op.count)
+        single_type = self.llvm.VectorType(self.cpu.llvm_single_float_type,
+                                           op.count)
+        cstring = self.cpu.value_name("vec_single_floats")
+        vec = self.llvm.BuildFPTrunc(self.builder, vec, single_type,
+                                     cstring.ptr)
+        cstring = self.cpu.value_name("vec_float_to_single_float_res")
+        self.ssa_vars[op] = self.llvm.BuildBitCast(self.builder, vec,
+                                                   self.vector_type(op),
+                                                   cstring.ptr)
+
+    def parse_vec_cast_singlefloat_to_float(self, op):
+        assert isinstance(op, VectorOp)
+        vec = self.resize_vector(self.ssa_vars[op.getarg(0)], op.count)
+        single_type = self.llvm.VectorType(self.cpu.llvm_single_float_type,
+                                           op.count)
+        cstring = self.cpu.value_name("vec_single_floats")
+        vec = self.llvm.BuildBitCast(self.builder, vec, single_type,
+                                     cstring.ptr)
+        cstring = self.cpu.value_name("vec_single_float_to_float_res")
+        self.ssa_vars[op] = self.llvm.BuildFPExt(self.builder, vec,
+                                                 self.vector_type(op),
+                                                 cstring.ptr)
+
+    def parse_vec_i(self, op):
+        self.ssa_vars[op] = self.llvm.ConstNull(self.vector_type(op))
+
+    parse_vec_f = parse_vec_i
+
+    def parse_vec_expand_i(self, op):
+        assert isinstance(op, VectorOp)
+        vec_type = self.vector_type(op)
+        lane = self.scalar_to_lane(op.getarg(0), vec_type, op.bytesize)
+        cstring = self.cpu.value_name("vec_expand")
+        vec = self.llvm.BuildInsertElement(self.builder,
+                                           self.llvm.ConstNull(vec_type),
+                                           lane, self.lane_index(0),
+                                           cstring.ptr)
+        self.ssa_vars[op] = self.shuffle_lanes(vec, [0] * op.count)
+
+    parse_vec_expand_f = parse_vec_expand_i
+
+    def parse_vec_pack_i(self, op):
+        assert isinstance(op, VectorOp)
+        vec = self.resize_vector(self.ssa_vars[op.getarg(0)], op.count)
+        src = op.getarg(1)
+        index = op.getarg(2).getint()
+        count = op.getarg(3).getint()
+        cstring = self.cpu.value_name("vec_pack")
+        if not src.is_vector():
+            lane = self.scalar_to_lane(src, self.llvm.TypeOf(vec), op.bytesize)
+            vec = self.llvm.BuildInsertElement(self.builder, vec, lane,
+                                               self.lane_index(index),
+                                               cstring.ptr)
+        else:
+            src_vec = self.ssa_vars[src]
+            for lane in range(count):
+                elem = self.llvm.BuildExtractElement(self.builder, src_vec,
+                                                     self.lane_index(lane),
+                                                     cstring.ptr)
+                vec = self.llvm.BuildInsertElement(self.builder, vec, elem,
+                                                   self.lane_index(index+lane),
+                                                   cstring.ptr)
+        self.ssa_vars[op] = vec
+
+    parse_vec_pack_f = parse_vec_pack_i
+
+    def parse_vec_unpack_i(self, op):
+        index = op.getarg(1).getint()
+        count = op.getarg(2).getint()
+        if op.is_vector():
+            vec = self.ssa_vars[op.getarg(0)]
+            self.ssa_vars[op] = self.shuffle_lanes(vec, range(index,
+                                                              index+count))
+        else:
+            self.ssa_vars[op] = self.lane_to_scalar(op.getarg(0), index)
+
+    parse_vec_unpack_f = parse_vec_unpack_i
+
+    def _vector_guard_cnd(self, op, pred):
+        """
+        True if no lane of the guarded vector compares to zero with pred,
+        every lane's mask bit gathered into one integer to test at once.
+        """
+        vec = self.ssa_vars[op.getarg(0)]
+        zeros = self.llvm.ConstNull(self.llvm.TypeOf(vec))
+        cstring = self.cpu.value_name("vec_guard_mask")
+        mask = self.llvm.BuildICmp(self.builder, pred, vec, zeros, cstring.ptr)
+        lanes = self.vector_lanes(vec)
+        bits_type = self.llvm.IntType(self.cpu.context, lanes)
+        cstring = self.cpu.value_name("vec_guard_bits")
+        bits = self.llvm.BuildBitCast(self.builder, mask, bits_type,
+                                      cstring.ptr)
+        cstring = self.cpu.value_name("vec_guard_cnd")
+        return self.llvm.BuildICmp(self.builder, self.inteq, bits,
+                                   self.llvm.ConstNull(bits_type), cstring.ptr)
+
+    def parse_vec_guard_true(self, op, resume):
+        self.guard_branch(self._vector_guard_cnd(op, self.inteq), resume)
+
+    def parse_vec_guard_false(self, op, resume):
+        self.guard_branch(self._vector_guard_cnd(op, self.intne), resume)
+
+    def not_implemented_op(self, op):
+        raise Exception("Unimplemented opcode: "+str(op)+"\n Opnum: "+str(op.getopnum()))
+
+    def not_implemented_op_guard(self, op, resume):
+        self.not_implemented_op(op)
+
+    parse_convert_float_bytes_to_longlong = parse_cast_float_to_int #int is already word len
+    parse_convert_longlong_bytes_to_float = parse_cast_int_to_float
+
+op_list = [LLVMOpDispatcher.not_implemented_op] * rop._LAST
+guard_list = [LLVMOpDispatcher.not_implemented_op_guard] * rop._LAST
+
+for name, value in LLVMOpDispatcher.__dict__.iteritems():
+    if name.startswith('parse_guard_') or name.startswith('parse_vec_guard_'):
+        opname = name[len('parse_'):]
+        num = getattr(rop, opname.upper())
+        guard_list[num] = value
+    elif name.startswith('parse_'):
+        opname = name[len('parse_'):]
+        num = getattr(rop, opname.upper())
+        op_list[num] = value
+
 class LLVMArray:
     def __init__(self, dispatcher, elem_type, elem_counts, depth, caller_block,
                  array=None, array_type=None):
@@ -1255,9 +3175,6 @@ class LLVMArray:
         self.elem_type = elem_type
         self.elem_counts = elem_counts
         self.depth = depth
-        indecies = rffi.CArray(self.llvm.ValueRef)
-        self.indecies_array = lltype.malloc(indecies, n=self.depth+1,
-                                            flavor='raw')
         if array_type is None:
             self.array_type = self.get_array_type()
         else:
@@ -1282,10 +3199,7 @@ class LLVMArray:
         """
         instr = self.llvm.GetFirstInstruction(entry)
         self.llvm.PositionBuilderBefore(self.builder, instr)
-        index = self.llvm.ConstInt(self.cpu.llvm_indx_type,
-                                   0, 1)
-        self.indecies_array.__setitem__(0, index) #held array is actually a pointer to the array, will always needs to be deref'ed at indx 0 first
-        cstring = CString("array")
+        cstring = self.cpu.value_name("array")
         array = self.llvm.BuildAlloca(self.builder, self.array_type,
                                       cstring.ptr) #TODO: check for stack overflow
         self.llvm.PositionBuilderAtEnd(self.builder, caller_block)
@@ -1299,7 +3213,7 @@ class LLVMArray:
         """
         ptr = self.get_ptr(*indecies)
         elem_type = self.llvm.getResultElementType(ptr)
-        cstring = CString("array_elem")
+        cstring = self.cpu.value_name("array_elem")
         elem = self.llvm.BuildLoad(self.builder, elem_type,
                                    ptr, cstring.ptr)
         return elem
@@ -1309,22 +3223,16 @@ class LLVMArray:
         self.llvm.BuildStore(self.builder, elem, ptr)
 
     def get_ptr(self, *indecies):
-        for i in range(len(indecies)):
-            index = self.llvm.ConstInt(self.cpu.llvm_indx_type,
-                                       indecies[i], 1)
-            self.indecies_array.__setitem__(i+1, index)
-        cstring = CString("array_elem_ptr")
+        indecies_array = self.dispatcher.gep_indices(indecies) #held array is actually a pointer to the array, will always needs to be deref'ed at indx 0 first
+        cstring = self.cpu.value_name("array_elem_ptr")
         ptr = self.llvm.BuildGEP(self.builder, self.array_type,
-                                 self.array, self.indecies_array,
+                                 self.array, indecies_array,
                                  len(indecies)+1, cstring.ptr)
         return ptr
 
-    def __del__(self):
-        lltype.free(self.indecies_array, flavor='raw')
-
 class LLVMStruct:
     def __init__(self, dispatcher, subtypes, depth, caller_block,
-                 struct=None, struct_type=None):
+                 struct=None, struct_type=None, slot=None):
         self.dispatcher = dispatcher
         self.builder = self.dispatcher.builder
         self.cpu = self.dispatcher.cpu
@@ -1332,11 +3240,6 @@ class LLVMStruct:
         self.subtypes = subtypes #only defined up to depth=1
         self.elem_count = len(subtypes)
         self.depth = depth
-        indecies = rffi.CArray(self.llvm.ValueRef)
-        self.indecies_array = lltype.malloc(indecies, n=self.depth+1,
-                                            flavor='raw')
-        index = self.llvm.ConstInt(self.cpu.llvm_indx_type, 0, 1)
-        self.indecies_array.__setitem__(0, index) #held struct is actually a pointer to the array, will always needs to be deref'ed at indx 0 first
         if struct_type is None:
             self.struct_type = self.get_struct_type()
         else:
@@ -1345,18 +3248,30 @@ class LLVMStruct:
             self.struct = self.allocate_struct(dispatcher.entry, caller_block)
         else:
             self.struct = struct
+        self.slot = slot #holds the struct pointer if it can change, e.g. when the gc moves it
+        if self.slot is not None:
+            self.llvm.BuildStore(self.builder, self.struct, self.slot)
+
+    def get_struct(self):
+        if self.slot is None:
+            return self.struct
+        struct_ptr_type = self.llvm.PointerType(self.struct_type, 0)
+        cstring = self.cpu.value_name("struct")
+        return self.llvm.BuildLoad(self.builder, struct_ptr_type, self.slot,
+                                   cstring.ptr)
+
+    def set_struct(self, struct):
+        if self.slot is None:
+            self.struct = struct
+        else:
+            self.llvm.BuildStore(self.builder, struct, self.slot)
 
     def get_struct_type(self):
-        types_array_type = rffi.CArray(self.llvm.TypeRef)
         packed = 0
-        types_array = lltype.malloc(types_array_type,
-                                    n=self.elem_count, flavor='raw')
-        for c, elem in enumerate(self.subtypes):
-            types_array.__setitem__(c, elem)
+        types_array = self.cpu.type_scratch.fill(self.subtypes)
         struct_type = self.llvm.StructType(self.cpu.context, types_array,
                                            self.elem_count,
                                            packed)
-        lltype.free(types_array, flavor='raw')
         return struct_type
 
     def allocate_struct(self, entry, caller_block):
@@ -1366,7 +3281,7 @@ class LLVMStruct:
         """
         instr = self.llvm.GetFirstInstruction(entry)
         self.llvm.PositionBuilderBefore(self.builder, instr)
-        cstring = CString("struct")
+        cstring = self.cpu.value_name("struct")
         struct = self.llvm.BuildAlloca(self.builder, self.struct_type,
                                       cstring.ptr) #TODO: check for stack overflow
         self.llvm.PositionBuilderAtEnd(self.builder, caller_block)
@@ -1380,7 +3295,7 @@ class LLVMStruct:
         """
         ptr = self.get_ptr(*indecies)
         elem_type = self.llvm.getResultElementType(ptr)
-        cstring = CString("struct_elem")
+        cstring = self.cpu.value_name("struct_elem")
         elem = self.llvm.BuildLoad(self.builder, elem_type, ptr,
                                    cstring.ptr)
         return elem
@@ -1390,15 +3305,10 @@ class LLVMStruct:
         self.llvm.BuildStore(self.builder, elem, ptr)
 
     def get_ptr(self, *indecies):
-        for i in range(len(indecies)):
-            index = self.llvm.ConstInt(self.cpu.llvm_indx_type,
-                                       indecies[i], 1)
-            self.indecies_array.__setitem__(i+1, index)
-        cstring = CString("struct_elem_ptr")
+        struct = self.get_struct()
+        indecies_array = self.dispatcher.gep_indices(indecies) #held struct is actually a pointer to the struct, will always needs to be deref'ed at indx 0 first
+        cstring = self.cpu.value_name("struct_elem_ptr")
         ptr = self.llvm.BuildGEP(self.builder, self.struct_type,
-                                 self.struct, self.indecies_array,
+                                 struct, indecies_array,
                                  len(indecies)+1, cstring.ptr)
         return ptr
-
-    def __del__(self):
-        lltype.free(self.indecies_array, flavor='raw')
@@ -125,12 +125,238 @@ LLVMValueRef getIncomingValueForBlock(LLVMValueRef phi, LLVMBasicBlockRef block)
 	return getIncomingValueForBlock_wrapper(phi, block);
 }
 
-LLVMMCJITMemoryManagerRef CustomMemoryManager(void *Ctx){
-	return LLVMCreateSimpleMCJITMemoryManager(Ctx,
-											  )
+void SetMustTailCall(LLVMValueRef call){
+	setMustTailCall_wrapper(call);
 }
 
-LLVMOrcObjectLayerRef ObjectLinkingLayerCreator(void *Ctx, LLVMOrcExecutionSessionRef ES,
-												const char *Triple){
-	return LLVMOrcCreate
+int RunPasses(LLVMModuleRef mod, LLVMTargetMachineRef tm, const char *pipeline){
+	return runPasses_wrapper(mod, tm, pipeline);
+}
+
+unsigned GetInstructionCount(LLVMModuleRef mod){
+	return getInstructionCount_wrapper(mod);
+}
+
+LLVMMemoryBufferRef EmitObject(LLVMTargetMachineRef tm, LLVMModuleRef module){
+	char *error = NULL;
+	LLVMMemoryBufferRef buffer;
+	if (LLVMTargetMachineEmitToMemoryBuffer(tm, module, LLVMObjectFile, &error, &buffer)){
+		LLVMDisposeMessage(error);
+		return NULL;
+	}
+	return buffer;
+}
+
+LLVMErrorRef DefineAbsoluteSymbol(LLVMOrcLLJITRef jit, LLVMOrcJITDylibRef dylib, const char *name, uint64_t addr){
+	LLVMJITCSymbolMapPair pair;
+	pair.Name = LLVMOrcLLJITMangleAndIntern(jit, name);
+	pair.Sym.Address = addr;
+	pair.Sym.Flags.GenericFlags = LLVMJITSymbolGenericFlagsExported;
+	pair.Sym.Flags.TargetFlags = 0;
+	return LLVMOrcJITDylibDefine(dylib, LLVMOrcAbsoluteSymbols(&pair, 1));
+}
+
+LLVMValueRef BuildGEP1D(LLVMBuilderRef builder, LLVMTypeRef type, LLVMValueRef ptr, LLVMValueRef index, const char *name){
+	return LLVMBuildGEP2(builder, type, ptr, &index, 1, name);
+}
+
+LLVMValueRef BuildGEP2D(LLVMBuilderRef builder, LLVMTypeRef type, LLVMValueRef ptr, LLVMValueRef index1, LLVMValueRef index2, const char *name){
+	LLVMValueRef indices[2] = {index1, index2};
+	return LLVMBuildGEP2(builder, type, ptr, indices, 2, name);
+}
+
+LLVMValueRef BuildGEP3D(LLVMBuilderRef builder, LLVMTypeRef type, LLVMValueRef ptr, LLVMValueRef index1, LLVMValueRef index2, LLVMValueRef index3, const char *name){
+	LLVMValueRef indices[3] = {index1, index2, index3};
+	return LLVMBuildGEP2(builder, type, ptr, indices, 3, name);
+}
+
+/*
+ * Everything below emits a pattern the dispatcher would otherwise build
+ * one LLVM-C call at a time, so a trace op costs a single crossing.
+ * Arrays come from the caller's scratch buffers, see ScratchArray.
+ */
+
+static LLVMValueRef frame_slot(LLVMBuilderRef builder, LLVMTypeRef frame_type, LLVMValueRef frame, unsigned field, unsigned slot){
+	LLVMTypeRef index_type = LLVMInt32TypeInContext(LLVMGetTypeContext(frame_type));
+	LLVMValueRef indices[3] = {LLVMConstInt(index_type, 0, 0),
+							   LLVMConstInt(index_type, field, 0),
+							   LLVMConstInt(index_type, slot, 0)};
+	return LLVMBuildGEP2(builder, frame_type, frame, indices, 3, "");
+}
+
+void LoadFrameArgs(LLVMBuilderRef builder, LLVMTypeRef frame_type, LLVMValueRef frame, unsigned field, unsigned first, LLVMTypeRef *types, LLVMValueRef *values, unsigned count){
+	LLVMTypeRef word_type = LLVMGetElementType(LLVMStructGetTypeAtIndex(frame_type, field));
+	for (unsigned i = 0; i < count; i++){
+		LLVMValueRef ptr = frame_slot(builder, frame_type, frame, field, first+i);
+		LLVMValueRef word = LLVMBuildLoad2(builder, word_type, ptr, "");
+		switch (LLVMGetTypeKind(types[i])){
+			case LLVMDoubleTypeKind:
+				values[i] = LLVMBuildBitCast(builder, word, types[i], "");
+				break;
+			case LLVMPointerTypeKind:
+				values[i] = LLVMBuildIntToPtr(builder, word, types[i], "");
+				break;
+			default:
+				values[i] = word;
+		}
+	}
+}
+
+void StoreFrameArgs(LLVMBuilderRef builder, LLVMTypeRef frame_type, LLVMValueRef frame, unsigned field, unsigned first, LLVMValueRef *values, unsigned count){
+	LLVMTypeRef word_type = LLVMGetElementType(LLVMStructGetTypeAtIndex(frame_type, field));
+	for (unsigned i = 0; i < count; i++){
+		LLVMValueRef value = values[i];
+		if (value == NULL) //hole in the failargs
+			continue;
+		LLVMTypeRef type = LLVMTypeOf(value);
+		switch (LLVMGetTypeKind(type)){
+			case LLVMDoubleTypeKind:
+				value = LLVMBuildBitCast(builder, value, word_type, "");
+				break;
+			case LLVMPointerTypeKind:
+				value = LLVMBuildPtrToInt(builder, value, word_type, "");
+				break;
+			default:
+				if (LLVMGetIntTypeWidth(type) == 1) //comparison results are 0 or 1, not -1
+					value = LLVMBuildZExt(builder, value, word_type, "");
+				else if (LLVMGetIntTypeWidth(type) < LLVMGetIntTypeWidth(word_type))
+					value = LLVMBuildSExt(builder, value, word_type, "");
+		}
+		LLVMValueRef ptr = frame_slot(builder, frame_type, frame, field, first+i);
+		LLVMBuildStore(builder, value, ptr);
+	}
+}
+
+LLVMValueRef BuildGuardBranch(LLVMBuilderRef builder, LLVMValueRef cnd, LLVMBasicBlockRef then_block, LLVMBasicBlockRef else_block, unsigned prof_kind, LLVMMetadataRef weights, LLVMBasicBlockRef resume){
+	LLVMValueRef branch = LLVMBuildCondBr(builder, cnd, then_block, else_block);
+	LLVMContextRef ctx = LLVMGetTypeContext(LLVMTypeOf(cnd));
+	LLVMSetMetadata(branch, prof_kind, LLVMMetadataAsValue(ctx, weights));
+	LLVMPositionBuilderAtEnd(builder, resume);
+	return branch;
+}
+
+LLVMValueRef BuildOverflowOp(LLVMBuilderRef builder, LLVMValueRef intrinsic, LLVMValueRef lhs, LLVMValueRef rhs, LLVMValueRef *flag){
+	LLVMValueRef args[2] = {lhs, rhs};
+	LLVMValueRef res = LLVMBuildCall2(builder, LLVMGlobalGetValueType(intrinsic), intrinsic, args, 2, "");
+	*flag = LLVMBuildExtractValue(builder, res, 1, "");
+	return LLVMBuildExtractValue(builder, res, 0, "");
+}
+
+LLVMValueRef BuildCallAddress(LLVMBuilderRef builder, LLVMValueRef func_addr, LLVMTypeRef ret_type, LLVMTypeRef *param_types, LLVMValueRef *args, unsigned count, const char *name){
+	for (unsigned i = 0; i < count; i++){ //fit words to the C type of the parameter
+		LLVMTypeRef arg_type = LLVMTypeOf(args[i]);
+		if (LLVMGetTypeKind(arg_type) != LLVMIntegerTypeKind ||
+			LLVMGetTypeKind(param_types[i]) != LLVMIntegerTypeKind)
+			continue;
+		unsigned arg_width = LLVMGetIntTypeWidth(arg_type);
+		unsigned param_width = LLVMGetIntTypeWidth(param_types[i]);
+		if (arg_width > param_width)
+			args[i] = LLVMBuildTrunc(builder, args[i], param_types[i], "");
+		else if (arg_width < param_width && arg_width == 1) //comparison results are 0 or 1, not -1
+			args[i] = LLVMBuildZExt(builder, args[i], param_types[i], "");
+		else if (arg_width < param_width)
+			args[i] = LLVMBuildSExt(builder, args[i], param_types[i], "");
+	}
+	LLVMTypeRef func_type = LLVMFunctionType(ret_type, param_types, count, 0);
+	LLVMValueRef func = LLVMBuildIntToPtr(builder, func_addr, LLVMPointerType(func_type, 0), "");
+	return LLVMBuildCall2(builder, func_type, func, args, count, name);
+}
+
+LLVMValueRef BuildReleaseStore(LLVMBuilderRef builder, LLVMValueRef value, LLVMValueRef ptr){
+	LLVMValueRef store = LLVMBuildStore(builder, value, ptr);
+	LLVMSetOrdering(store, LLVMAtomicOrderingRelease);
+	LLVMSetAlignment(store, LLVMGetIntTypeWidth(LLVMTypeOf(value))/8);
+	return store;
+}
+
+LLVMValueRef BuildCompareAndSwap(LLVMBuilderRef builder, LLVMValueRef ptr, LLVMValueRef cmp, LLVMValueRef new_value, const char *name){
+	LLVMValueRef res = LLVMBuildAtomicCmpXchg(builder, ptr, cmp, new_value,
+											  LLVMAtomicOrderingSequentiallyConsistent,
+											  LLVMAtomicOrderingSequentiallyConsistent, 0);
+	return LLVMBuildExtractValue(builder, res, 1, name); //the success bit
+}
+
+/*
+ * Link src into dest with every function src defines made available
+ * externally, so LLVM can inline them into dest while their code stays
+ * in src's own object. Consumes src.
+ */
+LLVMBool LinkForInlining(LLVMModuleRef dest, LLVMModuleRef src){
+	for (LLVMValueRef func = LLVMGetFirstFunction(src); func; func = LLVMGetNextFunction(func)){
+		if (!LLVMIsDeclaration(func))
+			LLVMSetLinkage(func, LLVMAvailableExternallyLinkage);
+	}
+	return LLVMLinkModules2(dest, src);
+}
+
+/*
+ * Sizes of the symbols in the objects the JIT links, which ORC's C API
+ * doesn't give out. Taken from each object on its way through the JIT's
+ * object transform layer, until the CPU asks for them.
+ */
+struct SymbolSize {
+	char *name;
+	uint64_t size;
+	struct SymbolSize *next;
+};
+
+struct SymbolSizes {
+	struct SymbolSize *head;
+};
+
+static LLVMErrorRef record_symbol_sizes(void *ctx, LLVMMemoryBufferRef *obj){
+	struct SymbolSizes *sizes = (struct SymbolSizes *)ctx;
+	char *error = NULL;
+	LLVMBinaryRef binary = LLVMCreateBinary(*obj, NULL, &error);
+	if (binary == NULL){ //not ours to reject, the linker reports it
+		LLVMDisposeMessage(error);
+		return NULL;
+	}
+	LLVMSymbolIteratorRef sym = LLVMObjectFileCopySymbolIterator(binary);
+	for (; !LLVMObjectFileIsSymbolIteratorAtEnd(binary, sym); LLVMMoveToNextSymbol(sym)){
+		uint64_t size = LLVMGetSymbolSize(sym);
+		const char *name = LLVMGetSymbolName(sym);
+		if (size == 0 || name == NULL || name[0] == '\0')
+			continue;
+		struct SymbolSize *entry = malloc(sizeof(struct SymbolSize));
+		entry->name = strdup(name);
+		entry->size = size;
+		entry->next = sizes->head;
+		sizes->head = entry;
+	}
+	LLVMDisposeSymbolIterator(sym);
+	LLVMDisposeBinary(binary);
+	return NULL;
+}
+
+struct SymbolSizes *CreateSymbolSizes(void){
+	return calloc(1, sizeof(struct SymbolSizes));
+}
+
+void RecordSymbolSizes(LLVMOrcLLJITRef jit, struct SymbolSizes *sizes){
+	LLVMOrcObjectTransformLayerSetTransform(LLVMOrcLLJITGetObjTransformLayer(jit),
+											record_symbol_sizes, sizes);
+}
+
+uint64_t TakeSymbolSize(struct SymbolSizes *sizes, const char *name){
+	for (struct SymbolSize **entry = &sizes->head; *entry; entry = &(*entry)->next){
+		if (strcmp((*entry)->name, name) == 0){
+			struct SymbolSize *found = *entry;
+			uint64_t size = found->size;
+			*entry = found->next;
+			free(found->name);
+			free(found);
+			return size;
+		}
+	}
+	return 0;
+}
+
+void ClearSymbolSizes(struct SymbolSizes *sizes){
+	while (sizes->head){
+		struct SymbolSize *entry = sizes->head;
+		sizes->head = entry->next;
+		free(entry->name);
+		free(entry);
+	}
 }
@@ -8,6 +8,10 @@
 #include <llvm-c/ExecutionEngine.h>
 #include <llvm-c/Core.h>
 #include <llvm-c/LLJIT.h>
+#include <llvm-c/Linker.h>
+#include <llvm-c/Object.h>
+#include <stdint.h>
+#include <string.h>
 #include <stdlib.h>
 #include <stddef.h>
 #include <stdio.h>
@@ -74,3 +78,51 @@ void dumpModule(LLVMModuleRef mod);
 void dumpBasicBlock(LLVMBasicBlockRef block);
 
 LLVMValueRef getIncomingValueForBlock(LLVMValueRef phi, LLVMBasicBlockRef block);
+
+void SetMustTailCall(LLVMValueRef call);
+
+int RunPasses(LLVMModuleRef mod, LLVMTargetMachineRef tm, const char *pipeline);
+
+unsigned GetInstructionCount(LLVMModuleRef mod);
+
+LLVMMemoryBufferRef EmitObject(LLVMTargetMachineRef tm, LLVMModuleRef module);
+
+LLVMErrorRef DefineAbsoluteSymbol(LLVMOrcLLJITRef jit, LLVMOrcJITDylibRef dylib, const char *name, uint64_t addr);
+
+long GetSizeOf(LLVMTypeRef typ);
+
+void SetJITEnums(struct JITEnums *enums);
+
+void SetCmpEnums(struct CmpEnums *enums);
+
+LLVMValueRef BuildGEP1D(LLVMBuilderRef builder, LLVMTypeRef type, LLVMValueRef ptr, LLVMValueRef index, const char *name);
+
+LLVMValueRef BuildGEP2D(LLVMBuilderRef builder, LLVMTypeRef type, LLVMValueRef ptr, LLVMValueRef index1, LLVMValueRef index2, const char *name);
+
+LLVMValueRef BuildGEP3D(LLVMBuilderRef builder, LLVMTypeRef type, LLVMValueRef ptr, LLVMValueRef index1, LLVMValueRef index2, LLVMValueRef index3, const char *name);
+
+void LoadFrameArgs(LLVMBuilderRef builder, LLVMTypeRef frame_type, LLVMValueRef frame, unsigned field, unsigned first, LLVMTypeRef *types, LLVMValueRef *values, unsigned count);
+
+void StoreFrameArgs(LLVMBuilderRef builder, LLVMTypeRef frame_type, LLVMValueRef frame, unsigned field, unsigned first, LLVMValueRef *values, unsigned count);
+
+LLVMValueRef BuildGuardBranch(LLVMBuilderRef builder, LLVMValueRef cnd, LLVMBasicBlockRef then_block, LLVMBasicBlockRef else_block, unsigned prof_kind, LLVMMetadataRef weights, LLVMBasicBlockRef resume);
+
+LLVMValueRef BuildOverflowOp(LLVMBuilderRef builder, LLVMValueRef intrinsic, LLVMValueRef lhs, LLVMValueRef rhs, LLVMValueRef *flag);
+
+LLVMValueRef BuildCallAddress(LLVMBuilderRef builder, LLVMValueRef func_addr, LLVMTypeRef ret_type, LLVMTypeRef *param_types, LLVMValueRef *args, unsigned count, const char *name);
+
+LLVMValueRef BuildReleaseStore(LLVMBuilderRef builder, LLVMValueRef value, LLVMValueRef ptr);
+
+LLVMValueRef BuildCompareAndSwap(LLVMBuilderRef builder, LLVMValueRef ptr, LLVMValueRef cmp, LLVMValueRef new_value, const char *name);
+
+LLVMBool LinkForInlining(LLVMModuleRef dest, LLVMModuleRef src);
+
+struct SymbolSizes;
+
+struct SymbolSizes *CreateSymbolSizes(void);
+
+void RecordSymbolSizes(LLVMOrcLLJITRef jit, struct SymbolSizes *sizes);
+
+uint64_t TakeSymbolSize(struct SymbolSizes *sizes, const char *name);
+
+void ClearSymbolSizes(struct SymbolSizes *sizes);
@@ -5,6 +5,10 @@
 #include <llvm/IR/Module.h>
 #include <llvm/ADT/APInt.h>
 #include <llvm/Support/raw_ostream.h>
+#include <llvm/Analysis/AliasAnalysis.h>
+#include <llvm/Config/llvm-config.h>
+#include <llvm/Passes/PassBuilder.h>
+#include <llvm/Target/TargetMachine.h>
 #include <cstddef>
 #include <sys/types.h>
 #include <stdio.h>
@@ -63,6 +67,44 @@ extern "C"{
         PHINode *phi_node = cast<PHINode>(unwrap(phi));
         return wrap(phi_node->getIncomingValueForBlock(basic_block));
     }
+
+    void setMustTailCall_wrapper(LLVMValueRef call){
+        CallInst *call_inst = cast<CallInst>(unwrap(call));
+        call_inst->setTailCallKind(CallInst::TCK_MustTail);
+    }
+
+    int runPasses_wrapper(LLVMModuleRef mod, LLVMTargetMachineRef tm, const char *pipeline){
+        //new pass manager, with a NULL module this only checks the pipeline parses
+        TargetMachine *target_machine = reinterpret_cast<TargetMachine *>(tm);
+#if LLVM_VERSION_MAJOR >= 13
+        PassBuilder pass_builder(target_machine);
+#else
+        PassBuilder pass_builder(false, target_machine); //DebugLogging went in 13
+#endif
+        LoopAnalysisManager lam;
+        FunctionAnalysisManager fam;
+        CGSCCAnalysisManager cgam;
+        ModuleAnalysisManager mam;
+        fam.registerPass([&]{ return pass_builder.buildDefaultAAPipeline(); }); //includes TBAA
+        pass_builder.registerModuleAnalyses(mam);
+        pass_builder.registerCGSCCAnalyses(cgam);
+        pass_builder.registerFunctionAnalyses(fam);
+        pass_builder.registerLoopAnalyses(lam);
+        pass_builder.crossRegisterProxies(lam, fam, cgam, mam);
+        ModulePassManager mpm;
+        if (Error err = pass_builder.parsePassPipeline(mpm, pipeline)){
+            consumeError(std::move(err));
+            return 1;
+        }
+        if (mod != NULL){
+            mpm.run(*unwrap(mod), mam);
+        }
+        return 0;
+    }
+
+    unsigned getInstructionCount_wrapper(LLVMModuleRef mod){
+        return unwrap(mod)->getInstructionCount();
+    }
 #ifdef __cplusplus
 }
 #endif
@@ -1,4 +1,5 @@
 #include <llvm-c/Core.h>
+#include <llvm-c/TargetMachine.h>
 #include <sys/types.h>
 
 #ifdef __cplusplus
@@ -21,6 +22,12 @@ extern "C"{
     void dumpBasicBlock_wrapper(LLVMBasicBlockRef block);
 
     LLVMValueRef getIncomingValueForBlock_wrapper(LLVMValueRef phi, LLVMBasicBlockRef block);
+
+    void setMustTailCall_wrapper(LLVMValueRef call);
+
+    int runPasses_wrapper(LLVMModuleRef mod, LLVMTargetMachineRef tm, const char *pipeline);
+
+    unsigned getInstructionCount_wrapper(LLVMModuleRef mod);
 #ifdef __cplusplus
 }
 #endif
@@ -0,0 +1,134 @@
+"""
+Opt-in on-disk cache of the object code LLVM produces for traces, so that
+processes started from the same interpreter binary don't have to run the
+pass pipeline and codegen again for loops an earlier process already
+compiled. Enabled with --jit llvm_cache=<directory>.
+
+Entries are keyed by a hash of the module's unoptimised IR together with
+the salt: the interpreter binary, the host CPU and its features, and the
+pass pipeline and codegen level. The object code is a pure function of
+all of those, so a hit is exactly what compiling the module would have
+produced. Addresses only valid in one process (guard descrs, bridge
+slots, gc tables...) aren't part of the IR while the cache is on, traces
+load them from a per-module relocation table instead, see
+LLVMOpDispatcher.address.
+
+The directory can be shared by many processes: entries are written to a
+temporary file and renamed into place, and once the directory grows past
+its size cap the least recently used entries are removed. Entries made by
+a different interpreter binary can never be hit, they just age out.
+"""
+
+import os
+from rpython.rlib import rsha
+from rpython.rlib.rwholefile import read_whole_file, replace_file
+from rpython.rlib.listsort import make_timsort_class
+
+SUFFIX = ".o"
+RELOC_TABLE = "reloc_table" #placeholder name of a module's relocation table while it's hashed
+
+
+class CacheEntry(object):
+    def __init__(self, name, size, mtime):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+
+EntrySort = make_timsort_class(lt=lambda a, b: a.mtime < b.mtime)
+
+
+def interpreter_salt(executable):
+    """Identifies the interpreter binary, changes whenever it's rebuilt"""
+    try:
+        st = os.stat(executable)
+    except OSError:
+        return executable
+    return "%s:%d:%d" % (executable, st.st_size, int(st.st_mtime))
+
+
+class ObjectCache(object):
+    def __init__(self, path, max_size, salt):
+        self.path = path
+        self.max_size = max_size #in bytes
+        self.salt = salt
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        try:
+            os.mkdir(path)
+        except OSError:
+            pass #already exists, or we'll find out when storing
+        self.total_size = 0
+        for entry in self.list_entries():
+            self.total_size += entry.size
+
+    def make_key(self, ir_text, config):
+        """config describes how the IR is compiled, e.g. the pass pipeline"""
+        return rsha.new(self.salt + "\n" + config + "\n" + ir_text).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key + SUFFIX)
+
+    def lookup(self, key):
+        """Object code stored under key, or None"""
+        filename = self.filename(key)
+        try:
+            data = read_whole_file(filename)
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(filename, None) #mark as recently used
+        except OSError:
+            pass #evicted by another process in the meantime, we have the data anyway
+        self.hits += 1
+        return data
+
+    def store(self, key, data):
+        try:
+            replace_file(self.filename(key), data) #readers never see half an entry
+        except OSError:
+            return #not cached, compiled again by the next process
+        self.total_size += len(data)
+        if self.total_size > self.max_size:
+            self.evict()
+
+    def list_entries(self):
+        entries = []
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append(CacheEntry(name, st.st_size, st.st_mtime))
+        return entries
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is back to 3/4
+        of its cap, so we don't rescan the directory on every store.
+        Other processes write here too, so the running total is
+        recomputed from the directory first.
+        """
+        entries = self.list_entries()
+        total_size = 0
+        for entry in entries:
+            total_size += entry.size
+        EntrySort(entries).sort()
+        target = self.max_size // 4 * 3
+        for entry in entries:
+            if total_size <= target:
+                break
+            try:
+                os.unlink(os.path.join(self.path, entry.name))
+            except OSError:
+                continue
+            total_size -= entry.size
+            self.evictions += 1
+        self.total_size = total_size
@@ -1,21 +1,290 @@
+"""
+The IR pass pipeline run on every module before it's handed to the JIT.
+Pipelines are described by the string given to --jit llvm_passes=..., one of:
+
+  * a preset: O0, O1, O2, O3, trace-tuned (the default) or trace-loops,
+    which adds LLVM's loop optimisations to trace-tuned
+  * a ':' separated list of legacy passes and presets, as opt names them,
+    e.g. "trace-tuned:licm:loop-unroll"
+  * "npm/" followed by a pipeline for the new pass manager, in the syntax of
+    opt -passes=, e.g. "npm/default<O2>". --jit already uses ',' to separate
+    parameters, so ':' is accepted in its place here.
+
+Presets also choose the codegen optimisation level of the JIT's target machine.
+"""
+
+import time
+from rpython.rtyper.lltypesystem import lltype, rffi
+from rpython.rlib.unroll import unrolling_iterable
+from rpython.rlib.jit import Counters
+from rpython.rlib.debug import (debug_start, debug_stop, debug_print,
+                                have_debug_prints)
+from rpython.jit.backend.llvm.llvm_api import CString
+
+#map legacy pass names to the llvm_api function adding them to a pass manager
+LEGACY_PASSES = {
+    'inline': 'AddFunctionInliningPass',
+    'basicaa': 'AddBasicAliasAnalysisPass',
+    'tbaa': 'AddTypeBasedAliasAnalysisPass',
+    'sroa': 'AddScalarReplAggregatesPass',
+    'mem2reg': 'AddPromoteMemoryToRegisterPass',
+    'early-cse': 'AddEarlyCSEPass',
+    'instcombine': 'AddInstructionCombiningPass',
+    'reassociate': 'AddReassociatePass',
+    'gvn': 'AddGVNPass',
+    'sccp': 'AddSCCPPass',
+    'dse': 'AddDeadStoreEliminationPass',
+    'adce': 'AddAggressiveDCEPass',
+    'indvars': 'AddIndVarSimplifyPass',
+    'licm': 'AddLICMPass',
+    'loop-rotate': 'AddLoopRotatePass',
+    'loop-unroll': 'AddLoopUnrollPass',
+    'loop-deletion': 'AddLoopDeletionPass',
+    'jump-threading': 'AddJumpThreadingPass',
+    'correlated-propagation': 'AddCorrelatedValuePropagationPass',
+    'memcpyopt': 'AddMemCpyOptPass',
+    'tailcallelim': 'AddTailCallEliminationPass',
+    'slp-vectorizer': 'AddSLPVectorizePass',
+    'loop-vectorize': 'AddLoopVectorizePass',
+    'simplifycfg': 'AddCFGSimplificationPass',
+}
+unroll_legacy_passes = unrolling_iterable(LEGACY_PASSES.items())
+ALIAS_ANALYSES = ('basicaa', 'tbaa') #only make sense alongside other passes
+
+#LLVMCodeGenOptLevel
+CODEGEN_NONE = 0
+CODEGEN_LESS = 1
+CODEGEN_DEFAULT = 2
+CODEGEN_AGGRESSIVE = 3
+
+#the heap accesses we emit carry tbaa tags, and call_assembler targets are
+#linked into the module for the inliner, see call_assembler_target
+TRACE_TUNED_PASSES = ['tbaa', 'basicaa', 'inline', 'instcombine', 'reassociate',
+                      'gvn', 'sroa', 'indvars', 'simplifycfg']
+TRACE_LOOP_PASSES = TRACE_TUNED_PASSES + ['licm', 'loop-unroll',
+                                         'loop-vectorize', 'slp-vectorizer',
+                                         'instcombine', 'simplifycfg'] #labels are emitted as canonical loops, see parse_label
+O1_PASSES = ['sroa', 'early-cse', 'instcombine', 'simplifycfg']
+O2_PASSES = ['tbaa', 'basicaa', 'inline', 'sroa', 'early-cse', 'instcombine',
+             'reassociate', 'gvn', 'sccp', 'dse', 'indvars', 'licm',
+             'simplifycfg']
+O3_PASSES = O2_PASSES + ['loop-rotate', 'licm', 'loop-unroll',
+                         'jump-threading', 'correlated-propagation', 'gvn',
+                         'memcpyopt', 'dse', 'slp-vectorizer',
+                         'loop-vectorize', 'instcombine', 'adce',
+                         'simplifycfg']
+
+#map preset names to their legacy passes and codegen level
+PRESETS = {
+    'O0': ([], CODEGEN_NONE),
+    'O1': (O1_PASSES, CODEGEN_LESS),
+    'O2': (O2_PASSES, CODEGEN_DEFAULT),
+    'O3': (O3_PASSES, CODEGEN_AGGRESSIVE),
+    'trace-tuned': (TRACE_TUNED_PASSES, CODEGEN_AGGRESSIVE),
+    'trace-loops': (TRACE_LOOP_PASSES, CODEGEN_AGGRESSIVE),
+}
+NEW_PM_PRESETS = {
+    'O0': 'default<O0>',
+    'O1': 'default<O1>',
+    'O2': 'default<O2>',
+    'O3': 'default<O3>',
+    'trace-tuned': 'cgscc(inline),function(instcombine,reassociate,gvn,sroa,'
+                   'indvars,simplifycfg)', #new pm sets up alias analysis itself
+    'trace-loops': 'cgscc(inline),function(instcombine,reassociate,gvn,sroa,'
+                   'indvars,simplifycfg,loop-mssa(licm),loop-unroll,'
+                   'loop-vectorize,slp-vectorizer,instcombine,simplifycfg)',
+}
+DEFAULT_PIPELINE = 'trace-tuned'
+
+
+class PassPipeline(object):
+    """A parsed llvm_passes string"""
+    def __init__(self, text, passes, new_pm, codegen_level):
+        self.text = text
+        self.passes = passes #legacy pass names, or the top level passes of a new pm pipeline
+        self.new_pm = new_pm
+        self.codegen_level = codegen_level
+
+    def new_pm_pipeline(self):
+        return ",".join(self.passes)
+
+
+def split_pipeline(text):
+    """Split a new pass manager pipeline at its top level commas"""
+    parts = []
+    depth = 0
+    start = 0
+    for i in range(len(text)):
+        c = text[i]
+        if c == '(' or c == '<':
+            depth += 1
+        elif c == ')' or c == '>':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [part for part in parts if part]
+
+def parse_pipeline(text):
+    if not text:
+        text = DEFAULT_PIPELINE
+    if text.startswith('npm/'):
+        pipeline = text[4:].replace(':', ',')
+        if pipeline in PRESETS:
+            codegen_level = PRESETS[pipeline][1]
+            pipeline = NEW_PM_PRESETS[pipeline]
+        else:
+            codegen_level = CODEGEN_DEFAULT
+        passes = split_pipeline(pipeline)
+        if not passes:
+            raise ValueError("Empty LLVM pass pipeline")
+        return PassPipeline(text, passes, True, codegen_level)
+    passes = []
+    codegen_level = CODEGEN_DEFAULT
+    for name in text.replace(',', ':').split(':'):
+        if not name:
+            continue
+        if name in PRESETS:
+            preset_passes, codegen_level = PRESETS[name]
+            passes.extend(preset_passes)
+        elif name in LEGACY_PASSES:
+            passes.append(name)
+        else:
+            raise ValueError("Unknown LLVM pass " + name)
+    return PassPipeline(text, passes, False, codegen_level)
+
+
+class PassStats(object):
+    def __init__(self, name):
+        self.name = name
+        self.runs = 0
+        self.seconds = 0.0
+        self.instrs_removed = 0 #net IR instructions, negative if the pass grew the code
+
+
 class LLVMOptimiser:
+    """
+    Runs the current pipeline over modules. While jit-llvm-passes is being
+    logged every pass is run and timed on its own, so the log gets the
+    compile time and IR size change of each pass.
+    """
     def __init__(self, cpu):
         self.cpu = cpu
         self.llvm = cpu.llvm
         self.debug = cpu.debug
-        self.pass_manager = self.llvm.CreatePassManager(None)
-
-    def populate_default_passes(self):
-        self.llvm.AddInstructionCombiningPass(self.pass_manager)
-        self.llvm.AddReassociatePass(self.pass_manager)
-        self.llvm.AddGVNPass(self.pass_manager)
-        self.llvm.AddScalarReplAggregatesPass(self.pass_manager)
-        self.llvm.AddIndVarSimplifyPass(self.pass_manager)
-        self.llvm.AddCFGSimplificationPass(self.pass_manager)
-
-    def run_default_passes(self, module, populate=False):
-        if populate:
-            self.populate_default_passes()
-        self.llvm.RunPassManager(self.pass_manager, module)
+        self.target_machine = lltype.nullptr(rffi.VOIDP.TO) #set by the assembler, gives the new pm target info
+        self.pass_manager = lltype.nullptr(rffi.VOIDP.TO)
+        self.profiling_pass_managers = [] #one per pass, created on first use
+        self.stats = {} #map pass names to their PassStats
+        self.total = PassStats("total")
+        self.set_pipeline(DEFAULT_PIPELINE)
+
+    def set_pipeline(self, text):
+        """Raises ValueError if text isn't a valid pipeline"""
+        pipeline = parse_pipeline(text)
+        if pipeline.new_pm:
+            cstring = CString(pipeline.new_pm_pipeline())
+            if self.llvm.RunPasses(lltype.nullptr(rffi.VOIDP.TO),
+                                   self.target_machine, cstring.ptr): #checks the pipeline parses
+                raise ValueError("Invalid LLVM pass pipeline " + text)
+        self.dispose_pass_managers()
+        self.pipeline = pipeline
+        if not pipeline.new_pm:
+            self.pass_manager = self.create_pass_manager(pipeline.passes)
+
+    def create_pass_manager(self, passes):
+        pass_manager = self.llvm.CreatePassManager(None)
+        for name in passes:
+            for pass_name, func_name in unroll_legacy_passes:
+                if pass_name == name:
+                    getattr(self.llvm, func_name)(pass_manager)
+        return pass_manager
+
+    def dispose_pass_managers(self):
+        if self.pass_manager:
+            self.llvm.DisposePassManager(self.pass_manager)
+            self.pass_manager = lltype.nullptr(rffi.VOIDP.TO)
+        for pass_manager in self.profiling_pass_managers:
+            if pass_manager:
+                self.llvm.DisposePassManager(pass_manager)
+        self.profiling_pass_managers = []
+
+    def get_profiling_pass_manager(self, index):
+        if not self.profiling_pass_managers:
+            alias_analyses = [name for name in self.pipeline.passes
+                              if name in ALIAS_ANALYSES]
+            for name in self.pipeline.passes:
+                if name in ALIAS_ANALYSES:
+                    pass_manager = lltype.nullptr(rffi.VOIDP.TO)
+                else:
+                    pass_manager = self.create_pass_manager(alias_analyses +
+                                                            [name])
+                self.profiling_pass_managers.append(pass_manager)
+        return self.profiling_pass_managers[index]
+
+    def run(self, module):
+        debug_start("jit-llvm-passes")
+        start = time.time()
+        before = self.instruction_count(module)
+        if have_debug_prints():
+            self.run_profiled(module)
+        elif self.pipeline.new_pm:
+            cstring = CString(self.pipeline.new_pm_pipeline())
+            self.llvm.RunPasses(module, self.target_machine, cstring.ptr)
+        else:
+            self.llvm.RunPassManager(self.pass_manager, module)
+        seconds = time.time() - start
+        after = self.instruction_count(module)
+        self.record(self.total, seconds, before, after)
+        self.cpu.tracker.compile_stats.phase_done(Counters.LLVM_OPTIMISE,
+                                                  seconds)
+        debug_print("total", self.pipeline.text, before, "->", after,
+                    "instrs", int(seconds * 1000000), "us")
+        debug_stop("jit-llvm-passes")
         if self.debug:
             self.cpu.write_ir(module, "opt")
+        return seconds
+
+    def run_profiled(self, module):
+        for index in range(len(self.pipeline.passes)):
+            name = self.pipeline.passes[index]
+            before = self.instruction_count(module)
+            start = time.time()
+            if self.pipeline.new_pm:
+                cstring = CString(name)
+                self.llvm.RunPasses(module, self.target_machine, cstring.ptr)
+            else:
+                pass_manager = self.get_profiling_pass_manager(index)
+                if not pass_manager: #alias analysis, runs with every other pass
+                    continue
+                self.llvm.RunPassManager(pass_manager, module)
+            seconds = time.time() - start
+            after = self.instruction_count(module)
+            self.record(self.get_stats(name), seconds, before, after)
+            debug_print(name, before, "->", after, "instrs",
+                        int(seconds * 1000000), "us")
+
+    def instruction_count(self, module):
+        return rffi.cast(lltype.Signed, self.llvm.GetInstructionCount(module))
+
+    def get_stats(self, name):
+        try:
+            return self.stats[name]
+        except KeyError:
+            stats = PassStats(name)
+            self.stats[name] = stats
+            return stats
+
+    def record(self, stats, seconds, before, after):
+        stats.runs += 1
+        stats.seconds += seconds
+        stats.instrs_removed += before - after
+
+    def report_stats(self):
+        debug_start("jit-llvm-passes-summary")
+        for stats in self.stats.values() + [self.total]:
+            debug_print(stats.name, stats.runs, "runs",
+                        int(stats.seconds * 1000000), "us",
+                        stats.instrs_removed, "instrs removed")
+        debug_stop("jit-llvm-passes-summary")
@@ -0,0 +1,14 @@
+from rpython.jit.backend.llsupport.rewrite import GcRewriterAssembler
+
+class LLVMRewriterAssembler(GcRewriterAssembler):
+    """
+    The llsupport rewriter, minus the parts LLVM does better itself. Field
+    and array accesses keep their descrs so they can be given TBAA tags,
+    instead of becoming gc_load/gc_store, and string copies stay as ops so
+    they can be lowered to LLVM's memcpy intrinsic.
+    """
+    def transform_to_gc_load(self, op):
+        return False
+
+    def rewrite_copy_str_content(self, op):
+        self.emit_op(op)
@@ -1,30 +1,162 @@
 from rpython.jit.backend.llsupport.llmodel import AbstractLLCPU, jitframe
 from rpython.jit.backend.model import CPUTotalTracker
-from rpython.rtyper.lltypesystem import rffi, lltype
-from rpython.jit.backend.llvm.llvm_api import LLVMAPI, CString
-from rpython.jit.backend.llvm.llvm_parse_ops import LLVMOpDispatcher
+from rpython.jit.backend.llsupport.codemap import CodemapBuilder
+from rpython.jit.backend.x86.profagent import ProfileAgent
+from rpython.jit.backend.x86.perfmap import PerfMapAgent
+from rpython.rtyper.lltypesystem import rffi, lltype, llmemory
+from rpython.rtyper.lltypesystem.rffi import constcharp2str
+from rpython.jit.backend.llvm.llvm_api import LLVMAPI, CString, ScratchArray
+from rpython.jit.backend.llvm.llvm_parse_ops import (LLVMOpDispatcher,
+                                                     GUARD_HOT_WEIGHT)
 from rpython.jit.backend.llvm.assembler import LLVMAssembler
+from rpython.jit.backend.llvm.rewrite import LLVMRewriterAssembler
+from rpython.jit.backend.llvm.objcache import ObjectCache, interpreter_salt
+from rpython.jit.backend.llvm.vector_ext import LLVMVectorExt
 from rpython.jit.metainterp import history
+from rpython.jit.metainterp.compile import AbstractResumeGuardDescr
+from rpython.rlib.rarithmetic import r_uint
+from rpython.rlib.objectmodel import (compute_unique_id, we_are_translated,
+                                      Symbolic)
+from rpython.rlib.rjitlog import rjitlog as jl
+from rpython.rlib.jit import AsmInfo, Counters
+from rpython.rlib.longlong2float import float2longlong
 import ctypes
+import time
 import os
 
+MAX_CACHED_CONSTS = 4096
+
+class CodeRange(object):
+    """What jitlog asks of the machine code of a trace, see LogTrace.write"""
+    def __init__(self, addr, size):
+        self.addr = addr
+        self.size = size
+
+    def absolute_addr(self):
+        return self.addr
+
+    def get_relative_pos(self):
+        return self.size
+
+def register_code(cpu, resources, label, code_ranges):
+    """
+    Tell cpu's codemap and profile agent about LLVM functions of the loop
+    resources belong to. LLVM moves the code of ops around freely, so
+    machine code positions can't be mapped back to the portal frames
+    inlined into the trace, and the codemap puts all of it in the loop's
+    own frame.
+    """
+    for symbol, addr, size in code_ranges:
+        if cpu.HAS_CODEMAP:
+            builder = CodemapBuilder()
+            builder.enter_portal_frame(resources.jd_id, resources.unique_id, 0)
+            cpu.codemap.register_codemap(builder.get_final_bytecode(addr,
+                                                                    size))
+        cpu.profile_agent.native_code_written("%s (%s)" % (label, symbol),
+                                              addr, size)
+
+def unregister_code(cpu, code_ranges):
+    if cpu.HAS_CODEMAP:
+        for symbol, addr, size in code_ranges:
+            cpu.codemap.free_asm_block(addr, addr + size)
+
 class LLVM_CPU(AbstractLLCPU):
+    HAS_CODEMAP = True
+    JITFRAME_FIXED_SIZE = 0 #no registers are saved in the jitframe, inputargs start at jf_frame[0]
+    vector_ext = LLVMVectorExt()
+
     def __init__(self, rtyper, stats, opts=None,
                  translate_support_code=False, gcdescr=None, debug=True):
         AbstractLLCPU.__init__(self, rtyper, stats, opts,
                                translate_support_code, gcdescr)
         self.tracker = CPUTotalTracker()
         self.debug = debug
+        self.profile_agent = ProfileAgent() #told about every function added to the JIT, see register_code
+        if rtyper is not None:
+            config = rtyper.annotator.translator.config
+            if config.translation.jit_profiler == "perf":
+                self.profile_agent = PerfMapAgent()
         self.supports_floats = True
         self.llvm = LLVMAPI()
         self.assembler = LLVMAssembler(self)
         self.thread_safe_context = self.llvm.CreateThreadSafeContext(None)
         self.context = self.llvm.GetContext(self.thread_safe_context)
-        self.dispatchers = {} #map loop tokens to their dispatcher instance
+        self.bridge_count = 0
         self.WORD = 8
         cstring = CString("hot_code")
         self.kind_id = self.llvm.GetMDKindID(self.context, cstring.ptr, 8)
+        cstring = CString("tbaa")
+        self.tbaa_kind_id = self.llvm.GetMDKindID(self.context, cstring.ptr, 4)
+        cstring = CString("prof")
+        self.prof_kind_id = self.llvm.GetMDKindID(self.context, cstring.ptr, 4)
+        cstring = CString("llvm.loop")
+        self.loop_kind_id = self.llvm.GetMDKindID(self.context, cstring.ptr, 9)
+        self.tbaa_tags = {} #map descrs to the tbaa access tag of the memory they describe
+        self.gcmaps = {} #map tuples of jitframe slots holding gc refs to raw gcmaps
+        self.object_cache = None #on-disk cache of compiled modules, see objcache.py
+        self.object_cache_size = 512*1024*1024
+        self.inline_call_assembler = True #link call_assembler targets into the caller's module for LLVM's inliner
+        self.overflow_intrinsics = True #lower *_ovf ops to llvm.s*.with.overflow rather than widening to i128
+        self.guard_counter = None #the metainterp's JitCounter, see guard_fail_weight
+        self.max_guard_fail_weight = 200 #exit weight of a guard about to get a bridge, against GUARD_HOT_WEIGHT
+        self.branch_weights = {} #map (taken, not taken) weights to their !prof node
+        self.builder = self.llvm.CreateBuilder(self.context) #dispatchers take turns using it
+        self.trace_types = {} #map numbers of inputargs to the jitframe types and signature of trace functions
+        self.last_unnumbered = 0 #numbers given to loops the metainterp didn't number, counting down
+        self.function_types = {} #map names of intrinsics to their function type
+        self.word_consts = {} #map ints to their llvm constant, see const_word
+        self.float_consts = {} #map float bit patterns to their llvm constant
+        self.value_names = {} #map names of llvm values to their CString, see value_name
+        self.no_name = CString("")
+        self.type_scratch = ScratchArray() #raw arrays for passing refs to llvm, see ScratchArray
+        self.value_scratch = ScratchArray()
         self.define_types()
+        self.define_constants()
+        self.define_tbaa()
+        self.define_branch_weights()
+
+    def setup_once(self):
+        self.profile_agent.startup()
+        if self.HAS_CODEMAP:
+            self.codemap.setup()
+        self.assembler.setup_once()
+
+    def cast_ptr_to_int(x):
+        adr = llmemory.cast_ptr_to_adr(x)
+        return LLVM_CPU.cast_adr_to_int(adr)
+    cast_ptr_to_int._annspecialcase_ = 'specialize:arglltype(0)'
+    cast_ptr_to_int = staticmethod(cast_ptr_to_int)
+
+    def finish_once(self):
+        AbstractLLCPU.finish_once(self)
+        self.assembler.optimiser.report_stats()
+        self.profile_agent.shutdown()
+
+    def set_llvm_passes(self, text):
+        self.assembler.set_llvm_passes(text)
+
+    def set_llvm_cache(self, path):
+        if not path:
+            self.object_cache = None
+            return
+        salt = "%s %s %s" % (interpreter_salt("/proc/self/exe"),
+                             constcharp2str(self.llvm.GetHostCPUName(None)),
+                             constcharp2str(self.llvm.GetHostCPUFeatures(None)))
+        self.object_cache = ObjectCache(path, self.object_cache_size, salt)
+
+    def set_llvm_cache_size(self, megabytes):
+        self.object_cache_size = megabytes*1024*1024
+        if self.object_cache is not None:
+            self.object_cache.max_size = self.object_cache_size
+
+    def set_guard_counter(self, jitcounter):
+        self.guard_counter = jitcounter
+
+    def get_pass_stats(self):
+        """PassStats of every pass run so far, per pass numbers are only
+        collected while jit-llvm-passes is being logged"""
+        optimiser = self.assembler.optimiser
+        return optimiser.stats.values() + [optimiser.total]
 
     def define_types(self):
         self.llvm_bool_type = self.llvm.IntType(self.context, 1)
@@ -38,6 +170,227 @@ class LLVM_CPU(AbstractLLCPU):
         self.llvm_int_ptr = self.llvm.PointerType(self.llvm_int_type, 0)
         self.llvm_void_type = self.llvm.VoidType(self.context)
         self.llvm_void_ptr = self.llvm.PointerType(self.llvm.IntType(self.context, 8), 0) #llvm doesn't have void*, represents as i8*
+        types = lltype.malloc(rffi.CArray(self.llvm.TypeRef), n=2, flavor='raw')
+        types[0] = self.llvm_int_type
+        types[1] = self.llvm_bool_type
+        self.llvm_ovf_res_type = self.llvm.StructType(self.context, types, 2, 0) #{result, overflow bit}
+        lltype.free(types, flavor='raw')
+
+    def define_constants(self):
+        """
+        Constants and enums every dispatcher needs. LLVM's constants belong
+        to the context, so all modules can share them.
+        """
+        self.const_zero = self.llvm.ConstInt(self.llvm_int_type, 0, 1)
+        self.const_true = self.llvm.ConstInt(self.llvm_bool_type, 1, 0)
+        self.const_false = self.llvm.ConstInt(self.llvm_bool_type, 0, 0)
+        self.const_max_int = self.llvm.ConstInt(self.llvm_wide_int,
+                                                2**(self.WORD*8-1)-1, 1)
+        self.const_min_int = self.llvm.ConstInt(self.llvm_wide_int,
+                                                -2**(self.WORD*8-1), 1)
+        self.cmp_enums = lltype.malloc(self.llvm.CmpEnums, flavor='raw',
+                                       immortal=True)
+        self.llvm.SetCmpEnums(self.cmp_enums)
+
+    def const_word(self, value):
+        """Signed word constant, only asked LLVM for once"""
+        if not we_are_translated() and isinstance(value, Symbolic):
+            return self.llvm.ConstInt(self.llvm_int_type, value, 1) #not hashable
+        const = self.word_consts.get(value, None)
+        if const is None:
+            if len(self.word_consts) >= MAX_CACHED_CONSTS: #traces are full of one-off addresses
+                self.word_consts.clear()
+            const = self.llvm.ConstInt(self.llvm_int_type, value, 1)
+            self.word_consts[value] = const
+        return const
+
+    def const_float(self, value):
+        bits = float2longlong(value) #-0.0 and 0.0 compare equal
+        const = self.float_consts.get(bits, None)
+        if const is None:
+            if len(self.float_consts) >= MAX_CACHED_CONSTS:
+                self.float_consts.clear()
+            const = self.llvm.ConstFloat(self.llvm_float_type, value)
+            self.float_consts[bits] = const
+        return const
+
+    def value_name(self, name):
+        """
+        CString naming an instruction or block. Names only help reading
+        dumped IR, so outside debug mode nothing gets one, which also
+        spares LLVM making them unique.
+        """
+        if not self.debug:
+            return self.no_name
+        cstring = self.value_names.get(name, None)
+        if cstring is None:
+            cstring = CString(name)
+            self.value_names[name] = cstring
+        return cstring
+
+    def function_type(self, name, param_types, ret_type, variadic=False):
+        """Type of the intrinsic called name, made once per CPU"""
+        func_type = self.function_types.get(name, None)
+        if func_type is None:
+            params = self.type_scratch.fill(param_types)
+            func_type = self.llvm.FunctionType(ret_type, params,
+                                               len(param_types),
+                                               1 if variadic else 0)
+            self.function_types[name] = func_type
+        return func_type
+
+    def md_node(self, elems):
+        mds = self.value_scratch.fill(elems)
+        return self.llvm.MDNode(self.context, mds, len(elems))
+
+    def md_string(self, string):
+        cstring = CString(string)
+        return self.llvm.MDString(self.context, cstring.ptr, len(string))
+
+    def define_tbaa(self):
+        """
+        TBAA tree for heap accesses. Every GC field and array descr gets its
+        own type under 'any', mirroring how the optimiser's heap cache
+        already treats descrs as never aliasing each other. Raw and
+        gc_load/gc_store accesses don't know what they're touching, so they
+        use 'any' itself, which aliases everything below it.
+        """
+        self.md_zero = self.llvm.ValueAsMetadata(
+            self.llvm.ConstInt(self.llvm_int_type, 0, 0))
+        root = self.md_node([self.md_string("pypy tbaa")])
+        self.tbaa_any = self.md_node([self.md_string("any"), root,
+                                      self.md_zero])
+        self.tbaa_any_tag = self.md_node([self.tbaa_any, self.tbaa_any,
+                                          self.md_zero])
+
+    def define_branch_weights(self):
+        """
+        Metadata every trace shares. The !prof weights of guards are made
+        as they're needed, see get_branch_weights.
+        """
+        self.branch_weights_name = self.md_string("branch_weights")
+        one = self.llvm.ValueAsMetadata(
+            self.llvm.ConstInt(self.llvm_indx_type, 1, 0))
+        self.loop_vectorized_hint = self.md_node([self.md_string(
+            "llvm.loop.isvectorized"), one]) #the metainterp's vectoriser already did LoopVectorize's job
+
+    def get_branch_weights(self, taken, not_taken):
+        key = (taken, not_taken)
+        weights = self.branch_weights.get(key, None)
+        if weights is None:
+            taken_md = self.llvm.ValueAsMetadata(
+                self.llvm.ConstInt(self.llvm_indx_type, taken, 0))
+            not_taken_md = self.llvm.ValueAsMetadata(
+                self.llvm.ConstInt(self.llvm_indx_type, not_taken, 0))
+            weights = self.md_node([self.branch_weights_name, taken_md,
+                                    not_taken_md])
+            self.branch_weights[key] = weights
+        return weights
+
+    def guard_fail_weight(self, descr):
+        """
+        Branch weight of a guard's exit against GUARD_HOT_WEIGHT. The
+        metainterp ticks a guard's jitcounter entry every time it fails,
+        and gives it a bridge once that reaches 1.0, so a guard the
+        counter has seen failing (e.g. while its loop ran in the x86 tier)
+        is weighted by how close it is to that. Guard_values count per
+        value, so they're treated as never failing.
+        """
+        if self.guard_counter is None:
+            return 1
+        if not isinstance(descr, AbstractResumeGuardDescr):
+            return 1
+        status = descr.status
+        if status & (descr.ST_BUSY_FLAG | descr.ST_TYPE_MASK):
+            return 1
+        fraction = self.guard_counter.current_fraction(status)
+        return 1 + int(fraction * self.max_guard_fail_weight)
+
+    def loop_id(self, hints):
+        """
+        !llvm.loop node for a loop's back edge. LLVM wants it distinct and
+        referring to itself, which it becomes once the temporary node it's
+        built around is replaced by it.
+        """
+        temp = self.llvm.TemporaryMDNode(self.context,
+                                         lltype.nullptr(rffi.VOIDPP.TO), 0)
+        node = self.md_node([temp] + hints)
+        self.llvm.MetadataReplaceAllUsesWith(temp, node)
+        return node
+
+    def get_tbaa_tag(self, descr):
+        tag = self.tbaa_tags.get(descr, None)
+        if tag is None:
+            name = "%s %d" % (descr.repr_of_descr(), len(self.tbaa_tags)) #metadata is uniqued by content, so names must be unique per descr. Not an address, so the IR stays cacheable
+            typ = self.md_node([self.md_string(name), self.tbaa_any,
+                                self.md_zero])
+            tag = self.md_node([typ, typ, self.md_zero])
+            self.tbaa_tags[descr] = tag
+        return tag
+
+    def get_gcmap(self, positions):
+        """
+        Raw gcmap with a bit set for every jitframe slot in positions, 0 if
+        there are none. Dispatchers always spill to the lowest slots, so
+        only a handful of distinct gcmaps ever get made.
+        """
+        key = tuple(positions)
+        if not key:
+            return 0
+        try:
+            return self.gcmaps[key]
+        except KeyError:
+            pass
+        bits = self.WORD*8
+        length = max(key) // bits + 1
+        gcmap = lltype.malloc(jitframe.GCMAP, length, flavor='raw',
+                              track_allocation=False)
+        for i in range(length):
+            gcmap[i] = r_uint(0)
+        for pos in key:
+            gcmap[pos // bits] |= r_uint(1) << (pos % bits)
+        addr = rffi.cast(lltype.Signed, gcmap)
+        self.gcmaps[key] = addr
+        return addr
+
+    def allocate_gc_table(self, num_gcrefs):
+        """
+        Raw table load_from_gc_table reads from. Its address is baked into
+        the trace, and the gc updates the entries when it moves objects.
+        """
+        if num_gcrefs == 0:
+            return 0
+        table = lltype.malloc(rffi.SIGNEDP.TO, num_gcrefs, flavor='raw',
+                              track_allocation=False)
+        return rffi.cast(lltype.Signed, table)
+
+    def rewrite_operations(self, operations, allgcrefs):
+        rewriter = LLVMRewriterAssembler(self.gc_ll_descr, self)
+        return rewriter.rewrite(operations, allgcrefs)
+
+    def get_trace_types(self, num_args):
+        """
+        (jitframe type, its field types, trace function signature) for
+        traces with num_args inputargs, made once per CPU.
+        """
+        try:
+            return self.trace_types[num_args]
+        except KeyError:
+            pass
+        jitframe_type, jitframe_subtypes = self.decl_jitframe(num_args)
+        jitframe_ptr = self.llvm.PointerType(jitframe_type, 0)
+        arg_array = rffi.CArray(self.llvm.TypeRef)
+        arg_types = lltype.malloc(arg_array, n=3, flavor='raw')
+        arg_types.__setitem__(0, jitframe_ptr)
+        arg_types.__setitem__(1, self.llvm_void_ptr)
+        arg_types.__setitem__(2, self.llvm_int_type)
+        signature = self.llvm.FunctionType(jitframe_ptr,
+                                           arg_types,
+                                           3, 0)
+        lltype.free(arg_types, flavor='raw')
+        types = (jitframe_type, jitframe_subtypes, signature)
+        self.trace_types[num_args] = types
+        return types
 
     def decl_jitframe(self, num_args):
         arg_array = self.llvm.ArrayType(self.llvm_int_type, num_args+1) #+1 for python metadata in element 0
@@ -69,53 +422,234 @@ class LLVM_CPU(AbstractLLCPU):
         os.system("rm ir-"+name+".bc")
 
     def dump_looptoken(self, looptoken): #only dumps unoptimised IR
-        dispatcher = self.dispatchers[looptoken]
+        dispatcher = looptoken.compiled_loop_token.llvm_resources.dispatcher
         module = dispatcher.module
         self.write_ir(module, "dmp")
         os.system("cat ir-dmp.ll")
         os.system("rm ir-dmp.ll")
 
-    def compile_loop(self, inputargs, operations, looptoken, jd_id=0,
-                     unique_id=0, log=True, name='trace', logger=None):
-        self.assembler.refresh_jit()
-        cstring = CString(name)
+    def create_dispatcher(self, module_name, func_name, num_args):
+        """
+        Loops and bridges each get their own module holding one function
+        of type (jitframe*, threadlocal_addr, entry_index) -> jitframe*,
+        so they can tail call into each other once compiled.
+        """
+        cstring = CString(module_name)
         module = self.llvm.CreateModule(cstring.ptr, self.context)
         self.llvm.SetModuleDataLayout(module, self.assembler.data_layout)
-        builder = self.llvm.CreateBuilder(self.context) #TODO: look at moving to init
-        jitframe_type, jitframe_subtypes = self.decl_jitframe(len(inputargs))
-        jitframe_ptr = self.llvm.PointerType(jitframe_type, 0)
-        arg_array = rffi.CArray(self.llvm.TypeRef)
-        arg_types = lltype.malloc(arg_array, n=2, flavor='raw')
-        arg_types.__setitem__(0, jitframe_ptr)
-        arg_types.__setitem__(1, self.llvm_void_ptr)
-        signature = self.llvm.FunctionType(jitframe_ptr,
-                                           arg_types,
-                                           2, 0)
-        lltype.free(arg_types, flavor='raw')
-        cstring = CString("trace")
+        jitframe_type, jitframe_subtypes, signature = self.get_trace_types(
+                                                                    num_args)
+        cstring = CString(func_name)
         trace = self.llvm.AddFunction(module, cstring.ptr, signature)
-        cstring = CString("entry")
+        cstring = self.value_name("entry")
         entry = self.llvm.AppendBasicBlock(self.context, trace,
                                            cstring.ptr)
-        dispatcher = LLVMOpDispatcher(self, builder, module,
-                                      entry, trace, jitframe_type,
-                                      jitframe_subtypes)
-        self.dispatchers[looptoken] = dispatcher #this class holds data about llvm's state, so helpful to keep around on a per-loop basis for bridges
-        dispatcher.dispatch_ops(inputargs, operations)
+        return LLVMOpDispatcher(self, self.builder, module, entry, trace,
+                                func_name, signature, jitframe_type,
+                                jitframe_subtypes)
+
+    def compile_loop(self, inputargs, operations, looptoken, jd_id=0,
+                     unique_id=0, log=True, name='trace', logger=None):
+        start = time.time()
+        if looptoken.number < 0: #e.g. made by hand in tests, would share its symbol
+            self.last_unnumbered -= 1
+            looptoken.number = self.last_unnumbered
+        func_name = "trace_" + str(looptoken.number)
+        self.assembler.setup_compiled_loop_token(looptoken, inputargs)
+        allgcrefs = []
+        operations = self.rewrite_operations(operations, allgcrefs)
+        gc_table_addr = self.allocate_gc_table(len(allgcrefs))
+        dispatcher = self.create_dispatcher(name, func_name+"_body",
+                                            len(inputargs))
+        dispatcher.looptoken = looptoken
+        dispatcher.dispatch_ops(inputargs, operations, gc_table_addr)
+        dispatcher.define_entry_function(func_name, self.allocate_raw_word())
+        self.tracker.compile_stats.phase_done(Counters.LLVM_BUILD_IR,
+                                              time.time() - start)
         if self.debug:
-            self.verify(module)
-            self.write_ir(module, "org")
-        self.assembler.jit_compile(module, looptoken, inputargs, dispatcher) #set compiled loop token and func addr
-
-    def compile_bridge(self, faildescr, inputargs, operations, looptoken):
-        self.assembler.refresh_jit()
-        dispatcher = self.dispatchers[looptoken]
-        dispatcher.dispatch_ops(inputargs, operations, faildescr=faildescr)
+            self.verify(dispatcher.module)
+            self.write_ir(dispatcher.module, "org")
+        self.assembler.jit_compile(dispatcher.module, looptoken, inputargs,
+                                   dispatcher) #set compiled loop token and func addr
+        self.assembler.patch_gcref_table(looptoken, gc_table_addr, allgcrefs)
+        self.keep_resources(looptoken, dispatcher, gc_table_addr)
+        resources = looptoken.compiled_loop_token.llvm_resources
+        resources.jd_id = jd_id
+        resources.unique_id = unique_id
+        label = "Loop # %s: %s" % (looptoken.number, name)
+        self.report_code(resources, dispatcher, label)
+        if log and logger:
+            self.log_code(logger, dispatcher, inputargs, operations)
+        return self.asm_info(dispatcher)
+
+    def compile_bridge(self, faildescr, inputargs, operations, looptoken,
+                       log=True, logger=None):
+        start = time.time()
+        self.bridge_count += 1
+        func_name = "bridge_" + str(self.bridge_count)
+        allgcrefs = []
+        operations = self.rewrite_operations(operations, allgcrefs)
+        gc_table_addr = self.allocate_gc_table(len(allgcrefs))
+        dispatcher = self.create_dispatcher(func_name, func_name,
+                                            len(inputargs))
+        dispatcher.dispatch_ops(inputargs, operations, gc_table_addr)
+        self.tracker.compile_stats.phase_done(Counters.LLVM_BUILD_IR,
+                                              time.time() - start)
         if self.debug:
             self.verify(dispatcher.module)
             self.write_ir(dispatcher.module, "org")
-        self.assembler.jit_compile(dispatcher.module, looptoken,
-                                   inputargs, dispatcher, is_bridge=True)
+        self.assembler.patch_gcref_table(looptoken, gc_table_addr, allgcrefs) #before the guard can reach the bridge
+        self.assembler.jit_compile_bridge(dispatcher.module, faildescr,
+                                          looptoken, dispatcher)
+        self.keep_resources(looptoken, dispatcher, gc_table_addr)
+        self.llvm.DisposeModule(dispatcher.module) #the JIT has its own copy
+        descr_number = compute_unique_id(faildescr)
+        label = "Bridge # %s" % (descr_number,)
+        self.report_code(looptoken.compiled_loop_token.llvm_resources,
+                         dispatcher, label)
+        if log and logger:
+            self.log_code(logger, dispatcher, inputargs, operations)
+            if dispatcher.code_ranges:
+                symbol, addr, size = dispatcher.code_ranges[0]
+                logger.log_patch_guard(descr_number, addr)
+        return self.asm_info(dispatcher)
+
+    def report_code(self, resources, dispatcher, label):
+        register_code(self, resources, label, dispatcher.code_ranges)
+
+    def log_code(self, logger, dispatcher, inputargs, operations):
+        """
+        LLVM doesn't say which machine code an op became, so jitlog gets
+        the address range of the trace's function but no per-op dumps.
+        """
+        if not dispatcher.code_ranges:
+            return
+        symbol, addr, size = dispatcher.code_ranges[0]
+        log = logger.log_trace(jl.MARK_TRACE_ASM, None, CodeRange(addr, size))
+        log.write(inputargs, operations)
+
+    def asm_info(self, dispatcher):
+        if not dispatcher.code_ranges:
+            return None
+        symbol, addr, size = dispatcher.code_ranges[0]
+        return AsmInfo({}, addr, size, addr)
+
+    def keep_resources(self, looptoken, dispatcher, gc_table_addr):
+        """Make a trace's raw memory live as long as the loop it's part of"""
+        resources = looptoken.compiled_loop_token.llvm_resources
+        if gc_table_addr != 0:
+            resources.gc_tables.append(gc_table_addr)
+        for op in dispatcher.guards:
+            resources.guard_descrs.append(op.getdescr())
+        if dispatcher.invalidation_flag != 0:
+            resources.raw_words.append(dispatcher.invalidation_flag)
+            looptoken.compiled_loop_token.invalidate_positions.append(
+                dispatcher.invalidation_flag)
+        if dispatcher.redirect_slot != 0:
+            resources.raw_words.append(dispatcher.redirect_slot)
+            resources.redirect_slot = dispatcher.redirect_slot
+
+    def free_loop_and_bridges(self, compiled_loop_token):
+        """
+        Called once the loop's gone cold, see metainterp/memmgr.py. Its
+        code and that of its bridges leaves the JIT, and the IR module and
+        raw memory the LLVM_CPU kept for them are freed.
+        """
+        AbstractLLCPU.free_loop_and_bridges(self, compiled_loop_token)
+        resources = compiled_loop_token.llvm_resources
+        if resources is None: #already freed
+            return
+        compiled_loop_token.llvm_resources = None
+        unregister_code(self, resources.code_ranges)
+        self.assembler.free_code(resources)
+        self.llvm.DisposeModule(resources.dispatcher.module)
+        for addr in resources.gc_tables:
+            lltype.free(rffi.cast(rffi.SIGNEDP, addr), flavor='raw',
+                        track_allocation=False)
+        for descr in resources.guard_descrs:
+            self.free_bridge_slot(descr)
+        for addr in resources.raw_words:
+            self.free_raw_word(addr)
+        compiled_loop_token.invalidate_positions = []
+        lltype.free(compiled_loop_token.frame_info, flavor='raw',
+                    track_allocation=False)
+
+    def allocate_raw_word(self):
+        """Zeroed word of raw memory compiled code reads, as an address"""
+        word = lltype.malloc(rffi.SIGNEDP.TO, 1, flavor='raw',
+                             track_allocation=False)
+        word[0] = 0
+        return rffi.cast(lltype.Signed, word)
+
+    def free_raw_word(self, addr):
+        lltype.free(rffi.cast(rffi.SIGNEDP, addr), flavor='raw',
+                    track_allocation=False)
+
+    def invalidate_loop(self, looptoken):
+        """
+        Every trace with a guard_not_invalidated checks a flag word of its
+        own, setting them makes those guards fail. Bridges compiled later
+        get new flags, so invalidating again leaves the guards that already
+        got a bridge alone.
+        """
+        clt = looptoken.compiled_loop_token
+        for addr in clt.invalidate_positions:
+            rffi.cast(rffi.SIGNEDP, addr)[0] = 1
+        clt.invalidate_positions = []
+
+    def redirect_call_assembler(self, oldlooptoken, newlooptoken):
+        """
+        Call_assemblers call the old loop's entry function directly, or
+        have it inlined, and it checks its redirect slot first, so
+        redirecting only means writing the new loop's address there.
+        """
+        oldclt = oldlooptoken.compiled_loop_token
+        newclt = newlooptoken.compiled_loop_token
+        assert oldclt._debug_nbargs == newclt._debug_nbargs
+        baseofs = self.get_baseofs_of_frame_field()
+        newclt.update_frame_info(oldclt, baseofs)
+        resources = oldclt.llvm_resources
+        if resources is not None and resources.redirect_slot != 0:
+            slot = rffi.cast(rffi.SIGNEDP, resources.redirect_slot)
+            slot[0] = newlooptoken._ll_function_addr
+
+    def allocate_bridge_slot(self, faildescr):
+        """
+        Raw word the guard's exit path reads to find its bridge, the
+        equivalent of the jump the x86 backend patches.
+        """
+        slot = lltype.malloc(rffi.SIGNEDP.TO, 1, flavor='raw',
+                             track_allocation=False)
+        slot[0] = 0
+        faildescr.adr_jump_offset = rffi.cast(lltype.Signed, slot)
+        return faildescr.adr_jump_offset
+
+    def get_bridge_slot(self, faildescr):
+        return faildescr.adr_jump_offset
+
+    def free_bridge_slot(self, faildescr):
+        slot = faildescr.adr_jump_offset
+        if slot != 0:
+            faildescr.adr_jump_offset = 0
+            lltype.free(rffi.cast(rffi.SIGNEDP, slot), flavor='raw',
+                        track_allocation=False)
+
+    def set_failarg_locs(self, descr, failargs, first_slot=0):
+        """
+        The failargs that aren't holes go to consecutive jitframe positions
+        from first_slot, in the order a bridge's inputargs list them.
+        Returns the number of positions used.
+        """
+        locs = []
+        num_slots = 0
+        for arg in failargs:
+            if arg is None:
+                locs.append(rffi.cast(rffi.USHORT, 0xFFFF))
+            else:
+                locs.append(rffi.cast(rffi.USHORT, first_slot+num_slots))
+                num_slots += 1
+        descr.rd_locs = locs
+        return num_slots
 
     def parse_arg_types(self, *ARGS):
         types = []
@@ -124,6 +658,8 @@ class LLVM_CPU(AbstractLLCPU):
                 types.append(lltype.Signed)
             elif type(arg) == float:
                 types.append(lltype.Float)
+            else:
+                types.append(llmemory.GCREF)
         return types
 
     def execute_token(self, looptoken, *ARGS):
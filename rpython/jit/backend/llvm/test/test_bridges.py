@@ -0,0 +1,54 @@
+import time
+from rpython.jit.backend.llvm.test.test_compile_latency import get_cpu
+from rpython.jit.tool.oparser import parse
+from rpython.jit.metainterp.history import (JitCellToken, TargetToken,
+                                            BasicFailDescr)
+
+def make_guarded_loop(num_guards, targettoken, faildescrs, exitdescr):
+    lines = ["[i0]",
+             "label(i0, descr=targettoken)",
+             "i1 = int_add(i0, 1)"]
+    namespace = {'targettoken': targettoken, 'exitdescr': exitdescr}
+    for k in range(num_guards):
+        lines.append("i%d = int_ne(i1, %d)" % (k+2, k+1))
+        lines.append("guard_true(i%d, descr=f%d) [i1]" % (k+2, k))
+        namespace['f%d' % k] = faildescrs[k]
+    lines.append("i%d = int_lt(i1, %d)" % (num_guards+2, num_guards+5))
+    lines.append("guard_true(i%d, descr=exitdescr) [i1]" % (num_guards+2,))
+    lines.append("jump(i1, descr=targettoken)")
+    return parse("\n".join(lines), namespace=namespace)
+
+def test_many_bridges_on_one_loop(num_bridges=128):
+    """
+    Bridges are compiled as their own functions, so attaching the nth one
+    shouldn't cost more than attaching the first.
+    """
+    cpu = get_cpu()
+    targettoken = TargetToken()
+    faildescrs = [BasicFailDescr(k) for k in range(num_bridges)]
+    exitdescr = BasicFailDescr(-1)
+    loop = make_guarded_loop(num_bridges, targettoken, faildescrs, exitdescr)
+    looptoken = JitCellToken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+
+    deadframe = cpu.execute_token(looptoken, 0)
+    assert cpu.get_latest_descr(deadframe) is faildescrs[0]
+
+    compile_times = []
+    for k in range(num_bridges):
+        bridge = parse("""
+        [i0]
+        jump(i0, descr=targettoken)
+        """, namespace={'targettoken': targettoken})
+        start = time.time()
+        cpu.compile_bridge(faildescrs[k], bridge.inputargs,
+                           bridge.operations, looptoken)
+        compile_times.append(time.time() - start)
+
+    deadframe = cpu.execute_token(looptoken, 0)
+    assert cpu.get_latest_descr(deadframe) is exitdescr
+    assert cpu.get_int_value(deadframe, 0) == num_bridges + 5
+
+    print("%d bridges: cumulative compile %.3fms, first %.3fms, last %.3fms"
+          % (num_bridges, 1000*sum(compile_times), 1000*compile_times[0],
+             1000*compile_times[-1]))
@@ -0,0 +1,146 @@
+import time
+from rpython.jit.backend.llvm.test.test_compile_latency import get_cpu
+from rpython.jit.backend.llvm.test.test_runner import FakeStats
+from rpython.jit.backend.x86.runner import CPU_X86_64
+from rpython.jit.tool.oparser import parse
+from rpython.jit.metainterp.history import (JitCellToken, TargetToken,
+                                            BasicFailDescr, BasicFinalDescr)
+from rpython.rtyper.lltypesystem import lltype, llmemory
+from rpython.rtyper.annlowlevel import llhelper
+
+HELPER = lltype.Ptr(lltype.FuncType([llmemory.GCREF, llmemory.GCREF],
+                                    lltype.Signed))
+
+def make_jitdriver_sd(cpu, called):
+    def assembler_helper(deadframe, virtualizable):
+        called.append(cpu.get_latest_descr(deadframe))
+        return -1
+
+    class FakeJitDriverSD:
+        index_of_virtualizable = -1
+        _assembler_helper_ptr = llhelper(HELPER, assembler_helper)
+        assembler_helper_adr = llmemory.cast_ptr_to_adr(_assembler_helper_ptr)
+    return FakeJitDriverSD()
+
+def compile_callee(cpu, jd, step, done):
+    """step * (1 + 2 + ... + i0), the kind of numeric portal recursive code calls"""
+    loop = parse("""
+    [i0]
+    i1 = int_add(i0, 1)
+    i2 = int_mul(i0, i1)
+    i3 = int_mul(i2, %d)
+    i4 = int_rshift(i3, 1)
+    finish(i4, descr=done)
+    """ % step, namespace={'done': done})
+    looptoken = JitCellToken()
+    looptoken.outermost_jitdriver_sd = jd
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+    return looptoken
+
+def compile_caller(cpu, calleetoken):
+    loop = parse("""
+    [i0, i1, i2]
+    label(i0, i1, i2, descr=targettoken)
+    i3 = call_assembler_i(i1, descr=calleetoken)
+    guard_not_forced(descr=forced) [i0, i2]
+    i4 = int_add(i2, i3)
+    i5 = int_sub(i0, 1)
+    i6 = int_gt(i5, 0)
+    guard_true(i6, descr=done) [i4]
+    jump(i5, i1, i4, descr=targettoken)
+    """, namespace={'targettoken': TargetToken(), 'calleetoken': calleetoken,
+                    'forced': BasicFailDescr(3), 'done': BasicFailDescr(4)})
+    looptoken = JitCellToken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+    return looptoken
+
+def setup_cpu(cpu, called):
+    jd = make_jitdriver_sd(cpu, called)
+    done = BasicFinalDescr(2)
+    cpu.done_with_this_frame_descr_int = done
+    return jd, done
+
+def test_call_assembler_is_linked_for_inlining():
+    cpu = get_cpu()
+    called = []
+    jd, done = setup_cpu(cpu, called)
+    calleetoken = compile_callee(cpu, jd, 3, done)
+    callertoken = compile_caller(cpu, calleetoken)
+    dispatcher = callertoken.compiled_loop_token.llvm_resources.dispatcher
+    text = cpu.assembler.module_text(dispatcher.module)
+    assert "available_externally" in text
+    deadframe = cpu.execute_token(callertoken, 5, 10, 0)
+    assert cpu.get_latest_descr(deadframe).identifier == 4
+    assert cpu.get_int_value(deadframe, 0) == 5 * 3 * sum(range(1, 11))
+    assert not called #always took the fast path
+
+def test_call_assembler_helper():
+    cpu = get_cpu()
+    called = []
+    jd, done = setup_cpu(cpu, called)
+    calleetoken = compile_callee(cpu, jd, 1, BasicFinalDescr(7))
+    callertoken = compile_caller(cpu, calleetoken)
+    deadframe = cpu.execute_token(callertoken, 2, 10, 0)
+    assert cpu.get_int_value(deadframe, 0) == -2
+    assert [descr.identifier for descr in called] == [7, 7]
+
+def test_redirect_call_assembler():
+    cpu = get_cpu()
+    called = []
+    jd, done = setup_cpu(cpu, called)
+    oldtoken = compile_callee(cpu, jd, 1, done)
+    callertoken = compile_caller(cpu, oldtoken)
+    deadframe = cpu.execute_token(callertoken, 1, 10, 0)
+    assert cpu.get_int_value(deadframe, 0) == sum(range(1, 11))
+    newtoken = compile_callee(cpu, jd, 2, done)
+    cpu.redirect_call_assembler(oldtoken, newtoken)
+    deadframe = cpu.execute_token(callertoken, 1, 10, 0)
+    assert cpu.get_int_value(deadframe, 0) == 2 * sum(range(1, 11))
+
+def test_invalidate_loop():
+    cpu = get_cpu()
+    loop = parse("""
+    [i0]
+    guard_not_invalidated(descr=invalidated) [i0]
+    i1 = int_add(i0, 1)
+    finish(i1, descr=done)
+    """, namespace={'invalidated': BasicFailDescr(1),
+                    'done': BasicFinalDescr(2)})
+    looptoken = JitCellToken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+    deadframe = cpu.execute_token(looptoken, 41)
+    assert cpu.get_latest_descr(deadframe).identifier == 2
+    assert cpu.get_int_value(deadframe, 0) == 42
+    cpu.invalidate_loop(looptoken)
+    deadframe = cpu.execute_token(looptoken, 41)
+    assert cpu.get_latest_descr(deadframe).identifier == 1
+    assert cpu.get_int_value(deadframe, 0) == 41
+
+def run(cpu, calls, depth, repeats):
+    called = []
+    jd, done = setup_cpu(cpu, called)
+    calleetoken = compile_callee(cpu, jd, 3, done)
+    callertoken = compile_caller(cpu, calleetoken)
+    cpu.execute_token(callertoken, calls, depth, 0) #warmup
+    best = None
+    for n in range(repeats):
+        t = time.time()
+        deadframe = cpu.execute_token(callertoken, calls, depth, 0)
+        elapsed = time.time() - t
+        if best is None or elapsed < best:
+            best = elapsed
+    assert cpu.get_int_value(deadframe, 0) == calls * 3 * sum(range(1, depth+1))
+    return best
+
+def test_call_assembler_benchmark(calls=10**6, depth=4, repeats=3):
+    """x86 against LLVM calling the callee trace, and inlining it"""
+    x86 = CPU_X86_64(rtyper=None, stats=FakeStats())
+    x86.setup_once()
+    backends = [("x86", x86)]
+    for inline in (False, True):
+        cpu = get_cpu()
+        cpu.inline_call_assembler = inline
+        backends.append(("llvm inlined" if inline else "llvm called", cpu))
+    for name, cpu in backends:
+        best = run(cpu, calls, depth, repeats)
+        print("%-13s %.2fns/call_assembler" % (name, 1e9*best/calls))
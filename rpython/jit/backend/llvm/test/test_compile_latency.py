@@ -0,0 +1,55 @@
+import time
+from rpython.jit.backend.llvm.runner import LLVM_CPU
+from rpython.jit.backend.llvm.test.test_runner import FakeStats
+from rpython.jit.tool.oparser import parse
+from rpython.jit.metainterp.history import (JitCellToken, TargetToken,
+                                            BasicFailDescr)
+
+def get_cpu():
+    cpu = LLVM_CPU(rtyper=None, stats=FakeStats(), debug=False)
+    cpu.setup_once()
+    return cpu
+
+def make_loop(n):
+    targettoken = TargetToken()
+    loop = parse("""
+    [i0]
+    label(i0, descr=targettoken)
+    i1 = int_add(i0, %d)
+    i2 = int_le(i1, 1000)
+    guard_true(i2, descr=fdescr) [i1]
+    jump(i1, descr=targettoken)
+    """ % (n+1,), namespace={'targettoken': targettoken,
+                             'fdescr': BasicFailDescr(n)})
+    return loop
+
+def test_compile_latency_as_loops_grow(num_loops=500, report_every=50):
+    """
+    With a persistent LLJIT, compiling the nth loop shouldn't cost more
+    than compiling the first, and earlier loops must still be runnable.
+    """
+    cpu = get_cpu()
+    tokens = []
+    latencies = []
+    for n in range(num_loops):
+        loop = make_loop(n)
+        looptoken = JitCellToken()
+        start = time.time()
+        cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+        latencies.append(time.time() - start)
+        tokens.append(looptoken)
+        if (n+1) % report_every == 0:
+            window = latencies[-report_every:]
+            print("loops %5d: mean compile %.3fms, max %.3fms" % (
+                n+1, 1000*sum(window)/len(window), 1000*max(window)))
+
+    for n, looptoken in enumerate(tokens):
+        deadframe = cpu.execute_token(looptoken, 0)
+        fail = cpu.get_latest_descr(deadframe)
+        assert fail.identifier == n
+        assert cpu.get_int_value(deadframe, 0) > 1000
+
+    first = sum(latencies[:report_every]) / report_every
+    last = sum(latencies[-report_every:]) / report_every
+    print("compile latency first %d loops %.3fms, last %d loops %.3fms" % (
+        report_every, 1000*first, report_every, 1000*last))
@@ -0,0 +1,520 @@
+import struct
+from rpython.jit.backend.llvm.runner import LLVM_CPU
+from rpython.jit.backend.llvm.test.test_runner import FakeStats
+from rpython.jit.backend.llvm.test.test_compile_latency import get_cpu
+from rpython.jit.backend.llsupport.gc import (GcLLDescription,
+                                              GcLLDescr_framework, GcCache)
+from rpython.jit.backend.llsupport import jitframe
+from rpython.jit.backend.llsupport.symbolic import WORD
+from rpython.jit.tool.oparser import parse
+from rpython.jit.metainterp.history import (JitCellToken, BasicFinalDescr,
+                                            BasicFailDescr, AbstractDescr)
+from rpython.jit.metainterp.support import ptr2int
+from rpython.jit.codewriter.effectinfo import EffectInfo
+from rpython.rtyper.lltypesystem import lltype, llmemory, rffi
+from rpython.rtyper.annlowlevel import llhelper, llhelper_args
+
+S = lltype.GcStruct('S', ('x', lltype.Signed), ('y', lltype.Signed))
+
+def test_new_goes_through_rewriter():
+    cpu = get_cpu()
+    sizedescr = cpu.sizeof(S)
+    xdescr = cpu.fielddescrof(S, 'x')
+    loop = parse("""
+    [i0]
+    p0 = new(descr=sizedescr)
+    setfield_gc(p0, i0, descr=xdescr)
+    finish(p0, descr=finaldescr)
+    """, namespace={'sizedescr': sizedescr, 'xdescr': xdescr,
+                    'finaldescr': BasicFinalDescr(0)})
+    looptoken = JitCellToken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+
+    results = []
+    for i in range(2):
+        deadframe = cpu.execute_token(looptoken, 40+i)
+        res = cpu.get_ref_value(deadframe, 0)
+        s = lltype.cast_opaque_ptr(lltype.Ptr(S), res)
+        assert s.x == 40+i
+        results.append(res)
+    assert results[0] != results[1]
+
+
+def make_cpu(gc_ll_descr):
+    cpu = LLVM_CPU(rtyper=None, stats=FakeStats(), debug=False)
+    cpu.gc_ll_descr = gc_ll_descr
+    cpu.setup_once()
+    return cpu
+
+def run(cpu, ops, args, namespace):
+    loop = parse(ops, namespace=namespace)
+    looptoken = JitCellToken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+    return cpu.execute_token(looptoken, *args)
+
+def unpack_gcmap(frame):
+    bits = WORD * 8
+    gcmap = frame.jf_gcmap
+    if not gcmap:
+        return []
+    return [i for i in range(len(gcmap) * bits)
+              if gcmap[i // bits] & (1 << (i % bits))]
+
+NOT_INITIALIZED = chr(0xdd)
+
+class GCDescrFastpathMalloc(GcLLDescription):
+    """
+    A 64 bytes raw nursery. The slow paths record how they were called,
+    and the one of call_malloc_nursery starts the nursery over.
+    """
+    gcrootmap = None
+    write_barrier_descr = None
+    max_size_of_young_obj = 50
+
+    def __init__(self):
+        GcLLDescription.__init__(self, None)
+        self.nursery = lltype.malloc(rffi.CArray(lltype.Char), 64,
+                                     flavor='raw',
+                                     track_allocation=False)
+        for i in range(64):
+            self.nursery[i] = NOT_INITIALIZED
+        self.nursery_words = rffi.cast(rffi.CArrayPtr(lltype.Signed),
+                                       self.nursery)
+        self.addrs = lltype.malloc(rffi.CArray(lltype.Signed), 2,
+                                   flavor='raw', track_allocation=False)
+        self.addrs[0] = rffi.cast(lltype.Signed, self.nursery)
+        self.addrs[1] = self.addrs[0] + 64
+        self.calls = []
+        def malloc_slowpath(size):
+            self.calls.append(size)
+            nadr = rffi.cast(lltype.Signed, self.nursery)
+            self.addrs[0] = nadr + size
+            return nadr
+        self.generate_function('malloc_nursery', malloc_slowpath,
+                               [lltype.Signed], lltype.Signed)
+
+        def malloc_array(itemsize, tid, num_elem):
+            self.calls.append((itemsize, tid, num_elem))
+            return 13
+        self.malloc_slowpath_array_fnptr = llhelper_args(malloc_array,
+                                                         [lltype.Signed] * 3,
+                                                         lltype.Signed)
+
+        def malloc_str(length):
+            self.calls.append(('str', length))
+            return 13
+        self.generate_function('malloc_str', malloc_str, [lltype.Signed],
+                               lltype.Signed)
+
+    def get_nursery_free_addr(self):
+        return rffi.cast(lltype.Signed, self.addrs)
+
+    def get_nursery_top_addr(self):
+        return rffi.cast(lltype.Signed, self.addrs) + WORD
+
+    def get_malloc_slowpath_addr(self):
+        return self.get_malloc_fn_addr('malloc_nursery')
+
+    def get_malloc_slowpath_array_addr(self):
+        return ptr2int(self.malloc_slowpath_array_fnptr)
+
+    def check_nothing_in_nursery(self):
+        # CALL_MALLOC_NURSERY should not write anything in the nursery
+        for i in range(64):
+            assert self.nursery[i] == NOT_INITIALIZED
+
+    def free(self):
+        lltype.free(self.addrs, flavor='raw', track_allocation=False)
+        lltype.free(self.nursery, flavor='raw', track_allocation=False)
+
+class TestMallocFastpath(object):
+
+    def setup_method(self, meth):
+        self.gc_ll_descr = GCDescrFastpathMalloc()
+        self.cpu = make_cpu(self.gc_ll_descr)
+
+    def teardown_method(self, meth):
+        self.gc_ll_descr.free()
+
+    def run(self, ops, args, namespace={}):
+        namespace = namespace.copy()
+        namespace['faildescr'] = BasicFailDescr(1)
+        namespace['finaldescr'] = BasicFinalDescr(0)
+        deadframe = run(self.cpu, ops, args, namespace)
+        assert self.cpu.get_latest_descr(deadframe).identifier == 1
+        return [rffi.cast(lltype.Signed, self.cpu.get_ref_value(deadframe, i))
+                for i in range(3)]
+
+    def test_malloc_fastpath(self):
+        refs = self.run('''
+        [i0]
+        p0 = call_malloc_nursery(16)
+        p1 = call_malloc_nursery(32)
+        p2 = call_malloc_nursery(16)
+        guard_true(i0, descr=faildescr) [p0, p1, p2]
+        finish(descr=finaldescr)
+        ''', [0])
+        gc_ll_descr = self.gc_ll_descr
+        nurs_adr = rffi.cast(lltype.Signed, gc_ll_descr.nursery)
+        assert refs == [nurs_adr, nurs_adr + 16, nurs_adr + 48]
+        gc_ll_descr.check_nothing_in_nursery()
+        assert gc_ll_descr.addrs[0] == nurs_adr + 64
+        assert gc_ll_descr.calls == []
+
+    def test_malloc_slowpath(self):
+        refs = self.run('''
+        [i0]
+        p0 = call_malloc_nursery(16)
+        p1 = call_malloc_nursery(32)
+        p2 = call_malloc_nursery(24)     # overflow
+        guard_true(i0, descr=faildescr) [p0, p1, p2]
+        finish(descr=finaldescr)
+        ''', [0])
+        gc_ll_descr = self.gc_ll_descr
+        nurs_adr = rffi.cast(lltype.Signed, gc_ll_descr.nursery)
+        assert refs == [nurs_adr, nurs_adr + 16, nurs_adr]
+        gc_ll_descr.check_nothing_in_nursery()
+        assert gc_ll_descr.addrs[0] == nurs_adr + 24
+        assert gc_ll_descr.calls == [24]
+
+    def test_malloc_nursery_varsize(self):
+        A = lltype.GcArray(lltype.Signed)
+        arraydescr = self.cpu.arraydescrof(A)
+        arraydescr.tid = 1515
+        refs = self.run('''
+        [i0, i1]
+        p0 = call_malloc_nursery_varsize(0, 8, i0, descr=arraydescr)
+        p1 = call_malloc_nursery_varsize(0, 5, i1, descr=arraydescr)
+        guard_false(i0, descr=faildescr) [p0, p1, p1]
+        finish(descr=finaldescr)
+        ''', [1, 2], {'arraydescr': arraydescr})
+        gc_ll_descr = self.gc_ll_descr
+        nurs_adr = rffi.cast(lltype.Signed, gc_ll_descr.nursery)
+        assert refs[:2] == [nurs_adr, nurs_adr + 2*WORD + 8*1]
+        # the tid is written, nothing else
+        assert gc_ll_descr.nursery_words[0] == 1515
+        assert gc_ll_descr.nursery_words[2 + 8 // WORD] == 1515
+        assert gc_ll_descr.addrs[0] == nurs_adr + (
+            ((4*WORD + 8*1 + 5*2) + (WORD - 1)) & ~(WORD - 1))
+        assert gc_ll_descr.calls == []
+
+    def test_malloc_nursery_varsize_slowpath(self):
+        A = lltype.GcArray(lltype.Signed)
+        arraydescr = self.cpu.arraydescrof(A)
+        arraydescr.tid = 15
+        self.run('''
+        [i0, i1, i2]
+        p0 = call_malloc_nursery_varsize(0, 8, i0, descr=arraydescr)
+        p1 = call_malloc_nursery_varsize(0, 5, i1, descr=arraydescr)
+        p3 = call_malloc_nursery_varsize(0, 5, i2, descr=arraydescr)
+        # overflow
+        p4 = call_malloc_nursery_varsize(0, 5, i2, descr=arraydescr)
+        # we didn't collect, so still overflow
+        p5 = call_malloc_nursery_varsize(1, 5, i2, descr=strdescr)
+        guard_false(i0, descr=faildescr) [p0, p4, p5]
+        finish(descr=finaldescr)
+        ''', [10, 3, 3], {'arraydescr': arraydescr, 'strdescr': arraydescr})
+        # one was too large, two fit, then the nursery was full
+        assert self.gc_ll_descr.calls == [(8, 15, 10), (5, 15, 3), ('str', 3)]
+
+
+class MockShadowStackRootMap(object):
+    is_shadow_stack = True
+
+    def __init__(self):
+        TP = rffi.CArray(lltype.Signed)
+        self.stack = lltype.malloc(TP, 10, flavor='raw',
+                                   track_allocation=False)
+        self.stack_addr = lltype.malloc(TP, 1, flavor='raw',
+                                        track_allocation=False)
+        self.stack_addr[0] = rffi.cast(lltype.Signed, self.stack)
+
+    def free(self):
+        lltype.free(self.stack_addr, flavor='raw', track_allocation=False)
+        lltype.free(self.stack, flavor='raw', track_allocation=False)
+
+    def get_root_stack_top_addr(self):
+        return rffi.cast(lltype.Signed, self.stack_addr)
+
+    def getlength(self):
+        top = self.stack_addr[0]
+        base = rffi.cast(lltype.Signed, self.stack)
+        n = (top - base) // WORD
+        assert 0 <= n < 10
+        return n
+
+    def curtop(self):
+        n = self.getlength()
+        return self.stack[n - 1]
+
+    def settop(self, newvalue):
+        n = self.getlength()
+        self.stack[n - 1] = newvalue
+
+class WriteBarrierDescr(AbstractDescr):
+    jit_wb_if_flag_byteofs = struct.pack("l", 1).index('\x01') # in T.hdr
+    jit_wb_if_flag_singlebyte = 1
+    jit_wb_cards_set = 0
+
+    def __init__(self):
+        self.called = []
+        def write_barrier(obj):
+            self.called.append(obj)
+        self.write_barrier_fnptr = llhelper_args(write_barrier,
+                                                 [lltype.Signed], lltype.Void)
+
+    def get_write_barrier_fn(self, cpu):
+        return ptr2int(self.write_barrier_fnptr)
+
+class GCDescrShadowstack(GcLLDescr_framework):
+    """
+    A framework gc with a shadowstack, whose collections are done by the
+    functions the tests call: they find the jitframe on the shadowstack
+    like the real gc would, and can move it and the objects it holds.
+    The nursery is always full, so every malloc takes the slow path.
+    """
+    layoutbuilder = None
+
+    def __init__(self):
+        GcCache.__init__(self, False, None)
+        self._generated_functions = []
+        self.gcrootmap = MockShadowStackRootMap()
+        self.write_barrier_descr = WriteBarrierDescr()
+        self._initialize_for_tests()
+        self.nursery_ptrs = lltype.malloc(rffi.CArray(lltype.Signed), 2,
+                                          flavor='raw',
+                                          track_allocation=False)
+        self.nursery_ptrs[0] = self.nursery_ptrs[1] = 0
+        self.malloc_slowpath = None #set by the tests
+
+        def malloc_slowpath(size):
+            return self.malloc_slowpath(size)
+        self.malloc_slowpath_fnptr = llhelper_args(malloc_slowpath,
+                                                   [lltype.Signed],
+                                                   lltype.Signed)
+
+    def get_malloc_slowpath_addr(self):
+        return ptr2int(self.malloc_slowpath_fnptr)
+
+    def get_nursery_free_addr(self):
+        return rffi.cast(lltype.Signed, self.nursery_ptrs)
+
+    def get_nursery_top_addr(self):
+        return rffi.cast(lltype.Signed, self.nursery_ptrs) + WORD
+
+    def malloc_jitframe(self, frame_info):
+        # zeroed, like everything the real gc allocates
+        frame = lltype.malloc(jitframe.JITFRAME, frame_info.jfi_frame_depth,
+                              zero=True)
+        frame.jf_frame_info = frame_info
+        return frame
+
+    def free(self):
+        self.gcrootmap.free()
+        lltype.free(self.nursery_ptrs, flavor='raw', track_allocation=False)
+
+T = lltype.GcForwardReference()
+T.become(lltype.GcStruct('T', ('hdr', lltype.Signed), ('x', lltype.Ptr(T))))
+
+class TestGcShadowstack(object):
+
+    def setup_method(self, meth):
+        self.gc_ll_descr = GCDescrShadowstack()
+        self.cpu = make_cpu(self.gc_ll_descr)
+        self.xdescr = self.cpu.fielddescrof(T, 'x')
+        self.keepalive = []
+
+    def teardown_method(self, meth):
+        self.gc_ll_descr.free()
+
+    def new(self, hdr=0):
+        t = lltype.malloc(T, zero=True)
+        t.hdr = hdr
+        self.keepalive.append(t)
+        return t
+
+    def get_frame(self):
+        gcrootmap = self.gc_ll_descr.gcrootmap
+        assert gcrootmap.getlength() == 2 # pushed by the loop
+        assert gcrootmap.stack[0] == 1
+        return rffi.cast(jitframe.JITFRAMEPTR, gcrootmap.curtop())
+
+    def move_frame(self, frame, new_refs):
+        """What a collection of the nursery does to the jitframe"""
+        new_frame = self.gc_ll_descr.malloc_jitframe(frame.jf_frame_info)
+        self.keepalive.append(new_frame)
+        for i, t in zip(unpack_gcmap(frame), new_refs):
+            new_frame.jf_frame[i] = rffi.cast(lltype.Signed, t)
+        self.gc_ll_descr.gcrootmap.settop(
+            rffi.cast(lltype.Signed, new_frame))
+        return new_frame
+
+    def test_collecting_call_moves_frame(self):
+        cpu = self.cpu
+        old_refs = [self.new() for i in range(3)]
+        new_refs = [self.new(hdr=1), self.new(), self.new()]
+        new_refs[2].x = marker = self.new()
+        frames = []
+
+        def collect():
+            frame = self.get_frame()
+            assert unpack_gcmap(frame) == [0, 1, 2] # p0, p1 and p2
+            assert [frame.jf_frame[i] for i in range(3)] == [
+                rffi.cast(lltype.Signed, t) for t in old_refs]
+            frames.append(self.move_frame(frame, new_refs))
+
+        COLLECT = lltype.FuncType([], lltype.Void)
+        collectptr = llhelper(lltype.Ptr(COLLECT), collect)
+        collectdescr = cpu.calldescrof(COLLECT, COLLECT.ARGS, COLLECT.RESULT,
+                                       EffectInfo.MOST_GENERAL)
+        deadframe = run(cpu, """
+        [p0, p1, p2]
+        call_n(ConstClass(collectptr), descr=collectdescr)
+        setfield_gc(p0, p1, descr=xdescr)
+        p3 = getfield_gc_r(p2, descr=xdescr)
+        finish(p3, descr=finaldescr)
+        """, old_refs, {'collectptr': collectptr,
+                        'collectdescr': collectdescr,
+                        'xdescr': self.xdescr,
+                        'finaldescr': BasicFinalDescr(0)})
+        # the code went on with the moved frame and objects
+        frame = lltype.cast_opaque_ptr(jitframe.JITFRAMEPTR, deadframe)
+        assert frame == frames[0]
+        assert unpack_gcmap(frame) == [0] # the result of the finish
+        res = lltype.cast_opaque_ptr(lltype.Ptr(T),
+                                     cpu.get_ref_value(deadframe, 0))
+        assert res == marker
+        assert new_refs[0].x == new_refs[1]
+        assert not old_refs[0].x
+        wbdescr = self.gc_ll_descr.write_barrier_descr
+        assert wbdescr.called == [rffi.cast(lltype.Signed, new_refs[0])]
+        assert self.gc_ll_descr.gcrootmap.getlength() == 0 # popped
+
+    def test_call_that_cannot_collect(self):
+        cpu = self.cpu
+        def func():
+            assert not self.get_frame().jf_gcmap
+
+        FUNC = lltype.FuncType([], lltype.Void)
+        funcptr = llhelper(lltype.Ptr(FUNC), func)
+        calldescr = cpu.calldescrof(FUNC, FUNC.ARGS, FUNC.RESULT,
+                                    EffectInfo([], [], [], [], [], [],
+                                               EffectInfo.EF_CANNOT_RAISE,
+                                               can_collect=False))
+        t = self.new()
+        deadframe = run(cpu, """
+        [p0]
+        call_n(ConstClass(funcptr), descr=calldescr)
+        finish(p0, descr=finaldescr)
+        """, [t], {'funcptr': funcptr, 'calldescr': calldescr,
+                   'finaldescr': BasicFinalDescr(0)})
+        res = lltype.cast_opaque_ptr(lltype.Ptr(T),
+                                     cpu.get_ref_value(deadframe, 0))
+        assert res == t
+
+    def test_malloc_slowpath_gcmap(self):
+        cpu = self.cpu
+        old_refs = [self.new(), self.new()]
+        new_refs = [self.new(), self.new()]
+        obj = self.new()
+        sizes = []
+
+        def malloc_slowpath(size):
+            frame = self.get_frame()
+            assert unpack_gcmap(frame) == [0, 1] # p0 and p1, not i0
+            self.move_frame(frame, new_refs)
+            sizes.append(size)
+            return rffi.cast(lltype.Signed, obj)
+        self.gc_ll_descr.malloc_slowpath = malloc_slowpath
+
+        deadframe = run(cpu, """
+        [i0, p0, p1]
+        p2 = call_malloc_nursery(%d)
+        guard_true(i0, descr=faildescr) [p0, p1, p2]
+        finish(descr=finaldescr)
+        """ % (WORD*2,), [0, old_refs[0], old_refs[1]],
+            {'faildescr': BasicFailDescr(1),
+             'finaldescr': BasicFinalDescr(0)})
+        assert sizes == [WORD*2]
+        res = [lltype.cast_opaque_ptr(lltype.Ptr(T),
+                                      cpu.get_ref_value(deadframe, i))
+               for i in range(3)]
+        assert res == new_refs + [obj]
+        assert self.gc_ll_descr.gcrootmap.getlength() == 0
+
+    def test_cond_call_gc_wb(self):
+        cpu = self.cpu
+        wbdescr = self.gc_ll_descr.write_barrier_descr
+        for hdr in [0, 1]:
+            del wbdescr.called[:]
+            t = self.new(hdr)
+            run(cpu, """
+            [p0, p1]
+            setfield_gc(p0, p1, descr=xdescr)
+            finish(descr=finaldescr)
+            """, [t, self.new()], {'xdescr': self.xdescr,
+                                   'finaldescr': BasicFinalDescr(0)})
+            if hdr:
+                assert wbdescr.called == [rffi.cast(lltype.Signed, t)]
+            else:
+                assert wbdescr.called == []
+
+    def test_cond_call_gc_wb_array_card_marking(self):
+        U = lltype.Struct('U', ('tid', lltype.Signed))
+        U_WITH_CARDS = lltype.Struct('U_WITH_CARDS',
+                                     ('card0', lltype.Char),
+                                     ('card1', lltype.Char),
+                                     ('card2', lltype.Char),
+                                     ('card3', lltype.Char),
+                                     ('card4', lltype.Char),
+                                     ('card5', lltype.Char),
+                                     ('card6', lltype.Char),
+                                     ('card7', lltype.Char),
+                                     ('data',  U))
+        record = []
+        def wb_from_array(obj):
+            record.append(obj)
+            if cond == 1:      # the write barrier sets the flag
+                u.data.tid |= 32768
+        wb_ptr = llhelper_args(wb_from_array, [lltype.Signed], lltype.Void)
+
+        class CardsWriteBarrierDescr(AbstractDescr):
+            jit_wb_if_flag = 4096
+            jit_wb_if_flag_byteofs = struct.pack("l", 4096).index('\x10')
+            jit_wb_if_flag_singlebyte = 0x10
+            jit_wb_cards_set = 32768
+            jit_wb_card_page_shift = 7
+            def get_write_barrier_from_array_fn(self, cpu):
+                return ptr2int(wb_ptr)
+        #
+        for cond in [-1, 0, 1, 2]:
+            # cond=-1:GCFLAG_TRACK_YOUNG_PTRS, GCFLAG_CARDS_SET are not set
+            # cond=0: GCFLAG_CARDS_SET is never set
+            # cond=1: GCFLAG_CARDS_SET is not set, but the wb sets it
+            # cond=2: GCFLAG_CARDS_SET is already set
+            value = 0x70000
+            if cond >= 0:
+                value |= 4096
+            if cond == 2:
+                value |= 32768
+            u = lltype.malloc(U_WITH_CARDS, immortal=True, zero=True)
+            u.data.tid = value
+            ugcref = rffi.cast(llmemory.GCREF, u.data)
+            del record[:]
+            run(self.cpu, """
+            [p0, i0]
+            cond_call_gc_wb_array(p0, i0, descr=wbdescr)
+            finish(descr=finaldescr)
+            """, [ugcref, (9<<7) + 17], {'wbdescr': CardsWriteBarrierDescr(),
+                                         'finaldescr': BasicFinalDescr(0)})
+            if cond in [0, 1]:
+                assert record == [rffi.cast(lltype.Signed, u.data)]
+            else:
+                assert record == []
+            # card 9, i.e. bit 1 of the second byte before the object
+            cards = [u.card0, u.card1, u.card2, u.card3, u.card4, u.card5,
+                     u.card6, u.card7]
+            if cond in [1, 2]:
+                assert cards == ['\x00'] * 6 + ['\x02', '\x00']
+            else:
+                assert cards == ['\x00'] * 8
@@ -0,0 +1,154 @@
+import re
+from rpython.jit.backend.llvm.test.test_compile_latency import get_cpu
+from rpython.jit.backend.llvm.test.test_loop_pipeline import module_text
+from rpython.jit.backend.llsupport.symbolic import WORD
+from rpython.jit.tool.oparser import parse
+from rpython.jit.metainterp.history import (JitCellToken, BasicFinalDescr,
+                                            BasicFailDescr)
+from rpython.rtyper.lltypesystem import lltype, llmemory, rffi
+
+A = lltype.GcArray(lltype.Signed)
+S = lltype.GcStruct('S', ('x', lltype.Signed), ('y', lltype.Signed),
+                    ('c', rffi.SIGNEDCHAR), ('h', rffi.SHORT),
+                    ('b', lltype.Char))
+
+def parse_trace(ops, namespace):
+    """Traces end in a guard that always fails, with the results"""
+    namespace = namespace.copy()
+    namespace['faildescr'] = BasicFailDescr(1)
+    namespace['finaldescr'] = BasicFinalDescr(0)
+    return parse(ops + """
+    finish(descr=finaldescr)
+    """, namespace=namespace)
+
+def run(cpu, ops, args, namespace={}):
+    loop = parse_trace(ops, namespace)
+    looptoken = JitCellToken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+    deadframe = cpu.execute_token(looptoken, *args)
+    assert cpu.get_latest_descr(deadframe).identifier == 1
+    return [cpu.get_int_value(deadframe, i)
+            for i in range(len(loop.operations[-2].getfailargs()))]
+
+def new_array(items):
+    a = lltype.malloc(A, len(items))
+    for i in range(len(items)):
+        a[i] = items[i]
+    return a
+
+def test_gc_load_scaled_and_negative_offsets():
+    cpu = get_cpu()
+    basesize = cpu.arraydescrof(A).basesize
+    a = new_array([10, 20, 30, 40])
+    res = run(cpu, """
+    [p0, i0, i1]
+    i2 = gc_load_i(p0, %(item1)d, %(word)d)
+    i3 = gc_load_i(p0, i0, %(word)d)
+    i4 = gc_load_indexed_i(p0, i1, %(word)d, %(item2)d, %(word)d)
+    i5 = int_sub(i1, 1)
+    i6 = gc_load_indexed_i(p0, i5, %(word)d, %(item2)d, %(word)d)
+    i99 = ptr_eq(p0, p0)
+    guard_false(i99, descr=faildescr) [i2, i3, i4, i6]
+    """ % {'word': WORD, 'item1': basesize + WORD, 'item2': basesize + 2*WORD},
+        [lltype.cast_opaque_ptr(llmemory.GCREF, a), basesize + 3*WORD, -1])
+    # i1 = -1 is scaled by the word size before the base offset is added
+    assert res == [20, 40, 20, 10]
+
+def test_gc_store_scaled_and_negative_offsets():
+    cpu = get_cpu()
+    basesize = cpu.arraydescrof(A).basesize
+    a = new_array([0, 0, 0, 0])
+    run(cpu, """
+    [p0, i0, i1]
+    gc_store(p0, %(item3)d, 33, %(word)d)
+    gc_store(p0, i0, 22, %(word)d)
+    gc_store_indexed(p0, i1, 11, %(word)d, %(item2)d, %(word)d)
+    i2 = int_add(i1, -1)
+    gc_store_indexed(p0, i2, 1, %(word)d, %(item2)d, %(word)d)
+    i99 = ptr_eq(p0, p0)
+    guard_false(i99, descr=faildescr) []
+    """ % {'word': WORD, 'item2': basesize + 2*WORD,
+           'item3': basesize + 3*WORD},
+        [lltype.cast_opaque_ptr(llmemory.GCREF, a), basesize + 2*WORD, -1])
+    assert list(a) == [1, 11, 22, 33]
+
+def test_narrow_loads_are_extended():
+    cpu = get_cpu()
+    s = lltype.malloc(S)
+    s.c = rffi.cast(rffi.SIGNEDCHAR, -3)
+    s.h = rffi.cast(rffi.SHORT, -300)
+    s.b = '\xfd'
+    cdescr = cpu.fielddescrof(S, 'c')
+    hdescr = cpu.fielddescrof(S, 'h')
+    bdescr = cpu.fielddescrof(S, 'b')
+    cofs = cdescr.offset
+    res = run(cpu, """
+    [p0]
+    i1 = getfield_gc_i(p0, descr=cdescr)
+    i2 = getfield_gc_i(p0, descr=hdescr)
+    i3 = getfield_gc_i(p0, descr=bdescr)
+    i4 = gc_load_i(p0, %d, -1)
+    i5 = gc_load_i(p0, %d, 1)
+    i99 = ptr_eq(p0, p0)
+    guard_false(i99, descr=faildescr) [i1, i2, i3, i4, i5]
+    """ % (cofs, cofs), [lltype.cast_opaque_ptr(llmemory.GCREF, s)],
+        {'cdescr': cdescr, 'hdescr': hdescr, 'bdescr': bdescr})
+    # a negative size asks gc_load for a signed value
+    assert res == [-3, -300, 0xfd, -3, 0xfd]
+
+def test_narrow_stores_are_truncated():
+    cpu = get_cpu()
+    s = lltype.malloc(S, zero=True)
+    s.y = 42
+    res = run(cpu, """
+    [p0, i0]
+    setfield_gc(p0, i0, descr=hdescr)
+    i1 = getfield_gc_i(p0, descr=hdescr)
+    i99 = ptr_eq(p0, p0)
+    guard_false(i99, descr=faildescr) [i1]
+    """, [lltype.cast_opaque_ptr(llmemory.GCREF, s), 0x7f345],
+        {'hdescr': cpu.fielddescrof(S, 'h')})
+    assert res == [0xf345 - 0x10000]
+    assert s.y == 42 # the neighbouring fields are untouched
+
+def tbaa_tags(text):
+    return re.findall(r"(load|store) .*!tbaa (![0-9]+)", text)
+
+def tbaa_type(text, tag):
+    """Name of the type a tbaa access tag is for, and its parent type"""
+    typ = re.search(r"^%s = !{(![0-9]+), " % tag, text, re.M).group(1)
+    match = re.search(r'^%s = !{!"([^"]*)", (![0-9]+), i64 0}' % typ, text,
+                      re.M)
+    return match.group(1), match.group(2)
+
+def test_tbaa_tag_per_descr():
+    cpu = get_cpu()
+    xdescr = cpu.fielddescrof(S, 'x')
+    ydescr = cpu.fielddescrof(S, 'y')
+    trace = parse_trace("""
+    [p0, i0]
+    i1 = getfield_gc_i(p0, descr=xdescr)
+    i2 = getfield_gc_i(p0, descr=ydescr)
+    setfield_gc(p0, i0, descr=xdescr)
+    i3 = getfield_gc_i(p0, descr=xdescr)
+    i4 = gc_load_i(p0, 0, %d)
+    i99 = ptr_eq(p0, p0)
+    guard_false(i99, descr=faildescr) [i1, i2, i3, i4]
+    """ % WORD, {'xdescr': xdescr, 'ydescr': ydescr})
+    text = module_text(cpu, trace)
+    # the jitframe's own slots have no tag
+    accesses = tbaa_tags(text)
+    assert [kind for kind, tag in accesses] == ['load', 'load', 'store',
+                                                'load', 'load']
+    x1, y, x2, x3, untyped = [tag for kind, tag in accesses]
+    assert x1 == x2 == x3
+    assert len(set([x1, y, untyped])) == 3
+    # every descr's type is a child of 'any', which gc_load uses
+    any_name, root = tbaa_type(text, untyped)
+    assert any_name == "any"
+    any_type = re.search(r'^(![0-9]+) = !{!"any", ', text, re.M).group(1)
+    xname, xparent = tbaa_type(text, x1)
+    yname, yparent = tbaa_type(text, y)
+    assert xname.startswith(xdescr.repr_of_descr())
+    assert yname.startswith(ydescr.repr_of_descr())
+    assert xparent == yparent == any_type
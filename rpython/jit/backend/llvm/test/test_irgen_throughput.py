@@ -0,0 +1,98 @@
+import time
+from rpython.jit.backend.llvm.test.test_compile_latency import get_cpu
+from rpython.jit.tool.oparser import parse
+from rpython.jit.metainterp.history import (TargetToken, BasicFailDescr,
+                                            BasicFinalDescr)
+from rpython.rlib.jit import PARAMETERS
+
+def make_long_loop(num_ops):
+    """Loop of int arithmetic with a guard every few ops, num_ops long"""
+    lines = ["[i0, i1]",
+             "label(i0, i1, descr=targettoken)"]
+    namespace = {'targettoken': TargetToken()}
+    k = 2
+    while len(lines) < num_ops:
+        lines.append("i%d = int_add(i%d, 1)" % (k, k-2))
+        lines.append("i%d = int_mul(i%d, 3)" % (k+1, k-1))
+        lines.append("i%d = int_lt(i%d, 1000000)" % (k+2, k))
+        lines.append("guard_true(i%d, descr=f%d) [i%d, i%d]" % (k+2, k, k,
+                                                               k+1))
+        namespace['f%d' % k] = BasicFailDescr(k)
+        k += 3
+    lines.append("jump(i%d, i%d, descr=targettoken)" % (k-3, k-2))
+    return parse("\n".join(lines), namespace=namespace)
+
+def test_irgen_throughput(num_ops=PARAMETERS['trace_limit'], repeats=5):
+    """
+    Times IR generation alone, so lowering regressions aren't hidden behind
+    LLVM's own optimisation and codegen time.
+    """
+    cpu = get_cpu()
+    loop = make_long_loop(num_ops)
+    best = None
+    for n in range(repeats):
+        dispatcher = cpu.create_dispatcher("bench", "bench_%d" % n,
+                                           len(loop.inputargs))
+        start = time.time()
+        dispatcher.dispatch_ops(loop.inputargs, loop.operations)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print("IR generation: %d ops in %.3fms, %.0f ops/s" % (
+        len(loop.operations), 1000*best, len(loop.operations)/best))
+
+def make_guarded_trace(num_guards, wide_failargs=50):
+    """One guard with many failargs, then num_guards with a single one"""
+    inputs = ["i%d" % k for k in range(wide_failargs)]
+    lines = ["[%s]" % ", ".join(inputs),
+             "i1000 = int_lt(i0, 1000000)",
+             "guard_true(i1000, descr=wide) [%s]" % ", ".join(inputs)]
+    namespace = {'wide': BasicFailDescr(0), 'done': BasicFinalDescr(1)}
+    for k in range(num_guards):
+        lines.append("i%d = int_add(i0, %d)" % (2001+k, k))
+        lines.append("i%d = int_lt(i%d, 1000000)" % (3001+k, 2001+k))
+        lines.append("guard_true(i%d, descr=f%d) [i%d]" % (3001+k, k, 2001+k))
+        namespace['f%d' % k] = BasicFailDescr(k+2)
+    lines.append("finish(i0, descr=done)")
+    return parse("\n".join(lines), namespace=namespace)
+
+def test_guard_ir_scales_linearly():
+    """Guards only pay for their own failargs, not the widest guard's"""
+    cpu = get_cpu()
+    sizes = []
+    for num_guards in (100, 200):
+        trace = make_guarded_trace(num_guards)
+        dispatcher = cpu.create_dispatcher("guards", "guards_%d" % num_guards,
+                                           len(trace.inputargs))
+        dispatcher.dispatch_ops(trace.inputargs, trace.operations)
+        sizes.append(cpu.llvm.GetInstructionCount(dispatcher.module))
+    print("IR instructions: 100 guards %d, 200 guards %d" % tuple(sizes))
+    assert sizes[1] < 2.2 * sizes[0]
+    assert sizes[1] - sizes[0] < 100 * 15 #a handful of instructions per guard
+
+def build_time(cpu, loop, name):
+    dispatcher = cpu.create_dispatcher("bench", name, len(loop.inputargs))
+    start = time.time()
+    dispatcher.dispatch_ops(loop.inputargs, loop.operations)
+    return time.time() - start
+
+def test_cpu_caches(num_ops=5000, repeats=5):
+    """
+    A trace built on a fresh CPU fills its type, constant and name caches,
+    later ones only look them up. The only new constants are the addresses
+    of the bridge slots every build of the trace allocates for its guards.
+    """
+    loop = make_long_loop(num_ops)
+    num_guards = len([op for op in loop.operations if op.is_guard()])
+    cold = min([build_time(get_cpu(), loop, "cold") for n in range(repeats)])
+    cpu = get_cpu()
+    build_time(cpu, loop, "fill")
+    cached = (len(cpu.trace_types), len(cpu.float_consts),
+              len(cpu.value_names))
+    cached_words = len(cpu.word_consts)
+    warm = min([build_time(cpu, loop, "warm_%d" % n) for n in range(repeats)])
+    assert (len(cpu.trace_types), len(cpu.float_consts),
+            len(cpu.value_names)) == cached
+    assert len(cpu.word_consts) <= cached_words + repeats * num_guards
+    print("IR generation of %d ops: fresh CPU %.3fms, warm caches %.3fms" % (
+        len(loop.operations), 1000*cold, 1000*warm))
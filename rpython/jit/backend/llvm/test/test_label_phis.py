@@ -0,0 +1,110 @@
+import time
+from rpython.jit.backend.llvm.test.test_compile_latency import get_cpu
+from rpython.jit.backend.llvm.test.test_loop_pipeline import module_text
+from rpython.jit.backend.llvm.test.test_runner import FakeStats
+from rpython.jit.backend.x86.runner import CPU_X86_64
+from rpython.jit.tool.oparser import parse
+from rpython.jit.metainterp.history import (JitCellToken, TargetToken,
+                                            BasicFailDescr)
+
+DT = 0.001
+
+def make_oscillator_loop(targettoken, done):
+    """
+    Leapfrog steps of a spring, nbody's inner loop in one dimension. The
+    floats and the sign of the position, a comparison, are carried
+    around the loop.
+    """
+    return parse("""
+    [i0, i1, f2, f3]
+    i4 = float_lt(f2, 0.0)
+    label(i0, i1, f2, f3, i4, descr=targettoken)
+    f5 = float_mul(f2, %(dt)r)
+    f6 = float_sub(f3, f5)
+    f7 = float_mul(f6, %(dt)r)
+    f8 = float_add(f2, f7)
+    i9 = float_lt(f8, 0.0)
+    i10 = int_add(i0, 1)
+    i11 = int_lt(i10, i1)
+    guard_true(i11, descr=done) [i10, i1, f8, f6, i9, i4]
+    jump(i10, i1, f8, f6, i9, descr=targettoken)
+    """ % {'dt': DT}, namespace={'targettoken': targettoken, 'done': done})
+
+def oscillate(steps, x, v):
+    sign = prev = x < 0.0
+    for i in range(steps):
+        v = v - x * DT
+        x = x + v * DT
+        prev = sign
+        sign = x < 0.0
+    return x, v, sign, prev
+
+def check_exit(cpu, deadframe, steps, x, v):
+    ex, ev, esign, eprev = oscillate(steps, x, v)
+    assert cpu.get_int_value(deadframe, 0) == steps
+    assert cpu.get_float_value(deadframe, 2) == ex
+    assert cpu.get_float_value(deadframe, 3) == ev
+    assert cpu.get_int_value(deadframe, 4) == int(esign) #0 or 1, never -1
+    assert cpu.get_int_value(deadframe, 5) == int(eprev)
+
+def test_header_phis_are_typed():
+    cpu = get_cpu()
+    text = module_text(cpu, make_oscillator_loop(TargetToken(),
+                                                 BasicFailDescr(1)))
+    assert "phi double" in text
+    assert "phi i1" in text
+
+def test_typed_phis_run():
+    cpu = get_cpu()
+    done = BasicFailDescr(1)
+    loop = make_oscillator_loop(TargetToken(), done)
+    looptoken = JitCellToken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+    for x in (1.0, -1.0):
+        deadframe = cpu.execute_token(looptoken, 0, 5000, x, 0.0)
+        assert cpu.get_latest_descr(deadframe) is done
+        check_exit(cpu, deadframe, 5000, x, 0.0)
+
+def test_bool_phi_entered_from_bridge():
+    """A bridge jumping back leaves the comparison in the jitframe as a word"""
+    cpu = get_cpu()
+    targettoken = TargetToken()
+    done = BasicFailDescr(1)
+    loop = make_oscillator_loop(targettoken, done)
+    looptoken = JitCellToken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+    stop = BasicFailDescr(2)
+    bridge = parse("""
+    [i0, i1, f2, f3, i4, i5]
+    i6 = int_lt(i1, 3000)
+    guard_true(i6, descr=stop) [i0, i1, f2, f3, i4, i5]
+    i7 = int_add(i1, 1000)
+    jump(i0, i7, f2, f3, i4, descr=targettoken)
+    """, namespace={'targettoken': targettoken, 'stop': stop})
+    cpu.compile_bridge(done, bridge.inputargs, bridge.operations, looptoken)
+    deadframe = cpu.execute_token(looptoken, 0, 1000, 1.0, 0.0)
+    assert cpu.get_latest_descr(deadframe) is stop
+    check_exit(cpu, deadframe, 3000, 1.0, 0.0)
+
+def run(cpu, steps, repeats):
+    loop = make_oscillator_loop(TargetToken(), BasicFailDescr(1))
+    looptoken = JitCellToken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+    cpu.execute_token(looptoken, 0, steps, 1.0, 0.0) #warmup
+    best = None
+    for n in range(repeats):
+        t = time.time()
+        deadframe = cpu.execute_token(looptoken, 0, steps, 1.0, 0.0)
+        elapsed = time.time() - t
+        if best is None or elapsed < best:
+            best = elapsed
+    assert cpu.get_int_value(deadframe, 0) == steps
+    return best
+
+def test_float_loop_benchmark(steps=10**7, repeats=3):
+    """x86 against LLVM on a loop carrying floats and a comparison"""
+    x86 = CPU_X86_64(rtyper=None, stats=FakeStats())
+    x86.setup_once()
+    for name, cpu in [("x86", x86), ("llvm", get_cpu())]:
+        best = run(cpu, steps, repeats)
+        print("%-5s %.2fns/step" % (name, 1e9*best/steps))
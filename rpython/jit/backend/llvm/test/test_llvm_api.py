@@ -0,0 +1,27 @@
+import ctypes, os
+import py
+from rpython.jit.backend.llvm.llvm_api import (llvm_config, build_wrapper,
+                                               WRAPPER_DIR, ScratchArray)
+from rpython.rtyper.lltypesystem import rffi, lltype
+
+def test_wrapper_builds_from_source():
+    try:
+        config = llvm_config()
+    except ImportError:
+        py.test.skip("llvm-config not found")
+    if not py.process.cmdexec('"%s" --version' % config).startswith("12."):
+        py.test.skip("the wrapper is written against LLVM 12")
+    build_wrapper(config)
+    lib = ctypes.CDLL(os.path.join(WRAPPER_DIR, "libwrapper.so"))
+    for name in ("LoadFrameArgs", "StoreFrameArgs", "BuildGuardBranch",
+                 "BuildOverflowOp", "BuildCallAddress", "BuildGEP1D"):
+        assert hasattr(lib, name)
+
+def test_scratch_array_grows():
+    scratch = ScratchArray(2)
+    null = lltype.nullptr(rffi.VOIDP.TO)
+    array = scratch.fill([null, null, null])
+    assert scratch.size == 4
+    assert scratch.reserve(4) == array
+    scratch.reserve(5)
+    assert scratch.size == 8
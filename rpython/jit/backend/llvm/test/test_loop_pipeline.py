@@ -0,0 +1,115 @@
+import time
+from rpython.jit.backend.llvm.test.test_compile_latency import get_cpu
+from rpython.jit.backend.llvm.test.test_runner import FakeStats
+from rpython.jit.backend.x86.runner import CPU_X86_64
+from rpython.jit.tool.oparser import parse
+from rpython.jit.metainterp.compile import ResumeGuardDescr
+from rpython.jit.metainterp.history import (JitCellToken, TargetToken,
+                                            BasicFailDescr)
+from rpython.rtyper.lltypesystem import lltype, rffi
+from rpython.rlib.rarithmetic import r_uint
+
+FLOATS = rffi.CArray(lltype.Float)
+
+def make_int_loop(guard_descr=None):
+    """Counting loop doing some arithmetic, the shape of rpystone's loops"""
+    return parse("""
+    [i0, i1, i2]
+    label(i0, i1, i2, descr=targettoken)
+    i3 = int_mul(i0, 7)
+    i4 = int_and(i3, 255)
+    i5 = int_add(i2, i4)
+    i6 = int_ge(i5, 0)
+    guard_true(i6, descr=overflow) [i0, i5]
+    i7 = int_add(i0, 1)
+    i8 = int_lt(i7, i1)
+    guard_true(i8, descr=done) [i7, i5]
+    jump(i7, i1, i5, descr=targettoken)
+    """, namespace={'targettoken': TargetToken(),
+                    'overflow': guard_descr or BasicFailDescr(1),
+                    'done': BasicFailDescr(2)})
+
+def make_axpy_loop(cpu):
+    """y[i] += a*x[i] over raw arrays, a micronumpy kernel"""
+    return parse("""
+    [i0, i1, i2, i3, f4]
+    label(i0, i1, i2, i3, f4, descr=targettoken)
+    f5 = raw_load_f(i0, i2, descr=arraydescr)
+    f6 = raw_load_f(i1, i2, descr=arraydescr)
+    f7 = float_mul(f4, f5)
+    f8 = float_add(f6, f7)
+    raw_store(i1, i2, f8, descr=arraydescr)
+    i9 = int_add(i2, 8)
+    i10 = int_lt(i9, i3)
+    guard_true(i10, descr=done) [i9]
+    jump(i0, i1, i9, i3, f4, descr=targettoken)
+    """, namespace={'targettoken': TargetToken(), 'done': BasicFailDescr(2),
+                    'arraydescr': cpu.arraydescrof(FLOATS)})
+
+def module_text(cpu, trace):
+    dispatcher = cpu.create_dispatcher("loop", "loop", len(trace.inputargs))
+    dispatcher.dispatch_ops(trace.inputargs, trace.operations)
+    return cpu.assembler.module_text(dispatcher.module)
+
+def test_loops_are_canonical():
+    cpu = get_cpu()
+    text = module_text(cpu, make_int_loop())
+    assert "loop_preheader:" in text
+    assert "!llvm.loop" in text
+    assert "distinct !{" in text #the loop id refers to itself
+
+class FakeGuardCounter(object):
+    def __init__(self, fractions):
+        self.fractions = fractions
+
+    def current_fraction(self, hash):
+        return self.fractions.get(hash, 0.0)
+
+def test_guard_weights_follow_failures():
+    cpu = get_cpu()
+    descr = ResumeGuardDescr()
+    descr.status = r_uint(5 << descr.ST_SHIFT)
+    text = module_text(cpu, make_int_loop(descr))
+    assert '!"branch_weights", i32 2000, i32 1}' in text
+    cpu.set_guard_counter(FakeGuardCounter({descr.status: 0.5}))
+    text = module_text(cpu, make_int_loop(descr))
+    assert '!"branch_weights", i32 2000, i32 101}' in text
+
+def run(cpu, trace, args, repeats):
+    looptoken = JitCellToken()
+    cpu.compile_loop(trace.inputargs, trace.operations, looptoken)
+    cpu.execute_token(looptoken, *args) #warmup
+    best = None
+    for n in range(repeats):
+        t = time.time()
+        deadframe = cpu.execute_token(looptoken, *args)
+        elapsed = time.time() - t
+        if best is None or elapsed < best:
+            best = elapsed
+    assert cpu.get_latest_descr(deadframe).identifier == 2
+    return best
+
+def test_loop_pipeline_benchmark(iterations=10**7, repeats=3):
+    """x86 against LLVM with and without its loop passes, after warmup"""
+    x = lltype.malloc(FLOATS, iterations, flavor='raw')
+    y = lltype.malloc(FLOATS, iterations, flavor='raw')
+    for i in range(iterations):
+        x[i] = i * 0.5
+        y[i] = 1.0
+    axpy_args = [rffi.cast(lltype.Signed, x), rffi.cast(lltype.Signed, y),
+                 0, iterations * 8, 2.0]
+    int_args = [0, iterations, 0]
+    x86 = CPU_X86_64(rtyper=None, stats=FakeStats())
+    x86.setup_once()
+    backends = [("x86", x86)]
+    for pipeline in ("trace-tuned", "trace-loops"):
+        cpu = get_cpu()
+        cpu.set_llvm_passes(pipeline)
+        backends.append(("llvm " + pipeline, cpu))
+    for name, cpu in backends:
+        int_time = run(cpu, make_int_loop(), int_args, repeats)
+        axpy_time = run(cpu, make_axpy_loop(cpu), axpy_args, repeats)
+        print("%-18s int loop %.2fns/iteration, axpy %.2fns/element" % (
+            name, 1e9*int_time/iterations, 1e9*axpy_time/iterations))
+    lltype.free(x, flavor='raw')
+    lltype.free(y, flavor='raw')
@@ -0,0 +1,42 @@
+import os
+from rpython.jit.backend.llvm.llvm_api import CString
+from rpython.jit.backend.llvm.test.test_compile_latency import get_cpu
+from rpython.jit.backend.llvm.test.test_loop_pipeline import make_int_loop
+from rpython.jit.metainterp.history import JitCellToken
+
+def rss():
+    statm = open("/proc/self/statm").read()
+    return int(statm.split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def compile_and_run(cpu):
+    loop = make_int_loop()
+    looptoken = JitCellToken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+    deadframe = cpu.execute_token(looptoken, 0, 10, 0)
+    assert cpu.get_latest_descr(deadframe).identifier == 2
+    return looptoken
+
+def test_free_removes_code():
+    cpu = get_cpu()
+    looptoken = compile_and_run(cpu)
+    cstring = CString("trace_%d" % looptoken.number)
+    lookup = cpu.llvm.LLJITLookup
+    assert lookup(cpu.assembler.LLJIT, cstring.ptr)._cast_to_int() != 0
+    cpu.free_loop_and_bridges(looptoken.compiled_loop_token)
+    assert looptoken.compiled_loop_token.llvm_resources is None
+    assert lookup(cpu.assembler.LLJIT, cstring.ptr)._cast_to_int() == 0
+    cpu.free_loop_and_bridges(looptoken.compiled_loop_token) #again when the token dies
+
+def test_retired_loops_release_memory(num_loops=3000):
+    """RSS stays flat while loops keep getting compiled and retired"""
+    cpu = get_cpu()
+    def cycle(n):
+        for i in range(n):
+            looptoken = compile_and_run(cpu)
+            cpu.free_loop_and_bridges(looptoken.compiled_loop_token)
+    cycle(200) #caches and allocator pools reach their steady state
+    before = rss()
+    cycle(num_loops)
+    growth = rss() - before
+    print("RSS growth over %d loops: %dKB" % (num_loops, growth // 1024))
+    assert growth < 16 * 1024 * 1024
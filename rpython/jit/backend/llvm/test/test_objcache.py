@@ -0,0 +1,41 @@
+import os
+from rpython.jit.backend.llvm.objcache import ObjectCache, interpreter_salt
+
+def test_store_and_lookup(tmpdir):
+    cache = ObjectCache(str(tmpdir), 1024, "salt")
+    key = cache.make_key("define void @trace_1()", "trace-tuned 3")
+    assert cache.lookup(key) is None
+    cache.store(key, "\x7fELF\x00object")
+    assert cache.lookup(key) == "\x7fELF\x00object"
+    assert (cache.hits, cache.misses) == (1, 1)
+    #a fresh process sees the same entry
+    assert ObjectCache(str(tmpdir), 1024, "salt").lookup(key) is not None
+
+def test_key_depends_on_salt_and_config(tmpdir):
+    cache = ObjectCache(str(tmpdir), 1024, "salt")
+    other_binary = ObjectCache(str(tmpdir), 1024, "other salt")
+    key = cache.make_key("ir", "O2 2")
+    assert other_binary.make_key("ir", "O2 2") != key
+    assert cache.make_key("ir", "O3 3") != key
+    assert cache.make_key("ir", "O2 2") == key
+
+def test_lru_eviction(tmpdir):
+    cache = ObjectCache(str(tmpdir), 300, "salt")
+    for i in range(3):
+        cache.store("key%d" % i, "x" * 100)
+        os.utime(cache.filename("key%d" % i), (i, i))
+    assert cache.lookup("key0") is not None #now the most recently used
+    cache.store("key3", "x" * 100)
+    assert cache.evictions == 2
+    assert cache.lookup("key1") is None
+    assert cache.lookup("key2") is None
+    assert cache.lookup("key0") is not None
+    assert cache.lookup("key3") is not None
+    assert cache.total_size == 200
+
+def test_interpreter_salt(tmpdir):
+    binary = tmpdir.join("pypy")
+    binary.write("old")
+    old = interpreter_salt(str(binary))
+    binary.write("rebuilt")
+    assert interpreter_salt(str(binary)) != old
@@ -0,0 +1,32 @@
+import py
+from rpython.jit.backend.llvm.optimiser import (parse_pipeline, split_pipeline,
+                                                PRESETS, CODEGEN_DEFAULT,
+                                                CODEGEN_NONE)
+
+def test_presets():
+    for name, (passes, codegen_level) in PRESETS.items():
+        pipeline = parse_pipeline(name)
+        assert not pipeline.new_pm
+        assert pipeline.passes == passes
+        assert pipeline.codegen_level == codegen_level
+    assert parse_pipeline('').passes == PRESETS['trace-tuned'][0]
+
+def test_pass_list():
+    pipeline = parse_pipeline('O0:licm:gvn')
+    assert pipeline.passes == ['licm', 'gvn']
+    assert pipeline.codegen_level == CODEGEN_NONE
+    pipeline = parse_pipeline('instcombine,simplifycfg') #from pypyjit.set_param()
+    assert pipeline.passes == ['instcombine', 'simplifycfg']
+    assert pipeline.codegen_level == CODEGEN_DEFAULT
+    py.test.raises(ValueError, parse_pipeline, 'gvn:not-a-pass')
+
+def test_new_pm():
+    pipeline = parse_pipeline('npm/function(sroa:instcombine):globaldce')
+    assert pipeline.new_pm
+    assert pipeline.passes == ['function(sroa,instcombine)', 'globaldce']
+    assert pipeline.new_pm_pipeline() == 'function(sroa,instcombine),globaldce'
+    assert parse_pipeline('npm/O2').passes == ['default<O2>']
+    py.test.raises(ValueError, parse_pipeline, 'npm/')
+
+def test_split_pipeline():
+    assert split_pipeline('a,b(c,d<e,f>),g') == ['a', 'b(c,d<e,f>)', 'g']
@@ -0,0 +1,55 @@
+import sys, time
+from rpython.jit.backend.llvm.test.test_compile_latency import get_cpu
+from rpython.jit.tool.oparser import parse
+from rpython.jit.metainterp.history import (JitCellToken, TargetToken,
+                                            BasicFailDescr)
+
+def make_ovf_loop():
+    """Sums i*3 - 1 for i up to i1 with every op overflow checked"""
+    return parse("""
+    [i0, i1, i2]
+    label(i0, i1, i2, descr=targettoken)
+    i3 = int_mul_ovf(i0, 3)
+    guard_no_overflow(descr=ovf) [i0, i2]
+    i4 = int_sub_ovf(i3, 1)
+    guard_no_overflow(descr=ovf) [i0, i2]
+    i5 = int_add_ovf(i2, i4)
+    guard_no_overflow(descr=ovf) [i0, i2]
+    i6 = int_add_ovf(i0, 1)
+    guard_no_overflow(descr=ovf) [i0, i2]
+    i7 = int_lt(i6, i1)
+    guard_true(i7, descr=done) [i6, i5]
+    jump(i6, i1, i5, descr=targettoken)
+    """, namespace={'targettoken': TargetToken(),
+                    'ovf': BasicFailDescr(1), 'done': BasicFailDescr(2)})
+
+def run_loop(overflow_intrinsics, start, limit, acc):
+    cpu = get_cpu()
+    cpu.overflow_intrinsics = overflow_intrinsics
+    loop = make_ovf_loop()
+    looptoken = JitCellToken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+    t = time.time()
+    deadframe = cpu.execute_token(looptoken, start, limit, acc)
+    elapsed = time.time() - t
+    descr = cpu.get_latest_descr(deadframe)
+    return (descr.identifier, cpu.get_int_value(deadframe, 0),
+            cpu.get_int_value(deadframe, 1), elapsed)
+
+def test_lowerings_agree():
+    for overflow_intrinsics in (True, False):
+        res = run_loop(overflow_intrinsics, 0, 1000, 0)
+        assert res[:3] == (2, 1000, sum([i*3-1 for i in range(1000)]))
+        res = run_loop(overflow_intrinsics, 0, 1000, sys.maxint - 1000)
+        assert res[0] == 1 #int_add_ovf into the accumulator overflows
+        res = run_loop(overflow_intrinsics, sys.maxint // 3 + 1, sys.maxint, 0)
+        assert res[:2] == (1, sys.maxint // 3 + 1) #the first int_mul_ovf overflows
+
+def test_overflow_lowering_benchmark(iterations=10**8, repeats=3):
+    """Overflow intrinsics vs the sign-extend-to-i128 lowering"""
+    for overflow_intrinsics in (False, True):
+        best = min([run_loop(overflow_intrinsics, 0, iterations, 0)[3]
+                    for n in range(repeats)])
+        print("%s: %d iterations in %.3fms, %.2fns/iteration" % (
+            "intrinsics" if overflow_intrinsics else "i128 widening",
+            iterations, 1000*best, 1e9*best/iterations))
@@ -0,0 +1,65 @@
+from rpython.jit.backend.llvm.test.test_compile_latency import get_cpu
+from rpython.jit.backend.llsupport.codemap import unpack_traceback
+from rpython.jit.backend.x86.perfmap import PerfMapAgent
+from rpython.jit.tool.oparser import parse
+from rpython.jit.metainterp.history import (JitCellToken, BasicFailDescr,
+                                            BasicFinalDescr)
+
+def test_perf_map_agent(tmpdir):
+    path = str(tmpdir.join("perf.map"))
+    agent = PerfMapAgent(path)
+    agent.startup()
+    agent.native_code_written("Loop # 1: foo (trace_1)", 0x1000, 0x40)
+    agent.native_code_written("Bridge # 2 (bridge_1)", 0x2000, 8)
+    agent.shutdown()
+    agent.native_code_written("too late", 0x3000, 8)
+    assert open(path).read() == ("1000 40 Loop # 1: foo (trace_1)\n"
+                                 "2000 8 Bridge # 2 (bridge_1)\n")
+
+class RecordingAgent(object):
+    def __init__(self):
+        self.written = []
+
+    def native_code_written(self, name, address, size):
+        self.written.append((name, address, size))
+
+def compile_loop_and_bridge(cpu):
+    loop = parse("""
+    [i0]
+    i1 = int_add(i0, 1)
+    i2 = int_lt(i1, 10)
+    guard_true(i2, descr=faildescr) [i1]
+    finish(i1, descr=done)
+    """, namespace={'faildescr': BasicFailDescr(1),
+                    'done': BasicFinalDescr(2)})
+    looptoken = JitCellToken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken,
+                     jd_id=0, unique_id=1234, name="foo")
+    bridge = parse("""
+    [i0]
+    i1 = int_sub(i0, 10)
+    finish(i1, descr=done)
+    """, namespace={'done': BasicFinalDescr(3)})
+    faildescr = loop.operations[2].getdescr()
+    cpu.compile_bridge(faildescr, bridge.inputargs, bridge.operations,
+                       looptoken)
+    return looptoken
+
+def test_code_is_registered():
+    cpu = get_cpu()
+    cpu.codemap.setup()
+    cpu.profile_agent = agent = RecordingAgent()
+    looptoken = compile_loop_and_bridge(cpu)
+    resources = looptoken.compiled_loop_token.llvm_resources
+    symbols = [symbol for symbol, addr, size in resources.code_ranges]
+    assert symbols[0] == "trace_%d_body" % looptoken.number
+    assert "bridge_%d" % cpu.bridge_count in symbols
+    assert len(agent.written) == len(resources.code_ranges)
+    assert agent.written[0][0].startswith("Loop # %d: foo" % looptoken.number)
+    for symbol, addr, size in resources.code_ranges:
+        assert size > 0
+        assert unpack_traceback(addr) == [1234]
+        assert unpack_traceback(addr + size - 1) == [1234]
+    cpu.free_loop_and_bridges(looptoken.compiled_loop_token)
+    for symbol, addr, size in resources.code_ranges:
+        assert unpack_traceback(addr) == []
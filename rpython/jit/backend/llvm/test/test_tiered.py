@@ -0,0 +1,144 @@
+import time
+from rpython.jit.backend.llvm.tiered import TieredCPU
+from rpython.jit.backend.llvm.test.test_runner import FakeStats
+from rpython.jit.backend.llvm.test.test_compile_latency import make_loop
+from rpython.jit.tool.oparser import parse
+from rpython.jit.metainterp.history import JitCellToken, BasicFinalDescr
+from rpython.rlib.jit import Counters
+from rpython.rlib import rtime
+import itertools
+
+_numbers = itertools.count()
+
+def get_cpu(threshold):
+    cpu = TieredCPU(rtyper=None, stats=FakeStats())
+    cpu.setup_once()
+    cpu.set_llvm_threshold(threshold)
+    return cpu
+
+def new_looptoken():
+    """Numbered like the metainterp does, LLVM names the loop after it"""
+    looptoken = JitCellToken()
+    looptoken.number = next(_numbers)
+    return looptoken
+
+def run_until_tiered(cpu, looptoken, timeout=30.0):
+    start = time.time()
+    while cpu.tier_up(looptoken) is None:
+        assert time.time() - start < timeout
+        rtime.sleep(0.01) #releases the GIL the compile threads need
+
+def test_hot_loop_moves_to_llvm(threshold=5):
+    cpu = get_cpu(threshold)
+    loop = make_loop(0)
+    looptoken = new_looptoken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+
+    for i in range(threshold):
+        deadframe = cpu.execute_token(looptoken, 0)
+        assert not cpu.is_llvm_frame(deadframe)
+        assert cpu.get_latest_descr(deadframe).identifier == 0
+        assert cpu.get_int_value(deadframe, 0) == 1001
+
+    run_until_tiered(cpu, looptoken)
+    deadframe = cpu.execute_token(looptoken, 0)
+    assert cpu.is_llvm_frame(deadframe)
+    assert cpu.get_latest_descr(deadframe).identifier == 0
+    assert cpu.get_int_value(deadframe, 0) == 1001
+
+def test_bridge_follows_loop_to_llvm(threshold=5):
+    cpu = get_cpu(threshold)
+    loop = make_loop(0)
+    looptoken = new_looptoken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+    for i in range(threshold):
+        cpu.execute_token(looptoken, 0)
+    run_until_tiered(cpu, looptoken)
+
+    guard = loop.operations[3]
+    finishdescr = BasicFinalDescr(42)
+    bridge = parse("""
+    [i0]
+    i1 = int_add(i0, 7)
+    finish(i1, descr=finishdescr)
+    """, namespace={'finishdescr': finishdescr})
+    cpu.compile_bridge(guard.getdescr(), bridge.inputargs,
+                       bridge.operations, looptoken)
+    deadframe = cpu.execute_token(looptoken, 0) #x86 until the bridge is moved over
+    assert cpu.get_latest_descr(deadframe) is finishdescr
+    assert cpu.get_int_value(deadframe, 0) == 1008
+
+    run_until_tiered(cpu, looptoken)
+    deadframe = cpu.execute_token(looptoken, 0)
+    assert cpu.is_llvm_frame(deadframe)
+    assert cpu.get_latest_descr(deadframe) is finishdescr
+    assert cpu.get_int_value(deadframe, 0) == 1008
+
+def test_loops_spread_over_compile_threads(threshold=1):
+    cpu = get_cpu(threshold)
+    assert len(cpu.compiler.workers) == cpu.compile_threads > 1
+    tokens = []
+    for n in range(2 * cpu.compile_threads):
+        loop = make_loop(n)
+        looptoken = new_looptoken()
+        cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+        cpu.execute_token(looptoken, 0)
+        tokens.append(looptoken)
+    for n, looptoken in enumerate(tokens):
+        run_until_tiered(cpu, looptoken)
+        deadframe = cpu.execute_token(looptoken, 0)
+        assert cpu.is_llvm_frame(deadframe)
+        assert cpu.get_latest_descr(deadframe).identifier == n
+    workers = set([cpu.requests[looptoken].worker for looptoken in tokens])
+    assert len(workers) == cpu.compile_threads
+    for worker in cpu.compiler.workers:
+        assert worker.started
+        assert worker.labels
+
+def test_compile_budget_defers_loops(threshold=5):
+    cpu = get_cpu(threshold)
+    now = [100.0]
+    cpu.timer = lambda: now[0]
+    looptokens = []
+    for i in range(2):
+        loop = make_loop(0)
+        looptoken = new_looptoken()
+        cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+        looptokens.append(looptoken)
+    cpu.set_llvm_compile_budget(len(loop.operations)) #one loop per second
+    for looptoken in looptokens:
+        for i in range(threshold):
+            cpu.execute_token(looptoken, 0)
+    assert cpu.deferred == [cpu.requests[looptokens[1]]]
+    stats = cpu.tracker.compile_stats
+    assert stats.counts[Counters.LLVM_DEFERRED] == 1
+    run_until_tiered(cpu, looptokens[0])
+    assert cpu.deferred #still the same second
+    now[0] += 1.0
+    run_until_tiered(cpu, looptokens[1])
+    assert not cpu.deferred
+    assert stats.counts[Counters.LLVM_BUILD_IR] == 2
+    assert stats.counts[Counters.LLVM_CODE_SIZE] > 0
+
+def test_free_loop_frees_llvm_tier(threshold=5):
+    cpu = get_cpu(threshold)
+    looptokens = []
+    for n in range(2):
+        loop = make_loop(n)
+        looptoken = new_looptoken()
+        cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+        looptokens.append(looptoken)
+    for i in range(threshold):
+        cpu.execute_token(looptokens[0], 0)
+    run_until_tiered(cpu, looptokens[0])
+    request = cpu.requests[looptokens[0]]
+
+    cpu.free_loop_and_bridges(looptokens[0].compiled_loop_token)
+    assert cpu.requests.keys() == [looptokens[1]]
+    assert cpu.loop_requests.values() == [cpu.requests[looptokens[1]]]
+    assert request.freed
+    assert not cpu.is_llvm_frame(cpu.execute_token(looptokens[1], 0))
+    start = time.time()
+    while request.llvm_token is not None: #freed by the compile thread
+        assert time.time() - start < 30.0
+        rtime.sleep(0.01)
@@ -0,0 +1,57 @@
+from rpython.jit.backend.llvm.test.test_compile_latency import get_cpu
+from rpython.jit.backend.llvm.vector_ext import vector_register_size
+from rpython.jit.tool.oparser import parse
+from rpython.jit.metainterp.history import (JitCellToken, TargetToken,
+                                            BasicFailDescr)
+from rpython.rtyper.lltypesystem import lltype, rffi
+
+def test_vector_register_size():
+    assert vector_register_size("+sse2,+avx,-avx2,+fma") == 16
+    assert vector_register_size("+sse2,+avx,+avx2") == 32
+    assert vector_register_size("+avx2,+avx512f,-avx512vl") == 64
+    assert vector_register_size("+neon") == 16
+    assert vector_register_size("") == 16
+
+def set_vector_shapes(loop):
+    """oparser leaves the shape of vector ops in their debug info"""
+    for op in loop.operations:
+        info = getattr(op, '_vec_debug_info', None)
+        if info is not None and info.count > 0:
+            op.datatype = info.datatype
+            op.bytesize = info.bytesize
+            op.signed = info.signed
+            op.count = info.count
+
+def test_vector_float_add():
+    cpu = get_cpu()
+    FLOATS = rffi.CArray(lltype.Float)
+    loop = parse("""
+    [i0, i1, i2, i3, i4]
+    label(i0, i1, i2, i3, i4, descr=targettoken)
+    v5[2xf64] = vec_load_f(i0, i3, 8, 0, descr=arraydescr)
+    v6[2xf64] = vec_load_f(i1, i3, 8, 0, descr=arraydescr)
+    v7[2xf64] = vec_float_add(v5, v6)
+    vec_store(i2, i3, v7, 8, 0, descr=arraydescr)
+    i8 = int_add(i3, 2)
+    i9 = int_lt(i8, i4)
+    guard_true(i9, descr=done) [i8]
+    jump(i0, i1, i2, i8, i4, descr=targettoken)
+    """, namespace={'targettoken': TargetToken(), 'done': BasicFailDescr(1),
+                    'arraydescr': cpu.arraydescrof(FLOATS)})
+    set_vector_shapes(loop)
+    looptoken = JitCellToken()
+    cpu.compile_loop(loop.inputargs, loop.operations, looptoken)
+    n = 10
+    arrays = [lltype.malloc(FLOATS, n, flavor='raw') for i in range(3)]
+    for i in range(n):
+        arrays[0][i] = i * 1.5
+        arrays[1][i] = -i * 0.25
+        arrays[2][i] = 0.0
+    addrs = [rffi.cast(lltype.Signed, array) for array in arrays]
+    deadframe = cpu.execute_token(looptoken, addrs[0], addrs[1], addrs[2],
+                                  0, n)
+    assert cpu.get_latest_descr(deadframe).identifier == 1
+    assert cpu.get_int_value(deadframe, 0) == n
+    assert [arrays[2][i] for i in range(n)] == [i * 1.25 for i in range(n)]
+    for array in arrays:
+        lltype.free(array, flavor='raw')
@@ -0,0 +1,509 @@
+"""
+Tiered compilation: the x86 backend compiles every trace straight away,
+and loops that keep getting entered are recompiled by the LLVM backend on
+a pool of background threads. The LLVM version is installed at the loop
+token's entry the next time execute_token is called for it, so LLVM's
+compile latency never sits on the path of the thread that hit the hot loop.
+
+Each compile thread has an LLVM_CPU of its own, and so its own context and
+JIT. The llexternals release the GIL, so the threads run their pass
+pipelines and codegen in parallel. A loop and its bridges always go to the
+same thread, since bridges link against the loop's symbols.
+"""
+
+from rpython.jit.backend.x86.runner import CPU_X86_64
+from rpython.jit.backend.llvm.runner import (LLVM_CPU, register_code,
+                                             unregister_code)
+from rpython.jit.backend.x86.profagent import ProfileAgent
+from rpython.jit.backend.llsupport import jitframe
+from rpython.jit.metainterp.counter import JitCounter
+from rpython.jit.metainterp.history import JitCellToken
+from rpython.jit.metainterp.resoperation import (rop, InputArgInt,
+                                                 InputArgFloat, InputArgRef)
+from rpython.rtyper.lltypesystem import lltype, rffi
+from rpython.rlib.objectmodel import we_are_translated
+from rpython.rlib.jit import Counters
+from rpython.rlib import rthread, rgil
+import time
+
+
+def snapshot_trace(inputargs, operations):
+    """
+    The x86 backend rewrites and annotates the operations it compiles, so
+    the LLVM tier gets its own copy taken before that happens.
+    """
+    mapping = {}
+    new_inputargs = []
+    for arg in inputargs:
+        if arg.type == 'i':
+            new_arg = InputArgInt()
+        elif arg.type == 'f':
+            new_arg = InputArgFloat()
+        else:
+            new_arg = InputArgRef()
+        mapping[arg] = new_arg
+        new_inputargs.append(new_arg)
+
+    def get(box):
+        if box is None or box.is_constant():
+            return box
+        return mapping[box]
+
+    new_operations = []
+    for op in operations:
+        new_op = op.copy_and_change(op.getopnum(),
+                                    args=[get(arg) for arg in op.getarglist()])
+        if op.is_guard():
+            new_op.setfailargs([get(arg) for arg in op.getfailargs()])
+        mapping[op] = new_op
+        new_operations.append(new_op)
+    return new_inputargs, new_operations
+
+
+class TraceSnapshot(object):
+    """A loop or bridge as the x86 tier saw it, kept for the LLVM tier"""
+    def __init__(self, inputargs, operations, faildescr=None):
+        self.inputargs, self.operations = snapshot_trace(inputargs,
+                                                         operations)
+        self.faildescr = faildescr
+
+
+class TierUpRequest(object):
+    def __init__(self, looptoken, hash):
+        self.looptoken = looptoken
+        self.hash = hash
+        self.loop = None
+        self.bridges = []
+        self.queued = False
+        self.llvm_token = None #set by the compile thread once the code is ready
+        self.worker = None #CompileWorker compiling this loop and its bridges
+        self.complete = False #LLVM code covers every bridge the x86 code has
+        self.abandoned = False #a bridge couldn't be moved over, stay on x86
+        self.freed = False #the x86 loop was freed, the compile thread frees the LLVM one
+        self.jd_id = 0 #portal frame and name of the loop, for the codemap and profile agent
+        self.unique_id = 0
+        self.name = ''
+        self.registered = 0 #number of the LLVM code ranges the main thread has registered
+
+    def num_ops(self):
+        """What the request costs against the compile budget"""
+        ops = len(self.loop.operations)
+        for bridge in self.bridges:
+            ops += len(bridge.operations)
+        return ops
+
+
+class LLVMTierCPU(LLVM_CPU):
+    """
+    LLVM_CPU as the second tier. Guard descrs are shared with the x86
+    code, so their adr_jump_offset and rd_locs stay owned by the x86 backend.
+    The codemap isn't thread safe, so the TieredCPU registers the code
+    once it's installed, from the main thread, rather than this.
+    """
+    HAS_CODEMAP = False
+
+    def __init__(self, *args, **kwds):
+        LLVM_CPU.__init__(self, *args, **kwds)
+        self.profile_agent = ProfileAgent()
+        self.bridge_slots = {}
+
+    def report_code(self, resources, dispatcher, label):
+        pass
+
+    def log_code(self, logger, dispatcher, inputargs, operations):
+        pass
+
+    def allocate_bridge_slot(self, faildescr):
+        slot = lltype.malloc(rffi.SIGNEDP.TO, 1, flavor='raw',
+                             track_allocation=False)
+        slot[0] = 0
+        addr = rffi.cast(lltype.Signed, slot)
+        self.bridge_slots[faildescr] = addr
+        return addr
+
+    def get_bridge_slot(self, faildescr):
+        return self.bridge_slots[faildescr]
+
+    def free_bridge_slot(self, faildescr):
+        slot = self.bridge_slots.pop(faildescr, 0)
+        if slot != 0:
+            lltype.free(rffi.cast(rffi.SIGNEDP, slot), flavor='raw',
+                        track_allocation=False)
+
+    def set_failarg_locs(self, descr, num_failargs, first_slot=0):
+        return 0 #failarg i is always at jitframe position i, see TieredCPU._decode_pos
+
+    def owns_guard(self, faildescr):
+        return faildescr in self.bridge_slots
+
+
+class CompileWorker(object):
+    """A compile thread and the LLVM_CPU it compiles with"""
+    def __init__(self, tiered_cpu, llvm):
+        self.tiered_cpu = tiered_cpu
+        self.llvm = llvm
+        self.queue = []
+        self.pending = 0 #requests enqueued but not yet compiled, only a hint
+        self.labels = {} #label descrs compiled into llvm's JIT
+        self.started = False
+        self.waiting = False
+
+    def setup(self):
+        self.lock = rthread.allocate_lock() #protects queue and waiting
+        self.work_ready = rthread.allocate_lock() #held while there's nothing to do
+        self.work_ready.acquire(True)
+
+    def enqueue(self, request):
+        if not self.started:
+            self.started = True
+            self.setup()
+            _bootstrap.workers.append(self)
+            if we_are_translated():
+                rthread.start_new_thread(_bootstrap.run, ())
+            else: #ll2ctypes doesn't run the function given to rthread's
+                import thread
+                rgil.allocate()
+                thread.start_new_thread(_bootstrap.run, ())
+        self.pending += 1
+        self.lock.acquire(True)
+        self.queue.append(request)
+        if self.waiting:
+            self.waiting = False
+            self.work_ready.release()
+        self.lock.release()
+
+    def next_request(self):
+        while True:
+            self.lock.acquire(True)
+            if self.queue:
+                request = self.queue.pop(0)
+                self.lock.release()
+                return request
+            self.waiting = True
+            self.lock.release()
+            self.work_ready.acquire(True) #releases the GIL while blocked
+
+    def run(self):
+        while True:
+            request = self.next_request()
+            self.tiered_cpu.compile_llvm_tier(request)
+            self.pending -= 1
+
+
+class BackgroundCompiler(object):
+    """Hands LLVM compilations of the tier out to the compile threads"""
+    def __init__(self, tiered_cpu, llvm_cpus):
+        self.workers = [CompileWorker(tiered_cpu, llvm) for llvm in llvm_cpus]
+        self.next_worker = 0
+
+    def enqueue(self, request):
+        if request.worker is None:
+            request.worker = self.least_loaded()
+        request.worker.enqueue(request)
+
+    def least_loaded(self):
+        """Ties go round robin, so idle threads all get used"""
+        n = len(self.workers)
+        best = self.workers[self.next_worker]
+        for i in range(1, n):
+            worker = self.workers[(self.next_worker + i) % n]
+            if worker.pending < best.pending:
+                best = worker
+        self.next_worker = (self.next_worker + 1) % n
+        return best
+
+
+class Bootstrap(object):
+    """rthread.start_new_thread() only takes functions without closures"""
+    def __init__(self):
+        self.workers = [] #started but not yet picked up by their thread
+
+    def run(self):
+        rthread.gc_thread_start()
+        rgil.acquire_maybe_in_new_thread()
+        worker = self.workers.pop(0)
+        worker.run()
+
+_bootstrap = Bootstrap()
+
+
+class TieredCPU(CPU_X86_64):
+    llvm_threshold = 1000 #number of entries before a loop goes to the LLVM tier
+    compile_threads = 2 #size of the LLVM compile thread pool
+    llvm_compile_budget = 0 #trace ops the LLVM tier takes on per second, 0 for no limit
+    timer = staticmethod(time.time)
+
+    def __init__(self, rtyper, stats, opts=None, translate_support_code=False,
+                 gcdescr=None):
+        CPU_X86_64.__init__(self, rtyper, stats, opts,
+                            translate_support_code, gcdescr)
+        self.llvm_tiers = [LLVMTierCPU(rtyper, stats, opts,
+                                       translate_support_code, gcdescr,
+                                       debug=False)
+                           for i in range(self.compile_threads)]
+        self.llvm_tier = self.llvm_tiers[0] #for what doesn't depend on which JIT the code is in
+        self.jitcounter = JitCounter()
+        self.increment = self.jitcounter.compute_threshold(self.llvm_threshold)
+        self.requests = {} #map x86 loop tokens to their TierUpRequest
+        self.loop_requests = {} #same requests, by the x86 loop's compiled loop token
+        self.llvm_frame_infos = {} #addresses of frame infos used by LLVM code
+        self.compiled = [] #requests the compile thread has finished, guarded by lock
+        self.compiler = BackgroundCompiler(self, self.llvm_tiers)
+        for llvm in self.llvm_tiers:
+            llvm.tracker.compile_stats = self.tracker.compile_stats #the profiler only asks this cpu
+        self.budget_window = 0.0 #when the current second of the compile budget started
+        self.budget_spent = 0 #trace ops sent to the LLVM tier since then
+        self.deferred = [] #hot loops waiting for compile budget, oldest first
+
+    def setup_once(self):
+        CPU_X86_64.setup_once(self)
+        for llvm in self.llvm_tiers:
+            llvm.setup_once()
+        self.lock = rthread.allocate_lock()
+
+    def finish_once(self):
+        CPU_X86_64.finish_once(self)
+        for llvm in self.llvm_tiers:
+            llvm.finish_once()
+
+    def set_llvm_passes(self, text):
+        for llvm in self.llvm_tiers:
+            llvm.set_llvm_passes(text)
+
+    def set_llvm_cache(self, path):
+        for llvm in self.llvm_tiers:
+            llvm.set_llvm_cache(path)
+
+    def set_llvm_cache_size(self, megabytes):
+        for llvm in self.llvm_tiers:
+            llvm.set_llvm_cache_size(megabytes)
+
+    def set_guard_counter(self, jitcounter):
+        for llvm in self.llvm_tiers:
+            llvm.set_guard_counter(jitcounter) #only ever read by the compile threads, a stale value is fine
+
+    def set_llvm_threshold(self, threshold):
+        self.llvm_threshold = threshold
+        self.increment = self.jitcounter.compute_threshold(threshold)
+
+    def set_llvm_compile_budget(self, ops):
+        self.llvm_compile_budget = ops
+
+    def compile_loop(self, inputargs, operations, looptoken, jd_id=0,
+                     unique_id=0, log=True, name='', logger=None):
+        request = TierUpRequest(looptoken, self.jitcounter.fetch_next_hash())
+        request.loop = TraceSnapshot(inputargs, operations)
+        request.jd_id = jd_id
+        request.unique_id = unique_id
+        request.name = name
+        self.requests[looptoken] = request
+        asminfo = CPU_X86_64.compile_loop(self, inputargs, operations,
+                                          looptoken, jd_id, unique_id, log,
+                                          name, logger)
+        self.loop_requests[looptoken.compiled_loop_token] = request
+        return asminfo
+
+    def compile_bridge(self, faildescr, inputargs, operations,
+                       original_loop_token, log=True, logger=None):
+        request = self.requests.get(original_loop_token, None)
+        if request is not None:
+            bridge = TraceSnapshot(inputargs, operations, faildescr)
+            request.bridges.append(bridge)
+            if request.queued: #loop is already on its way to the LLVM tier
+                request.complete = False
+                self.budget_spent += len(operations)
+                if request not in self.deferred:
+                    self.compiler.enqueue(request)
+        return CPU_X86_64.compile_bridge(self, faildescr, inputargs,
+                                         operations, original_loop_token,
+                                         log, logger)
+
+    def compile_llvm_tier(self, request):
+        """Runs on request.worker's compile thread"""
+        worker = request.worker
+        llvm = worker.llvm
+        if request.freed:
+            if request.llvm_token is not None:
+                llvm.free_loop_and_bridges(
+                    request.llvm_token.compiled_loop_token)
+                request.llvm_token = None
+            return
+        if request.llvm_token is None:
+            llvm_token = JitCellToken()
+            llvm_token.number = request.looptoken.number
+            loop = request.loop
+            llvm.compile_loop(loop.inputargs, loop.operations, llvm_token,
+                              request.jd_id, request.unique_id, log=False,
+                              name=request.name)
+            self.record_labels(worker, loop.operations)
+            request.llvm_token = llvm_token
+        #bridges compiled by the x86 tier since the last time we looked
+        while request.bridges:
+            bridge = request.bridges.pop(0)
+            if (llvm.owns_guard(bridge.faildescr) and
+                    self.targets_compiled(worker, bridge.operations)):
+                llvm.compile_bridge(bridge.faildescr, bridge.inputargs,
+                                    bridge.operations, request.llvm_token)
+                self.record_labels(worker, bridge.operations)
+            else:
+                request.abandoned = True
+        self.lock.acquire(True)
+        self.compiled.append(request)
+        self.lock.release()
+
+    def record_labels(self, worker, operations):
+        for op in operations:
+            if op.getopnum() == rop.LABEL:
+                worker.labels[op.getdescr()] = None
+
+    def targets_compiled(self, worker, operations):
+        """
+        A bridge jumping to a label that isn't in worker's JIT, because
+        the LLVM tier hasn't compiled it yet or another thread did, can't
+        be moved over, so the whole loop has to stay on x86.
+        """
+        for op in operations:
+            if op.getopnum() == rop.JUMP:
+                if op.getdescr() not in worker.labels:
+                    return False
+        return True
+
+    def install_compiled(self):
+        self.lock.acquire(True)
+        compiled = self.compiled
+        self.compiled = []
+        self.lock.release()
+        for request in compiled:
+            if request.freed:
+                continue
+            request.complete = not request.bridges
+            frame_info = request.llvm_token.compiled_loop_token.frame_info
+            self.llvm_frame_infos[rffi.cast(lltype.Signed, frame_info)] = None
+            self.register_llvm_code(request)
+
+    def register_llvm_code(self, request):
+        """LLVM functions of the request compiled since the last time"""
+        resources = request.llvm_token.compiled_loop_token.llvm_resources
+        code_ranges = resources.code_ranges[request.registered:]
+        request.registered += len(code_ranges)
+        label = "LLVM Loop # %s: %s" % (request.looptoken.number, request.name)
+        register_code(self, resources, label, code_ranges)
+
+    def tier_up(self, looptoken):
+        """
+        Called at every loop entry, returns the LLVM version of the loop
+        if there is one.
+        """
+        if self.compiled:
+            self.install_compiled()
+        if self.deferred:
+            self.enqueue_deferred()
+        request = self.requests.get(looptoken, None)
+        if request is None:
+            return None
+        if request.complete and not request.abandoned:
+            return request.llvm_token
+        if not request.queued and self.jitcounter.tick(request.hash,
+                                                       self.increment):
+            request.queued = True
+            if self.deferred or not self.take_budget(request):
+                self.deferred.append(request)
+                self.tracker.compile_stats.count(Counters.LLVM_DEFERRED)
+            else:
+                self.compiler.enqueue(request)
+        return None
+
+    def take_budget(self, request):
+        """
+        Whether the LLVM tier can take request on in the current second.
+        The budget is counted in trace ops rather than compile time, so
+        which loops get deferred doesn't depend on how busy the machine
+        is. A loop bigger than the whole budget goes at the start of a
+        second, on its own.
+        """
+        if self.llvm_compile_budget <= 0:
+            return True
+        now = self.timer()
+        if now - self.budget_window >= 1.0:
+            self.budget_window = now
+            self.budget_spent = 0
+        ops = request.num_ops()
+        if (self.budget_spent > 0 and
+                self.budget_spent + ops > self.llvm_compile_budget):
+            return False
+        self.budget_spent += ops
+        return True
+
+    def enqueue_deferred(self):
+        while self.deferred:
+            request = self.deferred[0]
+            if not request.freed:
+                if not self.take_budget(request):
+                    return
+                self.compiler.enqueue(request)
+            self.deferred.pop(0)
+
+    def make_execute_token(self, *ARGS):
+        execute_x86 = CPU_X86_64.make_execute_token(self, *ARGS)
+        execute_llvm = self.llvm_tier.make_execute_token(*ARGS)
+
+        def execute_token(executable_token, *args):
+            llvm_token = self.tier_up(executable_token)
+            if llvm_token is not None:
+                return execute_llvm(llvm_token, *args)
+            return execute_x86(executable_token, *args)
+        return execute_token
+
+    def is_llvm_frame(self, deadframe):
+        frame = lltype.cast_opaque_ptr(jitframe.JITFRAMEPTR, deadframe)
+        frame_info = rffi.cast(lltype.Signed, frame.jf_frame_info)
+        return frame_info in self.llvm_frame_infos
+
+    def get_latest_descr(self, deadframe):
+        if self.is_llvm_frame(deadframe):
+            return self.llvm_tier.get_latest_descr(deadframe)
+        return CPU_X86_64.get_latest_descr(self, deadframe)
+
+    def _decode_pos(self, deadframe, index):
+        if self.is_llvm_frame(deadframe):
+            return index * self.llvm_tier.WORD
+        return CPU_X86_64._decode_pos(self, deadframe, index)
+
+    def free_loop_and_bridges(self, compiled_loop_token):
+        """
+        The LLVM version of the loop goes with the x86 one. Its JIT belongs
+        to the compile thread, so that's where it gets freed, after any
+        compilation of the loop already queued.
+        """
+        CPU_X86_64.free_loop_and_bridges(self, compiled_loop_token)
+        request = self.loop_requests.pop(compiled_loop_token, None)
+        if request is not None:
+            del self.requests[request.looptoken]
+            if request.queued:
+                self.free_llvm_tier(request)
+
+    def invalidate_loop(self, looptoken):
+        """
+        The guard_not_invalidateds of the LLVM version fail too, and it's
+        never entered again, so the loop stays on x86 until it's freed.
+        """
+        CPU_X86_64.invalidate_loop(self, looptoken)
+        request = self.requests.get(looptoken, None)
+        if request is None:
+            return
+        request.abandoned = True
+        llvm_token = request.llvm_token
+        if llvm_token is not None:
+            request.worker.llvm.invalidate_loop(llvm_token)
+
+    def free_llvm_tier(self, request):
+        llvm_token = request.llvm_token
+        if llvm_token is not None:
+            clt = llvm_token.compiled_loop_token
+            frame_info = clt.frame_info
+            self.llvm_frame_infos.pop(rffi.cast(lltype.Signed, frame_info),
+                                      None)
+            unregister_code(self, clt.llvm_resources.code_ranges[
+                                                    :request.registered])
+        request.freed = True
+        self.compiler.enqueue(request)
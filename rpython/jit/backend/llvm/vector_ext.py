@@ -0,0 +1,29 @@
+"""
+Vector support for the LLVM backend. VEC_* resops are lowered to LLVM
+vector types of exactly the shape the vectoriser gave them, see the
+parse_vec_* methods of LLVMOpDispatcher. LLVM's instruction selection
+picks the SIMD instructions and legalises shapes the host has no register
+for, so the register size given to the vectoriser only decides how wide
+packs should get, not what can be compiled.
+"""
+
+from rpython.jit.backend.llsupport.vector_ext import VectorExt
+from rpython.rtyper.lltypesystem.rffi import constcharp2str
+
+
+def vector_register_size(features):
+    """Bytes in the widest vector register of a host feature string"""
+    enabled = [feature[1:] for feature in features.split(',')
+               if feature.startswith('+')]
+    if 'avx512f' in enabled:
+        return 64
+    if 'avx2' in enabled: #avx alone has no 256 bit integer ops
+        return 32
+    return 16 #sse2 is baseline on x86-64, as is neon on aarch64
+
+
+class LLVMVectorExt(VectorExt):
+    def setup_once(self, asm):
+        features = constcharp2str(asm.llvm.GetHostCPUFeatures(None))
+        self.enable(vector_register_size(features), accum=True)
+        self._setup = True
@@ -4,6 +4,41 @@ from rpython.rtyper.lltypesystem import lltype, llmemory
 from rpython.rtyper.rclass import OBJECTPTR
 from rpython.jit.metainterp.history import ConstInt
 from rpython.jit.metainterp.support import ptr2int
+from rpython.rlib.jit import Counters
+
+class Histogram(object):
+    """Counts of values by power of two, bucket i holds the values below
+    2**i and from 2**(i-1) up, the last bucket everything bigger."""
+    def __init__(self, size=32):
+        self.buckets = [0] * size
+
+    def add(self, value):
+        i = 0
+        while value > 0 and i < len(self.buckets) - 1:
+            value >>= 1
+            i += 1
+        self.buckets[i] += 1
+
+class CompileStats(object):
+    """Where a backend's compile time goes, by the Counters number of each
+    phase, and how much code it emits. Histograms have a value per trace,
+    microseconds for the phases. Only the LLVM backend fills it in."""
+    def __init__(self):
+        self.counts = [0] * Counters.ncounters
+        self.times = [0.0] * Counters.ncounters
+        self.histograms = [Histogram() for i in range(Counters.ncounters)]
+
+    def phase_done(self, num, seconds):
+        self.counts[num] += 1
+        self.times[num] += seconds
+        self.histograms[num].add(int(seconds * 1000000))
+
+    def record(self, num, value):
+        self.counts[num] += value
+        self.histograms[num].add(value)
+
+    def count(self, num, inc=1):
+        self.counts[num] += inc
 
 class CPUTotalTracker(object):
     total_compiled_loops = 0
@@ -11,6 +46,9 @@ class CPUTotalTracker(object):
     total_freed_loops = 0
     total_freed_bridges = 0
 
+    def __init__(self):
+        self.compile_stats = CompileStats()
+
 class AbstractCPU(object):
     supports_floats = False
     supports_longlong = False
@@ -39,6 +77,29 @@ class AbstractCPU(object):
         """Called once by the front-end when the program stops."""
         pass
 
+    def set_llvm_passes(self, text):
+        """Set the IR optimisation pipeline from the llvm_passes JIT
+        parameter. Ignored by backends that don't use LLVM."""
+        pass
+
+    def set_llvm_cache(self, path):
+        """Directory of the on-disk cache of compiled traces, or '' to not
+        use one, from the llvm_cache JIT parameter."""
+        pass
+
+    def set_llvm_cache_size(self, megabytes):
+        pass
+
+    def set_llvm_compile_budget(self, ops):
+        """Trace operations per second the LLVM tier of a tiered backend
+        takes on, from the llvm_compile_budget JIT parameter."""
+        pass
+
+    def set_guard_counter(self, jitcounter):
+        """Called with the metainterp's JitCounter, which counts how often
+        each guard failed. Backends that weight guards by it keep it."""
+        pass
+
     def get_all_loop_runs(self):
         """ Function that will return number of times all the loops were run.
         Requires earlier setting of set_debug(True), otherwise you won't
@@ -292,6 +353,7 @@ class AbstractCPU(object):
 class CompiledLoopToken(object):
     asmmemmgr_blocks = None
     asmmemmgr_gcreftracers = None
+    llvm_resources = None
 
     def __init__(self, cpu, number):
         cpu.tracker.total_compiled_loops += 1
@@ -0,0 +1,31 @@
+import os
+from rpython.rlib.rarithmetic import r_uint
+from rpython.jit.backend.x86 import profagent
+
+
+class PerfMapAgent(profagent.ProfileAgent):
+    """ Writes /tmp/perf-PID.map, the symbol table 'perf report' reads for
+    code it found no ELF symbols for. perf only reads it after the fact,
+    so lines are appended and never removed, even for freed code. """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.fd = -1
+
+    def startup(self):
+        path = self.path
+        if path is None:
+            path = "/tmp/perf-%d.map" % os.getpid()
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+
+    def shutdown(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def native_code_written(self, name, address, size):
+        assert size > 0
+        if self.fd < 0:
+            return
+        os.write(self.fd, "%x %x %s\n" % (r_uint(address), r_uint(size),
+                                          name))
@@ -48,6 +48,9 @@ class AbstractX86CPU(AbstractLLCPU):
                 if not oprofile.OPROFILE_AVAILABLE:
                     raise Exception('oprofile support was explicitly enabled, but oprofile headers seem not to be available')
                 profile_agent = oprofile.OProfileAgent()
+            elif config.translation.jit_profiler == "perf":
+                from rpython.jit.backend.x86.perfmap import PerfMapAgent
+                profile_agent = PerfMapAgent()
             self.with_threads = config.translation.thread
 
         self.profile_agent = profile_agent
@@ -0,0 +1,178 @@
+"""
+Background optimization of loops, turned on by the background_optimize
+jit parameter. When tracing closes a loop, the trace is frozen and handed
+to the JIT thread, and the interpreter goes back to running the loop
+normally. The JIT thread runs the optimizer on it, yielding the GIL every
+YIELD_EVERY operations so the interpreter isn't stalled for the whole of
+a long trace. The next time any greenkey is checked for compiled code, the
+interpreter thread compiles the optimized loop with the backend, which
+isn't thread safe, and attaches it to its greenkey.
+
+The JIT thread writes nothing to the jitlog or the loggers: the trace is
+logged when it's installed, so its records don't interleave with the ones
+of the loops the interpreter traces meanwhile. The optimizer still
+updates state shared with the interpreter thread, like the profiler's
+counters, the ResumeDataStore and the loggers' box names. No lock is
+needed for these because both threads only touch them while holding the
+GIL, and the JIT thread only releases it in yield_to_interpreter(),
+between two trace operations, when no update is half done. Anything the
+optimizer keeps across operations must not be shared. It doesn't yield
+while its debug sections are printed either, to keep them well nested in
+the log.
+
+Untranslated there is no JIT thread: the pending loops are optimized at
+the next entry check instead, which keeps tests deterministic.
+"""
+
+from rpython.jit.metainterp import compile
+from rpython.jit.metainterp.warmstate import JC_OPTIMIZING
+from rpython.rlib.objectmodel import we_are_translated
+from rpython.rlib.debug import (debug_start, debug_stop, debug_print,
+    have_debug_prints)
+from rpython.rlib import rthread
+
+YIELD_EVERY = 1024 # trace operations the optimizer runs between GIL yields
+
+
+class PendingLoop(object):
+    """A loop's frozen trace and everything needed to finish compiling it"""
+    def __init__(self, jitdriver_sd, greenkey, trace, jitcell_token,
+                 inputargs, jumpargs, call_pure_results, enable_opts, memo):
+        self.jitdriver_sd = jitdriver_sd
+        self.greenkey = greenkey
+        self.trace = trace
+        self.jitcell_token = jitcell_token
+        self.inputargs = inputargs
+        self.jumpargs = jumpargs
+        self.call_pure_results = call_pure_results
+        self.enable_opts = enable_opts
+        self.memo = memo
+        self.loop = None #the optimized TreeLoop, None if it was invalid
+        self.loop_info = None
+
+
+class BackgroundOptimizer(object):
+    def __init__(self, metainterp_sd):
+        self.metainterp_sd = metainterp_sd
+        self.queue = [] #loops waiting for the JIT thread
+        self.optimized = [] #loops waiting to be installed
+        self.pending = 0 #loops enqueued and not installed yet
+        self.installed = 0
+        self.started = False
+        self.waiting = False
+        self.thread_ident = -1
+
+    def setup(self):
+        self.lock = rthread.allocate_lock() #protects queue, optimized and waiting
+        self.work_ready = rthread.allocate_lock() #held while there's nothing to do
+        self.work_ready.acquire(True)
+
+    def enqueue(self, pending):
+        """Called by the interpreter thread once tracing closed a loop"""
+        cell = pending.jitdriver_sd.warmstate.JitCell.ensure_jit_cell_at_key(
+            pending.greenkey)
+        cell.flags |= JC_OPTIMIZING
+        self.pending += 1
+        if not we_are_translated():
+            self.queue.append(pending)
+            return
+        if not self.started:
+            self.started = True
+            self.setup()
+            _bootstrap.optimizer = self
+            rthread.start_new_thread(_bootstrap.run, ())
+        self.lock.acquire(True)
+        self.queue.append(pending)
+        if self.waiting:
+            self.waiting = False
+            self.work_ready.release()
+        self.lock.release()
+
+    def next_pending(self):
+        while True:
+            self.lock.acquire(True)
+            if self.queue:
+                pending = self.queue.pop(0)
+                self.lock.release()
+                return pending
+            self.waiting = True
+            self.lock.release()
+            self.work_ready.acquire(True) #releases the GIL while blocked
+
+    def run(self):
+        self.thread_ident = rthread.get_ident()
+        while True:
+            pending = self.next_pending()
+            self.optimize(pending)
+            self.lock.acquire(True)
+            self.optimized.append(pending)
+            self.lock.release()
+
+    def optimize(self, pending):
+        debug_start("jit-background-optimize")
+        compile.optimize_pending_loop(self.metainterp_sd, pending)
+        debug_stop("jit-background-optimize")
+
+    def in_jit_thread(self):
+        return self.thread_ident == rthread.get_ident()
+
+    def take_optimized(self):
+        if not we_are_translated(): #no JIT thread, optimize them now
+            while self.queue:
+                pending = self.queue.pop(0)
+                self.optimize(pending)
+                self.optimized.append(pending)
+            optimized = self.optimized
+            self.optimized = []
+            return optimized
+        self.lock.acquire(True)
+        optimized = self.optimized
+        self.optimized = []
+        self.lock.release()
+        return optimized
+
+    def install_optimized(self):
+        """
+        Called at every entry check while loops are pending, on the
+        interpreter thread. Compiles and attaches the loops the JIT thread
+        is done with.
+        """
+        for pending in self.take_optimized():
+            self.pending -= 1
+            warmstate = pending.jitdriver_sd.warmstate
+            cell = warmstate.JitCell.get_jit_cell_at_key(pending.greenkey)
+            if cell is not None:
+                cell.flags &= ~JC_OPTIMIZING
+            debug_start("jit-background-install")
+            installed = compile.install_pending_loop(self.metainterp_sd,
+                                                     pending)
+            if installed:
+                self.installed += 1
+            else:
+                debug_print("dropped stale or invalid loop")
+            debug_stop("jit-background-install")
+
+
+class Bootstrap(object):
+    """rthread.start_new_thread() only takes functions without closures"""
+    def __init__(self):
+        self.optimizer = None
+
+    def run(self):
+        rthread.gc_thread_start()
+        from rpython.rlib import rgil
+        rgil.acquire_maybe_in_new_thread()
+        self.optimizer.run()
+
+_bootstrap = Bootstrap()
+
+
+def yield_to_interpreter():
+    """Called by the optimizer every YIELD_EVERY operations"""
+    if we_are_translated():
+        optimizer = _bootstrap.optimizer
+        if (optimizer is not None and optimizer.in_jit_thread() and
+                not have_debug_prints()):
+            from rpython.rlib import rgil
+            rgil.yield_thread()
+
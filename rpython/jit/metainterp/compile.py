@@ -15,7 +15,8 @@ from rpython.jit.metainterp.resoperation import (
     InputArgRef, InputArgFloat)
 from rpython.jit.metainterp.history import (TreeLoop, JitCellToken,
     TargetToken, AbstractFailDescr, ConstInt)
-from rpython.jit.metainterp import history, jitexc
+from rpython.jit.metainterp import (history, jitexc, guardprofile,
+    warmupprofile)
 from rpython.jit.metainterp.optimize import InvalidLoop
 from rpython.jit.metainterp.resume import (
     PENDINGFIELDSP, ResumeDataDirectReader)
@@ -34,6 +35,7 @@ class CompileData(object):
     """
     memo = None
     log_noopt = True
+    log_trace = True    # False on the JIT thread, see install_pending_loop()
 
     def forget_optimization_info(self):
         for arg in self.trace.inputargs:
@@ -43,11 +45,9 @@ class CompileData(object):
         """Optimize loop.operations to remove internal overheadish operations.
         """
         from rpython.jit.metainterp.optimizeopt import build_opt_chain
-        # mark that a new trace has been started
-        log = metainterp_sd.jitlog.log_trace(jl.MARK_TRACE, metainterp_sd, None)
-        log.write_trace(self.trace)
-        if self.log_noopt:
-            metainterp_sd.logger_noopt.log_loop_from_trace(self.trace, memo=memo)
+        if self.log_trace:
+            log_unoptimized_trace(metainterp_sd, self.trace, memo,
+                                  self.log_noopt)
 
         self.box_names_memo = memo
         optimizations = build_opt_chain(self.enable_opts)
@@ -59,6 +59,14 @@ class CompileData(object):
             debug_stop("jit-optimize")
 
 
+def log_unoptimized_trace(metainterp_sd, trace, memo, log_noopt=True):
+    # mark that a new trace has been started
+    log = metainterp_sd.jitlog.log_trace(jl.MARK_TRACE, metainterp_sd, None)
+    log.write_trace(trace)
+    if log_noopt:
+        metainterp_sd.logger_noopt.log_loop_from_trace(trace, memo=memo)
+
+
 class PreambleCompileData(CompileData):
     """
     This is the case of label() ops label()
@@ -271,28 +279,11 @@ def compile_loop(metainterp, greenkey, start, inputargs, jumpargs,
         return compile_simple_loop(metainterp, greenkey, trace, jumpargs,
                                    enable_opts, cut_at)
     call_pure_results = metainterp.call_pure_results
-    preamble_data = PreambleCompileData(trace, jumpargs,
-                                    call_pure_results=call_pure_results,
-                                    enable_opts=enable_opts)
-    try:
-        start_state, preamble_ops = preamble_data.optimize_trace(
-            metainterp_sd, jitdriver_sd, metainterp.box_names_memo)
-    except InvalidLoop:
-        metainterp_sd.jitlog.trace_aborted()
-        history.cut(cut_at)
-        return None
-
-    metainterp_sd = metainterp.staticdata
-    jitdriver_sd = metainterp.jitdriver_sd
-    start_descr = TargetToken(jitcell_token,
-                              original_jitcell_token=jitcell_token)
-    jitcell_token.target_tokens = [start_descr]
-    loop_data = UnrolledLoopData(trace, jitcell_token, start_state,
-                                 call_pure_results=call_pure_results,
-                                 enable_opts=enable_opts)
     try:
-        loop_info, loop_ops = loop_data.optimize_trace(
-            metainterp_sd, jitdriver_sd, metainterp.box_names_memo)
+        start_state, preamble_ops, loop_info, loop_ops = (
+            optimize_unrolled_loop(metainterp_sd, jitdriver_sd, trace,
+                                   jitcell_token, jumpargs, call_pure_results,
+                                   enable_opts, metainterp.box_names_memo))
     except InvalidLoop:
         metainterp_sd.jitlog.trace_aborted()
         history.cut(cut_at)
@@ -306,7 +297,49 @@ def compile_loop(metainterp, greenkey, start, inputargs, jumpargs,
                                               loop_info, loop_ops,
                                               jitcell_token)
     #
-    loop = create_empty_loop(metainterp)
+    log_short_preamble(metainterp_sd, loop_info, metainterp.box_names_memo)
+    loop = assemble_unrolled_loop(metainterp_sd, jitcell_token, start_state,
+                                  preamble_ops, loop_info, loop_ops)
+    send_loop_to_backend(greenkey, jitdriver_sd, metainterp_sd, loop, "loop",
+                         inputargs, metainterp.box_names_memo)
+    record_loop_or_bridge(metainterp_sd, loop)
+    loop_info.post_loop_compilation(loop, jitdriver_sd, metainterp, jitcell_token)
+    return jitcell_token.target_tokens[0]
+
+def optimize_unrolled_loop(metainterp_sd, jitdriver_sd, trace, jitcell_token,
+                           runtime_boxes, call_pure_results, enable_opts,
+                           memo, log_trace=True):
+    """Optimize the trace of a loop into its preamble and the peeled loop.
+    Doesn't touch the metainterp, so it can run on the JIT thread too, with
+    log_trace=False. Raises InvalidLoop.
+    """
+    preamble_data = PreambleCompileData(trace, runtime_boxes,
+                                    call_pure_results=call_pure_results,
+                                    enable_opts=enable_opts)
+    preamble_data.log_trace = log_trace
+    start_state, preamble_ops = preamble_data.optimize_trace(
+        metainterp_sd, jitdriver_sd, memo)
+    start_descr = TargetToken(jitcell_token,
+                              original_jitcell_token=jitcell_token)
+    jitcell_token.target_tokens = [start_descr]
+    loop_data = UnrolledLoopData(trace, jitcell_token, start_state,
+                                 call_pure_results=call_pure_results,
+                                 enable_opts=enable_opts)
+    loop_data.log_trace = log_trace
+    loop_info, loop_ops = loop_data.optimize_trace(
+        metainterp_sd, jitdriver_sd, memo)
+    return start_state, preamble_ops, loop_info, loop_ops
+
+def log_short_preamble(metainterp_sd, loop_info, memo):
+    label_token = loop_info.label_op.getdescr()
+    assert isinstance(label_token, TargetToken)
+    if label_token.short_preamble:
+        metainterp_sd.logger_ops.log_short_preamble([],
+            label_token.short_preamble, memo)
+
+def assemble_unrolled_loop(metainterp_sd, jitcell_token, start_state,
+                           preamble_ops, loop_info, loop_ops):
+    loop = TreeLoop(metainterp_sd.stats.name_for_new_loop())
     loop.original_jitcell_token = jitcell_token
     loop.inputargs = start_state.renamed_inputargs
     quasi_immutable_deps = {}
@@ -317,21 +350,90 @@ def compile_loop(metainterp, greenkey, start, inputargs, jumpargs,
     if quasi_immutable_deps:
         loop.quasi_immutable_deps = quasi_immutable_deps
     start_label = ResOperation(rop.LABEL, start_state.renamed_inputargs,
-                               descr=start_descr)
-    label_token = loop_info.label_op.getdescr()
-    assert isinstance(label_token, TargetToken)
-    if label_token.short_preamble:
-        metainterp_sd.logger_ops.log_short_preamble([],
-            label_token.short_preamble, metainterp.box_names_memo)
+                               descr=jitcell_token.target_tokens[0])
     loop.operations = ([start_label] + preamble_ops + loop_info.extra_same_as +
                        loop_info.extra_before_label + [loop_info.label_op] + loop_ops)
     if not we_are_translated():
         loop.check_consistency()
-    send_loop_to_backend(greenkey, jitdriver_sd, metainterp_sd, loop, "loop",
-                         inputargs, metainterp.box_names_memo)
+    return loop
+
+def compile_loop_in_background(metainterp, greenkey, start, inputargs,
+                               jumpargs):
+    """Like compile_loop(), but only freezes the trace. The JIT thread
+    optimizes it, and the next entry check compiles and attaches it,
+    see background.py.
+    """
+    from rpython.jit.metainterp.background import PendingLoop
+    metainterp_sd = metainterp.staticdata
+    jitdriver_sd = metainterp.jitdriver_sd
+    history = metainterp.history
+    trace = history.trace
+    jitcell_token = make_jitcell_token(jitdriver_sd)
+    history.record(rop.JUMP, jumpargs, None, descr=jitcell_token)
+    if start != (0, 0, 0):
+        trace = trace.cut_trace_from(start, inputargs)
+    loop = PendingLoop(jitdriver_sd, greenkey, trace, jitcell_token,
+                       inputargs, jumpargs, metainterp.call_pure_results,
+                       jitdriver_sd.warmstate.enable_opts,
+                       metainterp.box_names_memo)
+    metainterp_sd.background.enqueue(loop)
+
+def optimize_pending_loop(metainterp_sd, pending):
+    """
+    The JIT thread's half of compile_loop_in_background(). Everything
+    that goes to the jitlog or to the loggers is left to
+    install_pending_loop(), so their records don't interleave with what
+    the interpreter thread logs meanwhile.
+    """
+    jitdriver_sd = pending.jitdriver_sd
+    try:
+        start_state, preamble_ops, loop_info, loop_ops = (
+            optimize_unrolled_loop(metainterp_sd, jitdriver_sd,
+                                   pending.trace, pending.jitcell_token,
+                                   pending.jumpargs,
+                                   pending.call_pure_results,
+                                   pending.enable_opts, pending.memo,
+                                   log_trace=False))
+    except InvalidLoop:
+        return
+    pending.loop_info = loop_info
+    pending.loop = assemble_unrolled_loop(metainterp_sd, pending.jitcell_token,
+                                          start_state, preamble_ops,
+                                          loop_info, loop_ops)
+
+def install_pending_loop(metainterp_sd, pending):
+    """
+    Compile an optimized loop and attach it to its greenkey, on the
+    thread that runs the interpreter. Returns False if the loop went
+    stale while waiting: something invalidated a quasi-immutable field it
+    relies on, or the greenkey got a procedure of its own.
+    """
+    jitdriver_sd = pending.jitdriver_sd
+    loop = pending.loop
+    if loop is not None and loop.quasi_immutable_deps is not None:
+        # the optimizer checked each field and noted how many times it
+        # was invalidated; if that changed since, the loop is stale
+        for qmut, invalidations in loop.quasi_immutable_deps.items():
+            if qmut.invalidations != invalidations:
+                return False
+    warmstate = jitdriver_sd.warmstate
+    cell = warmstate.JitCell.get_jit_cell_at_key(pending.greenkey)
+    if cell is not None and cell.get_procedure_token() is not None:
+        return False
+    metainterp_sd.jitlog.start_new_trace(metainterp_sd,
+            faildescr=None, entry_bridge=False)
+    log_unoptimized_trace(metainterp_sd, pending.trace, pending.memo)
+    if loop is None:
+        metainterp_sd.jitlog.trace_aborted()
+        return False
+    log_short_preamble(metainterp_sd, pending.loop_info, pending.memo)
+    jitcell_token = pending.jitcell_token
+    send_loop_to_backend(pending.greenkey, jitdriver_sd, metainterp_sd, loop,
+                         "loop", pending.inputargs, pending.memo)
     record_loop_or_bridge(metainterp_sd, loop)
-    loop_info.post_loop_compilation(loop, jitdriver_sd, metainterp, jitcell_token)
-    return start_descr
+    warmstate.attach_procedure_to_interp(pending.greenkey, jitcell_token)
+    metainterp_sd.stats.add_jitcell_token(jitcell_token)
+    return True
 
 def compile_retrace(metainterp, greenkey, start,
                     inputargs, jumpargs,
@@ -549,6 +651,7 @@ def send_loop_to_backend(greenkey, jitdriver_sd, metainterp_sd, loop, type,
     #
     if asminfo is not None:
         ops_offset = asminfo.ops_offset
+        original_jitcell_token.code_size += asminfo.asmlen
     else:
         ops_offset = None
     metainterp_sd.logger_ops.log_loop(loop.inputargs, loop.operations, n,
@@ -598,6 +701,7 @@ def send_bridge_to_backend(jitdriver_sd, metainterp_sd, faildescr, inputargs,
     #
     if asminfo is not None:
         ops_offset = asminfo.ops_offset
+        original_loop_token.code_size += asminfo.asmlen
     else:
         ops_offset = None
     metainterp_sd.logger_ops.log_bridge(inputargs, operations, None, faildescr,
@@ -689,8 +793,11 @@ class AbstractResumeGuardDescr(ResumeDescr):
         raise NotImplementedError("abstract base class")
 
     def handle_fail(self, deadframe, metainterp_sd, jitdriver_sd):
+        profile = guardprofile.guard_failed(self, jitdriver_sd)
         if (self.must_compile(deadframe, metainterp_sd, jitdriver_sd)
-                and not rstack.stack_almost_full()):
+                and not rstack.stack_almost_full()
+                and not (profile is not None and
+                    guardprofile.retrace_instead_of_bridge(self, profile))):
             self.start_compiling()
             try:
                 self._trace_and_compile_from_bridge(deadframe, metainterp_sd,
@@ -794,6 +901,9 @@ class AbstractResumeGuardDescr(ResumeDescr):
                                new_loop.original_jitcell_token,
                                metainterp.box_names_memo)
         record_loop_or_bridge(metainterp.staticdata, new_loop)
+        guardprofile.bridge_compiled(metainterp.resumekey_original_loop_token)
+        warmupprofile.bridge_compiled(metainterp.staticdata,
+                                      metainterp.resumekey_original_loop_token)
 
     def make_a_counter_per_value(self, guard_value_op, index):
         assert guard_value_op.getopnum() == rop.GUARD_VALUE
@@ -236,6 +236,17 @@ class JitCounter:
             if p_entry.subhashes[i] == subhash:
                 p_entry.times[i] = r_singlefloat(0.0)
 
+    def current_fraction(self, hash):
+        """Return the time value stored for 'hash', without ticking it.
+        0.0 if there is none, e.g. because it was evicted or reset.
+        """
+        p_entry = self.timetable[self._get_index(hash)]
+        subhash = self._get_subhash(hash)
+        for i in range(5):
+            if p_entry.subhashes[i] == subhash:
+                return float(p_entry.times[i])
+        return 0.0
+
     def lookup_chain(self, hash):
         return self.celltable[self._get_index(hash)]
 
@@ -0,0 +1,98 @@
+"""
+Guard failure profiles and superblock retracing, turned on by the
+retrace_bridges jit parameter.
+
+Every failure of a guard of a loop, or of one of its bridges, that gets
+back to the frontend is counted in the loop's GuardProfile: a side table
+kept on its JitCellToken, only made once something failed. Each bridge
+compiled from those guards is a hot exit of the loop.
+
+Once retrace_bridges of them have been compiled, the next guard that gets
+hot doesn't grow one more bridge. Instead the loop is retired from the
+interpreter's entry and traced again from its header at the next
+iteration, so the path that is hot now, which usually goes through the
+bridges, becomes the body of the new loop (a "superblock") and no longer
+pays for guard exits and bridge entries. A trace is a single path, so
+this can only inline the path that is hot at that time; the others get
+bridges of the new loop again if they stay hot. Every greenkey is
+retraced like this at most once, so a loop that is polymorphic for good
+keeps its bridges.
+"""
+
+from rpython.jit.metainterp.warmstate import JC_SUPERBLOCK
+from rpython.rlib.debug import debug_start, debug_stop, debug_print
+
+
+class GuardProfile(object):
+    def __init__(self):
+        self.failures = {} # guard descr -> number of failures
+        self.hot_bridges = 0 # bridges compiled from the loop's guards
+
+    def record_failure(self, descr):
+        self.failures[descr] = self.failures.get(descr, 0) + 1
+
+    def get_failures(self, descr):
+        return self.failures.get(descr, 0)
+
+    def total_failures(self):
+        total = 0
+        for count in self.failures.itervalues():
+            total += count
+        return total
+
+
+def get_profile(jitcell_token):
+    profile = jitcell_token.guard_profile
+    if profile is None:
+        profile = jitcell_token.guard_profile = GuardProfile()
+    return profile
+
+def get_loop_token(descr):
+    clt = descr.rd_loop_token
+    if clt is None:
+        return None
+    return clt.loop_token_wref()
+
+def guard_failed(descr, jitdriver_sd):
+    """
+    Called by handle_fail() every time the guard fails. Returns the
+    profile of its loop, or None if profiling is off.
+    """
+    if not jitdriver_sd.warmstate.retrace_bridges:
+        return None
+    jitcell_token = get_loop_token(descr)
+    if jitcell_token is None:
+        return None
+    profile = get_profile(jitcell_token)
+    profile.record_failure(descr)
+    return profile
+
+def bridge_compiled(jitcell_token):
+    if jitcell_token.outermost_jitdriver_sd.warmstate.retrace_bridges:
+        get_profile(jitcell_token).hot_bridges += 1
+
+def retrace_instead_of_bridge(descr, profile):
+    """
+    Called when the guard is hot enough for a bridge. Returns True if the
+    loop was retired for a superblock retrace, in which case the guard
+    must just resume in the blackhole interpreter.
+    """
+    jitcell_token = get_loop_token(descr)
+    if jitcell_token is None or jitcell_token.greenkey is None:
+        return False
+    warmstate = jitcell_token.outermost_jitdriver_sd.warmstate
+    if profile.hot_bridges < warmstate.retrace_bridges:
+        return False
+    cell = warmstate.JitCell.get_jit_cell_at_key(jitcell_token.greenkey)
+    if cell is None or cell.flags & JC_SUPERBLOCK:
+        return False
+    cell.flags |= JC_SUPERBLOCK
+    jitcell_token.invalidated = True
+    warmstate.JitCell.trace_next_iteration(jitcell_token.greenkey)
+    debug_start("jit-superblock-retrace")
+    debug_print("retiring loop", jitcell_token.number, "with",
+                profile.hot_bridges, "hot bridges,",
+                profile.total_failures(), "guard failures and",
+                profile.get_failures(descr), "from this guard")
+    debug_stop("jit-superblock-retrace")
+    return True
@@ -418,9 +418,13 @@ class JitCellToken(AbstractDescr):
     retraced_count = 0
     invalidated = False
     outermost_jitdriver_sd = None
+    greenkey = None         # set when attached to the interpreter
+    guard_profile = None    # see guardprofile.py
     # and more data specified by the backend when the loop is compiled
     number = -1
     generation = r_int64(0)
+    code_size = 0           # bytes of machine code of the loop and bridges
+    entry_count = 0         # decaying count of entries, see memmgr.py
     # one purpose of LoopToken is to keep alive the CompiledLoopToken
     # returned by the backend.  When the LoopToken goes away, the
     # CompiledLoopToken has its __del__ called, which frees the assembler
@@ -447,6 +451,8 @@ class JitCellToken(AbstractDescr):
 class TargetToken(AbstractDescr):
     _ll_loop_code = 0     # for the backend.  If 0, we know that it is
                           # a LABEL that was not compiled yet.
+    _llvm_entry_func = None   # for the llvm backend: name of the function
+    _llvm_label_index = 0     # and entry index that reach this LABEL
 
     def __init__(self, targeting_jitcell_token=None,
                  original_jitcell_token=None):
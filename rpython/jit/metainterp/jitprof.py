@@ -11,7 +11,7 @@ from rpython.rlib.jit import Counters
 
 JITPROF_LINES = Counters.ncounters + 1 + 1
 # one for TOTAL, 1 for calls, update if needed
-_CPU_LINES = 4       # the last 4 lines are stored on the cpu
+_CPU_LINES = 9       # the last 9 lines are stored on the cpu
 
 class BaseProfiler(object):
     pass
@@ -49,6 +49,9 @@ class EmptyProfiler(BaseProfiler):
     def get_times(self, num):
         return 0.0
 
+    def get_histogram(self, num):
+        return []
+
 class Profiler(BaseProfiler):
     initialized = False
     timer = staticmethod(time.time)
@@ -110,11 +113,20 @@ class Profiler(BaseProfiler):
             return self.cpu.tracker.total_freed_loops
         elif num == Counters.TOTAL_FREED_BRIDGES:
             return self.cpu.tracker.total_freed_bridges
+        elif num >= Counters.LLVM_BUILD_IR:
+            return self.cpu.tracker.compile_stats.counts[num]
         return self.counters[num]
 
     def get_times(self, num):
+        if num >= Counters.LLVM_BUILD_IR:
+            return self.cpu.tracker.compile_stats.times[num]
         return self.times[num]
 
+    def get_histogram(self, num):
+        if num >= Counters.LLVM_BUILD_IR:
+            return self.cpu.tracker.compile_stats.histograms[num].buckets
+        return []
+
     def count_ops(self, opnum, kind=Counters.OPS):
         from rpython.jit.metainterp.resoperation import OpHelpers
         self.counters[kind] += 1
@@ -126,6 +138,10 @@ class Profiler(BaseProfiler):
         if have_debug_prints():
             self._print_stats()
         debug_stop("jit-summary")
+        debug_start("jit-compile-histograms")
+        if have_debug_prints() and self.cpu is not None:
+            self._print_histograms()
+        debug_stop("jit-compile-histograms")
 
     def _print_stats(self):
         cnt = self.counters
@@ -156,6 +172,9 @@ class Profiler(BaseProfiler):
         self._print_intline("nvirtuals", cnt[Counters.NVIRTUALS])
         self._print_intline("nvholes", cnt[Counters.NVHOLES])
         self._print_intline("nvreused", cnt[Counters.NVREUSED])
+        self._print_intline("resume bytes", cnt[Counters.RESUMEDATA_BYTES])
+        self._print_intline("resume bytes shared",
+                            cnt[Counters.RESUMEDATA_SHARED])
         self._print_intline("vecopt tried", cnt[Counters.OPT_VECTORIZE_TRY])
         self._print_intline("vecopt success", cnt[Counters.OPT_VECTORIZED])
         cpu = self.cpu
@@ -168,6 +187,29 @@ class Profiler(BaseProfiler):
                                 cpu.tracker.total_freed_loops)
             self._print_intline("Freed # of bridges",
                                 cpu.tracker.total_freed_bridges)
+            stats = cpu.tracker.compile_stats
+            for num, name in [(Counters.LLVM_BUILD_IR, "LLVM build IR"),
+                              (Counters.LLVM_OPTIMISE, "LLVM optimise"),
+                              (Counters.LLVM_CODEGEN, "LLVM codegen")]:
+                self._print_line_time(name, stats.counts[num],
+                                      stats.times[num])
+            self._print_intline("LLVM code size",
+                                stats.counts[Counters.LLVM_CODE_SIZE])
+            self._print_intline("LLVM deferred",
+                                stats.counts[Counters.LLVM_DEFERRED])
+
+    def _print_histograms(self):
+        stats = self.cpu.tracker.compile_stats
+        for num, name in [(Counters.LLVM_BUILD_IR, "LLVM build IR us"),
+                          (Counters.LLVM_OPTIMISE, "LLVM optimise us"),
+                          (Counters.LLVM_CODEGEN, "LLVM codegen us"),
+                          (Counters.LLVM_CODE_SIZE, "LLVM code size")]:
+            buckets = stats.histograms[num].buckets
+            line = name + ':'
+            for i in range(len(buckets)):
+                if buckets[i]:
+                    line += ' <%d:%d' % (1 << i, buckets[i])
+            debug_print(line)
 
     def _print_line_time(self, string, i, tim):
         final = "%s:%s\t%d\t%f" % (string, " " * max(0, 13-len(string)), i, tim)
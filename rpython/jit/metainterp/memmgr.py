@@ -2,6 +2,7 @@ import math
 from rpython.rlib.rarithmetic import r_int64
 from rpython.rlib.debug import debug_start, debug_print, debug_stop
 from rpython.rlib.objectmodel import we_are_translated
+from rpython.rlib.listsort import make_timsort_class
 
 #
 # Logic to decide which loops are old and not used any more.
@@ -19,6 +20,21 @@ from rpython.rlib.objectmodel import we_are_translated
 # 'generation' field is much smaller than the current generation, and
 # removed from the set.
 #
+# On top of that, the 'max_code_size' parameter puts a budget on the
+# machine code of all the loops in 'alive_loops', as counted in the
+# 'code_size' of their LoopToken.  When they get over it, the loops that
+# were entered the least often are removed first, using the
+# 'entry_count' of their LoopToken: it counts the calls to
+# keep_loop_alive(), i.e. the entries from the interpreter, and is halved
+# at every check so that only the recent entries really matter.
+#
+
+CODE_SIZE_CHECK_FREQUENCY = 20 # generations between checks of the budget
+
+def _fewer_entries(a, b):
+    return a.entry_count < b.entry_count
+
+EntryCountSort = make_timsort_class(lt=_fewer_entries)
 
 class MemoryManager(object):
 
@@ -37,16 +53,35 @@ class MemoryManager(object):
         # per second
         self.current_generation = r_int64(1)
         self.next_check = r_int64(-1)
+        self.max_age = 0
+        self.max_code_size = 0
         self.alive_loops = {}
 
     def set_max_age(self, max_age, check_frequency=0):
         if max_age <= 0:
-            self.next_check = r_int64(-1)
+            self.max_age = 0
         else:
             self.max_age = max_age
             if check_frequency <= 0:
                 check_frequency = int(math.sqrt(max_age))
             self.check_frequency = check_frequency
+        self._schedule_next_check()
+
+    def set_max_code_size(self, max_code_size, check_frequency=0):
+        if max_code_size <= 0:
+            self.max_code_size = 0
+        else:
+            self.max_code_size = max_code_size
+            if check_frequency > 0:
+                self.check_frequency = check_frequency
+            elif self.check_frequency <= 0:
+                self.check_frequency = CODE_SIZE_CHECK_FREQUENCY
+        self._schedule_next_check()
+
+    def _schedule_next_check(self):
+        if self.max_age <= 0 and self.max_code_size <= 0:
+            self.next_check = r_int64(-1)
+        else:
             self.next_check = self.current_generation + 1
 
     def next_generation(self):
@@ -56,6 +91,7 @@ class MemoryManager(object):
             self.next_check = self.current_generation + self.check_frequency
 
     def keep_loop_alive(self, looptoken):
+        looptoken.entry_count += 1
         if looptoken.generation != self.current_generation:
             looptoken.generation = self.current_generation
             self.alive_loops[looptoken] = None
@@ -66,11 +102,16 @@ class MemoryManager(object):
         #print self.alive_loops.keys()
         debug_print("Current generation:", self.current_generation)
         debug_print("Loop tokens before:", oldtotal)
-        max_generation = self.current_generation - (self.max_age-1)
+        if self.max_age > 0:
+            max_generation = self.current_generation - (self.max_age-1)
+        else:
+            max_generation = 0
         for looptoken in self.alive_loops.keys():
             if (0 <= looptoken.generation < max_generation or
                 looptoken.invalidated):
                 del self.alive_loops[looptoken]
+        if self.max_code_size > 0:
+            self._enforce_code_size()
         newtotal = len(self.alive_loops)
         debug_print("Loop tokens freed: ", oldtotal - newtotal)
         debug_print("Loop tokens left:  ", newtotal)
@@ -82,6 +123,26 @@ class MemoryManager(object):
             rgc.collect(); rgc.collect(); rgc.collect()
         debug_stop("jit-mem-collect")
 
+    def _enforce_code_size(self):
+        code_size = 0
+        candidates = []
+        for looptoken in self.alive_loops.keys():
+            code_size += looptoken.code_size
+            # the loops compiled or entered in this generation are in use
+            if looptoken.generation != self.current_generation:
+                candidates.append(looptoken)
+        debug_print("Code size:         ", code_size)
+        if code_size > self.max_code_size:
+            EntryCountSort(candidates).sort()
+            for looptoken in candidates:
+                if code_size <= self.max_code_size:
+                    break
+                code_size -= looptoken.code_size
+                del self.alive_loops[looptoken]
+            debug_print("Code size left:    ", code_size)
+        for looptoken in self.alive_loops.keys():
+            looptoken.entry_count >>= 1
+
     def release_all_loops(self):
         debug_start("jit-mem-releaseall")
         debug_print("Loop tokens cleared:", len(self.alive_loops))
@@ -665,10 +665,12 @@ class OptHeap(Optimization):
         # as invalid
         if not qmutdescr.is_still_valid_for(get_box_replacement(op.getarg(0))):
             raise InvalidLoop('quasi immutable field changed during tracing')
-        # record as an out-of-line guard
+        # record as an out-of-line guard, along with how many times it was
+        # invalidated so far (see install_pending_loop() in compile.py)
         if self.optimizer.quasi_immutable_deps is None:
             self.optimizer.quasi_immutable_deps = {}
-        self.optimizer.quasi_immutable_deps[qmutdescr.qmut] = None
+        qmut = qmutdescr.qmut
+        self.optimizer.quasi_immutable_deps[qmut] = qmut.invalidations
 
     def optimize_GUARD_NOT_INVALIDATED(self, op):
         # logic: we need one guard_not_invalidated after every call that can
@@ -1,4 +1,5 @@
 from rpython.jit.metainterp import jitprof, resume, compile
+from rpython.jit.metainterp.background import YIELD_EVERY, yield_to_interpreter
 from rpython.jit.metainterp.executor import execute_nonspec_const
 from rpython.jit.metainterp.history import (
     Const, ConstInt, CONST_NULL, new_ref_dict)
@@ -475,9 +476,13 @@ class Optimizer(Optimization):
         self.call_pure_results = call_pure_results
         last_op = None
         i = 0
+        n = 0
         while not trace.done():
             self._really_emitted_operation = None
             op = trace.next()
+            n += 1
+            if n % YIELD_EVERY == 0:
+                yield_to_interpreter()
             if op.getopnum() in (rop.FINISH, rop.JUMP):
                 last_op = op
                 break
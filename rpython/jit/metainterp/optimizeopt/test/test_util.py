@@ -17,6 +17,7 @@ from rpython.jit.tool.oparser import (
     OpParser, pure_parse, convert_loop_to_trace)
 from rpython.jit.metainterp.quasiimmut import QuasiImmutDescr
 from rpython.jit.metainterp import compile
+from rpython.jit.metainterp.resume import ResumeDataStore
 from rpython.jit.metainterp.jitprof import EmptyProfiler
 from rpython.jit.metainterp.counter import DeterministicJitCounter
 from rpython.config.translationoption import get_combined_translation_config
@@ -485,6 +486,7 @@ class FakeMetaInterpStaticData(object):
         self.config = get_combined_translation_config(translating=True)
         self.jitlog = jl.JitLogger()
         self.callinfocollection = FakeCallInfoCollection()
+        self.resumedata_store = ResumeDataStore()
 
     class logger_noopt:
         @classmethod
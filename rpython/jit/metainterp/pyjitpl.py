@@ -6,6 +6,8 @@ from rpython.jit.codewriter import longlong
 from rpython.jit.codewriter.effectinfo import EffectInfo
 from rpython.jit.codewriter.jitcode import JitCode, SwitchDictDescr
 from rpython.jit.metainterp import history, compile, resume, executor, jitexc
+from rpython.jit.metainterp.background import BackgroundOptimizer
+from rpython.jit.metainterp.warmupprofile import WarmupProfile
 from rpython.jit.metainterp.heapcache import HeapCache
 from rpython.jit.metainterp.history import (Const, ConstInt, ConstPtr,
     ConstFloat, CONST_NULL, TargetToken, MissingValue, SwitchToBlackhole)
@@ -1892,6 +1894,10 @@ class MetaInterpStaticData(object):
         self._addr2name_keys = []
         self._addr2name_values = []
 
+        self.background = BackgroundOptimizer(self)
+        self.resumedata_store = resume.ResumeDataStore()
+        self.warmup_profile = WarmupProfile()
+
         compile.make_and_attach_done_descrs([self, cpu])
 
     def _freeze_(self):
@@ -2663,12 +2669,7 @@ class MetaInterp(object):
         # interpreted mode, but it should come back very quickly to the
         # JIT, find probably the same 'loop_token', and execute it.
         if we_are_translated():
-            num_green_args = self.jitdriver_sd.num_green_args
-            gi, gr, gf = self._unpack_boxes(live_arg_boxes, 0, num_green_args)
-            ri, rr, rf = self._unpack_boxes(live_arg_boxes, num_green_args,
-                                            len(live_arg_boxes))
-            CRN = jitexc.ContinueRunningNormally
-            raise CRN(gi, gr, gf, ri, rr, rf)
+            self.raise_continue_running_in_interpreter(live_arg_boxes)
         else:
             # However, in order to keep the existing tests working
             # (which are based on the assumption that 'loop_token' is
@@ -2676,6 +2677,16 @@ class MetaInterp(object):
             self._nontranslated_run_directly(live_arg_boxes, loop_token)
             assert 0, "unreachable"
 
+    def raise_continue_running_in_interpreter(self, live_arg_boxes):
+        self.history.inputargs = None
+        self.history.operations = None
+        num_green_args = self.jitdriver_sd.num_green_args
+        gi, gr, gf = self._unpack_boxes(live_arg_boxes, 0, num_green_args)
+        ri, rr, rf = self._unpack_boxes(live_arg_boxes, num_green_args,
+                                        len(live_arg_boxes))
+        CRN = jitexc.ContinueRunningNormally
+        raise CRN(gi, gr, gf, ri, rr, rf)
+
     def _nontranslated_run_directly(self, live_arg_boxes, loop_token):
         "NOT_RPYTHON"
         args = []
@@ -2765,6 +2776,12 @@ class MetaInterp(object):
             # XXX this path not tested, but shown to occur on pypy-c :-(
             self.staticdata.log('cancelled: we already have a token now')
             raise SwitchToBlackhole(Counters.ABORT_BAD_LOOP)
+        if use_unroll and self.can_optimize_in_background():
+            compile.compile_loop_in_background(
+                self, greenkey, start, original_boxes[num_green_args:],
+                live_arg_boxes[num_green_args:])
+            self.staticdata.log('handed to the JIT thread')
+            self.raise_continue_running_in_interpreter(live_arg_boxes)
         target_token = compile.compile_loop(
             self, greenkey, start, original_boxes[num_green_args:],
             live_arg_boxes[num_green_args:], use_unroll=use_unroll)
@@ -2776,6 +2793,14 @@ class MetaInterp(object):
                 target_token.targeting_jitcell_token)
         return target_token
 
+    def can_optimize_in_background(self):
+        warmstate = self.jitdriver_sd.warmstate
+        if not warmstate.background_optimize:
+            return False
+        # vectorizing compiles loop versions straight after the loop
+        return not ((warmstate.vec and self.jitdriver_sd.vec) or
+                    warmstate.vec_all)
+
     def compile_retrace(self, original_boxes, live_arg_boxes, start):
         num_green_args = self.jitdriver_sd.num_green_args
         greenkey = original_boxes[:num_green_args]
@@ -55,6 +55,7 @@ class QuasiImmut(object):
     llopaque = True
     compress_limit = 30
     looptokens_wrefs = None
+    invalidations = 0  # loops optimized in the background compare this
 
     def __init__(self, cpu):
         self.cpu = cpu
@@ -89,6 +90,7 @@ class QuasiImmut(object):
         if self.looptokens_wrefs is None:
             # can't happen, but helps compiled tests
             return
+        self.invalidations += 1
         wrefs = self.looptokens_wrefs
         self.looptokens_wrefs = []
         invalidated = 0
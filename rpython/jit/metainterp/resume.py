@@ -7,7 +7,8 @@ from rpython.jit.metainterp.history import (
 from rpython.jit.metainterp.resoperation import rop
 from rpython.rlib import rarithmetic, rstack
 from rpython.rlib.objectmodel import (we_are_translated, specialize,
-        compute_unique_id)
+        compute_unique_id, compute_identity_hash)
+from rpython.rlib.rarithmetic import intmask
 from rpython.rlib.debug import ll_assert, debug_print
 from rpython.rtyper import annlowlevel
 from rpython.rtyper.lltypesystem import lltype, llmemory, rffi, rstr
@@ -169,6 +170,70 @@ class NumberingState(resumecode.Writer):
         self.liveboxes = {}
         self.num_boxes = 0
         self.num_virtuals = 0
+        self.prefix_end = -1 # where the top frame starts, if there is one
+
+
+STORE_SIZE = 4096 # entries in each of the tables of a ResumeDataStore
+STORE_MASK = STORE_SIZE - 1
+MIN_PREFIX_BYTES = 8 # shorter prefixes don't pay for their own numbering
+
+class ResumeDataStore(object):
+    """
+    Shared by all the loops and bridges of a metainterp_sd. Most guards of
+    a big trace are in the same few frames, so their numberings repeat the
+    parent frames and often all of it, and the same virtuals are described
+    again and again. This interns numberings, the prefixes holding the
+    virtualizable, virtualrefs and parent frames, and virtual infos.
+
+    The tables are direct-mapped on the hash of the contents: a collision
+    just replaces the older entry, and at most STORE_SIZE of each stay alive
+    after the loops using them are freed. The JIT thread of background.py
+    uses it too, only ever with the GIL held.
+    """
+    def __init__(self):
+        self.numberings = [resumecode.NULL_NUMBER] * STORE_SIZE
+        self.prefixes = [resumecode.NULL_NUMBER] * STORE_SIZE
+        self.vinfos = [None] * STORE_SIZE
+
+    def create_numbering(self, numb_state, memo):
+        items = numb_state.current
+        split = numb_state.prefix_end
+        prefix = resumecode.NULL_NUMBER
+        h = 0
+        if split > resumecode.HEADER_ITEMS:
+            shared = resumecode.encode_items(items, resumecode.HEADER_ITEMS,
+                                             split)
+            if len(shared) >= MIN_PREFIX_BYTES:
+                h = resumecode.hash_code(shared)
+                prefix = self.prefixes[h & STORE_MASK]
+                if prefix and resumecode.same_code(prefix, shared):
+                    memo.nresumeshared += len(shared)
+                else:
+                    prefix = resumecode.new_numbering(shared)
+                    self.prefixes[h & STORE_MASK] = prefix
+                    memo.nresumebytes += len(shared)
+        if prefix:
+            final = resumecode.encode_items(items, 0, resumecode.HEADER_ITEMS)
+            final.extend(resumecode.encode_items(items, split, len(items)))
+        else:
+            final = resumecode.encode_items(items, 0, len(items))
+        h = resumecode.hash_code(final, h)
+        numb = self.numberings[h & STORE_MASK]
+        if numb and numb.prefix == prefix and resumecode.same_code(numb, final):
+            memo.nresumeshared += len(final)
+            return numb
+        numb = resumecode.new_numbering(final, prefix)
+        self.numberings[h & STORE_MASK] = numb
+        memo.nresumebytes += len(final)
+        return numb
+
+    def intern_virtual_info(self, vinfo):
+        index = vinfo.content_hash() & STORE_MASK
+        other = self.vinfos[index]
+        if other is not None and other.same_content(vinfo):
+            return other
+        self.vinfos[index] = vinfo
+        return vinfo
 
 
 class ResumeDataLoopMemo(object):
@@ -176,6 +241,7 @@ class ResumeDataLoopMemo(object):
     def __init__(self, metainterp_sd):
         self.metainterp_sd = metainterp_sd
         self.cpu = metainterp_sd.cpu
+        self.store = metainterp_sd.resumedata_store
         self.consts = []
         self.large_ints = {}
         self.refs = new_ref_dict()
@@ -185,6 +251,8 @@ class ResumeDataLoopMemo(object):
         self.nvirtuals = 0
         self.nvholes = 0
         self.nvreused = 0
+        self.nresumebytes = 0
+        self.nresumeshared = 0
 
     def getconst(self, const):
         if const.type == INT:
@@ -275,6 +343,8 @@ class ResumeDataLoopMemo(object):
         self._number_boxes(snapshot_iter, arr, numb_state)
 
         for snapshot in snapshot_iter.framestack:
+            # ends up at the top frame, everything before can be shared
+            numb_state.prefix_end = len(numb_state.current)
             jitcode_index, pc = snapshot_iter.unpack_jitcode_pc(snapshot)
             numb_state.append_int(jitcode_index)
             numb_state.append_int(pc)
@@ -283,6 +353,18 @@ class ResumeDataLoopMemo(object):
 
         return numb_state
 
+    def create_numbering(self, numb_state):
+        if self.store is None:
+            numb = numb_state.create_numbering()
+            self.nresumebytes += len(numb.code)
+            return numb
+        return self.store.create_numbering(numb_state, self)
+
+    def intern_virtual_info(self, vinfo):
+        if self.store is None:
+            return vinfo
+        return self.store.intern_virtual_info(vinfo)
+
 
     # caching for virtuals and boxes inside them
 
@@ -319,6 +401,8 @@ class ResumeDataLoopMemo(object):
         profiler.count(jitprof.Counters.NVIRTUALS, self.nvirtuals)
         profiler.count(jitprof.Counters.NVHOLES, self.nvholes)
         profiler.count(jitprof.Counters.NVREUSED, self.nvreused)
+        profiler.count(jitprof.Counters.RESUMEDATA_BYTES, self.nresumebytes)
+        profiler.count(jitprof.Counters.RESUMEDATA_SHARED, self.nresumeshared)
 
 _frame_info_placeholder = (None, 0, 0)
 
@@ -469,7 +553,7 @@ class ResumeDataVirtualAdder(VirtualVisitor):
         numb_state.patch(1, len(liveboxes))
 
         self._add_optimizer_sections(numb_state, liveboxes, liveboxes_from_env)
-        storage.rd_numb = numb_state.create_numbering()
+        storage.rd_numb = self.memo.create_numbering(numb_state)
         storage.rd_consts = self.memo.consts
         return liveboxes[:]
 
@@ -521,6 +605,8 @@ class ResumeDataVirtualAdder(VirtualVisitor):
                 assert isinstance(info, AbstractVirtualPtrInfo)
                 fieldnums = [self._gettagged(box) for box in fieldboxes]
                 vinfo = self.make_virtual_info(info, fieldnums)
+                # an equal one may come from another guard, loop or bridge
+                vinfo = info._cached_vinfo = memo.intern_virtual_info(vinfo)
                 # if a new vinfo instance is made, we get the fieldnums list we
                 # pass in as an attribute. hackish.
                 if vinfo.fieldnums is not fieldnums:
@@ -606,15 +692,44 @@ class AbstractVirtualInfo(object):
     def set_content(self, fieldnums):
         self.fieldnums = fieldnums
 
+    def content_hash(self):
+        h = self.shape_hash()
+        for num in self.fieldnums:
+            h = intmask((h * 1000003) ^ rffi.cast(lltype.Signed, num))
+        return h
+
+    def same_content(self, other):
+        return (self.__class__ is other.__class__ and
+                self.equals(other.fieldnums) and self.same_shape(other))
+
+    def shape_hash(self):
+        return 0
+
+    def same_shape(self, other):
+        # everything but the fieldnums, other has the same class as self
+        return True
+
     def debug_prints(self):
         raise NotImplementedError
 
+def same_descrs(descrs1, descrs2):
+    if len(descrs1) != len(descrs2):
+        return False
+    for i in range(len(descrs1)):
+        if descrs1[i] is not descrs2[i]:
+            return False
+    return True
+
 
 class AbstractVirtualStructInfo(AbstractVirtualInfo):
     def __init__(self, fielddescrs):
         self.fielddescrs = fielddescrs
         #self.fieldnums = ...
 
+    def same_shape(self, other):
+        assert isinstance(other, AbstractVirtualStructInfo)
+        return same_descrs(self.fielddescrs, other.fielddescrs)
+
     @specialize.argtype(1)
     def setfields(self, decoder, struct):
         for i in range(len(self.fielddescrs)):
@@ -636,6 +751,14 @@ class VirtualInfo(AbstractVirtualStructInfo):
         AbstractVirtualStructInfo.__init__(self, fielddescrs)
         self.descr = descr
 
+    def shape_hash(self):
+        return compute_identity_hash(self.descr)
+
+    def same_shape(self, other):
+        assert isinstance(other, VirtualInfo)
+        return (self.descr is other.descr and
+                AbstractVirtualStructInfo.same_shape(self, other))
+
     @specialize.argtype(1)
     def allocate(self, decoder, index):
         struct = decoder.allocate_with_vtable(descr=self.descr)
@@ -652,6 +775,14 @@ class VStructInfo(AbstractVirtualStructInfo):
         AbstractVirtualStructInfo.__init__(self, fielddescrs)
         self.typedescr = typedescr
 
+    def shape_hash(self):
+        return compute_identity_hash(self.typedescr)
+
+    def same_shape(self, other):
+        assert isinstance(other, VStructInfo)
+        return (self.typedescr is other.typedescr and
+                AbstractVirtualStructInfo.same_shape(self, other))
+
     @specialize.argtype(1)
     def allocate(self, decoder, index):
         struct = decoder.allocate_struct(self.typedescr)
@@ -668,6 +799,13 @@ class AbstractVArrayInfo(AbstractVirtualInfo):
         self.arraydescr = arraydescr
         #self.fieldnums = ...
 
+    def shape_hash(self):
+        return compute_identity_hash(self.arraydescr)
+
+    def same_shape(self, other):
+        assert isinstance(other, AbstractVArrayInfo)
+        return self.arraydescr is other.arraydescr
+
     @specialize.argtype(1)
     def allocate(self, decoder, index):
         length = len(self.fieldnums)
@@ -719,6 +857,15 @@ class VRawBufferInfo(VAbstractRawInfo):
         self.offsets = offsets
         self.descrs = descrs
 
+    def shape_hash(self):
+        return self.size
+
+    def same_shape(self, other):
+        assert isinstance(other, VRawBufferInfo)
+        return (self.func == other.func and self.size == other.size and
+                self.offsets == other.offsets and
+                same_descrs(self.descrs, other.descrs))
+
     @specialize.argtype(1)
     def allocate_int(self, decoder, index):
         length = len(self.fieldnums)
@@ -741,6 +888,13 @@ class VRawSliceInfo(VAbstractRawInfo):
     def __init__(self, offset):
         self.offset = offset
 
+    def shape_hash(self):
+        return self.offset
+
+    def same_shape(self, other):
+        assert isinstance(other, VRawSliceInfo)
+        return self.offset == other.offset
+
     @specialize.argtype(1)
     def allocate_int(self, decoder, index):
         assert len(self.fieldnums) == 1
@@ -761,6 +915,15 @@ class VArrayStructInfo(AbstractVirtualInfo):
         self.arraydescr = arraydescr
         self.fielddescrs = fielddescrs
 
+    def shape_hash(self):
+        return compute_identity_hash(self.arraydescr)
+
+    def same_shape(self, other):
+        assert isinstance(other, VArrayStructInfo)
+        return (self.arraydescr is other.arraydescr and
+                self.size == other.size and
+                same_descrs(self.fielddescrs, other.fielddescrs))
+
     def debug_prints(self):
         debug_print("\tvarraystructinfo", self.arraydescr, " at ",  compute_unique_id(self))
         for i in self.fieldnums:
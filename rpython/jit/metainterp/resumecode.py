@@ -20,13 +20,21 @@
 
   # ----- optimization section
   <more code>                                      further sections according to bridgeopt.py
+
+A numbering can leave out the items that come after the first two and
+point to them with 'prefix' instead: another numbering, shared with other
+guards, holding the virtualizable, the virtualrefs and the parent frames.
+Readers see the two header items, then all the items of the prefix, then
+the rest of the numbering's own code. See ResumeDataStore in resume.py.
 """
 
 from rpython.rtyper.lltypesystem import rffi, lltype
 from rpython.rlib import objectmodel
+from rpython.rlib.rarithmetic import intmask
 
 NUMBERINGP = lltype.Ptr(lltype.GcForwardReference())
 NUMBERING = lltype.GcStruct('Numbering',
+                            ('prefix', NUMBERINGP),
                             ('code', lltype.Array(rffi.UCHAR)))
 NUMBERINGP.TO.become(NUMBERING)
 NULL_NUMBER = lltype.nullptr(NUMBERING)
@@ -74,12 +82,37 @@ def numb_next_n_items(numb, size, index):
 
 def unpack_numbering(numb):
     l = []
-    i = 0
-    while i < len(numb.code):
-        next, i = numb_next_item(numb, i)
-        l.append(next)
+    reader = Reader(numb)
+    while not reader.at_end():
+        l.append(reader.next_item())
     return l
 
+def encode_items(items, start, stop):
+    final = objectmodel.newlist_hint((stop - start) * 3)
+    for i in range(start, stop):
+        append_numbering(final, items[i])
+    return final
+
+def new_numbering(final, prefix=NULL_NUMBER):
+    numb = lltype.malloc(NUMBERING, len(final))
+    numb.prefix = prefix
+    for i, elt in enumerate(final):
+        numb.code[i] = elt
+    return numb
+
+def hash_code(final, h=0):
+    for elt in final:
+        h = intmask((h * 1000003) ^ rffi.cast(lltype.Signed, elt))
+    return h
+
+def same_code(numb, final):
+    if len(numb.code) != len(final):
+        return False
+    for i in range(len(final)):
+        if numb.code[i] != final[i]:
+            return False
+    return True
+
 class Writer(object):
     def __init__(self, size=0):
         self.current = objectmodel.newlist_hint(size)
@@ -93,13 +126,7 @@ class Writer(object):
         return self.append_short(short)
 
     def create_numbering(self):
-        final = objectmodel.newlist_hint(len(self.current) * 3)
-        for item in self.current:
-            append_numbering(final, item)
-        numb = lltype.malloc(NUMBERING, len(final))
-        for i, elt in enumerate(final):
-            numb.code[i] = elt
-        return numb
+        return new_numbering(encode_items(self.current, 0, len(self.current)))
 
     def patch_current_size(self, index):
         self.patch(index, len(self.current))
@@ -114,29 +141,54 @@ def create_numbering(l):
     return w.create_numbering()
 
 
+HEADER_ITEMS = 2 # items of a numbering that come before its prefix
+
 class Reader(object):
     def __init__(self, code):
-        self.code = code
+        self.numb = code
+        self.code = code # the numbering or its prefix, whichever is read
         self.cur_pos = 0 # index into the code
+        self.end = len(code.code) # where to switch to the other one
+        self.rest_pos = 0 # where to continue in numb after the prefix
         self.items_read = 0 # number of items read
+        if code.prefix:
+            self.end = numb_next_n_items(code, HEADER_ITEMS, 0)
+
+    def _next_piece(self):
+        numb = self.numb
+        if self.code == numb:
+            self.rest_pos = self.cur_pos
+            self.code = numb.prefix
+            self.cur_pos = 0
+        else:
+            self.code = numb
+            self.cur_pos = self.rest_pos
+        self.end = len(self.code.code)
+
+    def at_end(self):
+        return self.code == self.numb and self.cur_pos == len(self.numb.code)
 
     def next_item(self):
+        if self.cur_pos == self.end:
+            self._next_piece()
         result, self.cur_pos = numb_next_item(self.code, self.cur_pos)
         self.items_read += 1
         return result
 
     def peek(self):
+        if self.cur_pos == self.end:
+            self._next_piece()
         result, _ = numb_next_item(self.code, self.cur_pos)
         return result
 
     def jump(self, size):
         """ jump n items forward without returning anything """
-        index = self.cur_pos
         for i in range(size):
-            _, index = numb_next_item(self.code, index)
+            if self.cur_pos == self.end:
+                self._next_piece()
+            _, self.cur_pos = numb_next_item(self.code, self.cur_pos)
         self.items_read += size
-        self.cur_pos = index
 
     def unpack(self):
         # mainly for debugging
-        return unpack_numbering(self.code)
+        return unpack_numbering(self.numb)
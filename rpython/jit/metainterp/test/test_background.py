@@ -0,0 +1,132 @@
+from rpython.rlib.jit import JitDriver, set_param, promote
+from rpython.jit.metainterp.test.support import LLJitMixin
+from rpython.jit.metainterp import pyjitpl
+from rpython.jit.metainterp.quasiimmut import QuasiImmut
+
+
+class BackgroundTests:
+
+    def test_loop_installed_at_next_entry(self):
+        myjitdriver = JitDriver(greens=[], reds=['n', 'res'])
+        def f(n):
+            set_param(myjitdriver, 'background_optimize', 1)
+            res = 0
+            while n > 0:
+                myjitdriver.can_enter_jit(n=n, res=res)
+                myjitdriver.jit_merge_point(n=n, res=res)
+                res += n
+                n -= 1
+            return res
+        res = self.meta_interp(f, [100])
+        assert res == 5050
+        self.check_trace_count(1)
+        self.check_jitcell_token_count(1)
+        self.check_enter_count(1)
+        background = pyjitpl._warmrunnerdesc.metainterp_sd.background
+        assert background.installed == 1
+        assert background.pending == 0
+
+    def test_nested_loops(self):
+        myjitdriver = JitDriver(greens=['pc'], reds=['n', 'i', 'res'])
+        def f(n):
+            set_param(myjitdriver, 'background_optimize', 1)
+            res = 0
+            i = 0
+            pc = 0
+            while n > 0:
+                myjitdriver.jit_merge_point(pc=pc, n=n, i=i, res=res)
+                if pc == 0:
+                    i = 20
+                    pc = 1
+                elif i > 0:
+                    res += promote(n) * 2
+                    i -= 1
+                    myjitdriver.can_enter_jit(pc=pc, n=n, i=i, res=res)
+                else:
+                    n -= 1
+                    pc = 0
+                    myjitdriver.can_enter_jit(pc=pc, n=n, i=i, res=res)
+            return res
+        res = self.meta_interp(f, [30])
+        assert res == 20 * 2 * sum(range(1, 31))
+        background = pyjitpl._warmrunnerdesc.metainterp_sd.background
+        assert background.installed >= 1
+
+    def test_quasi_immutable_invalidated_before_optimizing(self, monkeypatch):
+        from rpython.jit.metainterp.background import BackgroundOptimizer
+        myjitdriver = JitDriver(greens=['foo'], reds=['x', 'total'])
+        class Foo:
+            _immutable_fields_ = ['a?']
+            def __init__(self, a):
+                self.a = a
+        def f(a, x):
+            set_param(myjitdriver, 'background_optimize', 1)
+            foo = Foo(a)
+            total = 0
+            while x > 0:
+                myjitdriver.jit_merge_point(foo=foo, x=x, total=total)
+                total += foo.a
+                x -= 1
+            return total
+        # the interpreter writes the field, without changing it, every time
+        # before the JIT thread gets to a loop
+        qmuts = []
+        orig_init = QuasiImmut.__init__
+        def init(self, cpu):
+            orig_init(self, cpu)
+            qmuts.append(self)
+        monkeypatch.setattr(QuasiImmut, '__init__', init)
+        orig_optimize = BackgroundOptimizer.optimize
+        def optimize(self, pending):
+            for qmut in qmuts:
+                qmut.invalidate()
+            orig_optimize(self, pending)
+        monkeypatch.setattr(BackgroundOptimizer, 'optimize', optimize)
+        res = self.meta_interp(f, [100, 30])
+        assert res == 3000
+        assert qmuts
+        background = pyjitpl._warmrunnerdesc.metainterp_sd.background
+        assert background.installed == 1
+        self.check_jitcell_token_count(1)
+
+    def test_trace_logged_at_install(self, monkeypatch):
+        from rpython.jit.metainterp import compile
+        from rpython.jit.metainterp.background import BackgroundOptimizer
+        myjitdriver = JitDriver(greens=[], reds=['n', 'res'])
+        def f(n):
+            set_param(myjitdriver, 'background_optimize', 1)
+            res = 0
+            while n > 0:
+                myjitdriver.jit_merge_point(n=n, res=res)
+                res += n
+                n -= 1
+            return res
+        events = []
+        orig_log = compile.log_unoptimized_trace
+        def log_unoptimized_trace(*args):
+            events.append('log')
+            orig_log(*args)
+        monkeypatch.setattr(compile, 'log_unoptimized_trace',
+                            log_unoptimized_trace)
+        orig_optimize = BackgroundOptimizer.optimize
+        def optimize(self, pending):
+            events.append('optimize')
+            orig_optimize(self, pending)
+        monkeypatch.setattr(BackgroundOptimizer, 'optimize', optimize)
+        res = self.meta_interp(f, [100])
+        assert res == 5050
+        assert events == ['optimize', 'log']
+
+    def test_qmut_counts_invalidations(self):
+        class FakeCPU:
+            def invalidate_loop(self, looptoken):
+                pass
+        qmut = QuasiImmut(FakeCPU())
+        assert qmut.invalidations == 0
+        qmut.invalidate()
+        qmut.invalidate()
+        assert qmut.invalidations == 2
+
+
+class TestLLtype(BackgroundTests, LLJitMixin):
+    pass
@@ -64,6 +64,7 @@ class FakeMetaInterpStaticData(object):
     stats = Stats(None)
     profiler = jitprof.EmptyProfiler()
     warmrunnerdesc = None
+    resumedata_store = None
     def log(self, msg, event_kind=None):
         pass
 
@@ -128,3 +128,14 @@ def test_change_current_fraction():
     assert r is False
     r = jc.tick(index2hash(jc, 104), incr)
     assert r is True
+
+def test_current_fraction():
+    jc = JitCounter()
+    incr = jc.compute_threshold(8)
+    assert jc.current_fraction(index2hash(jc, 104)) == 0.0
+    for i in range(3):
+        jc.tick(index2hash(jc, 104), incr)
+    assert abs(jc.current_fraction(index2hash(jc, 104)) - 3 * incr) < 1e-6
+    assert jc.current_fraction(index2hash(jc, 105)) == 0.0
+    jc.reset(index2hash(jc, 104))
+    assert jc.current_fraction(index2hash(jc, 104)) == 0.0
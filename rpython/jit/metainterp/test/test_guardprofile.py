@@ -0,0 +1,53 @@
+from rpython.rlib.jit import JitDriver, set_param
+from rpython.jit.metainterp.test.support import LLJitMixin, get_stats
+from rpython.jit.metainterp.warmstate import JC_SUPERBLOCK
+from rpython.jit.metainterp import pyjitpl
+
+
+class GuardProfileTests:
+
+    def run_phases(self, retrace_bridges):
+        myjitdriver = JitDriver(greens=[], reds=['i', 'n', 'res'])
+        def f(n):
+            set_param(myjitdriver, 'retrace_bridges', retrace_bridges)
+            res = 0
+            i = 0
+            while i < n:
+                myjitdriver.can_enter_jit(i=i, n=n, res=res)
+                myjitdriver.jit_merge_point(i=i, n=n, res=res)
+                if i < 20:
+                    res += 1
+                elif i < 40:
+                    res += 3
+                else:
+                    res += 7
+                i += 1
+            return res
+        res = self.meta_interp(f, [100])
+        assert res == 20 + 20 * 3 + 60 * 7
+        tokens = [wref() for wref in get_stats().jitcell_token_wrefs]
+        return [token for token in tokens if token is not None]
+
+    def test_no_retrace_by_default(self):
+        tokens = self.run_phases(0)
+        self.check_jitcell_token_count(1)
+        assert tokens[0].guard_profile is None
+
+    def test_superblock_retrace(self):
+        tokens = self.run_phases(1)
+        self.check_jitcell_token_count(2)
+        self.check_trace_count(3) # the loop, one bridge, the retraced loop
+        old, new = tokens
+        assert old.invalidated
+        assert not new.invalidated
+        assert old.guard_profile.hot_bridges == 1
+        assert old.guard_profile.total_failures() > 0
+        assert new.greenkey == old.greenkey
+        warmstate = pyjitpl._warmrunnerdesc.jitdrivers_sd[0].warmstate
+        cell = warmstate.JitCell.get_jit_cell_at_key(new.greenkey)
+        assert cell.flags & JC_SUPERBLOCK
+        assert cell.get_procedure_token() is new
+
+
+class TestLLtype(GuardProfileTests, LLJitMixin):
+    pass
@@ -126,3 +126,30 @@ class TestProfile(ProfilerMixin):
         profiler = pyjitpl._warmrunnerdesc.metainterp_sd.profiler
         assert profiler.counters[Counters.HEAPCACHED_OPS] == 3
 
+
+def test_compile_stats():
+    from rpython.jit.backend.model import CPUTotalTracker
+    class FakeCPU:
+        tracker = CPUTotalTracker()
+    stats = FakeCPU.tracker.compile_stats
+    stats.phase_done(Counters.LLVM_OPTIMISE, 0.000003)
+    stats.phase_done(Counters.LLVM_OPTIMISE, 0.0005)
+    stats.record(Counters.LLVM_CODE_SIZE, 0)
+    stats.record(Counters.LLVM_CODE_SIZE, 1000)
+    stats.count(Counters.LLVM_DEFERRED)
+    profiler = Profiler()
+    profiler.cpu = FakeCPU()
+    profiler.start()
+    assert profiler.get_counter(Counters.LLVM_OPTIMISE) == 2
+    assert profiler.get_times(Counters.LLVM_OPTIMISE) == 0.000503
+    assert profiler.get_counter(Counters.LLVM_CODE_SIZE) == 1000
+    assert profiler.get_counter(Counters.LLVM_DEFERRED) == 1
+    assert profiler.get_counter(Counters.LLVM_BUILD_IR) == 0
+    buckets = profiler.get_histogram(Counters.LLVM_OPTIMISE)
+    assert buckets[2] == 1 #3us
+    assert buckets[9] == 1 #500us
+    buckets = profiler.get_histogram(Counters.LLVM_CODE_SIZE)
+    assert buckets[0] == 1
+    assert buckets[10] == 1
+    assert sum(buckets) == 2
+    assert profiler.get_histogram(Counters.TRACING) == []
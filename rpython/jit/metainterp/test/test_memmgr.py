@@ -13,7 +13,7 @@ if len(sys.argv) >= 4 and sys.argv[1] == '--sub':
 import py
 from rpython.jit.metainterp.memmgr import MemoryManager
 from rpython.jit.metainterp.test.support import LLJitMixin
-from rpython.rlib.jit import JitDriver, dont_look_inside
+from rpython.rlib.jit import JitDriver, dont_look_inside, set_param
 from rpython.jit.metainterp.warmspot import get_stats
 from rpython.jit.metainterp.warmstate import BaseJitCell
 from rpython.rlib import rgc
@@ -21,6 +21,8 @@ from rpython.rlib import rgc
 class FakeLoopToken:
     generation = 0
     invalidated = False
+    code_size = 0
+    entry_count = 0
 
 
 class _TestMemoryManager:
@@ -78,6 +80,36 @@ class _TestMemoryManager:
             else:
                 assert tokens[i] in memmgr.alive_loops
 
+    def test_code_size_budget(self):
+        memmgr = MemoryManager()
+        memmgr.set_max_code_size(250, 1)
+        tokens = [FakeLoopToken() for i in range(4)]
+        for i, token in enumerate(tokens):
+            token.code_size = 100
+            for j in range(i + 1):
+                memmgr.keep_loop_alive(token)
+        memmgr.next_generation()
+        # tokens[3] was entered in this generation, tokens[0] and
+        # tokens[1] are entered the least often
+        assert memmgr.alive_loops == dict.fromkeys(tokens[2:])
+        assert tokens[2].entry_count == 1   # decayed
+        assert tokens[3].entry_count == 2
+
+    def test_code_size_budget_and_age(self):
+        memmgr = MemoryManager()
+        memmgr.set_max_age(4, 1)
+        memmgr.set_max_code_size(1000)
+        assert memmgr.check_frequency == 1
+        tokens = [FakeLoopToken() for i in range(10)]
+        for token in tokens:
+            token.code_size = 100
+            memmgr.keep_loop_alive(token)
+            memmgr.next_generation()
+        assert memmgr.alive_loops == dict.fromkeys(tokens[7:])
+        memmgr.set_max_age(0)
+        memmgr.set_max_code_size(0)
+        assert memmgr.next_check == -1
+
 
 class _TestIntegration(LLJitMixin):
     # See comments in TestMemoryManager.  To get temporarily the normal
@@ -212,6 +244,30 @@ class _TestIntegration(LLJitMixin):
         assert res == 42
         self.check_enter_count(2 + 10*4)
 
+    def test_code_size_budget(self):
+        myjitdriver = JitDriver(greens=['m'], reds=['n'])
+        def g(m):
+            n = 10
+            while n > 0:
+                myjitdriver.can_enter_jit(n=n, m=m)
+                myjitdriver.jit_merge_point(n=n, m=m)
+                n = n - 1
+            return 21
+        def f():
+            # the budget is too small for any loop: every
+            # CODE_SIZE_CHECK_FREQUENCY loops and bridges, those that
+            # were not entered since the last one was compiled are freed
+            set_param(myjitdriver, 'max_code_size', 1)
+            for m in range(50):
+                g(m)
+            return 42
+
+        res = self.meta_interp(f, [], loop_longevity=0)
+        assert res == 42
+        self.check_jitcell_token_count(50)
+        tokens = [t() for t in get_stats().jitcell_token_wrefs]
+        assert None in tokens
+
     def test_call_assembler_keep_alive(self):
         myjitdriver1 = JitDriver(greens=['m'], reds=['n'])
         myjitdriver2 = JitDriver(greens=['m'], reds=['n', 'rec'])
@@ -9,7 +9,7 @@ from rpython.jit.metainterp.resume import (
     VArrayInfoNotClear, VStrPlainInfo, VStrConcatInfo, VStrSliceInfo,
     VUniPlainInfo, VUniConcatInfo, VUniSliceInfo,
     ResumeDataLoopMemo, UNASSIGNEDVIRTUAL, INT, annlowlevel, PENDINGFIELDSP,
-    TAG_CONST_OFFSET)
+    TAG_CONST_OFFSET, ResumeDataStore)
 from rpython.jit.metainterp.resumecode import (
     unpack_numbering, create_numbering)
 from rpython.jit.metainterp.opencoder import Trace
@@ -530,6 +530,7 @@ class FakeJitCode(object):
 class FakeMetaInterpStaticData:
     cpu = LLtypeMixin.cpu
     all_descrs = []
+    resumedata_store = None
 
     class options:
         failargs_limit = 100
@@ -703,6 +704,53 @@ def test_ResumeDataLoopMemo_number():
         2, 1, tag(3, TAGINT), tag(0, TAGVIRTUAL), tag(0, TAGBOX), tag(3, TAGINT)
         ] + [0, 0]
 
+def test_ResumeDataStore_shares_numberings():
+    b1, b2, b3 = [IntFrontendOp(0), IntFrontendOp(1), IntFrontendOp(2)]
+    c1, c2 = [ConstInt(1), ConstInt(2)]
+    metainterp_sd = FakeMetaInterpStaticData()
+    t = Trace([b1, b2, b3], metainterp_sd)
+    snap = t.create_snapshot(FakeJitCode("jitcode", 0), 0,
+                             Frame([b1, c1, b2, b1, c2]), False)
+    for env in [[b3, c1], [b3, c2], [b3, c1]]:
+        t.append(0)
+        top = t.create_top_snapshot(FakeJitCode("jitcode", 0), 2, Frame(env),
+                                    False, [], [])
+        top.prev = snap
+    memo = ResumeDataLoopMemo(metainterp_sd)
+    memo.store = ResumeDataStore()
+    iter = t.get_iter()
+    numbs = [memo.create_numbering(memo.number(i, iter)) for i in range(3)]
+    numb1, numb2, numb3 = numbs
+    base = [0, 0, 0, 0, tag(0, TAGBOX), tag(1, TAGINT), tag(1, TAGBOX),
+            tag(0, TAGBOX), tag(2, TAGINT)]
+    assert unpack_numbering(numb1) == [15, 0] + base + [
+        0, 2, tag(2, TAGBOX), tag(1, TAGINT)]
+    assert unpack_numbering(numb2) == [15, 0] + base + [
+        0, 2, tag(2, TAGBOX), tag(2, TAGINT)]
+    assert numb1.prefix
+    assert numb2.prefix == numb1.prefix
+    assert numb3 == numb1
+    shared = len(numb1.prefix.code)
+    assert memo.nresumebytes == shared + len(numb1.code) + len(numb2.code)
+    assert memo.nresumeshared == 2 * shared + len(numb1.code)
+
+def test_ResumeDataStore_interns_virtual_infos():
+    store = ResumeDataStore()
+    descr = LLtypeMixin.nodesize
+    fielddescrs = [LLtypeMixin.valuedescr]
+    vinfo1 = VirtualInfo(descr, fielddescrs)
+    vinfo1.set_content([tag(0, TAGBOX)])
+    assert store.intern_virtual_info(vinfo1) is vinfo1
+    vinfo2 = VirtualInfo(descr, fielddescrs)
+    vinfo2.set_content([tag(0, TAGBOX)])
+    assert store.intern_virtual_info(vinfo2) is vinfo1
+    vinfo3 = VStructInfo(descr, fielddescrs)
+    vinfo3.set_content([tag(0, TAGBOX)])
+    assert not vinfo1.same_content(vinfo3)
+    vinfo4 = VirtualInfo(descr, fielddescrs)
+    vinfo4.set_content([tag(1, TAGBOX)])
+    assert store.intern_virtual_info(vinfo4) is vinfo4
+
 @given(strategies.lists(
     strategies.builds(IntFrontendOp, strategies.just(0)) | intconsts,
     min_size=1))
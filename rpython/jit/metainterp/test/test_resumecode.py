@@ -60,3 +60,17 @@ def test_patch(l):
         n = w.create_numbering()
         assert unpack_numbering(n)[1:] == l
         assert unpack_numbering(n)[0] == middle + 1
+
+def test_prefix():
+    prefix = create_numbering([5, 6, -7, 300])
+    n = create_numbering([10, 2, 1000, 9])
+    n.prefix = prefix
+    assert unpack_numbering(n) == [10, 2, 5, 6, -7, 300, 1000, 9]
+    r = Reader(n)
+    r.jump(3)
+    assert r.peek() == 6
+    assert r.next_item() == 6
+    r.jump(3)
+    assert r.items_read == 7
+    assert r.next_item() == 9
+    assert r.at_end()
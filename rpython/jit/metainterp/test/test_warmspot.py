@@ -623,6 +623,21 @@ class TestWarmspotDirect(object):
             def setup_descrs(self):
                 return []
 
+            def set_llvm_passes(self, text):
+                pass
+
+            def set_llvm_cache(self, path):
+                pass
+
+            def set_llvm_cache_size(self, megabytes):
+                pass
+
+            def set_guard_counter(self, jitcounter):
+                pass
+
+            def set_llvm_compile_budget(self, ops):
+                pass
+
             def get_latest_descr(self, deadframe):
                 assert isinstance(deadframe, FakeDeadFrame)
                 return self.get_fail_descr_from_number(deadframe._no)
@@ -0,0 +1,102 @@
+from rpython.rlib.jit import JitDriver, set_param
+from rpython.rlib.rarithmetic import r_uint
+from rpython.rlib.rjitlog import rjitlog as jl
+from rpython.jit.metainterp.test.support import LLJitMixin
+from rpython.jit.metainterp.warmupprofile import (WarmupProfile, HEADER,
+    SEED_FRACTION)
+from rpython.jit.metainterp import pyjitpl
+
+
+def test_record_and_load(tmpdir):
+    path = str(tmpdir.join('profile'))
+    profile = WarmupProfile()
+    profile.set_path(path)
+    assert profile.entries == {}
+    profile.record_traced("driver:a.py:1")
+    profile.record_traced("driver:a.py:1")
+    profile.record_bridge("driver:a.py:1")
+    profile.record_traced("driver:b.py:5 with spaces")
+    profile.record_traced(None)
+    profile.finish()
+    lines = open(path).read().splitlines()
+    assert lines[0] == HEADER
+    assert sorted(lines[1:]) == ["1 0 driver:b.py:5 with spaces",
+                                 "2 1 driver:a.py:1"]
+    #
+    profile = WarmupProfile()
+    profile.set_path(path)
+    assert profile.pending == 2
+    assert profile.seeding()
+    assert profile.first_lookup(r_uint(42))
+    assert not profile.first_lookup(r_uint(42))   # e.g. its counter decayed
+    assert profile.first_lookup(r_uint(43))
+    assert profile.seed("driver:c.py:1") == 0.0
+    assert profile.seed("driver:a.py:1") == SEED_FRACTION
+    assert profile.seed("driver:a.py:1") == 0.0   # only once
+    assert profile.pending == 1
+    profile.record_traced("driver:a.py:1")
+    profile.finish()
+    lines = open(path).read().splitlines()
+    # b.py wasn't seen again, it's halved away
+    assert lines[1:] == ["1 0 driver:a.py:1"]
+
+def test_stops_seeding(tmpdir):
+    path = tmpdir.join('profile')
+    path.write(HEADER + "\n1 0 driver:a.py:1\n")
+    profile = WarmupProfile()
+    profile.set_path(str(path))
+    assert profile.first_lookup(r_uint(42))
+    assert profile.seed("driver:a.py:1") == SEED_FRACTION
+    # every entry was seen, the hashes aren't kept any more
+    assert not profile.seeding()
+    assert profile.looked_up == {}
+
+def test_ignores_other_files(tmpdir):
+    path = tmpdir.join('profile')
+    path.write("something else\n1 0 driver:a.py:1\n")
+    profile = WarmupProfile()
+    profile.set_path(str(path))
+    assert not profile.seeding()
+    profile = WarmupProfile()
+    profile.set_path("")
+    assert not profile.enabled()
+
+
+class WarmupProfileTests:
+
+    def run_loops(self, path):
+        @jl.returns(jl.MP_FILENAME, jl.MP_INT)
+        def get_location(m):
+            return ("test.py", m)
+        myjitdriver = JitDriver(greens=['m'], reds=['n'],
+                                get_location=get_location)
+        def g(m, n):
+            while n > 0:
+                myjitdriver.can_enter_jit(m=m, n=n)
+                myjitdriver.jit_merge_point(m=m, n=n)
+                n -= 1
+            return m
+        def f(n):
+            set_param(myjitdriver, 'threshold', 50)
+            set_param(myjitdriver, 'warmup_profile', path)
+            return g(1, n) + g(2, n // 10)
+        res = self.meta_interp(f, [100])
+        assert res == 3
+        return pyjitpl._warmrunnerdesc.metainterp_sd.warmup_profile
+
+    def test_warmup_profile(self, tmpdir):
+        path = str(tmpdir.join('profile'))
+        profile = self.run_loops(path)
+        assert profile.seeded == 0
+        self.check_jitcell_token_count(1)     # g(2) doesn't get hot
+        lines = open(path).read().splitlines()
+        assert lines[1:] == ["1 0 jitdriver:test.py:1"]
+        #
+        profile = self.run_loops(path)
+        assert profile.seeded == 1
+        self.check_jitcell_token_count(1)
+        self.check_trace_count(1)
+
+
+class TestLLtype(WarmupProfileTests, LLJitMixin):
+    pass
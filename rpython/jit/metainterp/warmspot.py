@@ -13,6 +13,7 @@ from rpython.flowspace.model import SpaceOperation, Variable, Constant
 from rpython.flowspace.model import checkgraph, Link, copygraph
 from rpython.rlib.objectmodel import we_are_translated
 from rpython.rlib.unroll import unrolling_iterable
+from rpython.rlib.jit import STRING_PARAMETERS
 from rpython.rlib.debug import fatalerror
 from rpython.rlib.rstackovf import StackOverflow
 from rpython.translator.backendopt import removenoops
@@ -126,6 +127,7 @@ def jittify_and_run(interp, graph, args, repeat=1, graph_and_interp_only=False,
     if not kwds.get('translate_support_code', False):
         warmrunnerdesc.metainterp_sd.jitlog.finish()
         warmrunnerdesc.metainterp_sd.profiler.finish()
+        warmrunnerdesc.metainterp_sd.warmup_profile.finish()
         warmrunnerdesc.metainterp_sd.cpu.finish_once()
     print '~~~ return value:', repr(res)
     while repeat > 1:
@@ -267,6 +269,7 @@ class WarmRunnerDesc(object):
             self.jitcounter = counter.JitCounter(translator=translator)
         else:
             self.jitcounter = counter.DeterministicJitCounter()
+        self.cpu.set_guard_counter(self.jitcounter)
         #
         self.make_hooks(policy.jithookiface)
         self.make_virtualizable_infos()
@@ -1079,6 +1082,7 @@ class WarmRunnerDesc(object):
         def finish():
             if self.metainterp_sd.profiler.initialized:
                 self.metainterp_sd.profiler.finish()
+            self.metainterp_sd.warmup_profile.finish()
             self.metainterp_sd.cpu.finish_once()
 
         if self.cpu.translate_support_code:
@@ -1129,7 +1133,7 @@ class WarmRunnerDesc(object):
             key = jd, funcname
             if key not in closures:
                 closures[key] = make_closure(jd, 'set_param_' + funcname,
-                                             funcname == 'enable_opts')
+                                             funcname in STRING_PARAMETERS)
             op.opname = 'direct_call'
             op.args[:3] = [closures[key]]
 
@@ -137,6 +137,8 @@ JC_TRACING         = 0x01
 JC_DONT_TRACE_HERE = 0x02
 JC_TEMPORARY       = 0x04
 JC_TRACING_OCCURRED= 0x08
+JC_OPTIMIZING      = 0x10
+JC_SUPERBLOCK      = 0x20
 
 class BaseJitCell(object):
     """Subclasses of BaseJitCell are used in tandem with the single
@@ -172,6 +174,14 @@ class BaseJitCell(object):
 
         JC_TRACING_OCCURRED: set if JC_TRACING was set at least once.
 
+        JC_OPTIMIZING: the loop from this greenkey has been traced and
+        is being optimized on the JIT thread (see background.py).  Like
+        JC_TRACING, don't trace it a second time meanwhile.
+
+        JC_SUPERBLOCK: the loop from this greenkey was retired once to
+        be retraced along its hot bridges (see guardprofile.py).  Don't
+        do that again for the loops that replace it.
+
         JC_TEMPORARY: a "temporary" wref_procedure_token.
         It's the procedure_token of a dummy loop that simply calls
         back the interpreter.  Used for a CALL_ASSEMBLER where the
@@ -212,8 +222,12 @@ class BaseJitCell(object):
     def should_remove_jitcell(self):
         if self.get_procedure_token() is not None:
             return False    # don't remove JitCells with a procedure_token
-        if self.flags & JC_TRACING:
+        if self.flags & (JC_TRACING | JC_OPTIMIZING):
             return False    # don't remove JitCells that are being traced
+        if self.flags & JC_SUPERBLOCK:
+            # keep the flag while the retired loop is still around, until
+            # the retraced one replaces it
+            return self.wref_procedure_token() is None
         if self.flags & JC_DONT_TRACE_HERE:
             # if we have this flag, and we *had* a procedure_token but
             # we no longer have one, then remove me.  this prevents this
@@ -236,6 +250,10 @@ class WarmEnterState(object):
             self.profiler = warmrunnerdesc.metainterp_sd.profiler
         except AttributeError:       # for tests
             self.profiler = None
+        try:
+            self.warmup_profile = warmrunnerdesc.metainterp_sd.warmup_profile
+        except AttributeError:       # for tests
+            self.warmup_profile = None
         # initialize the state with the default values of the
         # parameters specified in rlib/jit.py
         if self.warmrunnerdesc is not None:
@@ -288,6 +306,12 @@ class WarmEnterState(object):
             self.warmrunnerdesc.memory_manager is not None):   # all for tests
             self.warmrunnerdesc.memory_manager.set_max_age(value)
 
+    def set_param_max_code_size(self, value):
+        # note: it's a global parameter, not a per-jitdriver one
+        if (self.warmrunnerdesc is not None and
+            self.warmrunnerdesc.memory_manager is not None):   # all for tests
+            self.warmrunnerdesc.memory_manager.set_max_code_size(value)
+
     def set_param_retrace_limit(self, value):
         if self.warmrunnerdesc:
             if self.warmrunnerdesc.memory_manager:
@@ -317,6 +341,41 @@ class WarmEnterState(object):
     def set_param_vec_cost(self, ivalue):
         self.vec_cost = ivalue
 
+    def set_param_llvm_passes(self, value):
+        # note: it's a global parameter, not a per-jitdriver one
+        if NonConstant(False):
+            value = 'blah' # not a constant ''
+        if self.warmrunnerdesc is not None and self.cpu is not None:
+            self.cpu.set_llvm_passes(value)
+
+    def set_param_llvm_cache(self, value):
+        # note: it's a global parameter, not a per-jitdriver one
+        if NonConstant(False):
+            value = 'blah' # not a constant ''
+        if self.warmrunnerdesc is not None and self.cpu is not None:
+            self.cpu.set_llvm_cache(value)
+
+    def set_param_llvm_cache_size(self, value):
+        if self.warmrunnerdesc is not None and self.cpu is not None:
+            self.cpu.set_llvm_cache_size(value)
+
+    def set_param_llvm_compile_budget(self, value):
+        if self.warmrunnerdesc is not None and self.cpu is not None:
+            self.cpu.set_llvm_compile_budget(value)
+
+    def set_param_background_optimize(self, value):
+        self.background_optimize = bool(value)
+
+    def set_param_retrace_bridges(self, value):
+        self.retrace_bridges = value
+
+    def set_param_warmup_profile(self, value):
+        # note: it's a global parameter, not a per-jitdriver one
+        if NonConstant(False):
+            value = 'blah' # not a constant ''
+        if self.warmup_profile is not None:
+            self.warmup_profile.set_path(value)
+
     def disable_noninlinable_function(self, greenkey):
         cell = self.JitCell.ensure_jit_cell_at_key(greenkey)
         cell.flags |= JC_DONT_TRACE_HERE
@@ -329,6 +388,7 @@ class WarmEnterState(object):
         cell = self.JitCell.ensure_jit_cell_at_key(greenkey)
         old_token = cell.get_procedure_token()
         cell.set_procedure_token(procedure_token)
+        procedure_token.greenkey = greenkey
         if old_token is not None:
             self.cpu.redirect_call_assembler(old_token, procedure_token)
             # procedure_token is also kept alive by any loop that used
@@ -371,6 +431,9 @@ class WarmEnterState(object):
         func_execute_token = self.cpu.make_execute_token(*ARGS)
         cpu = self.cpu
         jitcounter = self.warmrunnerdesc.jitcounter
+        background = metainterp_sd.background
+        warmup_profile = metainterp_sd.warmup_profile
+        location_key = self.location_key
         result_type = jitdriver_sd.result_type
 
         def execute_assembler(loop_token, *args):
@@ -417,10 +480,12 @@ class WarmEnterState(object):
             jitcounter.decay_all_counters()
             if rstack.stack_almost_full():
                 return
+            greenargs = args[:num_green_args]
+            if warmup_profile.enabled():
+                warmup_profile.record_traced(location_key(*greenargs))
             # start tracing
             from rpython.jit.metainterp.pyjitpl import MetaInterp
             metainterp = MetaInterp(metainterp_sd, jitdriver_sd)
-            greenargs = args[:num_green_args]
             if cell is None:
                 cell = JitCell(*greenargs)
                 jitcounter.install_new_cell(hash, cell)
@@ -440,6 +505,8 @@ class WarmEnterState(object):
             # BaseJitCell, and that stores a key that compares equal.
             # These few lines inline some logic that is also on the
             # JitCell class, to avoid computing the hash several times.
+            if background.pending:
+                background.install_optimized()
             greenargs = args[:num_green_args]
             hash = JitCell.get_uhash(*greenargs)
             cell = jitcounter.lookup_chain(hash)
@@ -449,14 +516,21 @@ class WarmEnterState(object):
                 cell = cell.next
             else:
                 # not found. increment the counter
+                if (warmup_profile.seeding() and
+                        warmup_profile.first_lookup(hash)):
+                    # first time we see it, maybe it was hot in an earlier
+                    # process, see warmupprofile.py
+                    fraction = warmup_profile.seed(location_key(*greenargs))
+                    if fraction > 0.0:
+                        jitcounter.change_current_fraction(hash, fraction)
                 if jitcounter.tick(hash, increment_threshold):
                     bound_reached(hash, None, *args)
                 return
 
             # Here, we have found 'cell'.
             #
-            if cell.flags & (JC_TRACING | JC_TEMPORARY):
-                if cell.flags & JC_TRACING:
+            if cell.flags & (JC_TRACING | JC_TEMPORARY | JC_OPTIMIZING):
+                if cell.flags & (JC_TRACING | JC_OPTIMIZING):
                     # tracing already happening in some outer invocation of
                     # this function. don't trace a second time.
                     return
@@ -479,6 +553,12 @@ class WarmEnterState(object):
                         if tick:
                             bound_reached(hash, cell, *args)
                         return
+                if cell.flags & JC_SUPERBLOCK:
+                    # the loop was retired to be retraced, see
+                    # guardprofile.py.  count normally
+                    if jitcounter.tick(hash, increment_threshold):
+                        bound_reached(hash, cell, *args)
+                    return
                 # it was an aborted compilation, or maybe a weakref that
                 # has been freed
                 jitcounter.cleanup_chain(hash)
@@ -718,11 +798,31 @@ class WarmEnterState(object):
                     else:
                         raise NotImplementedError
                 return values
+            def location_key(*greenargs):
+                fn = support.maybe_on_top_of_llinterp(rtyper, get_location_ptr)
+                value_tuple = fn(*greenargs)
+                parts = [drivername]
+                for i, (sem_type,gen_type) in unrolled_types:
+                    value = getattr(value_tuple, 'item' + str(i))
+                    if gen_type == "s":
+                        parts.append(hlstr(value))
+                    elif gen_type == "i":
+                        parts.append(str(intmask(value)))
+                    else:
+                        raise NotImplementedError
+                return ":".join(parts)
             self.get_location_types = list(types)
             self.get_location = get_location
         else:
+            def location_key(*greenargs):
+                return None
             self.get_location_types = None
             self.get_location = None
+        # identifies the greenkey across processes, see warmupprofile.py
+        self.location_key = location_key
+        def get_location_key(greenkey):
+            return location_key(*unwrap_greenkey(greenkey))
+        self.get_location_key = get_location_key
         #
         printable_loc_ptr = self.jitdriver_sd._get_printable_location_ptr
         if printable_loc_ptr is None:
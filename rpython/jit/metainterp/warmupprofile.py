@@ -0,0 +1,175 @@
+"""
+Persistent warmup profiles, turned on by the warmup_profile jit parameter
+naming a file. Every greenkey whose counter reaches the threshold, i.e.
+that starts being traced, is recorded along with how many bridges were
+compiled out of its loops, and the file is written when the process
+exits. The next process started with the same file seeds the counter of
+every greenkey that was hot before the first time it sees it, once the
+interpreter runs it, so that it's traced after a tenth of the threshold
+instead of having to warm up from scratch again.
+
+Greenkeys are identified by the jitdriver's name and the values returned
+by its get_location, e.g. the file name, line, function name and
+bytecode offset of PyPy's code objects; drivers without get_location
+aren't profiled. The key is only computed the first time the counter of
+a greenkey's hash is ticked, and only as long as the profile has entries
+that weren't seen yet, up to MAX_LOOKUPS times: counters that decayed
+back to zero, or are shared with another hash, aren't looked up again.
+
+Entries of the file that aren't seen again are kept with their count
+halved, until it drops to zero, so code that isn't run any more ages
+out of the profile.
+"""
+
+from rpython.rlib.rwholefile import read_whole_file, replace_file
+from rpython.rlib.rstring import ParseStringError
+from rpython.rlib.rarithmetic import string_to_int
+from rpython.rlib.debug import debug_start, debug_stop, debug_print
+
+HEADER = "warmup-profile 1"
+SEED_FRACTION = 0.9 # counter value of the hot greenkeys of the last run
+MAX_LOOKUPS = 100000 # keys computed for the seeding before giving up
+
+
+class ProfileEntry(object):
+    def __init__(self, key, traced, bridges):
+        self.key = key
+        self.traced = traced #number of times the greenkey started tracing
+        self.bridges = bridges #bridges compiled out of its loops
+        self.matched = False #seeded or recorded in this process
+        self.recorded = False #the counts are from this process
+
+
+class WarmupProfile(object):
+    def __init__(self):
+        self.path = ""
+        self.entries = {} #key -> ProfileEntry
+        self.pending = 0 #entries loaded from the file, not seen yet
+        self.lookups_left = 0
+        self.looked_up = {} #hashes of the greenkeys passed to seed()
+        self.seeded = 0
+
+    def set_path(self, path):
+        """Called when the warmup_profile parameter is set"""
+        self.path = path
+        self.entries = {}
+        self.pending = 0
+        self.looked_up = {}
+        self.seeded = 0
+        if path:
+            self.load()
+            self.lookups_left = MAX_LOOKUPS
+
+    def enabled(self):
+        return self.path != ""
+
+    def seeding(self):
+        return self.pending > 0 and self.lookups_left > 0
+
+    def first_lookup(self, hash):
+        """
+        Called as long as seeding() is true, before computing the key of
+        a greenkey whose cell doesn't exist yet. True only the first time
+        for each hash.
+        """
+        if hash in self.looked_up:
+            return False
+        self.looked_up[hash] = None
+        return True
+
+    def load(self):
+        try:
+            data = read_whole_file(self.path)
+        except OSError:
+            return #no profile yet
+        lines = data.split("\n")
+        if lines[0] != HEADER:
+            return #written by something else, overwritten at exit
+        for i in range(1, len(lines)):
+            parts = lines[i].split(" ", 2)
+            if len(parts) != 3:
+                continue
+            try:
+                traced = string_to_int(parts[0])
+                bridges = string_to_int(parts[1])
+            except ParseStringError:
+                continue
+            key = parts[2]
+            if key not in self.entries:
+                self.entries[key] = ProfileEntry(key, traced, bridges)
+                self.pending += 1
+        debug_start("jit-warmup-profile")
+        debug_print("loaded", self.pending, "hot greenkeys from", self.path)
+        debug_stop("jit-warmup-profile")
+
+    def seed(self, key):
+        """
+        Called when first_lookup() is true. Returns the value to give to
+        the greenkey's counter, or 0.0 to leave it alone.
+        """
+        self.lookups_left -= 1
+        fraction = 0.0
+        entry = self.entries.get(key, None)
+        if entry is not None and not entry.matched:
+            entry.matched = True
+            self.pending -= 1
+            self.seeded += 1
+            fraction = SEED_FRACTION
+        if not self.seeding():
+            self.looked_up = {} #never needed again
+        return fraction
+
+    def get_entry(self, key):
+        entry = self.entries.get(key, None)
+        if entry is None:
+            entry = self.entries[key] = ProfileEntry(key, 0, 0)
+            entry.matched = True
+        elif not entry.matched:
+            entry.matched = True
+            self.pending -= 1
+        if not entry.recorded:
+            entry.recorded = True
+            entry.traced = 0
+            entry.bridges = 0
+        return entry
+
+    def record_traced(self, key):
+        if key is not None:
+            self.get_entry(key).traced += 1
+
+    def record_bridge(self, key):
+        if key is not None:
+            self.get_entry(key).bridges += 1
+
+    def dump(self):
+        lines = [HEADER]
+        for entry in self.entries.values():
+            traced = entry.traced
+            bridges = entry.bridges
+            if not entry.recorded:
+                traced >>= 1 #not hot this time, ages out
+                bridges >>= 1
+            if traced <= 0 or "\n" in entry.key:
+                continue
+            lines.append("%d %d %s" % (traced, bridges, entry.key))
+        try:
+            replace_file(self.path, "\n".join(lines) + "\n") #other processes may read it
+        except OSError:
+            return #the next process warms up from scratch
+        debug_start("jit-warmup-profile")
+        debug_print("seeded", self.seeded, "greenkeys, wrote",
+                    len(lines) - 1, "to", self.path)
+        debug_stop("jit-warmup-profile")
+
+    def finish(self):
+        """Called when the process exits"""
+        if self.enabled():
+            self.dump()
+
+
+def bridge_compiled(metainterp_sd, jitcell_token):
+    warmup_profile = metainterp_sd.warmup_profile
+    if warmup_profile.enabled() and jitcell_token.greenkey is not None:
+        warmstate = jitcell_token.outermost_jitdriver_sd.warmstate
+        warmup_profile.record_bridge(
+            warmstate.get_location_key(jitcell_token.greenkey))
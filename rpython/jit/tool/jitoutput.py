@@ -28,12 +28,22 @@ REGEXES = [
     (('nvirtuals',), '^nvirtuals:\s+(\d+)$'),
     (('nvholes',), '^nvholes:\s+(\d+)$'),
     (('nvreused',), '^nvreused:\s+(\d+)$'),
+    (('resume_bytes',), '^resume bytes:\s+(\d+)$'),
+    (('resume_bytes_shared',), '^resume bytes shared:\s+(\d+)$'),
     (('vecopt_tried',), '^vecopt tried:\s+(\d+)$'),
     (('vecopt_success',), '^vecopt success:\s+(\d+)$'),
     (('total_compiled_loops',),   '^Total # of loops:\s+(\d+)$'),
     (('total_compiled_bridges',), '^Total # of bridges:\s+(\d+)$'),
     (('total_freed_loops',),      '^Freed # of loops:\s+(\d+)$'),
     (('total_freed_bridges',),    '^Freed # of bridges:\s+(\d+)$'),
+    (('llvm_build_ir_no', 'llvm_build_ir_time'),
+                        '^LLVM build IR:\s+([\d.]+)\s+([\d.]+)$'),
+    (('llvm_optimise_no', 'llvm_optimise_time'),
+                        '^LLVM optimise:\s+([\d.]+)\s+([\d.]+)$'),
+    (('llvm_codegen_no', 'llvm_codegen_time'),
+                        '^LLVM codegen:\s+([\d.]+)\s+([\d.]+)$'),
+    (('llvm_code_size',),         '^LLVM code size:\s+(\d+)$'),
+    (('llvm_deferred',),          '^LLVM deferred:\s+(\d+)$'),
     ]
 
 class Ops(object):
@@ -61,8 +71,18 @@ class OutputInfo(object):
     nvirtuals = 0
     nvholes = 0
     nvreused = 0
+    resume_bytes = 0
+    resume_bytes_shared = 0
     vecopt_tried = 0
     vecopt_success = 0
+    llvm_build_ir_no = 0
+    llvm_build_ir_time = 0.0
+    llvm_optimise_no = 0
+    llvm_optimise_time = 0.0
+    llvm_codegen_no = 0
+    llvm_codegen_time = 0.0
+    llvm_code_size = 0
+    llvm_deferred = 0
 
     def __init__(self):
         self.ops = Ops()
@@ -63,12 +63,19 @@ abort: force quasi-immut: 3
 nvirtuals:              13
 nvholes:                14
 nvreused:               15
+resume bytes:           4096
+resume bytes shared:    1024
 vecopt tried:           12
 vecopt success:         4
 Total # of loops:       100
 Total # of bridges:     300
 Freed # of loops:       99
 Freed # of bridges:     299
+LLVM build IR:  3       0.001210
+LLVM optimise:  3       0.004522
+LLVM codegen:   3       0.006031
+LLVM code size:         1848
+LLVM deferred:          2
 '''
 
 def test_parse():
@@ -93,5 +100,12 @@ def test_parse():
     assert info.nvirtuals == 13
     assert info.nvholes == 14
     assert info.nvreused == 15
+    assert info.resume_bytes == 4096
+    assert info.resume_bytes_shared == 1024
     assert info.vecopt_tried == 12
     assert info.vecopt_success == 4
+    assert info.llvm_build_ir_no == 3
+    assert info.llvm_optimise_time == 0.004522
+    assert info.llvm_codegen_no == 3
+    assert info.llvm_code_size == 1848
+    assert info.llvm_deferred == 2
@@ -553,6 +553,9 @@ PARAMETER_DOCS = {
     'trace_limit': 'number of recorded operations before we abort tracing with ABORT_TOO_LONG',
     'inlining': 'inline python functions or not (1/0)',
     'loop_longevity': 'a parameter controlling how long loops will be kept before being freed, an estimate',
+    'max_code_size': 'budget in bytes for the machine code of all loops, '
+                     'past it the loops entered the least often are freed '
+                     'first. 0 for no limit',
     'retrace_limit': 'how many times we can try retracing before giving up',
     'max_retrace_guards': 'number of extra guards a retrace can cause',
     'max_unroll_loops': 'number of extra unrollings a loop can cause',
@@ -565,6 +568,28 @@ PARAMETER_DOCS = {
     'vec_cost': 'threshold for which traces to bail. Unpacking increases the counter,'\
                 ' vector operation decrease the cost',
     'vec_all': 'try to vectorize trace loops that occur outside of the numpypy library',
+    'llvm_passes': 'LLVM backend only: IR optimisation pipeline, one of the '
+                   'presets O0, O1, O2, O3, trace-tuned, a ":" separated list '
+                   'of passes and presets, or npm/ followed by a pipeline '
+                   'for the new pass manager',
+    'llvm_cache': 'LLVM backend only: directory to cache compiled traces in '
+                  'across runs, or empty to disable',
+    'llvm_cache_size': 'LLVM backend only: size cap of llvm_cache in MB, '
+                       'least recently used traces are evicted past it',
+    'llvm_compile_budget': 'tiered LLVM backend only: number of trace '
+                           'operations the LLVM tier takes on per second, '
+                           'hot loops past it wait for the next second. '
+                           '0 for no limit',
+    'background_optimize': 'optimize new loops on a JIT thread while the '
+                           'interpreter keeps running, installing them at '
+                           'the next entry check (1/0)',
+    'retrace_bridges': 'number of bridges compiled from the guards of a '
+                       'loop after which the next hot guard retraces the '
+                       'whole loop along the path it takes instead, '
+                       '0 to never do it',
+    'warmup_profile': 'file to write the hot code locations to at exit, '
+                      'after seeding the JIT counters with the ones it '
+                      'already lists. Empty to disable',
 }
 
 PARAMETERS = {'threshold': 1039, # just above 1024, prime
@@ -574,6 +599,7 @@ PARAMETERS = {'threshold': 1039, # just above 1024, prime
               'trace_limit': 6000,
               'inlining': 1,
               'loop_longevity': 1000,
+              'max_code_size': 0,
               'retrace_limit': 0,
               'max_retrace_guards': 15,
               'max_unroll_loops': 0,
@@ -583,8 +609,17 @@ PARAMETERS = {'threshold': 1039, # just above 1024, prime
               'vec': 0,
               'vec_all': 0,
               'vec_cost': 0,
+              'llvm_passes': 'trace-tuned',
+              'llvm_cache': '',
+              'llvm_cache_size': 512,
+              'llvm_compile_budget': 0,
+              'background_optimize': 0,
+              'retrace_bridges': 0,
+              'warmup_profile': '',
               }
 unroll_parameters = unrolling_iterable(PARAMETERS.items())
+STRING_PARAMETERS = ('enable_opts', 'llvm_passes', 'llvm_cache',
+                     'warmup_profile')
 
 # ____________________________________________________________
 
@@ -835,20 +870,20 @@ def set_user_param(driver, text):
             raise ValueError
         name = parts[0]
         value = parts[1]
-        if name == 'enable_opts':
-            set_param(driver, 'enable_opts', value)
-        else:
-            for name1, _ in unroll_parameters:
-                if name1 == name and name1 != 'enable_opts':
+        for name1, _ in unroll_parameters:
+            if name1 == name:
+                if name1 in STRING_PARAMETERS:
+                    set_param(driver, name1, value)
+                else:
                     try:
                         if name1 == 'trace_limit' and int(value) > 2**14:
                             raise TraceLimitTooHigh
                         set_param(driver, name1, int(value))
                     except ValueError:
                         raise
-                    break
-            else:
-                raise ValueError
+                break
+        else:
+            raise ValueError
 
 # ____________________________________________________________
 #
@@ -1005,7 +1040,7 @@ class ExtSetParam(ExtRegistryEntry):
     def compute_result_annotation(self, s_driver, s_name, s_value):
         from rpython.annotator import model as annmodel
         assert s_name.is_constant()
-        if s_name.const == 'enable_opts':
+        if s_name.const in STRING_PARAMETERS:
             assert annmodel.SomeString(can_be_None=True).contains(s_value)
         else:
             assert (s_value == annmodel.s_None or
@@ -1020,7 +1055,7 @@ class ExtSetParam(ExtRegistryEntry):
         hop.exception_cannot_occur()
         driver = hop.inputarg(lltype.Void, arg=0)
         name = hop.args_s[1].const
-        if name == 'enable_opts':
+        if name in STRING_PARAMETERS:
             repr = string_repr
         else:
             repr = lltype.Signed
@@ -1332,10 +1367,17 @@ class Counters(object):
     NVIRTUALS
     NVHOLES
     NVREUSED
+    RESUMEDATA_BYTES
+    RESUMEDATA_SHARED
     TOTAL_COMPILED_LOOPS
     TOTAL_COMPILED_BRIDGES
     TOTAL_FREED_LOOPS
     TOTAL_FREED_BRIDGES
+    LLVM_BUILD_IR
+    LLVM_OPTIMISE
+    LLVM_CODEGEN
+    LLVM_CODE_SIZE
+    LLVM_DEFERRED
     """
 
     counter_names = []
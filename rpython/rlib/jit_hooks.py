@@ -111,6 +111,16 @@ def stats_get_counter_value(warmrunnerdesc, no):
 def stats_get_times_value(warmrunnerdesc, no):
     return warmrunnerdesc.metainterp_sd.profiler.get_times(no)
 
+HISTOGRAM = lltype.GcArray(lltype.Signed)
+
+@register_helper(lltype.Ptr(HISTOGRAM))
+def stats_get_histogram(warmrunnerdesc, no):
+    buckets = warmrunnerdesc.metainterp_sd.profiler.get_histogram(no)
+    res = lltype.malloc(HISTOGRAM, len(buckets))
+    for i in range(len(buckets)):
+        res[i] = buckets[i]
+    return res
+
 LOOP_RUN_CONTAINER = lltype.GcArray(lltype.Struct('elem',
                                                   ('type', lltype.Char),
                                                   ('number', lltype.Signed),
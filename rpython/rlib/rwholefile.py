@@ -0,0 +1,44 @@
+"""
+RPython helpers to read and write small files in one go, with os-level
+calls only, for the files the JIT keeps between processes.
+"""
+
+import os
+
+
+def read_whole_file(path):
+    """The contents of the file at path. Raises OSError"""
+    fd = os.open(path, os.O_RDONLY, 0)
+    try:
+        chunks = []
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            chunks.append(data)
+    finally:
+        os.close(fd)
+    return "".join(chunks)
+
+def replace_file(path, data):
+    """
+    Writes data to a temporary file next to path and renames it to path,
+    so that other processes reading path never see it half written.
+    Raises OSError, after removing the temporary file.
+    """
+    tmp_path = "%s.tmp%d" % (path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+    try:
+        try:
+            written = 0
+            while written < len(data):
+                written += os.write(fd, data[written:])
+        finally:
+            os.close(fd)
+        os.rename(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,50 @@
+import os
+from rpython.tool.udir import udir
+from rpython.rtyper.test.test_llinterp import interpret
+from rpython.rlib.rwholefile import read_whole_file, replace_file
+
+
+def test_replace_and_read():
+    path = str(udir.join('test_rwholefile_1'))
+    data = "".join([chr(i % 256) for i in range(200000)])
+    replace_file(path, data)
+    assert read_whole_file(path) == data
+    replace_file(path, "short")
+    assert read_whole_file(path) == "short"
+    assert [name for name in os.listdir(str(udir))
+            if name.startswith('test_rwholefile_1.tmp')] == []
+
+def test_errors():
+    path = str(udir.join('test_rwholefile_missing', 'file'))
+    try:
+        read_whole_file(path)
+    except OSError:
+        pass
+    else:
+        assert False
+    try:
+        replace_file(path, "data")
+    except OSError:
+        pass
+    else:
+        assert False
+
+def test_replace_fails_removes_tmp():
+    dir_path = udir.join('test_rwholefile_2')
+    dir_path.ensure(dir=True)
+    path = str(dir_path.join('target'))
+    os.mkdir(path) # rename() can't replace a directory with a file
+    try:
+        replace_file(path, "data")
+    except OSError:
+        pass
+    else:
+        assert False
+    assert sorted(os.listdir(str(dir_path))) == ['target']
+
+def test_rpython():
+    path = str(udir.join('test_rwholefile_3'))
+    def f(n):
+        replace_file(path, "x" * n)
+        return len(read_whole_file(path))
+    assert interpret(f, [70000]) == 70000